@@ -4,20 +4,35 @@
 __RCSID__ = "$Id$"
 
 import six
+import copy
 import datetime
 import time
 import threading
 import random
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from DIRAC.Core.Base.DB import DB
 from DIRAC import S_OK, S_ERROR, gConfig
 from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 from DIRAC.Core.Utilities import List, ThreadSafe, Time, DEncode
+from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC.Core.Utilities.Plotting.TypeLoader import TypeLoader
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
 
 gSynchro = ThreadSafe.Synchronizer()
 
+# The ids of the key values never change, they are kept in the cache as long as it is not full
+KEYS_CACHE_LIFETIME = 86400 * 365
+# Length of the buckets of the rollup tables
+ROLLUP_BUCKET_LENGTH = 86400
+# Seconds between two checks of the buckets written by the other AccountingDB instances
+BUCKET_WRITES_SYNC_PERIOD = 10
+# Seconds before the compaction watermark where buckets written late can still be found
+COMPACTION_WATERMARK_MARGIN = 86400
+# Seconds of buckets added up in the rollup table of a type at once when it is filled
+ROLLUP_FILL_RANGE = 86400 * 7
+
 
 class AccountingDB(DB):
 
@@ -28,13 +43,31 @@ class AccountingDB(DB):
     self.__readOnly = readOnly
     self.__doingCompaction = False
     self.__oldBucketMethod = False
+    self.__parallelCompaction = self.getCSOption("ParallelCompaction", True)
+    self.__compactionThreads = max(1, int(self.getCSOption("CompactionThreads", 4)))
     self.__doingPendingLockTime = 0
     self.__deadLockRetries = 2
     self.__queuedRecordsLock = ThreadSafe.Synchronizer()
     self.__queuedRecordsToInsert = []
     self.dbCatalog = {}
     self.dbBucketsLength = {}
+    # type name -> DictCache of the key ids
     self.__keysCache = {}
+    self.__keysCacheSize = int(self.getCSOption("KeysCacheSize", 10000))
+    self.__bulkRecordInsertion = self.getCSOption("BulkRecordInsertion", True)
+    # Types with a rollup table to update, and types with a rollup which can be queried
+    self.__rollupTables = set()
+    self.__rollupTypes = set()
+    # Types whose rollup is being filled from their buckets, one after the other
+    self.__rollupsToFill = []
+    self.__rollupsToFillLock = threading.Lock()
+    self.__useRollups = self.getCSOption("UseRollups", True)
+    # Results of retrieveBucketedData, invalidated when the buckets are written
+    self.__queryCache = DictCache(maxSize=int(self.getCSOption("QueryCacheSize", 1000)))
+    self.__queryCacheLifeTime = int(self.getCSOption("QueryCacheLifeTime", 600))
+    self.__queryCacheLock = threading.Lock()
+    self.__queryCacheSyncTime = 0
+    self.__lastBucketWriteId = None
     maxParallelInsertions = self.getCSOption("ParallelRecordInsertions", 10)
     self.__threadPool = ThreadPool(1, maxParallelInsertions)
     self.__threadPool.daemonize()
@@ -50,6 +83,11 @@ class AccountingDB(DB):
             'PrimaryKey': 'name'
         }
     })
+    self.rollupsTableName = _getTableName("catalog", "Rollups")
+    self.bucketWritesTableName = _getTableName("catalog", "BucketWrites")
+    self.compactionTableName = _getTableName("catalog", "Compaction")
+    if not self.__readOnly:
+      self.__createCatalogTables()
     self.__loadCatalogFromDB()
     gMonitor.registerActivity("registeradded",
                               "Register added",
@@ -66,6 +104,11 @@ class AccountingDB(DB):
                               "Accounting",
                               "seconds",
                               gMonitor.OP_MEAN)
+    gMonitor.registerActivity("compactedbuckets",
+                              "Buckets compacted",
+                              "Accounting",
+                              "buckets",
+                              gMonitor.OP_ACUM)
 
     self.__compactTime = datetime.time(hour=2,
                                        minute=random.randint(0, 59),
@@ -77,6 +120,34 @@ class AccountingDB(DB):
     self.__lastCompactionEpoch = Time.toEpoch(lcd)
 
     self.__registerTypes()
+    self.__loadKeysCache()
+
+  def __createCatalogTables(self):
+    """
+    Create the tables listing the types with a rollup, the buckets written and the
+    buckets already compacted
+    """
+    result = self.__loadTablesCreated()
+    if not result['OK']:
+      return result
+    tables = {}
+    if self.rollupsTableName not in result['Value']:
+      tables[self.rollupsTableName] = {'Fields': {'name': "VARCHAR(64) NOT NULL"},
+                                       'PrimaryKey': 'name'}
+    if self.bucketWritesTableName not in result['Value']:
+      tables[self.bucketWritesTableName] = {'Fields': {'id': "BIGINT NOT NULL AUTO_INCREMENT",
+                                                       'typeName': "VARCHAR(64) NOT NULL",
+                                                       'startTime': "INT UNSIGNED NOT NULL",
+                                                       'endTime': "INT UNSIGNED NOT NULL",
+                                                       'writeTime': "DATETIME NOT NULL"},
+                                            'PrimaryKey': 'id',
+                                            'Indexes': {'writeTimeIndex': ['writeTime']}}
+    if self.compactionTableName not in result['Value']:
+      tables[self.compactionTableName] = {'Fields': {'typeName': "VARCHAR(64) NOT NULL",
+                                                     'bucketLength': "INT UNSIGNED NOT NULL",
+                                                     'compactedUntil': "INT UNSIGNED NOT NULL"},
+                                          'PrimaryKey': ['typeName', 'bucketLength']}
+    return self._createTables(tables)
 
   def __loadTablesCreated(self):
     result = self._query("show tables")
@@ -246,6 +317,13 @@ class AccountingDB(DB):
         self.__threadPool.generateJobAndQueueIt(self.__insertFromINTable,
                                                 args=(recordsToProcess, ))
     self.log.info("[PENDING] Got %s records requests for all types" % pending)
+    cacheStats = [keysCache.getStats() for keysCache in self.__keysCache.values()]
+    self.log.info("[PENDING] Key ids cache: %s queries saved, %s queries done" %
+                  (sum(stats['hits'] for stats in cacheStats), sum(stats['misses'] for stats in cacheStats)))
+    result = self._update("DELETE FROM `%s` WHERE writeTime < UTC_TIMESTAMP() - INTERVAL 1 DAY" %
+                          self.bucketWritesTableName)
+    if not result['OK']:
+      self.log.error("[PENDING] Can't delete the old bucket writes", result['Message'])
     self.__doingPendingLockTime = 0
     return S_OK()
 
@@ -388,6 +466,12 @@ class AccountingDB(DB):
         self.log.notice("ReadOnly mode: %s is OK" % name)
       return S_OK(not updateDBCatalog)
 
+    # The rollup table is optional for the read only instances
+    rollupTableName = _getTableName("rollup", name)
+    if rollupTableName not in tablesInThere:
+      tables[rollupTableName] = {'Fields': bucketFieldsDict,
+                                 'UniqueIndexes': {'UniqueConstraint': uniqueIndexFields}
+                                 }
     if tables:
       retVal = self._createTables(tables)
       if not retVal['OK']:
@@ -400,6 +484,21 @@ class AccountingDB(DB):
                         ['name', 'keyFields', 'valueFields', 'bucketsLength'],
                         [name, ",".join(keyFieldsList), ",".join(valueFieldsList), bucketsEncoding])
       self.__addToCatalog(name, keyFieldsList, valueFieldsList, bucketsLength)
+    self.__rollupTables.add(name)
+    if rollupTableName in tables and _getTableName("bucket", name) in tables:
+      # The rollup of a new type is empty
+      retVal = self._update("INSERT IGNORE INTO `%s` ( name ) VALUES ( '%s' )" % (self.rollupsTableName, name))
+      if retVal['OK']:
+        self.__rollupTypes.add(name)
+      else:
+        self.log.error("Can't register the rollup", "of %s: %s" % (name, retVal['Message']))
+    else:
+      # The rollup of an existing type is complete once listed, else it is computed from the buckets
+      retVal = self._query("SELECT name FROM `%s` WHERE name = '%s'" % (self.rollupsTableName, name))
+      if not retVal['OK']:
+        self.log.error("Can't check the rollup", "of %s: %s" % (name, retVal['Message']))
+      elif not retVal['Value']:
+        self.__fillRollupInBackground(name)
     self.log.info("Registered type %s" % name)
     return S_OK(True)
 
@@ -431,13 +530,19 @@ class AccountingDB(DB):
     mainTable = "`%s`" % _getTableName("bucket", typeName)
     typeKeysList = self.dbCatalog[typeName]['keys']
 
+    keysCache = self.__getKeysCache(typeName)
     for keyName in condDict:
       if keyName in typeKeysList:
         keyTable = "`%s`" % _getTableName("key", typeName, keyName)
-        if keyTable not in keyTables:
-          keyTables.append(keyTable)
-        sqlCond.append("%s.id = %s.`%s`" % (keyTable, mainTable, keyName))
         for value in condDict[keyName]:
+          # The values with a cached id are compared without joining the key table
+          keyId = keysCache.get((keyName, _normalizeKeyValue(value)))
+          if keyId is not None:
+            sqlCond.append("%s.`%s` = %s" % (mainTable, keyName, keyId))
+            continue
+          if keyTable not in keyTables:
+            keyTables.append(keyTable)
+            sqlCond.append("%s.id = %s.`%s`" % (keyTable, mainTable, keyName))
           sqlCond.append("%s.value = %s" % (keyTable, self._escapeString(value)['Value']))
 
     for keyName in typeKeysList:
@@ -471,13 +576,20 @@ class AccountingDB(DB):
     for keyField in self.dbCatalog[typeName]['keys']:
       tablesToDelete.append("`%s`" % _getTableName("key", typeName, keyField))
     tablesToDelete.insert(0, "`%s`" % _getTableName("type", typeName))
+    if typeName in self.__rollupTables:
+      tablesToDelete.insert(0, "`%s`" % _getTableName("rollup", typeName))
     tablesToDelete.insert(0, "`%s`" % _getTableName("bucket", typeName))
     tablesToDelete.insert(0, "`%s`" % _getTableName("in", typeName))
     retVal = self._query("DROP TABLE %s" % ", ".join(tablesToDelete))
     if not retVal['OK']:
       return retVal
     retVal = self._update("DELETE FROM `%s` WHERE name='%s'" % (_getTableName("catalog", "Types"), typeName))
+    self._update("DELETE FROM `%s` WHERE name='%s'" % (self.rollupsTableName, typeName))
+    self._update("DELETE FROM `%s` WHERE typeName='%s'" % (self.compactionTableName, typeName))
     del self.dbCatalog[typeName]
+    self.__keysCache.pop(typeName, None)
+    self.__rollupTables.discard(typeName)
+    self.__rollupTypes.discard(typeName)
     return S_OK()
 
   def __getIdForKeyValue(self, typeName, keyName, keyValue, conn=False):
@@ -496,31 +608,56 @@ class AccountingDB(DB):
       return S_OK(retVal['Value'][0][0])
     return S_ERROR("Key id %s for value %s does not exist although it shoud" % (keyName, keyValue))
 
+  def __getKeysCache(self, typeName):
+    """
+      Get the cache of the key ids of a type: ( key name, key value ) -> id
+    """
+    keysCache = self.__keysCache.get(typeName)
+    if keysCache is None:
+      keysCache = self.__keysCache.setdefault(typeName, DictCache(maxSize=self.__keysCacheSize))
+    return keysCache
+
+  def __loadKeysCache(self):
+    """
+      Fill the key ids cache with the content of the key tables, the most recent values first
+    """
+    for typeName in self.dbCatalog:
+      keysCache = self.__getKeysCache(typeName)
+      for keyName in self.dbCatalog[typeName]['keys']:
+        retVal = self._query("SELECT `value`, `id` FROM `%s` ORDER BY `id` DESC LIMIT %d" % (
+            _getTableName("key", typeName, keyName), self.__keysCacheSize))
+        if not retVal['OK']:
+          self.log.warn("Can't load the key ids cache", "for %s %s: %s" % (typeName, keyName, retVal['Message']))
+          continue
+        # Add the most recent values last, so that they are the last ones to be evicted
+        for keyValue, keyId in reversed(retVal['Value']):
+          keysCache.add((keyName, keyValue), KEYS_CACHE_LIFETIME, keyId)
+    return S_OK()
+
+  def getKeysCacheStats(self):
+    """
+      Get the statistics of the key ids caches, the hits being the queries saved
+
+      :returns: S_OK( { type name : { 'hits' : n, 'misses' : n, 'evictions' : n, 'expired' : n, 'size' : n } } )
+    """
+    return S_OK(dict((typeName, keysCache.getStats()) for typeName, keysCache in self.__keysCache.items()))
+
   def __addKeyValue(self, typeName, keyName, keyValue):
     """
       Adds a key value to a key table if not existant
     """
-    # Cast to string just in case
-    if not isinstance(keyValue, six.string_types):
-      keyValue = str(keyValue)
-    # No more than 64 chars for keys
-    if len(keyValue) > 64:
-      keyValue = keyValue[:64]
+    keyValue = _normalizeKeyValue(keyValue)
 
     # Look into the cache
-    if typeName not in self.__keysCache:
-      self.__keysCache[typeName] = {}
-    typeCache = self.__keysCache[typeName]
-    if keyName not in typeCache:
-      typeCache[keyName] = {}
-    keyCache = typeCache[keyName]
-    if keyValue in keyCache:
-      return S_OK(keyCache[keyValue])
+    keysCache = self.__getKeysCache(typeName)
+    keyId = keysCache.get((keyName, keyValue))
+    if keyId is not None:
+      return S_OK(keyId)
     # Retrieve key
     keyTable = _getTableName("key", typeName, keyName)
     retVal = self.__getIdForKeyValue(typeName, keyName, keyValue)
     if retVal['OK']:
-      keyCache[keyValue] = retVal['Value']
+      keysCache.add((keyName, keyValue), KEYS_CACHE_LIFETIME, retVal['Value'])
       return retVal
     # Key is not in there
     retVal = self._getConnection()
@@ -534,9 +671,46 @@ class AccountingDB(DB):
     result = self.__getIdForKeyValue(typeName, keyName, keyValue, connection)
     if not result['OK']:
       return result
-    keyCache[keyValue] = result['Value']
+    keysCache.add((keyName, keyValue), KEYS_CACHE_LIFETIME, result['Value'])
     return result
 
+  def __getKeyIds(self, typeName, keyName, keyValues):
+    """
+      Get the ids of several values of a key, adding the missing ones to the key table.
+      The values not in the cache are looked for with a single query.
+
+      :returns: S_OK( { normalized key value : id } ) / S_ERROR
+    """
+    keysCache = self.__getKeysCache(typeName)
+    keyIds = {}
+    notCached = []
+    for keyValue in set(_normalizeKeyValue(keyValue) for keyValue in keyValues):
+      keyId = keysCache.get((keyName, keyValue))
+      if keyId is None:
+        notCached.append(keyValue)
+      else:
+        keyIds[keyValue] = keyId
+    if notCached:
+      retVal = self._escapeValues(notCached)
+      if not retVal['OK']:
+        return retVal
+      retVal = self._query("SELECT `value`, `id` FROM `%s` WHERE `value` IN ( %s )" %
+                           (_getTableName("key", typeName, keyName), ", ".join(retVal['Value'])))
+      if not retVal['OK']:
+        return retVal
+      for keyValue, keyId in retVal['Value']:
+        keysCache.add((keyName, keyValue), KEYS_CACHE_LIFETIME, keyId)
+        if keyValue in notCached:
+          keyIds[keyValue] = keyId
+      # New values, or values stored with another case, are resolved one by one
+      for keyValue in notCached:
+        if keyValue not in keyIds:
+          retVal = self.__addKeyValue(typeName, keyName, keyValue)
+          if not retVal['OK']:
+            return retVal
+          keyIds[keyValue] = retVal['Value']
+    return S_OK(keyIds)
+
   def calculateBucketLengthForTime(self, typeName, now, when):
     """
     Get the expected bucket time for a moment in time
@@ -632,6 +806,19 @@ class AccountingDB(DB):
     Do the real insert and delete from the in buffer table
     """
     self.log.verbose("Received bundle to process", "of %s elements" % len(recordTuples))
+    if self.__bulkRecordInsertion:
+      recordsByType = {}
+      for record in recordTuples:
+        recordsByType.setdefault(record[1], []).append(record)
+      recordTuples = []
+      for typeName, typeRecords in recordsByType.items():
+        result = self.__insertBundleFromINTable(typeName, typeRecords)
+        if not result['OK']:
+          self.log.warn("Can't insert the bundle at once, inserting the records one by one",
+                        "for type %s: %s" % (typeName, result['Message']))
+          recordTuples.extend(typeRecords)
+    # type name -> [ start, end ] of the records inserted one by one
+    writtenTimes = {}
     for record in recordTuples:
       iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
       result = self.insertRecordDirectly(typeName, startTime, endTime, valuesList)
@@ -639,10 +826,125 @@ class AccountingDB(DB):
         self._update("UPDATE `%s` SET taken=0 WHERE id=%s" % (_getTableName("in", typeName), iD))
         self.log.error("Can't insert row", result['Message'])
         continue
+      times = writtenTimes.setdefault(typeName, [startTime, endTime])
+      times[0] = min(times[0], startTime)
+      times[1] = max(times[1], endTime)
       result = self._update("DELETE FROM `%s` WHERE id=%s" % (_getTableName("in", typeName), iD))
       if not result['OK']:
         self.log.error("Can't delete row from the IN table", result['Message'])
       gMonitor.addMark("insertiontime", Time.toEpoch() - insertionEpoch)
+    for typeName, (startTime, endTime) in writtenTimes.items():
+      self.__registerBucketWrite(typeName, startTime, endTime)
+
+  def __insertBundleFromINTable(self, typeName, recordTuples):
+    """
+    Insert a bundle of records of a type and delete them from the in buffer table, in one transaction.
+    The contributions of the records to each bucket are added up before being written.
+    """
+    if self.__readOnly:
+      return S_ERROR("ReadOnly mode enabled. No modification allowed")
+    if typeName not in self.dbCatalog:
+      return S_ERROR("Type %s has not been defined in the db" % typeName)
+    keyNames = self.dbCatalog[typeName]['keys']
+    numKeys = len(keyNames)
+    numValues = len(self.dbCatalog[typeName]['values'])
+    # Discover key indexes for the whole bundle
+    keyIds = []
+    for keyPos in range(numKeys):
+      retVal = self.__getKeyIds(typeName, keyNames[keyPos], [record[4][keyPos] for record in recordTuples])
+      if not retVal['OK']:
+        return retVal
+      keyIds.append(retVal['Value'])
+
+    nowEpoch = int(Time.toEpoch(Time.dateTime()))
+    typeRows = []
+    # ( startTime, bucketLength, key ids ) -> values and number of entries of the bucket
+    buckets = {}
+    rollupBuckets = {}
+    for _iD, _typeName, startTime, endTime, valuesList, _insertionEpoch in recordTuples:
+      recordKeys = tuple(keyIds[keyPos][_normalizeKeyValue(valuesList[keyPos])] for keyPos in range(numKeys))
+      recordValues = [float(value) for value in valuesList[numKeys:]]
+      retVal = self._escapeValues(list(recordKeys) + list(valuesList[numKeys:]) + [startTime, endTime])
+      if not retVal['OK']:
+        return retVal
+      typeRows.append("( %s )" % ", ".join(retVal['Value']))
+      # HACK: One more value to split in the buckets to be able to count total entries
+      recordValues.append(1)
+      bucketsToFill = [(buckets, self.calculateBuckets(typeName, startTime, endTime, nowEpoch))]
+      if typeName in self.__rollupTables:
+        bucketsToFill.append((rollupBuckets, _calculateFixedBuckets(startTime, endTime, ROLLUP_BUCKET_LENGTH)))
+      for bucketsDict, recordBuckets in bucketsToFill:
+        for bStartTime, bProportion, bLength in recordBuckets:
+          bucketValues = bucketsDict.setdefault((bStartTime, bLength, recordKeys), [0.0] * (numValues + 1))
+          for valPos in range(numValues + 1):
+            bucketValues[valPos] += recordValues[valPos] * bProportion
+
+    sqlCmds = []
+    for rows in List.breakListIntoChunks(typeRows, 1000):
+      sqlCmds.append("INSERT INTO `%s` ( %s ) VALUES %s" % (
+          _getTableName("type", typeName),
+          ", ".join("`%s`" % field for field in self.dbCatalog[typeName]['typeFields']),
+          ", ".join(rows)))
+    sqlCmds.extend(self.__getAddToBucketsCmds(typeName, buckets, "bucket"))
+    sqlCmds.extend(self.__getAddToBucketsCmds(typeName, rollupBuckets, "rollup"))
+    idCond = " OR ".join("`id` BETWEEN %d AND %d" % idRange
+                         for idRange in _getIdRanges([record[0] for record in recordTuples]))
+    sqlCmds.append("DELETE FROM `%s` WHERE %s" % (_getTableName("in", typeName), idCond))
+
+    retVal = self._getConnection()
+    if not retVal['OK']:
+      return retVal
+    connObj = retVal['Value']
+    try:
+      retVal = self.__startTransaction(connObj)
+      if not retVal['OK']:
+        return retVal
+      for cmd in sqlCmds:
+        retVal = self._update(cmd, conn=connObj)
+        if not retVal['OK']:
+          self.__rollbackTransaction(connObj)
+          return retVal
+      retVal = self.__commitTransaction(connObj)
+      if not retVal['OK']:
+        self.__rollbackTransaction(connObj)
+        return retVal
+    finally:
+      connObj.close()
+
+    self.__registerBucketWrite(typeName,
+                               min(record[2] for record in recordTuples), max(record[3] for record in recordTuples))
+    self.log.info("Added bundle of records", "for type %s: %s records in %s buckets" %
+                  (typeName, len(recordTuples), len(buckets)))
+    gMonitor.addMark("registeradded", len(recordTuples))
+    gMonitor.addMark("registeradded:%s" % typeName, len(recordTuples))
+    now = Time.toEpoch()
+    for record in recordTuples:
+      gMonitor.addMark("insertiontime", now - record[5])
+    return S_OK()
+
+  def __getAddToBucketsCmds(self, typeName, buckets, tableType):
+    """
+    Get the queries adding values to buckets
+
+    :param dict buckets: ( startTime, bucketLength, key ids ) -> values and number of entries to add
+    :param str tableType: bucket or rollup
+    :returns: list of queries
+    """
+    sqlFields = ['`startTime`', '`bucketLength`', '`entriesInBucket`']
+    sqlFields.extend("`%s`" % keyName for keyName in self.dbCatalog[typeName]['keys'])
+    sqlUpData = ["`entriesInBucket`=`entriesInBucket`+VALUES(`entriesInBucket`)"]
+    for valueField in self.dbCatalog[typeName]['values']:
+      sqlFields.append("`%s`" % valueField)
+      sqlUpData.append("`%s`=`%s`+VALUES(`%s`)" % (valueField, valueField, valueField))
+    bucketRows = []
+    for (bStartTime, bLength, recordKeys), bucketValues in buckets.items():
+      sqlValues = [str(bStartTime), str(bLength), repr(bucketValues[-1])]
+      sqlValues.extend(str(keyId) for keyId in recordKeys)
+      sqlValues.extend(repr(value) for value in bucketValues[:-1])
+      bucketRows.append("( %s )" % ", ".join(sqlValues))
+    return ["INSERT INTO `%s` ( %s ) VALUES %s ON DUPLICATE KEY UPDATE %s" % (
+        _getTableName(tableType, typeName), ", ".join(sqlFields), ", ".join(rows), ", ".join(sqlUpData))
+        for rows in List.breakListIntoChunks(bucketRows, 1000)]
 
   def insertRecordDirectly(self, typeName, startTime, endTime, valuesList):
     """
@@ -687,6 +989,10 @@ class AccountingDB(DB):
       if not retVal['OK']:
         return retVal
       retVal = self.__splitInBuckets(typeName, startTime, endTime, valuesList, connObj=connObj)
+      if retVal['OK'] and typeName in self.__rollupTables:
+        numKeys = len(self.dbCatalog[typeName]['keys'])
+        retVal = self.__writeBuckets(typeName, _calculateFixedBuckets(startTime, endTime, ROLLUP_BUCKET_LENGTH),
+                                     valuesList[:numKeys], valuesList[numKeys:], connObj=connObj, tableType="rollup")
       if not retVal['OK']:
         self.__rollbackTransaction(connObj)
         return retVal
@@ -757,6 +1063,13 @@ class AccountingDB(DB):
       return S_OK(0)
     sqlValues.append(1)
     retVal = self.__deleteFromBuckets(typeName, startTime, endTime, sqlValues, numInsertions, connObj=connObj)
+    if retVal['OK'] and typeName in self.__rollupTables:
+      for bStartTime, bProportion, bLength in _calculateFixedBuckets(startTime, endTime, ROLLUP_BUCKET_LENGTH):
+        retVal = self.__extractFromBucket(typeName, bStartTime, bLength, sqlValues[:numKeyFields],
+                                          sqlValues[numKeyFields:], bProportion * numInsertions,
+                                          connObj=connObj, tableType="rollup")
+        if not retVal['OK']:
+          break
     if not retVal['OK']:
       self.__rollbackTransaction(connObj)
       return retVal
@@ -764,6 +1077,7 @@ class AccountingDB(DB):
     if not retVal['OK']:
       self.__rollbackTransaction(connObj)
       return retVal
+    self.__registerBucketWrite(typeName, startTime, endTime)
     return S_OK(numInsertions)
 
   def __splitInBuckets(self, typeName, startTime, endTime, valuesList, connObj=False):
@@ -813,7 +1127,7 @@ class AccountingDB(DB):
   def getBucketsDef(self, typeName):
     return self.dbBucketsLength[typeName]
 
-  def __generateSQLConditionForKeys(self, typeName, keyValues):
+  def __generateSQLConditionForKeys(self, typeName, keyValues, tableType="bucket"):
     """
     Generate sql condition for buckets, values are indexes to real values
     """
@@ -825,7 +1139,7 @@ class AccountingDB(DB):
       if not retVal['OK']:
         return retVal
       keyValue = retVal['Value']
-      realCondList.append("`%s`.`%s` = %s" % (_getTableName("bucket", typeName), keyField, keyValue))
+      realCondList.append("`%s`.`%s` = %s" % (_getTableName(tableType, typeName), keyField, keyValue))
     return " AND ".join(realCondList)
 
   def __getBucketFromDB(self, typeName, startTime, bucketLength, keyValues, connObj=False):
@@ -847,11 +1161,12 @@ class AccountingDB(DB):
     cmd += self.__generateSQLConditionForKeys(typeName, keyValues)
     return self._query(cmd, conn=connObj)
 
-  def __extractFromBucket(self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj=False):
+  def __extractFromBucket(self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj=False,
+                          tableType="bucket"):
     """
     Update a bucket when coming from the raw insert
     """
-    tableName = _getTableName("bucket", typeName)
+    tableName = _getTableName(tableType, typeName)
     cmd = "UPDATE `%s` SET " % tableName
     sqlValList = []
     for pos in range(len(self.dbCatalog[typeName]['values'])):
@@ -872,10 +1187,10 @@ class AccountingDB(DB):
         tableName,
         bucketLength
     )
-    cmd += self.__generateSQLConditionForKeys(typeName, keyValues)
+    cmd += self.__generateSQLConditionForKeys(typeName, keyValues, tableType)
     return self._update(cmd, conn=connObj)
 
-  def __writeBuckets(self, typeName, buckets, keyValues, valuesList, connObj=False):
+  def __writeBuckets(self, typeName, buckets, keyValues, valuesList, connObj=False, tableType="bucket"):
     """ Insert or update a bucket
     """
 #     tableName = _getTableName( "bucket", typeName )
@@ -901,7 +1216,7 @@ class AccountingDB(DB):
         sqlValues.append("(%s*%s)" % (valuesList[valPos], bProportion))
       valuesGroups.append("( %s )" % ",".join(str(val) for val in sqlValues))
 
-    cmd = "INSERT INTO `%s` ( %s ) " % (_getTableName("bucket", typeName), ", ".join(sqlFields))
+    cmd = "INSERT INTO `%s` ( %s ) " % (_getTableName(tableType, typeName), ", ".join(sqlFields))
     cmd += "VALUES %s " % ", ".join(valuesGroups)
     cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join(sqlUpData)
 
@@ -1000,20 +1315,253 @@ class AccountingDB(DB):
     nowEpoch = Time.toEpoch(Time.dateTime())
     bucketTimeLength = self.calculateBucketLengthForTime(typeName, nowEpoch, startTime)
     startTime = startTime - startTime % bucketTimeLength
-    result = self.__queryType(
-        typeName,
-        startTime,
-        endTime,
-        selectFields,
-        condDict,
-        groupFields,
-        orderFields,
-        "bucket",
-        connObj=connObj
-    )
+    timeBounds = self.__getBucketTimeBounds(typeName, startTime, endTime)
+    cacheKey = None
+    if self.__syncQueryCache():
+      normCondDict = []
+      for keyName in sorted(condDict):
+        keyValues = condDict[keyName] if isinstance(condDict[keyName], (list, tuple)) else [condDict[keyName]]
+        normCondDict.append((keyName, sorted(str(keyValue) for keyValue in keyValues)))
+      cacheKey = (typeName, timeBounds[0], timeBounds[1],
+                  repr((selectFields, normCondDict, groupFields, orderFields)))
+      result = self.__queryCache.get(cacheKey)
+      if result is not None:
+        gMonitor.addMark("querytime", Time.toEpoch() - startQueryEpoch)
+        return S_OK(result)
+    result = self.__queryBuckets(typeName, timeBounds, bucketTimeLength, selectFields, condDict,
+                                 groupFields, orderFields, connObj=connObj)
+    if result['OK'] and cacheKey:
+      self.__queryCache.add(cacheKey, self.__queryCacheLifeTime, result['Value'])
     gMonitor.addMark("querytime", Time.toEpoch() - startQueryEpoch)
     return result
 
+  def __queryBuckets(self, typeName, timeBounds, granularity, selectFields, condDict,
+                     groupFields, orderFields, connObj=False):
+    """
+    Query the buckets, taking the complete days from the rollup table when it can be used
+    """
+    if not self.__canUseRollup(typeName, timeBounds, granularity, groupFields, orderFields):
+      return self.__queryType(typeName, False, False, selectFields, condDict, groupFields, orderFields,
+                              "bucket", connObj=connObj, timeBounds=timeBounds)
+    splitTime = timeBounds[1] - timeBounds[1] % ROLLUP_BUCKET_LENGTH
+    data = []
+    for tableType, tableBounds in (("rollup", (timeBounds[0], splitTime - 1)),
+                                   ("bucket", (splitTime, timeBounds[1]))):
+      # The fields and conditions are modified by __queryType
+      result = self.__queryType(typeName, False, False, copy.deepcopy(selectFields), copy.deepcopy(condDict),
+                                copy.deepcopy(groupFields), copy.deepcopy(orderFields),
+                                tableType, connObj=connObj, timeBounds=tableBounds)
+      if not result['OK']:
+        return result
+      data.extend(result['Value'])
+    return S_OK(tuple(data))
+
+  def __canUseRollup(self, typeName, timeBounds, granularity, groupFields, orderFields):
+    """
+    The rollup table holds the buckets of one day. It is used for the time series of at least
+    one day of granularity, starting at the beginning of a day and with more than one day of data
+    """
+    if not self.__useRollups or typeName not in self.__rollupTypes:
+      return False
+    lowerTime, upperTime = timeBounds
+    if lowerTime is None or upperTime is None:
+      return False
+    if granularity < ROLLUP_BUCKET_LENGTH or granularity % ROLLUP_BUCKET_LENGTH:
+      return False
+    if lowerTime % ROLLUP_BUCKET_LENGTH or upperTime - upperTime % ROLLUP_BUCKET_LENGTH <= lowerTime:
+      return False
+    # The buckets after the split must not overlap the rollup
+    splitBucketLength = self.calculateBucketLengthForTime(typeName, Time.toEpoch(),
+                                                          upperTime - upperTime % ROLLUP_BUCKET_LENGTH)
+    if ROLLUP_BUCKET_LENGTH % splitBucketLength:
+      return False
+    if not groupFields or len(groupFields) != 2 or 'startTime' not in groupFields[1]:
+      return False
+    return not orderFields or list(orderFields[1]) == ['startTime']
+
+  def __getBucketTimeBounds(self, typeName, startTime, endTime):
+    """
+    Get the limits of the start time of the buckets to query, None if there is no limit
+    """
+    bounds = []
+    for epoch in (startTime, endTime):
+      if not epoch:
+        bounds.append(None)
+        continue
+      # HACK because MySQL and UNIX do not start epoch at the same time
+      epoch = epoch + 3600
+      bounds.append(self.calculateBuckets(typeName, epoch, epoch)[0][0])
+    return tuple(bounds)
+
+  def __registerBucketWrite(self, typeName, startTime, endTime):
+    """
+    Invalidate the cached query results for the buckets written, and record the write for
+    the other AccountingDB instances
+    """
+    # The buckets containing the start time may start up to the longest bucket length before it
+    startTime = int(startTime)
+    startTime -= startTime % self.maxBucketTime
+    endTime = int(endTime)
+    self.__invalidateQueryCache(typeName, startTime, endTime)
+    result = self._escapeString(typeName)
+    if not result['OK']:
+      return result
+    return self._update("INSERT INTO `%s` ( typeName, startTime, endTime, writeTime ) "
+                        "VALUES ( %s, %d, %d, UTC_TIMESTAMP() )" % (self.bucketWritesTableName,
+                                                                   result['Value'], startTime, endTime))
+
+  def __invalidateQueryCache(self, typeName, startTime, endTime):
+    """
+    Delete the cached results of the queries over the buckets of the time range
+    """
+    for cacheKey in self.__queryCache.getKeys():
+      keyType, lowerTime, upperTime = cacheKey[:3]
+      if keyType != typeName:
+        continue
+      if (lowerTime is None or lowerTime <= endTime) and (upperTime is None or upperTime >= startTime):
+        self.__queryCache.delete(cacheKey)
+
+  def __syncQueryCache(self):
+    """
+    Invalidate the cached results of the buckets written by the other AccountingDB instances,
+    and reload the types with a rollup
+
+    :returns: whether the query cache can be used
+    """
+    with self.__queryCacheLock:
+      if time.time() - self.__queryCacheSyncTime < BUCKET_WRITES_SYNC_PERIOD:
+        return self.__lastBucketWriteId is not None
+      self.__queryCacheSyncTime = time.time()
+      if self.__lastBucketWriteId is None:
+        self.__queryCache.purgeAll()
+        result = self._query("SELECT MAX(id) FROM `%s`" % self.bucketWritesTableName)
+        if result['OK']:
+          self.__lastBucketWriteId = (result['Value'][0][0] if result['Value'] else None) or 0
+      else:
+        result = self._query("SELECT id, typeName, startTime, endTime FROM `%s` WHERE id > %d ORDER BY id" %
+                             (self.bucketWritesTableName, self.__lastBucketWriteId))
+        if result['OK']:
+          for writeId, typeName, startTime, endTime in result['Value']:
+            self.__invalidateQueryCache(typeName, startTime, endTime)
+            self.__lastBucketWriteId = writeId
+      if not result['OK']:
+        self.log.error("Can't get the buckets written, disabling the query cache", result['Message'])
+        self.__queryCache.purgeAll()
+        self.__lastBucketWriteId = None
+        return False
+      result = self._query("SELECT name FROM `%s`" % self.rollupsTableName)
+      if result['OK']:
+        self.__rollupTypes = set(row[0] for row in result['Value'])
+      else:
+        self.log.error("Can't get the types with a rollup", result['Message'])
+        self.__rollupTypes = set()
+      return True
+
+  def __fillRollupInBackground(self, typeName):
+    """
+    Queue the filling of the rollup table of a type, done by a single thread
+    """
+    with self.__rollupsToFillLock:
+      if typeName in self.__rollupsToFill:
+        return
+      self.__rollupsToFill.append(typeName)
+      if len(self.__rollupsToFill) > 1:
+        return
+    th = threading.Thread(target=self.__fillQueuedRollups)
+    th.setDaemon(1)
+    th.start()
+
+  def __fillQueuedRollups(self):
+    typeName = self.__rollupsToFill[0]
+    while True:
+      self.log.info("Filling the rollup table", "of type %s" % typeName)
+      retVal = self.__fillRollup(typeName)
+      if not retVal['OK']:
+        self.log.error("Can't fill the rollup", "of %s: %s" % (typeName, retVal['Message']))
+      with self.__rollupsToFillLock:
+        self.__rollupsToFill.pop(0)
+        if not self.__rollupsToFill:
+          return
+        typeName = self.__rollupsToFill[0]
+
+  def __fillRollup(self, typeName):
+    """
+    Fill the rollup table of a type from its buckets, and make it available to the queries once complete.
+    Each range of days is emptied and added up again from the buckets in its own transaction, the buckets
+    written meanwhile are added to the rollup by the insertions
+    """
+    # The queries use the buckets until the rollup is complete
+    retVal = self._update("DELETE FROM `%s` WHERE name = '%s'" % (self.rollupsTableName, typeName))
+    if not retVal['OK']:
+      return retVal
+    self.__rollupTypes.discard(typeName)
+    tableName = _getTableName("rollup", typeName)
+    bucketTableName = _getTableName("bucket", typeName)
+    retVal = self._query("SELECT MIN(`startTime`), MAX(`startTime`) FROM `%s`" % bucketTableName)
+    if not retVal['OK']:
+      return retVal
+    firstTime, lastTime = retVal['Value'][0] if retVal['Value'] else (None, None)
+    keyFields = ["`%s`" % keyName for keyName in self.dbCatalog[typeName]['keys']]
+    valueFields = ["`%s`" % valueName for valueName in self.dbCatalog[typeName]['values']]
+    # The buckets longer than a day are split in days
+    maxBucketLength = max([self.maxBucketTime] + [bucketLength for _timeSpan, bucketLength
+                                                  in self.dbBucketsLength[typeName]])
+    numParts = -(-maxBucketLength // ROLLUP_BUCKET_LENGTH)
+    partsTable = " UNION ALL ".join("SELECT %d AS n" % part for part in range(numParts))
+    dayStart = "b.`startTime` - b.`startTime` %% %d + parts.n * %d" % (ROLLUP_BUCKET_LENGTH, ROLLUP_BUCKET_LENGTH)
+    proportion = "%d / GREATEST( b.`bucketLength`, %d )" % (ROLLUP_BUCKET_LENGTH, ROLLUP_BUCKET_LENGTH)
+    sqlSelect = [dayStart, str(ROLLUP_BUCKET_LENGTH), "SUM( b.`entriesInBucket` * %s )" % proportion]
+    sqlSelect.extend("b.%s" % keyField for keyField in keyFields)
+    sqlSelect.extend("SUM( b.%s * %s )" % (valueField, proportion) for valueField in valueFields)
+    ranges = []
+    if firstTime is not None:
+      firstTime = int(firstTime)
+      ranges = range(firstTime - firstTime % ROLLUP_BUCKET_LENGTH, int(lastTime) + maxBucketLength,
+                     ROLLUP_FILL_RANGE)
+    for rangeStart in ranges:
+      rangeEnd = rangeStart + ROLLUP_FILL_RANGE
+      sqlCmds = ["DELETE FROM `%s` WHERE `startTime` >= %d AND `startTime` < %d" % (tableName, rangeStart, rangeEnd),
+                 "INSERT INTO `%s` ( `startTime`, `bucketLength`, `entriesInBucket`, %s ) SELECT %s "
+                 "FROM `%s` b JOIN ( %s ) parts ON ( parts.n = 0 OR parts.n * %d < b.`bucketLength` ) "
+                 "WHERE b.`startTime` >= %d AND b.`startTime` < %d AND %s >= %d AND %s < %d "
+                 "GROUP BY %s" % (tableName, ", ".join(keyFields + valueFields), ", ".join(sqlSelect),
+                                  bucketTableName, partsTable, ROLLUP_BUCKET_LENGTH,
+                                  rangeStart - maxBucketLength, rangeEnd, dayStart, rangeStart, dayStart, rangeEnd,
+                                  ", ".join([dayStart] + ["b.%s" % keyField for keyField in keyFields]))]
+      retVal = self.__updateInTransaction(sqlCmds)
+      if not retVal['OK']:
+        return retVal
+    retVal = self._update("INSERT IGNORE INTO `%s` ( name ) VALUES ( '%s' )" % (self.rollupsTableName, typeName))
+    if not retVal['OK']:
+      return retVal
+    self.__rollupTypes.add(typeName)
+    self.log.info("Filled the rollup table", "of type %s" % typeName)
+    return S_OK()
+
+  def __updateInTransaction(self, sqlCmds):
+    """
+    Execute the updates in a transaction, on a connection of their own
+    """
+    retVal = self._getConnection()
+    if not retVal['OK']:
+      return retVal
+    connObj = retVal['Value']
+    try:
+      retVal = self.__startTransaction(connObj)
+      if not retVal['OK']:
+        return retVal
+      for sqlCmd in sqlCmds:
+        retVal = self._update(sqlCmd, conn=connObj)
+        if not retVal['OK']:
+          self.__rollbackTransaction(connObj)
+          return retVal
+      retVal = self.__commitTransaction(connObj)
+      if not retVal['OK']:
+        self.__rollbackTransaction(connObj)
+      return retVal
+    finally:
+      connObj.close()
+
   def __queryType(
           self,
           typeName,
@@ -1024,9 +1572,13 @@ class AccountingDB(DB):
           groupFields,
           orderFields,
           tableType,
-          connObj=False):
+          connObj=False,
+          timeBounds=None):
     """
     Execute a query over a main table
+
+    For the bucket and rollup tables, timeBounds are the limits of the start time of
+    the buckets, if the start and end time are not used
     """
 
     tableName = _getTableName(tableType, typeName)
@@ -1082,19 +1634,16 @@ class AccountingDB(DB):
     cmd += " FROM %s" % ", ".join(sqlFromList)
     # Calculate time conditions
     sqlTimeCond = []
+    if tableType in ("bucket", "rollup"):
+      if timeBounds is None:
+        timeBounds = self.__getBucketTimeBounds(typeName, startTime, endTime)
+      startTime, endTime = timeBounds
+      endTimeSQLVar = "startTime"
+    else:
+      endTimeSQLVar = "endTime"
     if startTime:
-      if tableType == 'bucket':
-        # HACK because MySQL and UNIX do not start epoch at the same time
-        startTime = startTime + 3600
-        startTime = self.calculateBuckets(typeName, startTime, startTime)[0][0]
       sqlTimeCond.append("`%s`.`startTime` >= %s" % (tableName, startTime))
     if endTime:
-      if tableType == "bucket":
-        endTimeSQLVar = "startTime"
-        endTime = endTime + 3600
-        endTime = self.calculateBuckets(typeName, endTime, endTime)[0][0]
-      else:
-        endTimeSQLVar = "endTime"
       sqlTimeCond.append("`%s`.`%s` <= %s" % (tableName, endTimeSQLVar, endTime))
     cmd += " WHERE %s" % " AND ".join(sqlTimeCond)
     # Calculate conditions
@@ -1162,6 +1711,7 @@ class AccountingDB(DB):
     finally:
       gSynchro.unlock()
     slow = True
+    typesToCompact = []
     for typeName in self.dbCatalog:
       if typeFilter and typeName.find(typeFilter) == -1:
         self.log.info("[COMPACT] Skipping %s" % typeName)
@@ -1169,11 +1719,19 @@ class AccountingDB(DB):
       if self.dbCatalog[typeName]['dataTimespan'] > 0:
         self.log.info("[COMPACT] Deleting records older that timespan for type %s" % typeName)
         self.__deleteRecordsOlderThanDataTimespan(typeName)
+      if self.__parallelCompaction:
+        typesToCompact.append(typeName)
+        continue
       self.log.info("[COMPACT] Compacting %s" % typeName)
       if slow:
         self.__slowCompactBucketsForType(typeName)
       else:
         self.__compactBucketsForType(typeName)
+      self.__registerBucketWrite(typeName, 0, Time.toEpoch())
+    if typesToCompact:
+      self.__parallelCompactBuckets(typesToCompact)
+      for typeName in typesToCompact:
+        self.__registerBucketWrite(typeName, 0, Time.toEpoch())
     self.log.info("[COMPACT] Compaction finished")
     self.__lastCompactionEpoch = int(Time.toEpoch())
     gSynchro.lock()
@@ -1184,6 +1742,153 @@ class AccountingDB(DB):
       gSynchro.unlock()
     return S_OK()
 
+  def __parallelCompactBuckets(self, typeNames):
+    """
+    Compact the buckets of several types in parallel. The buckets of each length are
+    compacted by time partitions, starting from where the previous compaction stopped
+    """
+    result = self._query("SELECT typeName, bucketLength, compactedUntil FROM `%s`" % self.compactionTableName)
+    if not result['OK']:
+      self.log.error("[COMPACT] Can't get the compaction watermarks, compacting all the buckets", result['Message'])
+      result = S_OK(())
+    watermarks = dict(((typeName, bucketLength), compactedUntil)
+                      for typeName, bucketLength, compactedUntil in result['Value'])
+    nowEpoch = int(Time.toEpoch())
+    numSteps = max(len(self.dbBucketsLength[typeName]) for typeName in typeNames) - 1
+    executor = ThreadPoolExecutor(max_workers=self.__compactionThreads)
+    try:
+      # The buckets compacted at one step are compacted again at the next one
+      for bPos in range(numSteps):
+        futures = {}
+        timeLimits = {}
+        for typeName in typeNames:
+          if bPos >= len(self.dbBucketsLength[typeName]) - 1:
+            continue
+          secondsLimit, bucketLength = self.dbBucketsLength[typeName][bPos]
+          nextBucketLength = self.dbBucketsLength[typeName][bPos + 1][1]
+          # Each bucket of the next length is filled by a single partition
+          timeLimit = (nowEpoch - nowEpoch % bucketLength) - secondsLimit
+          timeLimit -= timeLimit % nextBucketLength
+          result = self.__getCompactionPartitions(typeName, bucketLength, nextBucketLength, timeLimit,
+                                                  watermarks.get((typeName, bucketLength)))
+          if not result['OK']:
+            self.log.error("[COMPACT] Can't get the buckets to compact", "%s: %s" % (typeName, result['Message']))
+            continue
+          timeLimits[(typeName, bucketLength)] = timeLimit
+          for partitionStart, partitionEnd in result['Value']:
+            future = executor.submit(self.__compactPartition, typeName, bucketLength,
+                                     partitionStart, partitionEnd, nowEpoch)
+            futures[future] = (typeName, bucketLength)
+        self.__waitForCompactedPartitions(bPos, numSteps, futures, timeLimits)
+        for (typeName, bucketLength), timeLimit in timeLimits.items():
+          result = self.__setCompactionWatermark(typeName, bucketLength, timeLimit)
+          if not result['OK']:
+            self.log.error("[COMPACT] Can't set the compaction watermark", "%s: %s" % (typeName, result['Message']))
+    finally:
+      executor.shutdown(wait=True)
+    return S_OK()
+
+  def __getCompactionPartitions(self, typeName, bucketLength, nextBucketLength, timeLimit, watermark):
+    """
+    Get the time partitions with the buckets of a length to compact, after the watermark
+
+    :returns: S_OK( [ ( partition start, partition end ) ] ) / S_ERROR
+    """
+    if watermark is None:
+      result = self._query("SELECT MIN( `startTime` ) FROM `%s` WHERE `bucketLength` = %d" %
+                           (_getTableName("bucket", typeName), bucketLength))
+      if not result['OK']:
+        return result
+      if not result['Value'] or result['Value'][0][0] is None:
+        return S_OK([])
+      startTime = int(result['Value'][0][0])
+    else:
+      startTime = watermark - COMPACTION_WATERMARK_MARGIN
+    startTime -= startTime % nextBucketLength
+    partitionLength = nextBucketLength * max(1, 86400 // nextBucketLength)
+    return S_OK([(partitionStart, min(partitionStart + partitionLength, timeLimit))
+                 for partitionStart in range(startTime, timeLimit, partitionLength)])
+
+  def __waitForCompactedPartitions(self, bPos, numSteps, futures, timeLimits):
+    """
+    Wait for the compaction of the partitions, logging the progress. The watermark is not moved
+    for the types and bucket lengths with a partition not compacted
+    """
+    startTime = time.time()
+    compacted = 0
+    for done, future in enumerate(as_completed(futures), 1):
+      typeName, bucketLength = futures[future]
+      result = future.result()
+      if not result['OK']:
+        self.log.error("[COMPACT] Can't compact buckets", "%s of %s seconds: %s" %
+                       (typeName, bucketLength, result['Message']))
+        timeLimits.pop((typeName, bucketLength), None)
+        continue
+      compacted += result['Value']
+      gMonitor.addMark("compactedbuckets", result['Value'])
+      if done % 100 == 0 or done == len(futures):
+        elapsedTime = max(time.time() - startTime, 0.001)
+        self.log.info("[COMPACT] Step %d of %d: %d of %d partitions, %d buckets compacted (%.1f buckets/s)" %
+                      (bPos + 1, numSteps, done, len(futures), compacted, compacted / elapsedTime))
+
+  def __compactPartition(self, typeName, bucketLength, partitionStart, partitionEnd, nowEpoch):
+    """
+    Replace the buckets of a length in a time partition by the buckets of the length for their time,
+    in one transaction
+
+    :returns: S_OK( number of buckets compacted ) / S_ERROR
+    """
+    tableName = _getTableName("bucket", typeName)
+    numKeys = len(self.dbCatalog[typeName]['keys'])
+    timeCond = "`startTime` >= %d AND `startTime` < %d AND `bucketLength` = %d" % (partitionStart,
+                                                                                 partitionEnd,
+                                                                                 bucketLength)
+    sqlFields = ["`%s`" % field for field in self.dbCatalog[typeName]['keys'] + self.dbCatalog[typeName]['values']]
+    sqlFields.extend(['`entriesInBucket`', '`startTime`'])
+    retVal = self._getConnection()
+    if not retVal['OK']:
+      return retVal
+    connObj = retVal['Value']
+    retVal = self.__startTransaction(connObj)
+    if not retVal['OK']:
+      return retVal
+    retVal = self._query("SELECT %s FROM `%s` WHERE %s FOR UPDATE" % (", ".join(sqlFields), tableName, timeCond),
+                         conn=connObj)
+    if not retVal['OK'] or not retVal['Value']:
+      self.__rollbackTransaction(connObj)
+      return S_OK(0) if retVal['OK'] else retVal
+    bucketsData = retVal['Value']
+    # ( startTime, bucketLength, key ids ) -> values and number of entries of the bucket
+    buckets = {}
+    for record in bucketsData:
+      recordKeys = tuple(record[:numKeys])
+      recordValues = [float(value) for value in record[numKeys:-1]]
+      for bStartTime, bProportion, bLength in self.calculateBuckets(typeName, record[-1], record[-1] + bucketLength,
+                                                                    nowEpoch):
+        bucketValues = buckets.setdefault((bStartTime, bLength, recordKeys), [0.0] * len(recordValues))
+        for valPos, value in enumerate(recordValues):
+          bucketValues[valPos] += value * bProportion
+    sqlCmds = ["DELETE FROM `%s` WHERE %s" % (tableName, timeCond)]
+    sqlCmds.extend(self.__getAddToBucketsCmds(typeName, buckets, "bucket"))
+    for sqlCmd in sqlCmds:
+      retVal = self._update(sqlCmd, conn=connObj)
+      if not retVal['OK']:
+        self.__rollbackTransaction(connObj)
+        return retVal
+    retVal = self.__commitTransaction(connObj)
+    if not retVal['OK']:
+      self.__rollbackTransaction(connObj)
+      return retVal
+    return S_OK(len(bucketsData))
+
+  def __setCompactionWatermark(self, typeName, bucketLength, timeLimit):
+    """
+    Record that the buckets of a length are compacted until a time
+    """
+    return self._update("INSERT INTO `%s` ( typeName, bucketLength, compactedUntil ) VALUES ( '%s', %d, %d ) "
+                        "ON DUPLICATE KEY UPDATE compactedUntil = VALUES( compactedUntil )" %
+                        (self.compactionTableName, typeName, bucketLength, timeLimit))
+
   def __selectForCompactBuckets(self, typeName, timeLimit, bucketLength, nextBucketLength, connObj=False):
     """
     Nasty SQL query to get ideal buckets using grouping by date calculations and adding value contents
@@ -1382,8 +2087,11 @@ class AccountingDB(DB):
     dataTimespan = self.dbCatalog[typeName]['dataTimespan'] + self.dbBucketsLength[typeName][-1][1]
     if dataTimespan < 86400 * 30:
       return
-    for table, field in ((_getTableName("type", typeName), 'endTime'),
-                         (_getTableName("bucket", typeName), 'startTime')):
+    tables = [(_getTableName("type", typeName), 'endTime'),
+              (_getTableName("bucket", typeName), 'startTime')]
+    if typeName in self.__rollupTables:
+      tables.append((_getTableName("rollup", typeName), 'startTime'))
+    for table, field in tables:
       self.log.info("[COMPACT] Deleting old records for table %s" % table)
       deleteLimit = 100000
       deleted = deleteLimit
@@ -1400,6 +2108,7 @@ class AccountingDB(DB):
         self.log.info("[COMPACT] Deleted %d records for %s table" % (result['Value'], table))
         deleted = result['Value']
         time.sleep(1)
+    self.__registerBucketWrite(typeName, 0, Time.toEpoch() - dataTimespan)
 
   def regenerateBuckets(self, typeName):
     if self.__readOnly:
@@ -1415,6 +2124,10 @@ class AccountingDB(DB):
     #  return retVal
     self.log.info("[REBUCKET] Deleting buckets for %s" % typeName)
     retVal = self._update("DELETE FROM `%s`" % _getTableName("bucket", typeName))
+    if not retVal['OK']:
+      return retVal
+    # The buckets are compacted again from the beginning
+    retVal = self._update("DELETE FROM `%s` WHERE typeName='%s'" % (self.compactionTableName, typeName))
     if not retVal['OK']:
       return retVal
     # Generate the common part of the query
@@ -1529,6 +2242,12 @@ class AccountingDB(DB):
           self.log.info("[REBUCKET] Rebucketed %.2f%% %s (%.2f r/s block %.2f r/s query | ETA %s )..." %
                         (perDone, typeName, blockAvg, queryAvg, expectedEnd))
     # return self.__commitTransaction( connObj )
+    if typeName in self.__rollupTables:
+      self.log.info("[REBUCKET] Filling the rollup table for %s" % typeName)
+      retVal = self.__fillRollup(typeName)
+      if not retVal['OK']:
+        return retVal
+    self.__registerBucketWrite(typeName, 0, Time.toEpoch())
     return S_OK()
 
   def __startTransaction(self, connObj):
@@ -1545,6 +2264,49 @@ def _bucketizeDataField(dataField, bucketLength):
   return "%s - ( %s %% %s )" % (dataField, dataField, bucketLength)
 
 
+def _calculateFixedBuckets(startTime, endTime, bucketLength):
+  """
+  Buckets of a fixed length between two times, and the proportional part for each bucket,
+  as done by AccountingDB.calculateBuckets
+  """
+  currentBucketStart = startTime - startTime % bucketLength
+  if startTime == endTime:
+    return [(currentBucketStart, 1, bucketLength)]
+  buckets = []
+  totalLength = endTime - startTime
+  while currentBucketStart < endTime:
+    start = max(currentBucketStart, startTime)
+    end = min(currentBucketStart + bucketLength, endTime)
+    buckets.append((currentBucketStart, float(end - start) / totalLength, bucketLength))
+    currentBucketStart += bucketLength
+  return buckets
+
+
+def _normalizeKeyValue(keyValue):
+  """
+  Key value as stored in the key tables: a string of no more than 64 chars
+  """
+  # Cast to string just in case
+  if not isinstance(keyValue, six.string_types):
+    keyValue = str(keyValue)
+  return keyValue[:64]
+
+
+def _getIdRanges(idList):
+  """
+  Group ids in ranges of consecutive ids
+
+  :returns: list of ( first id, last id ) tuples
+  """
+  idRanges = []
+  for iD in sorted(idList):
+    if idRanges and iD == idRanges[-1][1] + 1:
+      idRanges[-1][1] = iD
+    else:
+      idRanges.append([iD, iD])
+  return [tuple(idRange) for idRange in idRanges]
+
+
 def _getTableName(tableType, typeName, keyName=None):
   """
   Generate table name
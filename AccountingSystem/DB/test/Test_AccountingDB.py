@@ -4,6 +4,8 @@
 # pylint: disable=protected-access
 
 # imports
+import re
+import time
 import unittest
 from mock import MagicMock
 
@@ -389,6 +391,275 @@ ORDER BY startTime" % (expectedStartTime, expectedEndTime)
     self.assertTrue(retVal)
     self.assertEqual(retVal, expectedQuery)
 
+
+class FakeTablesTestCase(TestCase):
+  """ Base class for the test cases with a type and its key tables
+  """
+
+  def setUp(self):
+    super(FakeTablesTestCase, self).setUp()
+    self.module = self.testClass()
+    self.module.dbCatalog = {'Setup_Pilot': {'keys': ['User', 'Site'],
+                                             'values': ['Jobs'],
+                                             'typeFields': ['User', 'Site', 'Jobs', 'startTime', 'endTime']}}
+    self.module.dbBucketsLength['Setup_Pilot'] = [(31104000, 3600)]
+    self.keyIds = {'user1': 1, 'user2': 2, 'LCG.CERN.ch': 3}
+    self.updates = []
+    self.module._query = MagicMock(side_effect=self.query)
+    self.module._update = MagicMock(side_effect=self.update)
+    self.module._escapeValues = MagicMock(side_effect=lambda values: {'OK': True,
+                                                                      'Value': ["'%s'" % v for v in values]})
+    self.module._escapeString = MagicMock(side_effect=lambda value: {'OK': True, 'Value': "'%s'" % value})
+    self.module._getConnection = MagicMock(return_value={'OK': True, 'Value': MagicMock()})
+
+  def query(self, cmd, conn=None):  # pylint: disable=unused-argument
+    """ Key ids, and the transaction statements """
+    if cmd.startswith("SELECT `value`, `id`") and cmd.endswith("LIMIT 10"):
+      return {'OK': True, 'Value': tuple(self.keyIds.items())}
+    if cmd.startswith("SELECT `value`, `id`"):
+      return {'OK': True, 'Value': tuple((value, iD) for value, iD in self.keyIds.items()
+                                         if "'%s'" % value in cmd)}
+    return {'OK': True, 'Value': ()}
+
+  def update(self, cmd, conn=None):  # pylint: disable=unused-argument
+    """ Records the modifications """
+    self.updates.append(cmd)
+    return {'OK': True, 'Value': 1}
+
+
+class BulkInsertion(FakeTablesTestCase):
+  """ testing the insertion of bundles of records from the in table
+  """
+
+  def test_insertBundle(self):
+    """ The records are inserted and deleted at once, and added up in their bucket """
+    startTime = int(time.time()) // 3600 * 3600
+    records = [(5, 'Setup_Pilot', startTime, startTime, ['user1', 'LCG.CERN.ch', 2], 0),
+               (6, 'Setup_Pilot', startTime, startTime, ['user1', 'LCG.CERN.ch', 3], 0),
+               (8, 'Setup_Pilot', startTime, startTime, ['user2', 'LCG.CERN.ch', 1], 0)]
+    self.module._AccountingDB__insertFromINTable(records)  # pylint: disable=no-member
+
+    self.assertEqual(len(self.updates), 4)
+    typeInsert, bucketInsert, inDelete, bucketWrite = self.updates
+    self.assertTrue(typeInsert.startswith("INSERT INTO `ac_type_Setup_Pilot`"))
+    self.assertEqual(typeInsert.count("( '"), 3)
+    self.assertTrue(bucketInsert.startswith("INSERT INTO `ac_bucket_Setup_Pilot`"))
+    self.assertIn("( %s, 3600, 2.0, 1, 3, 5.0 )" % startTime, bucketInsert)
+    self.assertIn("( %s, 3600, 1.0, 2, 3, 1.0 )" % startTime, bucketInsert)
+    self.assertEqual(inDelete,
+                     "DELETE FROM `ac_in_Setup_Pilot` WHERE `id` BETWEEN 5 AND 6 OR `id` BETWEEN 8 AND 8")
+    self.assertTrue(bucketWrite.startswith("INSERT INTO `ac_catalog_BucketWrites`"))
+
+    # The key ids are now cached
+    self.module._query.reset_mock()
+    self.module._AccountingDB__insertFromINTable(records[:1])  # pylint: disable=no-member
+    self.assertFalse(any(call[0][0].startswith("SELECT") for call in self.module._query.call_args_list))
+
+  def test_insertBundleFailure(self):
+    """ The records are inserted one by one if the bundle can't be inserted """
+    self.module._update.side_effect = [{'OK': False, 'Message': 'Some error'}] + [{'OK': True, 'Value': 1}] * 10
+    self.module.insertRecordDirectly = MagicMock(return_value={'OK': True})
+    records = [(5, 'Setup_Pilot', 1495411200, 1495411200, ['user1', 'LCG.CERN.ch', 2], 0),
+               (6, 'Setup_Pilot', 1495411200, 1495411200, ['user2', 'LCG.CERN.ch', 1], 0)]
+    self.module._AccountingDB__insertFromINTable(records)  # pylint: disable=no-member
+    self.assertEqual(self.module.insertRecordDirectly.call_count, 2)
+
+  def test_loadKeysCache(self):
+    """ The key ids are loaded at start, and used for the insertions and the queries """
+    self.module._AccountingDB__loadKeysCache()  # pylint: disable=no-member
+    self.module._query.reset_mock()
+    startTime = int(time.time()) // 3600 * 3600
+    self.module._AccountingDB__insertFromINTable(  # pylint: disable=no-member
+        [(5, 'Setup_Pilot', startTime, startTime, ['user1', 'LCG.CERN.ch', 2], 0)])
+    self.assertFalse(any(call[0][0].startswith("SELECT") for call in self.module._query.call_args_list))
+
+    self.module.getKeyValues('Setup_Pilot', {'Site': ['LCG.CERN.ch'], 'User': ['user3']})
+    query = self.module._query.call_args_list[-1][0][0]
+    self.assertIn("`ac_bucket_Setup_Pilot`.`Site` = 3", query)
+    self.assertIn("`ac_key_Setup_Pilot_User`.value = ", query)
+    self.assertNotIn("`ac_key_Setup_Pilot_Site`.value = ", query)
+
+    stats = self.module.getKeysCacheStats()['Value']['Setup_Pilot']
+    # The fake key tables of User and Site have the same 3 values
+    self.assertEqual((stats['hits'], stats['misses'], stats['size']), (3, 1, 6))
+
+
+class RollupsAndQueryCache(FakeTablesTestCase):
+  """ testing the queries over the rollup tables, and the cache of their results
+  """
+
+  def setUp(self):
+    super(RollupsAndQueryCache, self).setUp()
+    self.module.dbCatalog['Setup_Pilot']['bucketFields'] = ['User', 'Site', 'Jobs', 'entriesInBucket',
+                                                            'startTime', 'bucketLength']
+    self.module.dbBucketsLength['Setup_Pilot'] = [(86400 * 7, 3600), (31104000, 86400)]
+    self.module._AccountingDB__rollupTables.add('Setup_Pilot')
+    self.bucketWrites = ()
+    self.queries = []
+
+  def test_rollupInsertion(self):
+    """ The records are also added up in the buckets of their day """
+    startTime = int(time.time()) // 86400 * 86400
+    self.module._AccountingDB__insertFromINTable(  # pylint: disable=no-member
+        [(5, 'Setup_Pilot', startTime, startTime + 7200, ['user1', 'LCG.CERN.ch', 2], 0)])
+    rollupInserts = [cmd for cmd in self.updates if cmd.startswith("INSERT INTO `ac_rollup_Setup_Pilot`")]
+    self.assertEqual(len(rollupInserts), 1)
+    self.assertIn("( %s, 86400, 1.0, 1, 3, 2.0 )" % startTime, rollupInserts[0])
+
+  def query(self, cmd, conn=None):
+    """ Types with a rollup, buckets written by other instances, and the queries of the buckets """
+    if cmd.startswith("SELECT name FROM `ac_catalog_Rollups`"):
+      return {'OK': True, 'Value': (('Setup_Pilot', ), )}
+    if cmd.startswith("SELECT MAX(id)"):
+      return {'OK': True, 'Value': ((3, ), )}
+    if cmd.startswith("SELECT id, typeName"):
+      return {'OK': True, 'Value': self.bucketWrites}
+    if "`ac_rollup_Setup_Pilot`" in cmd or "`ac_bucket_Setup_Pilot`" in cmd:
+      self.queries.append(cmd)
+      return {'OK': True, 'Value': ((len(self.queries), 'LCG.CERN.ch', 1.0), )}
+    return super(RollupsAndQueryCache, self).query(cmd, conn)
+
+  def retrieve(self, startTime, endTime):
+    """ Query the jobs per site and time, as done by the reports """
+    return self.module.retrieveBucketedData('Setup_Pilot', startTime, endTime,
+                                            ('%s, %s, SUM(%s)', ['startTime', 'Site', 'Jobs']), {'User': ['user1']},
+                                            ('%s, %s', ['startTime', 'Site']), ('%s', ['startTime']))
+
+  def test_calculateFixedBuckets(self):
+    """ The records are split in days in the rollup tables """
+    self.assertEqual(self.moduleTested._calculateFixedBuckets(86400 + 5, 86400 + 5, 86400), [(86400, 1, 86400)])
+    self.assertEqual(self.moduleTested._calculateFixedBuckets(86400 * 2 - 100, 86400 * 2 + 300, 86400),
+                     [(86400, 0.25, 86400), (86400 * 2, 0.75, 86400)])
+
+  def test_rollupQuery(self):
+    """ The complete days are taken from the rollup table, and the results are cached """
+    now = int(time.time())
+    result = self.retrieve(now - 86400 * 30, now)
+    self.assertTrue(result['OK'])
+    self.assertEqual(len(result['Value']), 2)
+    rollupQuery, bucketQuery = self.queries
+    splitTime = (now + 3600) // 3600 * 3600 // 86400 * 86400
+    self.assertIn("FROM `ac_rollup_Setup_Pilot`", rollupQuery)
+    self.assertIn("`ac_rollup_Setup_Pilot`.`startTime` <= %s " % (splitTime - 1), rollupQuery)
+    self.assertIn("FROM `ac_bucket_Setup_Pilot`", bucketQuery)
+    self.assertIn("`ac_bucket_Setup_Pilot`.`startTime` >= %s " % splitTime, bucketQuery)
+
+    # Same query from the cache
+    self.assertEqual(self.retrieve(now - 86400 * 30, now), result)
+    self.assertEqual(len(self.queries), 2)
+
+    # The cache is invalidated by the records inserted
+    startTime = now // 3600 * 3600
+    self.module._AccountingDB__insertFromINTable(  # pylint: disable=no-member
+        [(5, 'Setup_Pilot', startTime, startTime, ['user1', 'LCG.CERN.ch', 2], 0)])
+    self.assertNotEqual(self.retrieve(now - 86400 * 30, now), result)
+    self.assertEqual(len(self.queries), 4)
+
+    # The rollup is only used for a granularity of one day or more
+    self.queries = []
+    self.assertTrue(self.retrieve(now - 86400 * 2, now)['OK'])
+    self.assertEqual(len(self.queries), 1)
+    self.assertIn("FROM `ac_bucket_Setup_Pilot`", self.queries[0])
+
+  def test_bucketWritesOfOtherInstances(self):
+    """ The results cached are invalidated by the buckets written by the other instances """
+    now = int(time.time())
+    result = self.retrieve(now - 86400 * 30, now)
+    self.module._AccountingDB__queryCacheSyncTime = 0
+    self.bucketWrites = ((4, 'Setup_Pilot', now - 86400 * 60, now - 86400 * 45), )
+    self.assertEqual(self.retrieve(now - 86400 * 30, now), result)
+    self.module._AccountingDB__queryCacheSyncTime = 0
+    self.bucketWrites = ((5, 'Setup_Pilot', now - 86400 * 10, now - 86400 * 9), )
+    self.assertNotEqual(self.retrieve(now - 86400 * 30, now), result)
+
+    # The cache is not used if the buckets written can't be known
+    self.module._AccountingDB__queryCacheSyncTime = 0
+    self.module._query.side_effect = lambda cmd, conn=None: (
+        {'OK': False, 'Message': 'Some error'} if cmd.startswith("SELECT id, typeName") else self.query(cmd, conn))
+    self.retrieve(now - 86400 * 30, now)
+    numQueries = len(self.queries)
+    self.retrieve(now - 86400 * 30, now)
+    self.assertEqual(len(self.queries), numQueries + 2)
+
+  def test_fillRollup(self):
+    """ The rollup is filled one week at a time, and only queried once complete """
+    self.module._query.side_effect = lambda cmd, conn=None: (
+        {'OK': True, 'Value': ((86400 * 10 + 500, 86400 * 20), )} if cmd.startswith("SELECT MIN(`startTime`)")
+        else self.query(cmd, conn))
+    self.module._AccountingDB__rollupTypes.add('Setup_Pilot')
+    self.assertTrue(self.module._AccountingDB__fillRollup('Setup_Pilot')['OK'])  # pylint: disable=no-member
+    self.assertEqual(self.updates[0], "DELETE FROM `ac_catalog_Rollups` WHERE name = 'Setup_Pilot'")
+    self.assertTrue(self.updates[-1].startswith("INSERT IGNORE INTO `ac_catalog_Rollups`"))
+    # The buckets can be a week long, so the last week of buckets goes up to the following week
+    rangeDeletes = [cmd for cmd in self.updates if cmd.startswith("DELETE FROM `ac_rollup_Setup_Pilot`")]
+    self.assertEqual(rangeDeletes[0], "DELETE FROM `ac_rollup_Setup_Pilot` WHERE `startTime` >= %d "
+                     "AND `startTime` < %d" % (86400 * 10, 86400 * 17))
+    self.assertEqual(len(rangeDeletes), 3)
+    self.assertEqual(len(self.updates), 8)
+    self.assertIn('Setup_Pilot', self.module._AccountingDB__rollupTypes)
+    self.assertEqual(self.module._getConnection.return_value['Value'].close.call_count, 3)
+
+    # The rollup is not queried if it could not be filled
+    self.module._update.side_effect = lambda cmd, conn=None: (
+        {'OK': False, 'Message': 'Some error'} if cmd.startswith("INSERT INTO") else self.update(cmd, conn))
+    self.assertFalse(self.module._AccountingDB__fillRollup('Setup_Pilot')['OK'])  # pylint: disable=no-member
+    self.assertNotIn('Setup_Pilot', self.module._AccountingDB__rollupTypes)
+    self.assertEqual(self.module._getConnection.return_value['Value'].close.call_count, 4)
+
+
+class ParallelCompaction(FakeTablesTestCase):
+  """ testing the compaction of the buckets by time partitions
+  """
+
+  def setUp(self):
+    super(ParallelCompaction, self).setUp()
+    self.module.dbCatalog['Setup_Pilot']['dataTimespan'] = 0
+    self.module.dbBucketsLength['Setup_Pilot'] = [(86400, 3600), (31104000, 86400)]
+    self.now = int(time.time())
+    self.oldDay = self.now - self.now % 86400 - 86400 * 10
+    # startTime, bucketLength, User, Site, Jobs, entriesInBucket
+    self.buckets = [(self.oldDay, 3600, 1, 3, 2.0, 1.0),
+                    (self.oldDay + 7200, 3600, 1, 3, 3.0, 2.0),
+                    (self.oldDay + 86400, 3600, 2, 3, 1.0, 1.0),
+                    (self.now - self.now % 3600, 3600, 1, 3, 1.0, 1.0)]
+    self.watermarks = ()
+
+  def query(self, cmd, conn=None):
+    """ Watermarks and buckets of the type """
+    if cmd.startswith("SELECT typeName, bucketLength, compactedUntil"):
+      return {'OK': True, 'Value': self.watermarks}
+    if cmd.startswith("SELECT MIN( `startTime` )"):
+      return {'OK': True, 'Value': ((min(bucket[0] for bucket in self.buckets if bucket[1] == 3600), ), )}
+    if cmd.endswith("FOR UPDATE"):
+      self.updates.append(cmd)
+      start, end = [int(value) for value in re.findall(r"`startTime` [<>]=? (\d+)", cmd)]
+      return {'OK': True, 'Value': tuple(bucket[2:] + bucket[:1] for bucket in self.buckets
+                                         if start <= bucket[0] < end and bucket[1] == 3600)}
+    return super(ParallelCompaction, self).query(cmd, conn)
+
+  def test_compactBuckets(self):
+    """ The hour buckets of the old days are replaced by day buckets, and the watermark is set """
+    self.module.compactBuckets()
+    selects = [cmd for cmd in self.updates if cmd.endswith("FOR UPDATE")]
+    # One partition per day, from the oldest bucket
+    self.assertEqual(len(selects), 9)
+    deletes = [cmd for cmd in self.updates if cmd.startswith("DELETE FROM `ac_bucket_Setup_Pilot`")]
+    self.assertEqual(len(deletes), 2)
+    inserts = " ".join(cmd for cmd in self.updates if cmd.startswith("INSERT INTO `ac_bucket_Setup_Pilot`"))
+    self.assertIn("( %s, 86400, 3.0, 1, 3, 5.0 )" % self.oldDay, inserts)
+    self.assertIn("( %s, 86400, 1.0, 2, 3, 1.0 )" % (self.oldDay + 86400), inserts)
+    watermark = [cmd for cmd in self.updates if cmd.startswith("INSERT INTO `ac_catalog_Compaction`")]
+    timeLimit = self.now - self.now % 86400 - 86400
+    self.assertIn("VALUES ( 'Setup_Pilot', 3600, %d )" % timeLimit, watermark[0])
+
+    # The next compaction starts from the watermark
+    self.updates = []
+    self.watermarks = (('Setup_Pilot', 3600, timeLimit), )
+    self.module.compactBuckets()
+    selects = [cmd for cmd in self.updates if cmd.endswith("FOR UPDATE")]
+    self.assertEqual(len(selects), 1)
+    self.assertIn("`startTime` >= %d " % (timeLimit - 86400), selects[0])
+
 #############################################################################
 # Test Suite run
 #############################################################################
@@ -397,4 +668,7 @@ ORDER BY startTime" % (expectedStartTime, expectedEndTime)
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestCase)
   suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(MakeQuery))
+  suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(BulkInsertion))
+  suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(RollupsAndQueryCache))
+  suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(ParallelCompaction))
   testResult = unittest.TextTestRunner(verbosity=2).run(suite)
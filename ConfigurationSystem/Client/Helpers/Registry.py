@@ -2,11 +2,14 @@
 """
 import six
 import errno
+import threading
 
 from DIRAC import S_OK, S_ERROR
 from DIRAC.Core.Utilities import DErrno
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
 from DIRAC.ConfigurationSystem.Client.Helpers.CSGlobals import getVO
+from DIRAC.ConfigurationSystem.private.Refresher import gRefresher
 
 __RCSID__ = "$Id$"
 
@@ -14,16 +17,67 @@ __RCSID__ = "$Id$"
 
 gBaseRegistrySection = "/Registry"
 
+# Reverse indexes of the Registry (e.g. DN -> users), built at their first use after each change
+# of the configuration
+gReverseIndexes = {}
+gReverseIndexesSyncCount = None
+gReverseIndexesLock = threading.Lock()
+
+
+def __getReverseIndex(indexKey, buildFunction, *args):
+  """ Get a reverse index of the Registry, building it if the configuration changed
+
+      :param tuple indexKey: key of the index
+      :param buildFunction: function building the index from args, returning S_OK(dict)/S_ERROR()
+
+      :return: S_OK(dict)/S_ERROR()
+  """
+  global gReverseIndexesSyncCount
+  gRefresher.refreshConfigurationIfNeeded()
+  syncCount = gConfigurationData.getSyncCount()
+  with gReverseIndexesLock:
+    if syncCount != gReverseIndexesSyncCount:
+      gReverseIndexes.clear()
+      gReverseIndexesSyncCount = syncCount
+    reverseIndex = gReverseIndexes.get(indexKey)
+  if reverseIndex is not None:
+    return S_OK(reverseIndex)
+  result = buildFunction(*args)
+  if not result['OK']:
+    return result
+  with gReverseIndexesLock:
+    # The configuration may have changed while the index was built
+    if syncCount == gReverseIndexesSyncCount:
+      gReverseIndexes[indexKey] = result['Value']
+  return result
+
+
+def __indexSectionsByValue(sectionPath, optionName):
+  """ Index the sections of a section by the values of one of their list options
+
+      :return: S_OK(dict) with the values of the option and the list of the sections having them
+  """
+  retVal = gConfig.getSections(sectionPath)
+  if not retVal['OK']:
+    return retVal
+  reverseIndex = {}
+  for section in retVal['Value']:
+    for value in gConfig.getValue("%s/%s/%s" % (sectionPath, section, optionName), []):
+      sections = reverseIndex.setdefault(value, [])
+      if section not in sections:
+        sections.append(section)
+  return S_OK(reverseIndex)
+
 
 def getUsernameForDN(dn, usersList=False):
-  if not usersList:
-    retVal = gConfig.getSections("%s/Users" % gBaseRegistrySection)
-    if not retVal['OK']:
-      return retVal
-    usersList = retVal['Value']
-  for username in usersList:
-    if dn in gConfig.getValue("%s/Users/%s/DN" % (gBaseRegistrySection, username), []):
-      return S_OK(username)
+  retVal = __getReverseIndex(('Users', 'DN'), __indexSectionsByValue, "%s/Users" % gBaseRegistrySection, 'DN')
+  if not retVal['OK']:
+    return retVal
+  usernames = retVal['Value'].get(dn, [])
+  if usernames and usersList:
+    usernames = [username for username in usersList if username in usernames]
+  if usernames:
+    return S_OK(usernames[0])
   return S_ERROR("No username found for dn %s" % dn)
 
 
@@ -49,18 +103,14 @@ def getGroupsForDN(dn):
 
 
 def __getGroupsWithAttr(attrName, value):
-  retVal = gConfig.getSections("%s/Groups" % gBaseRegistrySection)
+  retVal = __getReverseIndex(('Groups', attrName), __indexSectionsByValue,
+                             "%s/Groups" % gBaseRegistrySection, attrName)
   if not retVal['OK']:
     return retVal
-  groupsList = retVal['Value']
-  groups = []
-  for group in groupsList:
-    if value in gConfig.getValue("%s/Groups/%s/%s" % (gBaseRegistrySection, group, attrName), []):
-      groups.append(group)
+  groups = retVal['Value'].get(value)
   if not groups:
     return S_ERROR("No groups found for %s=%s" % (attrName, value))
-  groups.sort()
-  return S_OK(groups)
+  return S_OK(sorted(groups))
 
 
 def getGroupsForUser(username):
@@ -78,13 +128,12 @@ def getGroupsWithProperty(propName):
 
 
 def getHostnameForDN(dn):
-  retVal = gConfig.getSections("%s/Hosts" % gBaseRegistrySection)
+  retVal = __getReverseIndex(('Hosts', 'DN'), __indexSectionsByValue, "%s/Hosts" % gBaseRegistrySection, 'DN')
   if not retVal['OK']:
     return retVal
-  hostList = retVal['Value']
-  for hostname in hostList:
-    if dn in gConfig.getValue("%s/Hosts/%s/DN" % (gBaseRegistrySection, hostname), []):
-      return S_OK(hostname)
+  hostnames = retVal['Value'].get(dn)
+  if hostnames:
+    return S_OK(hostnames[0])
   return S_ERROR("No hostname found for dn %s" % dn)
 
 
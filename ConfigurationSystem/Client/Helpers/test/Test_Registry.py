@@ -0,0 +1,100 @@
+""" Test the reverse indexes of the Registry helper """
+
+# pylint: disable=missing-docstring
+
+import pytest
+
+from DIRAC import gConfig
+from DIRAC.Core.Utilities.CFG import CFG
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.ConfigurationSystem.Client.Helpers import Registry
+
+REGISTRY_CFG = """
+Registry
+{
+  Users
+  {
+    userA
+    {
+      DN = /DC=org/CN=userA
+    }
+    userB
+    {
+      DN = /DC=org/CN=userB, /DC=org/CN=userB2
+    }
+    userC
+    {
+      DN = /DC=org/CN=userB
+    }
+  }
+  Hosts
+  {
+    host.example.org
+    {
+      DN = /DC=org/CN=host.example.org
+      Properties = TrustedHost
+    }
+  }
+  Groups
+  {
+    prod
+    {
+      Users = userA
+      VO = vo
+      Properties = ProductionManagement, NormalUser
+    }
+    user
+    {
+      Users = userA, userB, userC
+      VO = vo
+      Properties = NormalUser
+    }
+    other_user
+    {
+      Users = userC
+      VO = other
+      Properties = NormalUser
+    }
+  }
+}
+"""
+
+
+@pytest.fixture
+def registry():
+  localCFG = gConfigurationData.localCFG
+  gConfigurationData.localCFG = CFG()
+  gConfig.loadCFG(CFG().loadFromBuffer(REGISTRY_CFG))
+  yield Registry
+  gConfigurationData.localCFG = localCFG
+  gConfigurationData.sync()
+
+
+def test_reverseIndexes(registry):
+  assert registry.getUsernameForDN('/DC=org/CN=userA')['Value'] == 'userA'
+  assert registry.getUsernameForDN('/DC=org/CN=userB2')['Value'] == 'userB'
+  # The first user with the DN, also among the given users
+  assert registry.getUsernameForDN('/DC=org/CN=userB')['Value'] == 'userB'
+  assert registry.getUsernameForDN('/DC=org/CN=userB', ['userC', 'userB'])['Value'] == 'userC'
+  assert not registry.getUsernameForDN('/DC=org/CN=userB', ['userA'])['OK']
+  assert not registry.getUsernameForDN('/DC=org/CN=unknown')['OK']
+
+  assert registry.getHostnameForDN('/DC=org/CN=host.example.org')['Value'] == 'host.example.org'
+  assert not registry.getHostnameForDN('/DC=org/CN=userA')['OK']
+
+  assert registry.getGroupsForUser('userC')['Value'] == ['other_user', 'user']
+  assert registry.getGroupsForDN('/DC=org/CN=userA')['Value'] == ['prod', 'user']
+  assert registry.getGroupsForVO('vo')['Value'] == ['prod', 'user']
+  assert registry.getGroupsWithProperty('NormalUser')['Value'] == ['other_user', 'prod', 'user']
+  assert not registry.getGroupsWithProperty('FullDelegation')['OK']
+
+
+def test_configurationChange(registry):
+  assert registry.getGroupsForUser('userB')['Value'] == ['user']
+  assert not registry.getUsernameForDN('/DC=org/CN=userD')['OK']
+
+  # The indexes are rebuilt when the configuration changes
+  gConfig.setOptionValue('/Registry/Users/userD/DN', '/DC=org/CN=userD')
+  gConfig.setOptionValue('/Registry/Groups/prod/Users', 'userA, userB')
+  assert registry.getUsernameForDN('/DC=org/CN=userD')['Value'] == 'userD'
+  assert registry.getGroupsForUser('userB')['Value'] == ['prod', 'user']
@@ -47,6 +47,24 @@ class ConfigurationHandler(RequestHandler):
       retDict['data'] = gServiceInterface.getCompressedConfigurationData()
     return S_OK(retDict)
 
+  types_getDeltaIfNewer = [basestring]
+
+  @classmethod
+  def export_getDeltaIfNewer(cls, sClientVersion):
+    """ Get the modifications of the configuration since the version of the client,
+        or the whole configuration if the version of the client is not kept any more
+    """
+    sVersion = gServiceInterface.getVersion()
+    retDict = {'newestVersion': sVersion}
+    if sClientVersion < sVersion:
+      deltaDict = gServiceInterface.getConfigurationDelta(sClientVersion)
+      if deltaDict and deltaDict['Version'] == sVersion:
+        retDict['modifications'] = deltaDict['Modifications']
+        retDict['checksum'] = deltaDict['Checksum']
+      else:
+        retDict['data'] = gServiceInterface.getCompressedConfigurationData()
+    return S_OK(retDict)
+
   types_publishSlaveServer = [basestring]
 
   @classmethod
@@ -2,10 +2,12 @@
 """
 
 from __future__ import print_function
+import hashlib
 import os.path
 import zlib
 import zipfile
 import thread
+import threading
 import time
 import DIRAC
 
@@ -18,6 +20,23 @@ from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
 __RCSID__ = "$Id$"
 
+# Number of versions of the remote CFG kept by the services, to send the changes since them
+MAX_DELTA_VERSIONS = 10
+
+
+def getCFGChecksum(cfg):
+  """ Checksum of the content of a CFG, to check the result of applying changes """
+  return hashlib.md5(str(cfg)).hexdigest()
+
+
+def _indexOptions(cfg, index, parentPath=""):
+  """ Fill a dictionary with the full paths of the options of a CFG and their values """
+  for option in cfg.listOptions():
+    index["%s/%s" % (parentPath, option)] = cfg[option]
+  for section in cfg.listSections():
+    _indexOptions(cfg[section], index, "%s/%s" % (parentPath, section))
+  return index
+
 
 class ConfigurationData(object):
 
@@ -35,6 +54,14 @@ class ConfigurationData(object):
     self.remoteCFG = CFG()
     self.mergedCFG = CFG()
     self.remoteServerList = []
+    # Services: ( version, remote CFG ) of the last versions, and the changes since them to the last one
+    self.__previousVersions = []
+    self.__deltaCache = {}
+    self.__deltaLock = threading.Lock()
+    # Options of the merged CFG by path, built at the first lookup after each change
+    self.__optionIndex = None
+    self.__optionIndexGeneration = 0
+    self.__optionIndexLock = threading.Lock()
     if loadDefaultCFG:
       defaultCFGFile = os.path.join(DIRAC.rootPath, "etc", "dirac.cfg")
       gLogger.debug("dirac.cfg should be at", "%s" % defaultCFGFile)
@@ -49,6 +76,9 @@ class ConfigurationData(object):
   def sync(self):
     gLogger.debug("Updating configuration internals")
     self.mergedCFG = self.remoteCFG.mergeWith(self.localCFG)
+    with self.__optionIndexLock:
+      self.__optionIndex = None
+      self.__optionIndexGeneration += 1
     self.remoteServerList = []
     localServers = self.extractOptionFromCFG("%s/Servers" % self.configurationPath,
                                              self.localCFG,
@@ -62,6 +92,60 @@ class ConfigurationData(object):
       self.remoteServerList.extend(List.fromChar(remoteServers, ","))
     self.remoteServerList = List.uniqueElements(self.remoteServerList)
     self.__compressedConfigurationData = None
+    if self._isService:
+      self.__recordVersion()
+
+  def __recordVersion(self):
+    """ Keep a copy of the remote CFG when its version changes, the changes sent to the clients
+        being computed from the copy of their version to the current remote CFG
+    """
+    version = self.extractOptionFromCFG("%s/Version" % self.configurationPath, self.remoteCFG,
+                                        disableDangerZones=True) or "0"
+    with self.__deltaLock:
+      self.__deltaCache = {}
+      if version in dict(self.__previousVersions):
+        return
+      self.__previousVersions = self.__previousVersions[1 - MAX_DELTA_VERSIONS:] + [(version,
+                                                                                     self.remoteCFG.clone())]
+
+  def getDataDelta(self, fromVersion):
+    """ Get the modifications of the remote CFG since a previous version (services only)
+
+        :param str fromVersion: version of the client
+        :return: dict with the keys Version, Modifications, as given by CFG.getModifications, and Checksum
+                 of the CFG once modified, or None if the version is not kept
+    """
+    with self.__deltaLock:
+      if fromVersion not in self.__deltaCache:
+        previousCFG = dict(self.__previousVersions).get(fromVersion)
+        if previousCFG is None:
+          return None
+        remoteCFG = self.remoteCFG
+        version = self.extractOptionFromCFG("%s/Version" % self.configurationPath, remoteCFG,
+                                            disableDangerZones=True) or "0"
+        self.__deltaCache[fromVersion] = {'Version': version,
+                                          'Modifications': previousCFG.getModifications(remoteCFG),
+                                          'Checksum': getCFGChecksum(remoteCFG)}
+      return self.__deltaCache[fromVersion]
+
+  def applyRemoteCFGModifications(self, modList, checksum):
+    """ Apply the modifications sent by a service to the remote CFG
+
+        :param list modList: modifications, as given by CFG.getModifications
+        :param str checksum: checksum of the CFG once modified
+        :return: S_OK / S_ERROR if the modifications do not give the same CFG as in the service
+    """
+    newCFG = self.remoteCFG.clone()
+    result = newCFG.applyModifications(modList)
+    if not result['OK']:
+      return result
+    if getCFGChecksum(newCFG) != checksum:
+      return S_ERROR("The modified configuration differs from the one of the server")
+    self.lock()
+    self.remoteCFG = newCFG
+    self.unlock()
+    self.sync()
+    return S_OK()
 
   def loadFile(self, fileName):
     try:
@@ -147,9 +231,37 @@ class ConfigurationData(object):
       pass
     return self.dangerZoneEnd(None)
 
+  def getSyncCount(self):
+    """ Number of times the merged CFG was rebuilt, for the caches of what is computed from it
+    """
+    return self.__optionIndexGeneration
+
+  def __getOptionIndex(self):
+    """ Get the index of the options of the merged CFG, building it if the CFG changed
+    """
+    optionIndex = self.__optionIndex
+    if optionIndex is not None:
+      return optionIndex
+    with self.__optionIndexLock:
+      generation = self.__optionIndexGeneration
+      mergedCFG = self.mergedCFG
+    optionIndex = _indexOptions(mergedCFG, {})
+    with self.__optionIndexLock:
+      # The merged CFG may have changed while it was indexed
+      if generation == self.__optionIndexGeneration:
+        self.__optionIndex = optionIndex
+    return optionIndex
+
   def extractOptionFromCFG(self, path, cfg=False, disableDangerZones=False):
     if not cfg:
-      cfg = self.mergedCFG
+      # The options of the merged CFG are looked up in its index
+      optionIndex = self.__getOptionIndex()
+      if path in optionIndex:
+        return optionIndex[path]
+      levelList = [level.strip() for level in path.split("/") if level.strip() != ""]
+      if levelList:
+        return optionIndex.get("/%s" % "/".join(levelList))
+      return None
     if not disableDangerZones:
       self.dangerZoneStart()
     try:
@@ -16,15 +16,40 @@ from DIRAC.Core.Utilities.EventDispatcher import gEventDispatcher
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 
 
+# Servers not able to send the modifications of the configuration
+gServersWithoutDelta = set()
+
+
+def _getDataIfNewer(serviceClient, localVersion):
+  """ Get the modifications of the configuration since the local version if the server can send them,
+      the whole configuration otherwise
+  """
+  if serviceClient.serviceURL not in gServersWithoutDelta:
+    retVal = serviceClient.getDeltaIfNewer(localVersion)
+    if retVal['OK'] or 'Unknown method' not in retVal['Message']:
+      return retVal
+    gServersWithoutDelta.add(serviceClient.serviceURL)
+  return serviceClient.getCompressedDataIfNewer(localVersion)
+
+
 def _updateFromRemoteLocation(serviceClient):
   gLogger.debug("", "Trying to refresh from %s" % serviceClient.serviceURL)
   localVersion = gConfigurationData.getVersion()
-  retVal = serviceClient.getCompressedDataIfNewer(localVersion)
+  retVal = _getDataIfNewer(serviceClient, localVersion)
   if retVal['OK']:
     dataDict = retVal['Value']
     if localVersion < dataDict['newestVersion']:
       gLogger.debug("New version available", "Updating to version %s..." % dataDict['newestVersion'])
-      gConfigurationData.loadRemoteCFGFromCompressedMem(dataDict['data'])
+      if 'modifications' in dataDict:
+        result = gConfigurationData.applyRemoteCFGModifications(dataDict['modifications'], dataDict['checksum'])
+        if not result['OK']:
+          gLogger.warn("Could not apply the modifications of the configuration, getting all of it", result['Message'])
+          retVal = serviceClient.getCompressedDataIfNewer(localVersion)
+          if not retVal['OK']:
+            return retVal
+          dataDict = retVal['Value']
+      if 'data' in dataDict:
+        gConfigurationData.loadRemoteCFGFromCompressedMem(dataDict['data'])
       gLogger.debug("Updated to version %s" % gConfigurationData.getVersion())
       gEventDispatcher.triggerEvent("CSNewVersion", dataDict['newestVersion'], threaded=True)
     return S_OK()
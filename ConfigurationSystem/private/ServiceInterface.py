@@ -258,6 +258,9 @@ class ServiceInterface(threading.Thread):
   def getCompressedConfigurationData(self):
     return gConfigurationData.getCompressedData()
 
+  def getConfigurationDelta(self, sClientVersion):
+    return gConfigurationData.getDataDelta(sClientVersion)
+
   def getVersion(self):
     return gConfigurationData.getVersion()
 
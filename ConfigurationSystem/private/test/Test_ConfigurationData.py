@@ -0,0 +1,154 @@
+""" Test the sending of the modifications of the configuration by the services """
+
+# pylint: disable=protected-access, missing-docstring
+
+import zlib
+
+from mock import MagicMock, patch
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities.CFG import CFG
+from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData, MAX_DELTA_VERSIONS
+from DIRAC.ConfigurationSystem.private import Refresher
+
+CFG_V1 = """
+DIRAC
+{
+  Configuration
+  {
+    Version = 2020-01-01 00:00:00
+    Name = Test
+  }
+}
+Resources
+{
+  # The sites
+  Sites
+  {
+    LCG
+    {
+      LCG.CERN.ch
+      {
+        SE = CERN-DISK
+      }
+    }
+  }
+}
+"""
+
+
+def getServiceData():
+  serviceData = ConfigurationData(False)
+  serviceData.setAsService()
+  serviceData.loadRemoteCFGFromMem(CFG_V1)
+  return serviceData
+
+
+def commit(serviceData, path, value, version):
+  serviceData.setOptionInCFG(path, value, serviceData.remoteCFG)
+  serviceData.setVersion(version)
+  serviceData.sync()
+
+
+def test_delta():
+  serviceData = getServiceData()
+  clientData = ConfigurationData(False)
+  clientData.loadRemoteCFGFromMem(CFG_V1)
+
+  commit(serviceData, '/Resources/Sites/LCG/LCG.CERN.ch/SE', 'CERN-DISK, CERN-TAPE', '2020-01-02 00:00:00')
+  serviceData.setOptionInCFG('/Resources/Sites/LCG/LCG.IN2P3.fr/SE', 'IN2P3-DISK', serviceData.remoteCFG)
+  serviceData.deleteOptionInCFG('/DIRAC/Configuration/Name', serviceData.remoteCFG)
+  serviceData.setVersion('2020-01-03 00:00:00')
+
+  delta = serviceData.getDataDelta('2020-01-01 00:00:00')
+  assert delta['Version'] == '2020-01-03 00:00:00'
+  # The changes are computed once per version
+  assert serviceData.getDataDelta('2020-01-01 00:00:00') is delta
+  result = clientData.applyRemoteCFGModifications(delta['Modifications'], delta['Checksum'])
+  assert result['OK'], result
+  assert str(clientData.remoteCFG) == str(serviceData.remoteCFG)
+  assert clientData.getVersion() == '2020-01-03 00:00:00'
+  assert clientData.mergedCFG.getOption('/Resources/Sites/LCG/LCG.IN2P3.fr/SE') == 'IN2P3-DISK'
+
+  # Unknown version
+  assert serviceData.getDataDelta('2019-01-01 00:00:00') is None
+
+
+def test_differentClientCFG():
+  """ A client whose configuration differs from the one of its version gets the whole configuration """
+  serviceData = getServiceData()
+  clientData = ConfigurationData(False)
+  clientData.loadRemoteCFGFromMem(CFG_V1.replace('CERN-DISK', 'CERN-OTHER'))
+  commit(serviceData, '/Resources/Sites/LCG/LCG.CERN.ch/CE', 'ce.cern.ch', '2020-01-02 00:00:00')
+  delta = serviceData.getDataDelta('2020-01-01 00:00:00')
+  result = clientData.applyRemoteCFGModifications(delta['Modifications'], delta['Checksum'])
+  assert not result['OK']
+  assert clientData.getVersion() == '2020-01-01 00:00:00'
+
+  clientData.loadRemoteCFGFromCompressedMem(serviceData.getCompressedData())
+  assert str(clientData.remoteCFG) == str(serviceData.remoteCFG)
+
+
+def test_maxVersions():
+  serviceData = getServiceData()
+  for day in range(2, MAX_DELTA_VERSIONS + 2):
+    commit(serviceData, '/Resources/Sites/LCG/LCG.CERN.ch/Day', str(day), '2020-01-%02d 00:00:00' % day)
+  assert serviceData.getDataDelta('2020-01-01 00:00:00') is None
+  assert serviceData.getDataDelta('2020-01-02 00:00:00')['Modifications']
+  assert not CFG().loadFromBuffer(zlib.decompress(serviceData.getCompressedData())).getOption(
+      '/DIRAC/Configuration/Version') < '2020-01-%02d 00:00:00' % (MAX_DELTA_VERSIONS + 1)
+
+
+@patch('DIRAC.ConfigurationSystem.private.Refresher.gEventDispatcher', new=MagicMock())
+def test_refresh():
+  """ The clients get the modifications from the servers able to send them """
+  serviceData = getServiceData()
+  clientData = ConfigurationData(False)
+  clientData.loadRemoteCFGFromMem(CFG_V1)
+  commit(serviceData, '/Resources/Sites/LCG/LCG.CERN.ch/CE', 'ce.cern.ch', '2020-01-02 00:00:00')
+  delta = serviceData.getDataDelta('2020-01-01 00:00:00')
+
+  serviceClient = MagicMock()
+  serviceClient.serviceURL = 'dips://server:9135/Configuration/Server'
+  serviceClient.getDeltaIfNewer.return_value = S_OK({'newestVersion': '2020-01-02 00:00:00',
+                                                     'modifications': delta['Modifications'],
+                                                     'checksum': delta['Checksum']})
+  with patch('DIRAC.ConfigurationSystem.private.Refresher.gConfigurationData', new=clientData):
+    assert Refresher._updateFromRemoteLocation(serviceClient)['OK']
+  assert str(clientData.remoteCFG) == str(serviceData.remoteCFG)
+  serviceClient.getCompressedDataIfNewer.assert_not_called()
+
+  # Servers of previous versions send the whole configuration
+  commit(serviceData, '/Resources/Sites/LCG/LCG.CERN.ch/CE', 'ce2.cern.ch', '2020-01-03 00:00:00')
+  serviceClient.getDeltaIfNewer.return_value = S_ERROR('Unknown method getDeltaIfNewer')
+  serviceClient.getCompressedDataIfNewer.return_value = S_OK({'newestVersion': '2020-01-03 00:00:00',
+                                                              'data': serviceData.getCompressedData()})
+  with patch('DIRAC.ConfigurationSystem.private.Refresher.gConfigurationData', new=clientData):
+    assert Refresher._updateFromRemoteLocation(serviceClient)['OK']
+    assert Refresher._updateFromRemoteLocation(serviceClient)['OK']
+  assert clientData.getVersion() == '2020-01-03 00:00:00'
+  assert serviceClient.getDeltaIfNewer.call_count == 2
+  Refresher.gServersWithoutDelta.clear()
+
+
+def test_optionIndex():
+  data = ConfigurationData(False)
+  data.loadRemoteCFGFromMem(CFG_V1)
+  assert data.extractOptionFromCFG('/Resources/Sites/LCG/LCG.CERN.ch/SE') == 'CERN-DISK'
+  assert data.extractOptionFromCFG('Resources/Sites//LCG/ LCG.CERN.ch /SE/') == 'CERN-DISK'
+  # Sections and missing paths are not options
+  assert data.extractOptionFromCFG('/Resources/Sites/LCG') is None
+  assert data.extractOptionFromCFG('/Resources/Sites/LCG/LCG.CERN.ch/CE') is None
+  assert data.extractOptionFromCFG('/') is None
+
+  # The index follows the changes of the configuration
+  data.setOptionInCFG('/Resources/Sites/LCG/LCG.CERN.ch/CE', 'ce.cern.ch')
+  assert data.extractOptionFromCFG('/Resources/Sites/LCG/LCG.CERN.ch/CE') == 'ce.cern.ch'
+  data.mergeWithLocal(CFG().loadFromBuffer("Resources\n{\n  Sites\n  {\n    LCG\n    {\n"
+                                           "      LCG.CERN.ch\n      {\n        SE = CERN-TAPE\n"
+                                           "      }\n    }\n  }\n}\n"))
+  assert data.extractOptionFromCFG('/Resources/Sites/LCG/LCG.CERN.ch/SE') == 'CERN-TAPE'
+  data.deleteOptionInCFG('/Resources/Sites/LCG/LCG.CERN.ch/CE')
+  assert data.extractOptionFromCFG('/Resources/Sites/LCG/LCG.CERN.ch/CE') is None
+  # An explicit CFG is still walked
+  assert data.extractOptionFromCFG('/Resources/Sites/LCG/LCG.CERN.ch/SE', data.remoteCFG) == 'CERN-DISK'
@@ -86,12 +86,13 @@ class Client(object):
     # Execute the method
     return getattr(rpcClient, toExecute)(*parms)
 
-  def _getRPC(self, rpc=None, url='', timeout=None):
+  def _getRPC(self, rpc=None, url='', timeout=None, streamResponses=False):
     """ Return an RPCClient object constructed following the attributes.
 
         :param rpc: if set, returns this object
         :param url: url of the service. If not set, use self.serverURL
         :param timeout: timeout of the call. If not given, self.timeout will be used
+        :param streamResponses: if set, the results streamed by the service are returned as iterators
     """
     if not rpc:
       if not url:
@@ -101,7 +102,10 @@ class Client(object):
         timeout = self.timeout
 
       self.__kwargs['timeout'] = timeout
-      rpc = RPCClient(url, **self.__kwargs)
+      kwargs = dict(self.__kwargs)
+      if streamResponses:
+        kwargs['streamResponses'] = True
+      rpc = RPCClient(url, **kwargs)
     return rpc
 
 
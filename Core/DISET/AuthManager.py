@@ -3,13 +3,19 @@
 
 import six
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
 from DIRAC.ConfigurationSystem.Client.Helpers import Registry
+from DIRAC.ConfigurationSystem.private.Refresher import gRefresher
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.Core.Security import Properties
 from DIRAC.Core.Utilities import List
+from DIRAC.Core.Utilities.DictCache import DictCache
 
 __RCSID__ = "$Id$"
 
+# Seconds an authorization decision is kept, if the configuration does not change before
+AUTH_CACHE_LIFETIME = 600
+
 
 class AuthManager(object):
   """ Handle Service Authorization
@@ -23,19 +29,25 @@ class AuthManager(object):
   KW_PROPERTIES = 'properties'
   KW_USERNAME = 'username'
 
-  def __init__(self, authSection):
+  def __init__(self, authSection, cacheSize=0):
     """
     Constructor
 
     :type authSection: string
     :param authSection: Section containing the authorization rules
+    :param int cacheSize: maximum number of authorization decisions kept, 0 to compute them at each query
     """
     self.authSection = authSection
+    self.__decisionCache = DictCache(maxSize=cacheSize) if cacheSize else None
+    self.__decisionCacheSyncCount = None
 
   def authQuery(self, methodQuery, credDict, defaultProperties=False):
     """
     Check if the query is authorized for a credentials dictionary
 
+    The decisions are cached by credentials and method, with the changes they make to the
+    credentials dictionary, until the configuration changes.
+
     :type  methodQuery: string
     :param methodQuery: Method to test
     :type  credDict: dictionary
@@ -43,6 +55,57 @@ class AuthManager(object):
                         and selected group.
     :return: Boolean result of test
     """
+    if self.__decisionCache is None:
+      return self.__authQuery(methodQuery, credDict, defaultProperties)
+    gRefresher.refreshConfigurationIfNeeded()
+    syncCount = gConfigurationData.getSyncCount()
+    if syncCount != self.__decisionCacheSyncCount:
+      self.__decisionCache.purgeAll()
+      self.__decisionCacheSyncCount = syncCount
+    try:
+      cacheKey = (credDict.get(self.KW_DN), credDict.get(self.KW_GROUP),
+                  self.__getHashable(credDict.get(self.KW_EXTRA_CREDENTIALS)),
+                  methodQuery, self.__getHashable(defaultProperties), syncCount)
+      hash(cacheKey)
+    except TypeError:
+      return self.__authQuery(methodQuery, credDict, defaultProperties)
+    decision = self.__decisionCache.get(cacheKey)
+    if decision is not None:
+      authorized, removedKeys, changedItems = decision
+      for key in removedKeys:
+        credDict.pop(key, None)
+      for key, value in changedItems:
+        credDict[key] = list(value) if isinstance(value, list) else value
+      return authorized
+    initialCredDict = dict(credDict)
+    authorized = self.__authQuery(methodQuery, credDict, defaultProperties)
+    removedKeys = [key for key in initialCredDict if key not in credDict]
+    changedItems = [(key, list(value) if isinstance(value, list) else value) for key, value in credDict.items()
+                    if key not in initialCredDict or initialCredDict[key] is not value]
+    self.__decisionCache.add(cacheKey, AUTH_CACHE_LIFETIME, (authorized, removedKeys, changedItems))
+    return authorized
+
+  @staticmethod
+  def __getHashable(value):
+    """ Value usable in a cache key, the lists being converted to tuples """
+    if isinstance(value, (list, tuple)):
+      return tuple(AuthManager.__getHashable(item) for item in value)
+    return value
+
+  def getCacheStats(self):
+    """
+    Get the statistics of the cache of the authorization decisions
+
+    :return: dictionary with the number of hits and misses, or None if there is no cache
+    """
+    if self.__decisionCache is None:
+      return None
+    return self.__decisionCache.getStats()
+
+  def __authQuery(self, methodQuery, credDict, defaultProperties=False):
+    """
+    Check if the query is authorized for a credentials dictionary, see authQuery
+    """
     userString = ""
     if self.KW_DN in credDict:
       userString += "DN=%s" % credDict[self.KW_DN]
@@ -75,7 +138,7 @@ class AuthManager(object):
     if self.forwardedCredentials(credDict):
       self.__authLogger.debug("Query comes from a gateway")
       self.unpackForwardedCredentials(credDict)
-      return self.authQuery(methodQuery, credDict, requiredProperties)
+      return self.__authQuery(methodQuery, credDict, requiredProperties)
     # Get the properties
     # Check for invalid forwarding
     if self.KW_EXTRA_CREDENTIALS in credDict:
@@ -5,13 +5,14 @@ __RCSID__ = "$Id$"
 
 import os
 import time
+import types
 import psutil
 
 import DIRAC
 
 from DIRAC.Core.DISET.private.FileHelper import FileHelper
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR, isReturnStructure
-from DIRAC.Core.Utilities import Time
+from DIRAC.Core.Utilities import Time, DEncode
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.Core.Security.Properties import CS_ADMINISTRATOR
@@ -29,6 +30,10 @@ def getServiceOption(serviceInfo, optionName, defaultValue):
   return defaultValue
 
 
+# Size of the chunks of the streamed results
+STREAM_CHUNK_SIZE = 1048576
+
+
 class RequestHandler(object):
 
   class ConnectionError(Exception):
@@ -135,11 +140,67 @@ class RequestHandler(object):
       message = "Method %s for action %s does not return a S_OK/S_ERROR!" % (actionTuple[1], actionTuple[0])
       gLogger.error(message)
       retVal = S_ERROR(message)
+    streamResponse = retVal['OK'] and isinstance(retVal['Value'], types.GeneratorType)
+    if streamResponse and not self.__acceptsStreamedResponse(proposalTuple):
+      # The client expects the whole result at once
+      streamResponse = False
+      try:
+        retVal = S_OK(list(retVal['Value']))
+      except Exception as e:  # pylint: disable=broad-except
+        gLogger.exception("Uncaught exception when serving RPC", "Function %s" % actionTuple[1], lException=e)
+        retVal = S_ERROR("Server error while serving %s: %s" % (actionTuple[1], str(e)))
     elapsedTime = time.time() - startTime
     self.__logRemoteQueryResponse(retVal, elapsedTime)
+    if streamResponse:
+      result = self.__sendStreamedResponse(actionTuple[1], retVal['Value'])
+      return S_OK([result, elapsedTime, result['OK']])
+    actionSucceeded = retVal['OK']
     result = self.__trPool.send(self.__trid, retVal)  # this will delete the value from the S_OK(value)
     del retVal
-    return S_OK([result, elapsedTime])
+    return S_OK([result, elapsedTime, actionSucceeded])
+
+  @staticmethod
+  def __acceptsStreamedResponse(proposalTuple):
+    """
+    Check if the client accepts the results of RPC calls as streams
+
+    :type proposalTuple: tuple
+    :param proposalTuple: tuple describing the proposed action
+    """
+    if proposalTuple[1][0] != "RPC" or len(proposalTuple) < 5 or not isinstance(proposalTuple[4], dict):
+      return False
+    return bool(proposalTuple[4].get('streamResponse'))
+
+  def __sendStreamedResponse(self, method, items):
+    """
+    Send the items generated by an RPC method as a stream, so that neither the server
+    nor the client have to hold the whole result.
+
+    The client gets a S_OK with the 'Stream' flag, followed by the encoded list of the
+    items in chunks sent as with FileHelper: S_OK([True, chunk]) and finally S_OK([False, ""]),
+    or S_ERROR if the generator fails.
+
+    :type method: string
+    :param method: name of the RPC method
+    :param items: generator returned by the RPC method
+    :return: S_OK/S_ERROR
+    """
+    header = S_OK()
+    header['Stream'] = True
+    result = self.__trPool.send(self.__trid, header)
+    if not result['OK']:
+      return result
+    try:
+      for chunk in DEncode.encodeStream(items, chunkSize=STREAM_CHUNK_SIZE):
+        result = self.__trPool.send(self.__trid, S_OK([True, chunk]))
+        if not result['OK']:
+          return result
+    except Exception as e:  # pylint: disable=broad-except
+      gLogger.exception("Uncaught exception when streaming RPC response", "Function %s" % method, lException=e)
+      result = S_ERROR("Server error while streaming %s: %s" % (method, str(e)))
+      self.__trPool.send(self.__trid, result)
+      return result
+    return self.__trPool.send(self.__trid, S_OK([False, ""]))
 
 #####
 #
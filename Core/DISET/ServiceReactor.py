@@ -112,6 +112,9 @@ class ServiceReactor(object):
           if kw == 'timeout':
             value = int(value)
           transportArgs[kw] = value
+      if svcCfg.getReactorMode() == 'events':
+        # The handshake is done by the ConnectionPoller of the service, if the transport supports it
+        transportArgs['nonBlockingHandshake'] = True
       gLogger.verbose("Initializing %s transport" % protocol, svcCfg.getURL())
       transport = gProtocolDict[protocol]['transport'](("", port),
                                                        bServerMode=True, **transportArgs)
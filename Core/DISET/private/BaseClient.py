@@ -7,6 +7,8 @@ __RCSID__ = "$Id$"
 import six
 import time
 import thread
+from hashlib import md5
+
 import DIRAC
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
@@ -17,6 +19,7 @@ from DIRAC.ConfigurationSystem.Client.PathFinder import getServiceURL, getServic
 from DIRAC.ConfigurationSystem.Client.Helpers import Registry
 from DIRAC.ConfigurationSystem.Client.Helpers.CSGlobals import skipCACheck
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
+from DIRAC.Core.DISET.private.ConnectionPool import getGlobalConnectionPool
 from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
 
 
@@ -40,6 +43,8 @@ class BaseClient(object):
   KW_PROXY_CHAIN = "proxyChain"
   KW_SKIP_CA_CHECK = "skipCACheck"
   KW_KEEP_ALIVE_LAPSE = "keepAliveLapse"
+  KW_KEEP_CONNECTION = "keepConnection"
+  KW_STREAM_RESPONSES = "streamResponses"
 
   __threadConfig = ThreadConfig()
 
@@ -59,6 +64,10 @@ class BaseClient(object):
       :param proxyChain: Specify the proxy chain
       :param skipCACheck: Do not check the CA
       :param keepAliveLapse: Duration for keepAliveLapse (heartbeat like)
+      :param keepConnection: Allow reusing the connections from the ConnectionPool
+                             (default from /DIRAC/ConnectionPool/Enabled)
+      :param streamResponses: Accept the results streamed by the server, which are then
+                              returned as iterators (see InnerRPCClient)
     """
 
     if not isinstance(serviceName, six.string_types):
@@ -82,6 +91,8 @@ class BaseClient(object):
     self.__nbOfRetry = 3  # by default we try try times
     self.__retryCounter = 1
     self.__bannedUrls = []
+    # trid -> connection key of the connections that may go back to the ConnectionPool
+    self.__connectionKeys = {}
     for initFunc in (self.__discoverSetup, self.__discoverVO, self.__discoverTimeout,
                      self.__discoverURL, self.__discoverCredentialsToUse,
                      self.__checkTransportSanity,
@@ -416,13 +427,19 @@ and this is thread %s
       gLogger.error("DISET client thread safety error", msgTxt)
       # raise Exception( msgTxt )
 
-  def _connect(self):
+  def _connect(self, reuseConnection=False):
     """ Establish the connection.
         It uses the URL discovered in __discoverURL.
         In case the connection cannot be established, __discoverURL
         is called again, and _connect calls itself.
         We stop after trying self.__nbOfRetry * self.__nbOfUrls
 
+        :param reuseConnection: if True, try first to take an idle connection from the
+                                ConnectionPool. The connection may then be given back to the
+                                pool with _disconnect. In that case, the returned structure
+                                has the 'Reused' key set to True.
+
+        :return: S_OK((trid, transport))
     """
     # Check if the useServerCertificate configuration changed
     # Note: I am not really sure that  all this block makes
@@ -444,6 +461,18 @@ and this is thread %s
     if self.__enableThreadCheck:
       self.__checkThreadID()
 
+    reuseConnection = reuseConnection and self.__keepConnection()
+    if reuseConnection:
+      connKey = self.__getConnectionKey()
+      pooledConnection = getGlobalConnectionPool().get(connKey)
+      if pooledConnection:
+        gLogger.debug("Reusing connection to: %s" % self.serviceURL)
+        trid, transport = pooledConnection
+        self.__connectionKeys[trid] = connKey
+        result = S_OK((trid, transport))
+        result['Reused'] = True
+        return result
+
     gLogger.debug("Trying to connect to: %s" % self.serviceURL)
     try:
       # Calls the transport method of the apropriate protocol.
@@ -479,7 +508,7 @@ and this is thread %s
           # rediscover the URL
           self.__discoverURL()
           # try to reconnect
-          return self._connect()
+          return self._connect(reuseConnection=reuseConnection)
         else:
           return retVal
     except Exception as e:
@@ -488,15 +517,57 @@ and this is thread %s
     # We add the connection to the transport pool
     gLogger.debug("Connected to: %s" % self.serviceURL)
     trid = getGlobalTransportPool().add(transport)
+    if reuseConnection:
+      self.__connectionKeys[trid] = self.__getConnectionKey()
 
     return S_OK((trid, transport))
 
-  def _disconnect(self, trid):
+  def _disconnect(self, trid, keepConnection=0):
     """ Disconnect the connection.
 
         :param trid: Transport ID in the transportPool
+        :param keepConnection: if set, the connection is given back to the ConnectionPool
+                               instead of being closed. The value is the number of seconds
+                               the server keeps the connection open.
+                               Only connections obtained with _connect(reuseConnection=True) can be kept.
+    """
+    connKey = self.__connectionKeys.pop(trid, None)
+    if keepConnection and connKey:
+      getGlobalConnectionPool().put(connKey, trid, serverIdleTimeout=keepConnection)
+    else:
+      getGlobalTransportPool().close(trid)
+
+  def _discardIdleConnections(self):
+    """ Close all the idle connections from the ConnectionPool matching this client,
+        typically because one of them was found broken.
+    """
+    getGlobalConnectionPool().discard(self.__getConnectionKey())
+
+  def __keepConnection(self):
+    """ Whether the connections of this client may be reused, according to
+        kwargs[KW_KEEP_CONNECTION] or the ConnectionPool configuration.
+    """
+    if self.KW_KEEP_CONNECTION in self.kwargs:
+      return self.kwargs[self.KW_KEEP_CONNECTION] not in (False, "False", "false", "no", "No", 0, "0")
+    return getGlobalConnectionPool().isEnabled()
+
+  def _streamResponses(self):
+    """ Whether the client accepts streamed results, according to kwargs[KW_STREAM_RESPONSES]
+    """
+    return self.kwargs.get(self.KW_STREAM_RESPONSES) not in (None, False, "False", "false", "no", "No", 0, "0")
+
+  def __getConnectionKey(self):
+    """ Key identifying the connections that can be shared: same URL and same credentials.
     """
-    getGlobalTransportPool().close(trid)
+    proxyString = self.kwargs.get(self.KW_PROXY_STRING)
+    if proxyString:
+      proxyString = md5(proxyString).hexdigest()
+    return (self.serviceURL,
+            str(self.__extraCredentials),
+            bool(self.__useCertificates),
+            self.kwargs.get(self.KW_PROXY_LOCATION),
+            proxyString,
+            bool(self.kwargs.get(self.KW_SKIP_CA_CHECK)))
 
   @staticmethod
   def _serializeStConnectionInfo(stConnectionInfo):
@@ -507,7 +578,7 @@ and this is thread %s
 
     return serializedTuple
 
-  def _proposeAction(self, transport, action):
+  def _proposeAction(self, transport, action, keepConnection=False, streamResponse=False):
     """ Proposes an action by sending a tuple containing
 
           * System/Component
@@ -515,6 +586,8 @@ and this is thread %s
           * VO
           * action
           * extraCredentials
+          * DIRAC version
+          * connection options (only if keepConnection or streamResponse is set)
 
         It is kind of a handshake.
 
@@ -525,6 +598,10 @@ and this is thread %s
         :param action: tuple (<action type>, <action name>). It depends on the
                        subclasses of BaseClient. <action type> can be for example
                        'RPC' or 'FileTransfer'
+        :param keepConnection: ask the server to keep the connection open after the action.
+                               If the server accepts, the returned value is a dictionary
+                               containing the key 'keepConnection' (idle timeout of the server)
+        :param streamResponse: tell the server that the result of the action can be streamed
 
        :return: whatever the server sent back
 
@@ -535,6 +612,13 @@ and this is thread %s
                         action,
                         self.__extraCredentials,
                         DIRAC.version)
+    connectionOptions = {}
+    if keepConnection:
+      connectionOptions['keepConnection'] = True
+    if streamResponse:
+      connectionOptions['streamResponse'] = True
+    if connectionOptions:
+      stConnectionInfo += (connectionOptions,)
 
     # Send the connection info and get the answer back
     retVal = transport.sendData(S_OK(BaseClient._serializeStConnectionInfo(stConnectionInfo)))
@@ -0,0 +1,168 @@
+""" This module hosts the ConnectionPoller class, which watches the client connections
+    of a service running in the event driven mode (``ReactorMode = Events`` in the service section).
+
+    In the default mode, a worker thread serves a connection from the handshake to the response,
+    and spends most of its time waiting for the network when the clients are slow or when a connection
+    is kept open (see the ``ConnectionIdleTimeout`` option). In the event driven mode, the ConnectionPoller
+    does the SSL handshake and reads the proposal and the arguments of the clients without blocking,
+    from a single thread using epoll (or poll where epoll is not available).
+    A worker thread is only used once a complete message has been received.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import time
+import errno
+import select
+import threading
+
+from DIRAC.FrameworkSystem.Client.Logger import gLogger
+from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
+
+
+class ConnectionPoller(object):
+  """ Watches client transports until they have a complete message to process,
+      and hand them over to a callback.
+
+      The callback is called from the poller thread with the result of the wait
+      (S_OK() if a message can be received without blocking, S_ERROR otherwise)
+      followed by the extra arguments given to watch. It has to return quickly,
+      typically by queuing a job in a thread pool.
+  """
+
+  def __init__(self, name):
+    self.log = gLogger.getSubLogger("ConnectionPoller/%s" % name)
+    self.__name = name
+    self.__lock = threading.Lock()
+    # fd -> [ transport, expiration time, callback, callback args ]
+    self.__watched = {}
+    # fds with data already received, that will not be signaled by the poll
+    self.__toCheck = set()
+    # The poll object and thread are created by the process which uses them
+    self.__pid = None
+    self.__poll = None
+    self.__pollUnit = 1
+    self.__wakeUpPipe = None
+
+  def __start(self):
+    """ Create the poll object and start the poller thread, if not done yet by this process
+    """
+    if self.__pid == os.getpid():
+      return
+    self.__pid = os.getpid()
+    self.__watched = {}
+    self.__toCheck = set()
+    if hasattr(select, 'epoll'):
+      self.__poll = select.epoll()
+      self.__pollUnit = 1
+    else:
+      # poll takes its timeout in milliseconds
+      self.__poll = select.poll()
+      self.__pollUnit = 1000
+    # Used to wake up the poller thread when a new connection is watched
+    self.__wakeUpPipe = os.pipe()
+    self.__poll.register(self.__wakeUpPipe[0], select.POLLIN)
+    thread = threading.Thread(target=self.__loop, name="ConnectionPoller-%s" % self.__name)
+    thread.daemon = True
+    thread.start()
+
+  def getNumWatched(self):
+    """ Number of connections currently watched
+    """
+    with self.__lock:
+      return len(self.__watched)
+
+  def watch(self, transport, timeout, callback, *args):
+    """ Watch a transport until a complete message can be received from it
+
+        :param transport: client transport, supporting non blocking IO
+        :param timeout: maximum number of seconds to wait for a message
+        :param callback: function called as callback(result, \\*args)
+    """
+    fd = transport.getSocket().fileno()
+    with self.__lock:
+      self.__start()
+      self.__watched[fd] = [transport, time.time() + timeout, callback, args]
+      self.__poll.register(fd, select.POLLIN)
+      if transport.hasPendingData():
+        self.__toCheck.add(fd)
+    os.write(self.__wakeUpPipe[1], "w")
+
+  def __loop(self):
+    """ Main loop of the poller thread
+    """
+    while True:
+      try:
+        events = self.__poll.poll(self.__pollUnit)
+      except (IOError, select.error) as e:
+        if e.args[0] == errno.EINTR:
+          continue
+        self.log.exception("Error while polling the connections")
+        time.sleep(1)
+        continue
+      with self.__lock:
+        toCheck = self.__toCheck
+        self.__toCheck = set()
+      for fd, event in events:
+        if fd == self.__wakeUpPipe[0]:
+          os.read(fd, 4096)
+          continue
+        toCheck.discard(fd)
+        self.__process(fd, event)
+      for fd in toCheck:
+        self.__process(fd, 0)
+      self.__expire()
+
+  def __process(self, fd, event):
+    """ Make the handshake or the reception of a message progress
+
+        :param fd: file descriptor of the connection
+        :param event: poll event mask
+    """
+    with self.__lock:
+      entry = self.__watched.get(fd)
+    if not entry:
+      return
+    transport = entry[0]
+    try:
+      result = transport.handshakeNonBlocking()
+      if result['OK'] and not result['Value']:
+        if not event & (select.POLLHUP | select.POLLERR):
+          return
+        result = S_ERROR("Connection closed during the handshake")
+      if result['OK']:
+        result = transport.bufferAvailableData()
+        if result['OK']:
+          if not result['Value']:
+            return
+          result = S_OK()
+    except Exception as e:  # pylint: disable=broad-except
+      result = S_ERROR("Error while reading from the client: %s" % repr(e))
+    self.__release(fd, result)
+
+  def __expire(self):
+    """ Give up the connections which have waited too long
+    """
+    now = time.time()
+    with self.__lock:
+      expired = [fd for fd in self.__watched if self.__watched[fd][1] < now]
+    for fd in expired:
+      self.__release(fd, S_ERROR("Timeout while waiting for the client"))
+
+  def __release(self, fd, result):
+    """ Stop watching a connection and call its callback
+    """
+    with self.__lock:
+      entry = self.__watched.pop(fd, None)
+      if not entry:
+        return
+      try:
+        self.__poll.unregister(fd)
+      except (IOError, ValueError, KeyError):
+        pass
+    _transport, _expirationTime, callback, args = entry
+    try:
+      callback(result, *args)
+    except Exception:  # pylint: disable=broad-except
+      self.log.exception("Error in the connection callback")
@@ -0,0 +1,212 @@
+""" This module hosts the ConnectionPool class, which keeps the client side
+    DISET connections open so that they can be reused by later RPC calls.
+
+    Establishing a dips connection means a TCP connection plus a full SSL handshake,
+    which is by far the most expensive part of a small RPC call. When the service accepts
+    it (see the ``ConnectionIdleTimeout`` option of the services), the connection is not closed
+    after the response has been received but it is given back to the pool, from which the
+    next RPC call to the same URL with the same credentials can take it.
+
+    The pool is configured in the /DIRAC/ConnectionPool section of the CS:
+
+      * Enabled: whether the connections should be kept at all (default yes)
+      * IdleTimeout: seconds after which an unused connection is closed (default 60)
+      * MaxLifeTime: seconds after which a connection is closed, even if used (default 600)
+      * MaxIdleConnections: maximum number of idle connections per URL and credentials (default 10)
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import select
+import threading
+
+from DIRAC.FrameworkSystem.Client.Logger import gLogger
+from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
+
+
+class ConnectionPool(object):
+  """ Per process pool of idle client connections, indexed by a connection key
+      (typically the URL of the service and the credentials used to connect).
+
+      Every connection in the pool is still registered in the global TransportPool,
+      so that the keep alive machinery of the transports keeps working on it.
+  """
+
+  def __init__(self, logger=False):
+    if logger:
+      self.log = logger
+    else:
+      self.log = gLogger.getSubLogger("ConnectionPool")
+    self.__lock = threading.Lock()
+    # connection key -> list of [ trid, expiration time ], the most recently used last
+    self.__idleConnections = {}
+    # trid -> time at which the connection was first given to the pool
+    self.__birthTimes = {}
+    self.__stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'discarded': 0}
+    self.__loadOptions()
+    result = gThreadScheduler.addPeriodicTask(60, self.__periodicCleanup)
+    if not result['OK']:
+      self.log.error("Cannot add task to thread scheduler", result['Message'])
+
+  def __loadOptions(self):
+    """ (Re)load the pool options from the CS
+    """
+    self.__enabled = gConfig.getValue("/DIRAC/ConnectionPool/Enabled", True)
+    self.__idleTimeout = gConfig.getValue("/DIRAC/ConnectionPool/IdleTimeout", 60)
+    self.__maxLifeTime = gConfig.getValue("/DIRAC/ConnectionPool/MaxLifeTime", 600)
+    self.__maxIdleConnections = gConfig.getValue("/DIRAC/ConnectionPool/MaxIdleConnections", 10)
+
+  def isEnabled(self):
+    """ Whether the connections should be kept open for reuse
+    """
+    return self.__enabled
+
+  def getStats(self):
+    """ Get the pool counters
+
+        :return: dictionary with the hits, misses, evictions (expired connections),
+                 discarded (broken connections) and idle (connections currently in the pool) counters
+    """
+    with self.__lock:
+      stats = dict(self.__stats)
+      stats['idle'] = sum(len(idleList) for idleList in self.__idleConnections.values())
+    return stats
+
+  def get(self, connKey):
+    """ Get an idle connection for the given key
+
+        :param connKey: key of the connection, as given to put
+        :return: tuple (trid, transport) or None if there is no valid idle connection
+    """
+    transportPool = getGlobalTransportPool()
+    while True:
+      with self.__lock:
+        idleList = self.__idleConnections.get(connKey)
+        if not idleList:
+          self.__stats['misses'] += 1
+          return None
+        trid, expirationTime = idleList.pop()
+        if not idleList:
+          del self.__idleConnections[connKey]
+      transport = transportPool.get(trid)
+      if not transport:
+        self.__forget(trid, 'discarded')
+        continue
+      if time.time() > expirationTime:
+        self.__discard(trid, 'evictions')
+        continue
+      if not self.__isHealthy(transport):
+        self.__discard(trid, 'discarded')
+        continue
+      with self.__lock:
+        self.__stats['hits'] += 1
+      return trid, transport
+
+  def put(self, connKey, trid, serverIdleTimeout=0):
+    """ Give a connection back to the pool. If the pool is full or the connection
+        is too old, it is closed.
+
+        :param connKey: key under which the connection is stored
+        :param trid: transport ID in the global TransportPool
+        :param serverIdleTimeout: number of seconds the server will keep the connection open
+    """
+    now = time.time()
+    idleTimeout = self.__idleTimeout
+    if serverIdleTimeout:
+      # Give the connection up a bit before the server does it
+      idleTimeout = min(idleTimeout, serverIdleTimeout - 1)
+    transport = getGlobalTransportPool().get(trid)
+    if transport and transport.getKeepAliveLapse():
+      # Never leave a connection idle long enough to trigger a keep alive
+      idleTimeout = min(idleTimeout, transport.getKeepAliveLapse() - 1)
+    with self.__lock:
+      birthTime = self.__birthTimes.setdefault(trid, now)
+      idleList = self.__idleConnections.setdefault(connKey, [])
+      keep = (self.__enabled and transport and idleTimeout > 0 and
+              now - birthTime < self.__maxLifeTime and
+              len(idleList) < self.__maxIdleConnections)
+      if keep:
+        idleList.append([trid, now + idleTimeout])
+      elif not idleList:
+        del self.__idleConnections[connKey]
+    if not keep:
+      self.__discard(trid, 'evictions')
+
+  def discard(self, connKey):
+    """ Close all the idle connections of a given key. This is useful when
+        one of the connections has been found broken, as the others are likely to be broken too.
+
+        :param connKey: key of the connections to close
+    """
+    with self.__lock:
+      idleList = self.__idleConnections.pop(connKey, [])
+    for trid, _expirationTime in idleList:
+      self.__discard(trid, 'discarded')
+
+  def __isHealthy(self, transport):
+    """ Check that an idle connection can still be used.
+        An idle connection should not have anything to read, except the answer
+        to a keep alive, that is consumed here.
+
+        :param transport: transport object
+        :return: boolean
+    """
+    try:
+      sock = transport.getSocket()
+      if not sock:
+        return False
+      readable = select.select([sock], [], [], 0)[0]
+    except Exception:  # pylint: disable=broad-except
+      return False
+    if not readable:
+      return True
+    result = transport.receiveData(blockAfterKeepAlive=False)
+    return result['OK'] and result.get('keepAlive', False)
+
+  def __forget(self, trid, counter):
+    """ Forget about a connection and increment the given counter
+    """
+    with self.__lock:
+      self.__birthTimes.pop(trid, None)
+      self.__stats[counter] += 1
+
+  def __discard(self, trid, counter):
+    """ Close a connection and forget about it
+    """
+    self.__forget(trid, counter)
+    try:
+      getGlobalTransportPool().close(trid)
+    except Exception as e:  # pylint: disable=broad-except
+      self.log.debug("Error while closing connection", "%s: %s" % (trid, repr(e)))
+
+  def __periodicCleanup(self):
+    """ Close the expired connections and reload the options
+    """
+    self.__loadOptions()
+    now = time.time()
+    expired = []
+    with self.__lock:
+      for connKey in list(self.__idleConnections):
+        idleList = self.__idleConnections[connKey]
+        expired.extend(trid for trid, expirationTime in idleList if now > expirationTime)
+        idleList[:] = [idleConn for idleConn in idleList if now <= idleConn[1]]
+        if not idleList or not self.__enabled:
+          expired.extend(trid for trid, _expirationTime in idleList)
+          del self.__idleConnections[connKey]
+    for trid in expired:
+      self.__discard(trid, 'evictions')
+    if expired:
+      self.log.debug("Closed expired connections", len(expired))
+
+
+gConnectionPool = None
+
+
+def getGlobalConnectionPool():
+  global gConnectionPool
+  if not gConnectionPool:
+    gConnectionPool = ConnectionPool()
+  return gConnectionPool
@@ -5,6 +5,7 @@ __RCSID__ = "$Id$"
 
 from DIRAC.Core.DISET.private.BaseClient import BaseClient
 from DIRAC.Core.Utilities.ReturnValues import S_OK
+from DIRAC.Core.Utilities import DEncode
 from DIRAC.Core.Utilities.DErrno import cmpError, ENOAUTH
 
 
@@ -12,11 +13,17 @@ class InnerRPCClient(BaseClient):
   """ This class instruments the BaseClient to perform RPC calls.
       At every RPC call, this class:
 
-        * connects
+        * connects (or reuses an idle connection from the ConnectionPool)
         * proposes the action
         * sends the method parameters
         * retrieve the result
-        * disconnect
+        * disconnect (or gives the connection back to the ConnectionPool,
+          if the server accepted it and the call succeeded)
+
+      If the client is created with streamResponses=True, the methods of the service returning
+      a generator give back S_OK(iterator) instead of S_OK(list). The items are decoded as they are
+      received, and the connection is released once the iterator is exhausted or discarded.
+      An error in the middle of the stream raises a RuntimeError.
   """
 
   # Number of times we retry the call.
@@ -34,7 +41,7 @@ class InnerRPCClient(BaseClient):
 
 
     """
-    retVal = self._connect()
+    retVal = self._connect(reuseConnection=True)
 
     # Generate the stub which contains all the connection and call options
     # JSON: cast args to list for serialization purposes
@@ -44,13 +51,22 @@ class InnerRPCClient(BaseClient):
       return retVal
     # Get the transport connection ID as well as the Transport object
     trid, transport = retVal['Value']
+    reusedConnection = retVal.get('Reused', False)
+    # Number of seconds the server keeps the connection open after the call, if it accepted to
+    keepConnection = 0
     try:
       # Handshake to perform the RPC call for functionName
-      retVal = self._proposeAction(transport, ("RPC", functionName))
+      retVal = self._proposeAction(transport, ("RPC", functionName), keepConnection=True,
+                                   streamResponse=self._streamResponses())
       if not retVal['OK']:
         if cmpError(retVal, ENOAUTH):  # This query is unauthorized
           retVal['rpcStub'] = stub
           return retVal
+        elif reusedConnection:
+          # The idle connection was closed in the meantime (e.g. the server restarted),
+          # so are probably the other idle connections: retry with a new one
+          self._discardIdleConnections()
+          return self.executeRPC(functionName, args)
         else:  # we have network problem or the service is not responding
           if self.__retry < 3:
             self.__retry += 1
@@ -59,6 +75,8 @@ class InnerRPCClient(BaseClient):
             retVal['rpcStub'] = stub
             return retVal
 
+      proposalAnswer = retVal['Value']
+
       # Send the arguments to the function
       # Note: we need to convert the arguments to list
       # We do not need to deseralize it because variadic functions
@@ -69,8 +87,50 @@ class InnerRPCClient(BaseClient):
 
       # Get the result of the call and append the stub to it
       receivedData = transport.receiveData()
+      if isinstance(receivedData, dict) and receivedData.get('Stream'):
+        stream = self.__readStream(transport, trid, proposalAnswer)
+        # Enter the generator, so that it releases the connection even if it is never iterated
+        next(stream)
+        # The connection now belongs to the stream
+        trid = None
+        receivedData = S_OK(stream)
+        receivedData['rpcStub'] = stub
+        return receivedData
       if isinstance(receivedData, dict):
+        # Only a successful call guarantees that the connection is in a clean state
+        if receivedData.get('OK') and isinstance(proposalAnswer, dict):
+          keepConnection = proposalAnswer.get('keepConnection', 0)
         receivedData['rpcStub'] = stub
       return receivedData
     finally:
-      self._disconnect(trid)
+      if trid is not None:
+        self._disconnect(trid, keepConnection=keepConnection)
+
+  def __readStream(self, transport, trid, proposalAnswer):
+    """ Generator decoding the items of a streamed result (see RequestHandler) as they are received.
+        The first value yielded is None, see executeRPC.
+
+        :param transport: the Transport object
+        :param trid: transport ID, disconnected at the end
+        :param proposalAnswer: answer of the server to the action proposal
+    """
+    keepConnection = 0
+    try:
+      yield None
+      decoder = DEncode.StreamDecoder()
+      while True:
+        result = transport.receiveData()
+        if not result['OK']:
+          raise RuntimeError("Streamed result interrupted: %s" % result['Message'])
+        hasData, chunk = result['Value']
+        if not hasData:
+          break
+        for item in decoder.feed(chunk):
+          yield item
+      if not decoder.isFinished():
+        raise RuntimeError("Streamed result interrupted: incomplete data")
+      # Only a fully read stream leaves the connection in a clean state
+      if isinstance(proposalAnswer, dict):
+        keepConnection = proposalAnswer.get('keepConnection', 0)
+    finally:
+      self._disconnect(trid, keepConnection=keepConnection)
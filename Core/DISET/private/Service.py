@@ -10,6 +10,7 @@
 
 import os
 import time
+import select
 import threading
 
 # TODO: Remove ThreadPool later
@@ -30,6 +31,7 @@ from DIRAC.FrameworkSystem.Client.MonitoringClient import MonitoringClient
 from DIRAC.Core.DISET.private.ServiceConfiguration import ServiceConfiguration
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
 from DIRAC.Core.DISET.private.MessageBroker import MessageBroker, MessageSender
+from DIRAC.Core.DISET.private.ConnectionPoller import ConnectionPoller
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.Core.Utilities.ReturnValues import isReturnStructure
 from DIRAC.Core.DISET.AuthManager import AuthManager
@@ -75,10 +77,12 @@ class Service(object):
     self._standalone = serviceData['standalone']
     self.__monitorLastStatsUpdate = time.time()
     self._stats = {'queries': 0, 'connections': 0}
-    self._authMgr = AuthManager("%s/Authorization" % PathFinder.getServiceSection(serviceData['loadName']))
+    self._authMgr = AuthManager("%s/Authorization" % PathFinder.getServiceSection(serviceData['loadName']),
+                                cacheSize=self._cfg.getAuthorizationCacheSize())
     self._transportPool = getGlobalTransportPool()
     self.__cloneId = 0
     self.__maxFD = 0
+    self.__authCacheStats = {'hits': 0, 'misses': 0}
 
   def setCloneProcessId(self, cloneId):
     self.__cloneId = cloneId
@@ -113,6 +117,10 @@ class Service(object):
                                     self._cfg.getMaxWaitingPetitions())
       self._threadPool.daemonize()
     self._msgBroker = MessageBroker("%sMSB" % self._name, threadPool=self._threadPool)
+    # In the event driven mode, the connections are watched by a poller instead of worker threads
+    self._poller = None
+    if self._cfg.getReactorMode() == 'events':
+      self._poller = ConnectionPoller(self._name)
     # Create static dict
     self._serviceInfoDict = {'serviceName': self._name,
                              'serviceSectionPath': PathFinder.getServiceSection(self._name),
@@ -302,6 +310,24 @@ class Service(object):
           'threads',
           MonitoringClient.OP_MEAN)
       self._monitor.registerActivity('MaxFD', "Max File Descriptors", 'Framework', 'fd', MonitoringClient.OP_MEAN)
+      self._monitor.registerActivity(
+          'HandshakeTime',
+          "SSL handshake time",
+          'Framework',
+          'seconds',
+          MonitoringClient.OP_MEAN)
+      self._monitor.registerActivity(
+          'ResumedHandshakes',
+          "Resumed SSL sessions",
+          'Framework',
+          'handshakes,%',
+          MonitoringClient.OP_MEAN)
+      self._monitor.registerActivity(
+          'AuthCacheHits',
+          "Authorizations from the cache",
+          'Framework',
+          'queries,%',
+          MonitoringClient.OP_MEAN)
 
       self._monitor.setComponentExtraParam('DIRACVersion', DIRAC.version)
       self._monitor.setComponentExtraParam('platform', DIRAC.getPlatform())
@@ -335,6 +361,30 @@ class Service(object):
     self._monitor.addMark('RunningThreads', threading.activeCount())
     self._monitor.addMark('MaxFD', self.__maxFD)
     self.__maxFD = 0
+    self.__reportAuthCache()
+
+  def __reportAuthCache(self):
+    """ Report the percentage of the queries authorized from the cache of the AuthManager
+        since the previous report
+    """
+    cacheStats = self._authMgr.getCacheStats()
+    if not cacheStats:
+      return
+    hits = cacheStats['hits'] - self.__authCacheStats['hits']
+    misses = cacheStats['misses'] - self.__authCacheStats['misses']
+    self.__authCacheStats = cacheStats
+    if hits + misses <= 0:
+      return
+    hitRate = 100. * hits / (hits + misses)
+    if not self.activityMonitoring:
+      self._monitor.addMark('AuthCacheHits', hitRate)
+    else:
+      self.activityMonitoringReporter.addRecord({'timestamp': int(Time.toEpoch()),
+                                                 'host': Network.getFQDN(),
+                                                 'componentType': 'service',
+                                                 'component': "_".join(self._name.split("/")),
+                                                 'componentLocation': self._cfg.getURL(),
+                                                 'AuthCacheHits': hitRate})
 
   def getConfig(self):
     return self._cfg
@@ -351,12 +401,25 @@ class Service(object):
     """
     self._stats['connections'] += 1
     self._monitor.setComponentExtraParam('queries', self._stats['connections'])
+    if self._poller and clientTransport.bNonBlockingIO:
+      self._poller.watch(clientTransport, clientTransport.iReadTimeout,
+                         self.__queueEvent, self._processProposalInThread, clientTransport)
+    else:
+      self.__queueJob(self._processInThread, clientTransport)
+
+  def __queueJob(self, function, *args):
+    """ Queue a job in the thread pool of the service
+    """
     # TODO: remove later
     if useThreadPoolExecutor:
-      self._threadPool.submit(self._processInThread, clientTransport)
+      self._threadPool.submit(function, *args)
     else:
-      self._threadPool.generateJobAndQueueIt(self._processInThread,
-                                             args=(clientTransport,))
+      self._threadPool.generateJobAndQueueIt(function, args=args)
+
+  def __queueEvent(self, result, function, *args):
+    """ Callback of the ConnectionPoller: process the connection in a worker thread
+    """
+    self.__queueJob(function, result, *args)
 
   # Threaded process function
   def _processInThread(self, clientTransport):
@@ -399,35 +462,216 @@ class Service(object):
           return
       except BaseException:
         return
+      self.__reportHandshake(clientTransport)
       # Add to the transport pool
       trid = self._transportPool.add(clientTransport)
       if not trid:
         return
-      # Receive and check proposal
-      result = self._receiveAndCheckProposal(trid)
-      if not result['OK']:
-        self._transportPool.sendAndClose(trid, result)
+      idleTimeout = self._cfg.getConnectionIdleTimeout()
+      keptConnection = False
+      while True:
+        # Receive and check proposal
+        result = self._receiveAndCheckProposal(trid, keptConnection=keptConnection)
+        if not result['OK']:
+          self._transportPool.sendAndClose(trid, result)
+          return
+        proposalTuple = result['Value']
+        # Instantiate handler
+        result = self._instantiateHandler(trid, proposalTuple)
+        if not result['OK']:
+          self._transportPool.sendAndClose(trid, result)
+          return
+        handlerObj = result['Value']
+        # Execute the action
+        keepConnection = idleTimeout if self._wantsToKeepConnection(proposalTuple) else 0
+        result = self._processProposal(trid, proposalTuple, handlerObj, keepConnection=keepConnection)
+        # Close the connection if required
+        if result['closeTransport'] or not result['OK']:
+          if not result['OK']:
+            gLogger.error("Error processing proposal", result['Message'])
+          self._transportPool.close(trid)
+          return result
+        if not result.get('keepConnection'):
+          return result
+        # Wait for the next call of the client on the same connection
+        if not self.__waitForNextProposal(clientTransport, idleTimeout):
+          self._transportPool.close(trid)
+          return result
+        keptConnection = True
+        if not self.activityMonitoring:
+          self._monitor.addMark("Queries")
+    finally:
+      self._lockManager.unlockGlobal()
+      if monReport:
+        self.__endReportToMonitoring(*monReport)
+
+  def _processProposalInThread(self, result, clientTransport, trid=None):
+    """
+    Event driven counterpart of _processInThread, called once the ConnectionPoller
+    has done the handshake and received the action proposal of the client.
+
+    RPC calls go back to the poller until the arguments have been received, see _executeRPCInThread.
+    The other actions are served by this thread as in _processInThread.
+
+    :param dict result: result of the wait for the proposal
+    :param clientTransport: transport of the client
+    :param int trid: transport ID, if the connection has been kept after a previous action
+    """
+    keptConnection = trid is not None
+    if not result['OK']:
+      if keptConnection:
+        gLogger.debug("Kept connection closed", result['Message'])
+        self._transportPool.close(trid)
+      else:
+        gLogger.debug("Error while waiting for the action proposal", result['Message'])
+        clientTransport.close()
+      return
+    if not keptConnection:
+      self.__maxFD = max(self.__maxFD, clientTransport.oSocket.fileno())
+      self.__reportHandshake(clientTransport)
+      # Add to the transport pool
+      trid = self._transportPool.add(clientTransport)
+      if not trid:
         return
-      proposalTuple = result['Value']
-      # Instantiate handler
-      result = self._instantiateHandler(trid, proposalTuple)
-      if not result['OK']:
-        self._transportPool.sendAndClose(trid, result)
+    # Receive and check proposal
+    result = self._receiveAndCheckProposal(trid, keptConnection=keptConnection)
+    if not result['OK']:
+      self._transportPool.sendAndClose(trid, result)
+      return
+    proposalTuple = result['Value']
+    # Instantiate handler
+    result = self._instantiateHandler(trid, proposalTuple)
+    if not result['OK']:
+      self._transportPool.sendAndClose(trid, result)
+      return
+    handlerObj = result['Value']
+
+    if proposalTuple[1][0] != 'RPC':
+      # File transfers stream their data and message connections are handed over
+      # to the MessageBroker, so they are served by this thread
+      self.__serveActionInThread(trid, proposalTuple, handlerObj)
+      return
+
+    keepConnection = self._cfg.getConnectionIdleTimeout() if self._wantsToKeepConnection(proposalTuple) else 0
+    result = self._acceptProposal(trid, keepConnection)
+    if not result['OK']:
+      self._transportPool.close(trid)
+      return
+    # Wait for the arguments
+    self._poller.watch(clientTransport, clientTransport.iReadTimeout, self.__queueEvent,
+                       self._executeRPCInThread, clientTransport, trid, proposalTuple, handlerObj, keepConnection)
+
+  def _executeRPCInThread(self, result, clientTransport, trid, proposalTuple, handlerObj, keepConnection):
+    """
+    Execute an RPC call once its arguments have been received by the ConnectionPoller.
+    The connection goes back to the poller if it is kept for another call.
+
+    :param dict result: result of the wait for the arguments
+    :param clientTransport: transport of the client
+    :param int trid: transport ID
+    :param tuple proposalTuple: tuple describing the proposed action
+    :param handlerObj: handler instance
+    :param int keepConnection: number of seconds the connection was proposed to be kept open
+    """
+    if not result['OK']:
+      gLogger.error("Error while receiving arguments", result['Message'])
+      self._transportPool.close(trid)
+      return
+    self._lockManager.lockGlobal()
+    try:
+      monReport = self.__startReportToMonitoring()
+    except Exception:
+      monReport = False
+    try:
+      result = self._setConnectionFlags(self._executeAction(trid, proposalTuple, handlerObj), keepConnection)
+      if result['closeTransport']:
+        if not result['OK']:
+          gLogger.error("Error processing proposal", result['Message'])
+        self._transportPool.close(trid)
         return
-      handlerObj = result['Value']
-      # Execute the action
+      # Wait for the next call of the client on the same connection
+      self._poller.watch(clientTransport, keepConnection, self.__queueEvent,
+                         self._processProposalInThread, clientTransport, trid)
+    finally:
+      self._lockManager.unlockGlobal()
+      if monReport:
+        self.__endReportToMonitoring(*monReport)
+
+  def __serveActionInThread(self, trid, proposalTuple, handlerObj):
+    """ Serve a non RPC action from the current thread, as in _processInThread
+    """
+    self._lockManager.lockGlobal()
+    try:
+      monReport = self.__startReportToMonitoring()
+    except Exception:
+      monReport = False
+    try:
       result = self._processProposal(trid, proposalTuple, handlerObj)
-      # Close the connection if required
       if result['closeTransport'] or not result['OK']:
         if not result['OK']:
           gLogger.error("Error processing proposal", result['Message'])
         self._transportPool.close(trid)
-      return result
     finally:
       self._lockManager.unlockGlobal()
       if monReport:
         self.__endReportToMonitoring(*monReport)
 
+  def __reportHandshake(self, clientTransport):
+    """ Report the duration of the SSL handshake of a new connection, and whether
+        it resumed a previous SSL session, for the services using a secured transport
+
+        :param clientTransport: transport of the client
+    """
+    handshakeStats = clientTransport.getHandshakeStats()
+    if not handshakeStats:
+      return
+    handshakeTime, sessionReused = handshakeStats
+    resumedHandshakes = 100. if sessionReused else 0.
+    if not self.activityMonitoring:
+      self._monitor.addMark('HandshakeTime', handshakeTime)
+      if sessionReused is not None:
+        self._monitor.addMark('ResumedHandshakes', resumedHandshakes)
+    else:
+      record = {'timestamp': int(Time.toEpoch()),
+                'host': Network.getFQDN(),
+                'componentType': 'service',
+                'component': "_".join(self._name.split("/")),
+                'componentLocation': self._cfg.getURL(),
+                'HandshakeTime': handshakeTime}
+      if sessionReused is not None:
+        record['ResumedHandshakes'] = resumedHandshakes
+      self.activityMonitoringReporter.addRecord(record)
+
+  @staticmethod
+  def _wantsToKeepConnection(proposalTuple):
+    """ Check if the client asked to keep the connection open after the action.
+        Only RPC calls can be followed by another action on the same connection.
+
+        :param tuple proposalTuple: tuple describing the proposed action
+    """
+    if proposalTuple[1][0] != 'RPC' or len(proposalTuple) < 5:
+      return False
+    connectionOptions = proposalTuple[4]
+    return isinstance(connectionOptions, dict) and bool(connectionOptions.get('keepConnection'))
+
+  def __waitForNextProposal(self, clientTransport, idleTimeout):
+    """ Wait for the client to send something more on a kept connection
+
+        :param clientTransport: transport of the client
+        :param int idleTimeout: maximum number of seconds to wait
+
+        :return: True if there is something to read
+    """
+    try:
+      oSocket = clientTransport.getSocket()
+      if not oSocket:
+        return False
+      inList, _outList, _errList = select.select([oSocket], [], [], idleTimeout)
+      return bool(inList)
+    except Exception as e:
+      gLogger.debug("Error while waiting for the next proposal", repr(e))
+      return False
+
   def _createIdentityString(self, credDict, clientTransport=None):
     if 'username' in credDict:
       if 'group' in credDict:
@@ -452,13 +696,24 @@ class Service(object):
     proposalTuple = tuple(tuple(x) if isinstance(x, list) else x for x in serializedProposal)
     return proposalTuple
 
-  def _receiveAndCheckProposal(self, trid):
+  def _receiveAndCheckProposal(self, trid, keptConnection=False):
+    """ Receive the action proposal of the client and check it
+
+        :param int trid: transport ID
+        :param bool keptConnection: True if the connection was kept open after a previous action,
+                                    in which case the client closing it is not an error
+
+        :return: S_OK(proposalTuple)/S_ERROR
+    """
     clientTransport = self._transportPool.get(trid)
     # Get the peer credentials
     credDict = clientTransport.getConnectingCredentials()
     # Receive the action proposal
     retVal = clientTransport.receiveData(1024)
     if not retVal['OK']:
+      if keptConnection:
+        gLogger.debug("Kept connection closed by the client", retVal['Message'])
+        return S_ERROR("No further action proposal")
       gLogger.error("Invalid action proposal", "%s %s" % (self._createIdentityString(credDict,
                                                                                      clientTransport),
                                                           retVal['Message']))
@@ -567,9 +822,19 @@ class Service(object):
       return S_ERROR("Server error while loading handler")
     return S_OK(handlerInstance)
 
-  def _processProposal(self, trid, proposalTuple, handlerObj):
+  def _processProposal(self, trid, proposalTuple, handlerObj, keepConnection=0):
+    """ Execute the action proposed by the client
+
+        :param int trid: transport ID
+        :param tuple proposalTuple: tuple describing the proposed action
+        :param handlerObj: handler instance
+        :param int keepConnection: if set, the client is told that the connection will be kept open
+                                   for keepConnection seconds after the action
+
+        :return: S_OK/S_ERROR with the 'closeTransport' and 'keepConnection' keys
+    """
     # Notify the client we're ready to execute the action
-    retVal = self._transportPool.send(trid, S_OK())
+    retVal = self._acceptProposal(trid, keepConnection)
     if not retVal['OK']:
       return retVal
 
@@ -597,7 +862,34 @@ class Service(object):
       if not result['OK']:
         self._msgBroker.removeTransport(trid)
 
-    result['closeTransport'] = not messageConnection or not result['OK']
+    return self._setConnectionFlags(result, keepConnection, messageConnection)
+
+  def _acceptProposal(self, trid, keepConnection=0):
+    """ Notify the client we're ready to execute the action
+
+        :param int trid: transport ID
+        :param int keepConnection: if set, the client is told that the connection will be kept open
+                                   for keepConnection seconds after the action
+
+        :return: S_OK/S_ERROR
+    """
+    if keepConnection:
+      return self._transportPool.send(trid, S_OK({'keepConnection': keepConnection}))
+    return self._transportPool.send(trid, S_OK())
+
+  @staticmethod
+  def _setConnectionFlags(result, keepConnection=0, messageConnection=False):
+    """ Tell what to do with the connection once an action has been executed
+
+        :param dict result: result of the action
+        :param int keepConnection: number of seconds the connection was proposed to be kept open
+        :param bool messageConnection: True if the connection is now a message connection
+
+        :return: the result, with the 'closeTransport' and 'keepConnection' keys
+    """
+    result['keepConnection'] = (bool(keepConnection) and result['OK'] and not messageConnection and
+                                result.get('actionSucceeded', False))
+    result['closeTransport'] = not (messageConnection or result['keepConnection']) or not result['OK']
     return result
 
   def _mbConnect(self, trid, handlerObj=None):
@@ -620,7 +912,10 @@ class Service(object):
             'componentLocation': self._cfg.getURL(),
             'ServiceResponseTime': response["Value"][1]
         })
-      return response["Value"][0]
+      result = response["Value"][0]
+      # The client only keeps the connection after a successful action
+      result['actionSucceeded'] = response["Value"][2]
+      return result
     except Exception as e:
       gLogger.exception("Exception while executing handler action")
       return S_ERROR("Server error while executing action: %s" % str(e))
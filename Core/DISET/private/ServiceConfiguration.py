@@ -79,6 +79,34 @@ class ServiceConfiguration:
     except:
       return 20
 
+  def getConnectionIdleTimeout(self):
+    """ Number of seconds a connection is kept open waiting for another RPC call
+        of the same client. 0 means that the connection is closed after each call.
+    """
+    try:
+      return max(0, int(self.getOption("ConnectionIdleTimeout")))
+    except:
+      return 0
+
+  def getAuthorizationCacheSize(self):
+    """ Maximum number of authorization decisions kept by the AuthManager, 0 to disable the cache
+    """
+    try:
+      return max(0, int(self.getOption("AuthorizationCacheSize")))
+    except:
+      return 10000
+
+  def getReactorMode(self):
+    """ How the connections are served:
+
+          - threads (default): a worker thread serves each connection from the handshake to the response
+          - events: the connections are watched by a ConnectionPoller, worker threads only execute the actions
+    """
+    optionValue = self.getOption("ReactorMode")
+    if optionValue and optionValue.lower() == 'events':
+      return 'events'
+    return 'threads'
+
   def getMaxThreadsForMethod(self, actionType, method):
     try:
       return int(self.getOption("ThreadLimit/%s/%s" % (actionType, method)))
@@ -22,7 +22,6 @@ __RCSID__ = "$Id$"
 
 import time
 import select
-import cStringIO
 from hashlib import md5
 
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
@@ -40,12 +39,17 @@ class BaseTransport(object):
   # you may want to read the man page before tuning it...
   iListenQueueSize = 128
   iReadTimeout = 600
+  # Maximum size asked for by each read when the transport cannot read in place (see _readInto)
+  iReadChunkSize = 65536
   keepAliveMagic = "dka"
+  # Whether the connections can be served by a ConnectionPoller (see handshakeNonBlocking and bufferAvailableData)
+  bNonBlockingIO = True
 
   def __init__(self, stServerAddress, bServerMode=False, **kwargs):
     self.bServerMode = bServerMode
     self.extraArgsDict = kwargs
-    self.byteStream = ""
+    # Data received but not processed yet
+    self.byteStream = bytearray()
     self.packetSize = 1048576  # 1MiB
     self.stServerAddress = stServerAddress
     self.peerCredentials = {}
@@ -57,6 +61,7 @@ class BaseTransport(object):
     self.sentKeepAlives = 0
     self.waitingForKeepAlivePong = False
     self.__keepAliveLapse = 0
+    self.__handshakeStats = None
     self.oSocket = None
     if 'keepAliveLapse' in kwargs:
       try:
@@ -81,6 +86,21 @@ class BaseTransport(object):
     """
     return S_OK()
 
+  def setHandshakeStats(self, handshakeTime, sessionReused):
+    """ Record how long the SSL handshake of this connection took
+
+    :param handshakeTime: duration of the handshake in seconds
+    :param sessionReused: True if a previous SSL session was resumed, None if unknown
+    """
+    self.__handshakeStats = (handshakeTime, sessionReused)
+
+  def getHandshakeStats(self):
+    """
+    :return: tuple (handshake duration in seconds, whether the SSL session was resumed),
+             or None if no handshake was done (e.g. plain transport)
+    """
+    return self.__handshakeStats
+
   def close(self):
     self.oSocket.close()
 
@@ -154,9 +174,83 @@ class BaseTransport(object):
     except Exception as e:
       return S_ERROR("Exception while reading from peer: %s" % str(e))
 
+  def _readInto(self, view):
+    """ Read from the socket straight into a writable buffer.
+        This is overwritten by the transports which can avoid the intermediate string.
+
+    :param view: memoryview of the buffer to fill
+    :return: S_OK(number of bytes read, 0 if the connection was closed)/S_ERROR
+    """
+    # Do not ask for too much at once, the SSL libraries allocate what is asked for
+    retVal = self._read(min(len(view), self.iReadChunkSize), skipReadyCheck=True)
+    if not retVal['OK']:
+      return retVal
+    data = retVal['Value']
+    view[:len(data)] = data
+    return S_OK(len(data))
+
   def _write(self, buf):
     return S_OK(self.oSocket.send(buf))
 
+  def handshakeNonBlocking(self):
+    """ Make the handshake progress as far as possible without blocking.
+        This is overwritten by the transports which can defer their handshake.
+
+    :return: S_OK(True) once the handshake is done, S_OK(False) if it needs more data from the peer
+    """
+    return S_OK(True)
+
+  def _readAvailable(self, bufSize=16384):
+    """ Read what can be read from the socket without blocking.
+        It must only be called when the socket is known to be readable.
+
+    :return: S_OK(data)/S_ERROR
+    """
+    try:
+      data = self.oSocket.recv(bufSize)
+    except Exception as e:
+      return S_ERROR("Exception while reading from peer: %s" % str(e))
+    if not data:
+      return S_ERROR("Connection closed by peer")
+    return S_OK(data)
+
+  def hasBufferedMessage(self):
+    """
+    :return: True if receiveData can return a message without reading from the socket
+    """
+    if self.receivedMessages or self.byteStream.startswith(self.keepAliveMagic):
+      return True
+    iSeparatorPosition = self.byteStream.find(":", 0, 10)
+    if iSeparatorPosition == -1:
+      return False
+    try:
+      pkgSize = int(self.byteStream[:iSeparatorPosition])
+    except ValueError:
+      # Let receiveData report the problem
+      return True
+    return len(self.byteStream) - iSeparatorPosition - 1 >= pkgSize
+
+  def hasPendingData(self):
+    """
+    :return: True if some data has been received but not processed yet, so that
+             waiting for the socket to be readable is not needed
+    """
+    return self.hasBufferedMessage()
+
+  def bufferAvailableData(self):
+    """ Read the data available on the socket without blocking, and keep it for receiveData.
+        This is used by the ConnectionPoller when the socket is readable.
+
+    :return: S_OK(True) if a complete message has been received,
+             S_OK(False) if more data is needed, S_ERROR if the connection is broken
+    """
+    if not self.hasBufferedMessage():
+      result = self._readAvailable()
+      if not result['OK']:
+        return result
+      self.byteStream += result['Value']
+    return S_OK(self.hasBufferedMessage())
+
   def sendData(self, uData, prefix=False):
     self.__updateLastActionTimestamp()
     sCodedData = DEncode.encode(uData)
@@ -214,41 +308,38 @@ class BaseTransport(object):
       if isKeepAlive:
         gLogger.debug("Received keep alive header")
         # Remove the ka magic from the buffer and process the keep alive
-        self.byteStream = self.byteStream[keepAliveMagicLen:]
+        del self.byteStream[:keepAliveMagicLen]
         return self.__processKeepAlive(maxBufferSize, blockAfterKeepAlive)
       # From here it must be a real message!
       # Process the size and remove the msg length from the bytestream
       pkgSize = int(self.byteStream[:iSeparatorPosition])
-      pkgData = self.byteStream[iSeparatorPosition + 1:]
-      readSize = len(pkgData)
+      pkgStart = iSeparatorPosition + 1
+      readSize = len(self.byteStream) - pkgStart
       if readSize >= pkgSize:
         # If we already have all the data we need
-        data = pkgData[:pkgSize]
-        self.byteStream = pkgData[pkgSize:]
+        data = memoryview(self.byteStream)[pkgStart:pkgStart + pkgSize].tobytes()
+        del self.byteStream[:pkgStart + pkgSize]
       else:
-        # If we still need to read stuff
-        pkgMem = cStringIO.StringIO()
-        pkgMem.write(pkgData)
+        if maxBufferSize and pkgSize > maxBufferSize:
+          return S_ERROR("Read limit exceeded (%s chars)" % maxBufferSize)
+        # If we still need to read stuff, receive it in place
+        # into a buffer holding the whole message
+        pkgBuffer = bytearray(pkgSize)
+        pkgView = memoryview(pkgBuffer)
+        pkgView[:readSize] = memoryview(self.byteStream)[pkgStart:]
+        self.byteStream = bytearray()
         # Receive while there's still data to be received
         while readSize < pkgSize:
-          retVal = self._read(pkgSize - readSize, skipReadyCheck=True)
+          retVal = self._readInto(pkgView[readSize:])
           if not retVal['OK']:
             return retVal
           if not retVal['Value']:
             return S_ERROR("Peer closed connection")
-          rcvData = retVal['Value']
-          readSize += len(rcvData)
-          pkgMem.write(rcvData)
-          if maxBufferSize and readSize > maxBufferSize:
-            return S_ERROR("Read limit exceeded (%s chars)" % maxBufferSize)
-        # Data is here! take it out from the bytestream, dencode and return
-        if readSize == pkgSize:
-          data = pkgMem.getvalue()
-          self.byteStream = ""
-        else:  # readSize > pkgSize:
-          pkgMem.seek(0, 0)
-          data = pkgMem.read(pkgSize)
-          self.byteStream = pkgMem.read()
+          readSize += retVal['Value']
+        # Data is here! dencode and return
+        del pkgView
+        data = str(pkgBuffer)
+        del pkgBuffer
       try:
         data = DEncode.decode(data)[0]
       except Exception as e:
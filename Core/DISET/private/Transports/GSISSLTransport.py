@@ -16,6 +16,8 @@ GSI.SSL.set_thread_safe()
 
 class SSLTransport(BaseTransport):
 
+  # The handshake is done by handshake(), which blocks
+  bNonBlockingIO = False
   __readWriteLock = LockRing().getLock()
 
   def __init__(self, *args, **kwargs):
@@ -47,11 +49,13 @@ class SSLTransport(BaseTransport):
     gSocketInfoFactory.setSocketTimeout(timeout)
 
   def initAsClient(self):
+    startTime = time.time()
     retVal = gSocketInfoFactory.getSocket(self.stServerAddress, **self.extraArgsDict)
     if not retVal['OK']:
       return retVal
     self.oSocketInfo = retVal['Value']
     self.oSocket = self.oSocketInfo.getSSLSocket()
+    self.setHandshakeStats(time.time() - startTime, bool(self.oSocket.session_reused()))
     if not self.oSocket.session_reused():
       gLogger.debug("New session connecting to server at %s" % str(self.stServerAddress))
     self.remoteAddress = self.oSocket.getpeername()
@@ -105,9 +109,11 @@ class SSLTransport(BaseTransport):
 
       :return: S_OK (with credentialDict if new session)
     """
+    startTime = time.time()
     retVal = self.oSocketInfo.doServerHandshake()
     if not retVal['OK']:
       return retVal
+    self.setHandshakeStats(time.time() - startTime, bool(self.oSocket.session_reused()))
     creds = retVal['Value']
     if not self.oSocket.session_reused():
       gLogger.debug("New session connecting from client at %s" % str(self.getRemoteAddress()))
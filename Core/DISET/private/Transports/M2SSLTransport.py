@@ -6,12 +6,14 @@ M2Crypto SSLTransport Library
 __RCSID__ = "$Id$"
 
 import os
+import time
 import socket
 from M2Crypto import SSL, threading as M2Threading
 
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 from DIRAC.Core.DISET.private.Transports.BaseTransport import BaseTransport
-from DIRAC.Core.DISET.private.Transports.SSL.M2Utils import getM2SSLContext, getM2PeerInfo
+from DIRAC.Core.DISET.private.Transports.SSL.M2Utils import getM2SSLContext, getM2PeerInfo, \
+    getM2ClientSSLContext, getM2SSLSession, setM2SSLSession, isM2SessionReused
 
 # TODO: For now we have to set an environment variable for proxy support in OpenSSL
 # Eventually we may need to add API support for this to M2Crypto...
@@ -42,6 +44,12 @@ class SSLTransport(BaseTransport):
       conn = SSL.Connection(self.__ctx, family=socket.AF_INET)
     return conn
 
+  @staticmethod
+  def __getServerAddress(stServerAddress, *_args, **_kwargs):
+    """ Helper function to get the server address out of the constructor arguments
+    """
+    return stServerAddress
+
   def __init__(self, *args, **kwargs):
     """ Create an SSLTransport object, parameters are the same
         as for other transports. If ctx is specified (as an instance of
@@ -51,10 +59,20 @@ class SSLTransport(BaseTransport):
     self.peerCredentials = {}
     self.__timeout = 1
     self.__locked = False  # We don't support locking, so this is always false.
+    # Key under which the client SSL session is saved for resumption
+    self.__sessionKey = None
+    # Time at which a server side connection has been accepted, as long as its handshake is not done
+    self.__handshakeStart = None
 
     self.__ctx = kwargs.pop('ctx', None)
     if not self.__ctx:
-      self.__ctx = getM2SSLContext(**kwargs)
+      if kwargs.get('bServerMode', False):
+        self.__ctx = getM2SSLContext(**kwargs)
+      else:
+        # Client contexts are shared, so that the SSL sessions can be resumed
+        self.__ctx, ctxKey = getM2ClientSSLContext(**kwargs)
+        if ctxKey:
+          self.__sessionKey = (tuple(self.__getServerAddress(*args, **kwargs)), ctxKey)
 
     self.__kwargs = kwargs
     BaseTransport.__init__(self, *args, **kwargs)
@@ -89,7 +107,14 @@ class SSLTransport(BaseTransport):
         # set SNI server name since we know it at this point
         self.oSocket.set_tlsext_host_name(host)
 
+        # Try to resume the previous session with this server
+        session = getM2SSLSession(self.__sessionKey) if self.__sessionKey else None
+        if session:
+          self.oSocket.set_session(session)
+
+        startTime = time.time()
         self.oSocket.connect((host, port))
+        self.setHandshakeStats(time.time() - startTime, isM2SessionReused(self.oSocket))
         self.remoteAddress = self.oSocket.getpeername()
 
         return S_OK()
@@ -97,6 +122,8 @@ class SSLTransport(BaseTransport):
         # Other exception are probably SSL-related, in that case we
         # abort and the exception is forwarded to the caller.
         error = repr(e)
+        if self.__sessionKey:
+          setM2SSLSession(self.__sessionKey, None)
 
         if self.oSocket is not None:
           self.oSocket.close()
@@ -128,6 +155,13 @@ class SSLTransport(BaseTransport):
   def close(self):
     """ Close this socket. """
     if self.oSocket:
+      if self.__sessionKey and self.remoteAddress:
+        # The session is saved only now, because with TLSv1.3 it is only
+        # known after the server has sent some data
+        try:
+          setM2SSLSession(self.__sessionKey, self.oSocket.get_session())
+        except Exception:  # pylint: disable=broad-except
+          pass
       # Surprisingly (to me at least), M2Crypto does not close
       # the socket when calling SSL.Connection.close
       # It only does it when the garbage collector kicks in
@@ -171,14 +205,82 @@ class SSLTransport(BaseTransport):
   def acceptConnection(self):
     """ Accept a new client, returns a new SSLTransport object representing
         the client connection.
+        If the server was created with the nonBlockingHandshake keyword, the handshake
+        is not done here, but by calls to handshakeNonBlocking on the returned object.
 
         :returns: S_OK(SSLTransport object)
     """
+    if self.extraArgsDict.get('nonBlockingHandshake'):
+      oClientSocket, address = self.oSocket.socket.accept()
+      oClient = SSL.Connection(self.__ctx, oClientSocket)
+      oClient.addr = address
+      oClient.setup_ssl()
+      oClient.set_accept_state()
+      oClient.setblocking(0)
+      oClientTrans = SSLTransport(self.stServerAddress, ctx=self.__ctx)
+      oClientTrans.oSocket = oClient
+      oClientTrans.remoteAddress = oClientSocket.getpeername()
+      oClientTrans.__handshakeStart = time.time()
+      return S_OK(oClientTrans)
+
+    startTime = time.time()
     oClient, _ = self.oSocket.accept()
+    handshakeTime = time.time() - startTime
     oClientTrans = SSLTransport(self.stServerAddress, ctx=self.__ctx)
     oClientTrans.setClientSocket(oClient)
+    oClientTrans.setHandshakeStats(handshakeTime, isM2SessionReused(oClient))
     return S_OK(oClientTrans)
 
+  def handshakeNonBlocking(self):
+    """ Make the handshake of a connection accepted with the nonBlockingHandshake
+        keyword progress, without blocking.
+
+        :returns: S_OK(True) once the handshake is done, S_OK(False) if it needs more data
+    """
+    if self.__handshakeStart is None:
+      return S_OK(True)
+    try:
+      if self.oSocket.accept_ssl() != 1:
+        return S_OK(False)
+      self.oSocket.setblocking(1)
+      self.peerCredentials = getM2PeerInfo(self.oSocket)
+    except Exception as e:  # pylint: disable=broad-except
+      return S_ERROR("SSL handshake failed: %s" % repr(e))
+    self.setHandshakeStats(time.time() - self.__handshakeStart, isM2SessionReused(self.oSocket))
+    self.__handshakeStart = None
+    return S_OK(True)
+
+  def _readAvailable(self, bufSize=16384):
+    """ Read all what can be read without blocking, including the data
+        already decrypted and buffered by OpenSSL.
+
+        :returns: S_OK(data)/S_ERROR
+    """
+    chunks = []
+    self.oSocket.setblocking(0)
+    try:
+      while True:
+        data = self.oSocket.read(bufSize)
+        if data is None:
+          break
+        if not data:
+          if not chunks:
+            return S_ERROR("Connection closed by peer")
+          break
+        chunks.append(data)
+    except Exception as e:  # pylint: disable=broad-except
+      return S_ERROR("Exception while reading from peer: %s" % str(e))
+    finally:
+      self.oSocket.setblocking(1)
+    return S_OK("".join(chunks))
+
+  def hasPendingData(self):
+    """ Data may have been decrypted by OpenSSL without being read yet
+
+        :returns: boolean
+    """
+    return self.hasBufferedMessage() or (self.__handshakeStart is None and self.oSocket.pending() > 0)
+
   def _read(self, bufSize=4096, skipReadyCheck=False):
     """ Read bufSize bytes from the buffer.
 
@@ -88,6 +88,25 @@ class PlainTransport(BaseTransport):
       except Exception as e:
         return S_ERROR("Exception while reading from peer: %s" % str(e))
 
+  def _readInto(self, view):
+    start = time.time()
+    timeout = False
+    if 'timeout' in self.extraArgsDict:
+      timeout = self.extraArgsDict['timeout']
+    while True:
+      if timeout:
+        if time.time() - start > timeout:
+          return S_ERROR("Socket read timeout exceeded")
+      try:
+        return S_OK(self.oSocket.recv_into(view))
+      except socket.error as e:
+        if e[0] == 11:
+          time.sleep(0.001)
+        else:
+          return S_ERROR("Exception while reading from peer: %s" % str(e))
+      except Exception as e:
+        return S_ERROR("Exception while reading from peer: %s" % str(e))
+
   def _write(self, buf):
     sentBytes = 0
     timeout = False
@@ -4,10 +4,12 @@ Utilities for using M2Crypto SSL with DIRAC.
 """
 
 import os
+import ctypes
 from M2Crypto import SSL, m2
 
 from DIRAC.Core.Security import Locations
 from DIRAC.Core.Security.m2crypto.X509Chain import X509Chain
+from DIRAC.Core.Utilities.DictCache import DictCache
 
 # Default ciphers to use if unspecified
 # Cipher line should be as readable as possible, sorry pylint
@@ -15,6 +17,24 @@ from DIRAC.Core.Security.m2crypto.X509Chain import X509Chain
 DEFAULT_SSL_CIPHERS = "AES256-GCM-SHA384:AES256-SHA256:AES256-SHA:CAMELLIA256-SHA:AES128-GCM-SHA256:AES128-SHA256:AES128-SHA:HIGH:MEDIUM:RSA:!3DES:!RC4:!aNULL:!eNULL:!MD5:!SEED:!IDEA"  # noqa
 # Verify depth of peer certs
 VERIFY_DEPTH = 50
+# Default lifetime of the SSL sessions in seconds, on the server and in the client cache
+DEFAULT_SESSION_TIMEOUT = 600
+# Not exported by M2Crypto. Session tickets are disabled so that sessions are resumed
+# from the server cache, which keeps the peer certificate chain (needed by getM2PeerInfo)
+SSL_OP_NO_TICKET = 0x00004000
+
+# Client side SSL contexts and sessions, see getM2ClientSSLContext and getM2SSLSession
+gClientContexts = DictCache()
+gClientSessions = DictCache()
+
+# SSL_session_reused is a macro in old OpenSSL versions and is not exported by M2Crypto,
+# so it is looked up in the OpenSSL library M2Crypto is linked with, if possible
+try:
+  from M2Crypto import _m2crypto
+  __sslSessionReused = ctypes.CDLL(_m2crypto.__file__).SSL_session_reused
+  __sslSessionReused.argtypes = [ctypes.c_void_p]
+except Exception:  # pylint: disable=broad-except
+  __sslSessionReused = None
 
 
 def __loadM2SSLCTXHostcert(ctx):
@@ -67,6 +87,8 @@ def getM2SSLContext(ctx=None, **kwargs):
                               cipher format, e.g. "SSLv3:TLSv1".
         - sslCiphers: String, OpenSSL style cipher string of ciphers to allow
                               on this connection.
+        - SSLSessionTimeout: Integer, lifetime in seconds of the sessions
+                             kept by a server for resumption.
 
       If an existing context "ctx" is provided, it is just reconfigured with
       the selected arguments.
@@ -127,12 +149,94 @@ def getM2SSLContext(ctx=None, **kwargs):
   ciphers = kwargs.get('sslCiphers', DEFAULT_SSL_CIPHERS)
   ctx.set_cipher_list(ciphers)
 
+  # Allow abbreviated handshakes for returning clients
+  # pylint: disable=no-member
+  if kwargs.get('bServerMode', False):
+    ctx.set_session_cache_mode(m2.SSL_SESS_CACHE_SERVER)
+    ctx.set_options(SSL_OP_NO_TICKET)
+    ctx.set_session_timeout(int(kwargs.get('SSLSessionTimeout') or DEFAULT_SESSION_TIMEOUT))
+  else:
+    ctx.set_session_cache_mode(m2.SSL_SESS_CACHE_CLIENT)
+
   # log the debug messages
   # ctx.set_info_callback()
 
   return ctx
 
 
+def __getCredentialsId(kwargs):
+  """ Get a string identifying the credentials a client context is built with.
+      The modification time of the file is included, so that a renewed proxy
+      or certificate leads to a new context.
+  """
+  if kwargs.get('useCertificates', False):
+    certKeyTuple = Locations.getHostCertificateAndKeyLocation()
+    credPath = certKeyTuple[0] if certKeyTuple else None
+  else:
+    credPath = kwargs.get('proxyLocation') or Locations.getProxyLocation()
+  try:
+    return "%s:%s" % (credPath, os.stat(credPath).st_mtime)
+  except (OSError, TypeError):
+    # Let getM2SSLContext report the problem
+    return None
+
+
+def getM2ClientSSLContext(**kwargs):
+  """ Same as getM2SSLContext for a client, but the contexts are cached and shared
+      between the connections using the same credentials and options, which avoids
+      reloading the credentials and allows the SSL sessions to be resumed.
+
+      :returns: tuple (context, key identifying the context, or None if it is not cached)
+  """
+  credentialsId = __getCredentialsId(kwargs)
+  if not credentialsId or kwargs.get('proxyString'):
+    return getM2SSLContext(**kwargs), None
+  ctxKey = (credentialsId, bool(kwargs.get('skipCACheck', False)),
+            kwargs.get('sslMethod'), kwargs.get('sslCiphers'))
+  ctx = gClientContexts.get(ctxKey)
+  if not ctx:
+    ctx = getM2SSLContext(**kwargs)
+    gClientContexts.add(ctxKey, DEFAULT_SESSION_TIMEOUT, ctx)
+  return ctx, ctxKey
+
+
+def getM2SSLSession(sessionKey):
+  """ Get the SSL session saved for a server
+
+      :param sessionKey: key identifying the server and the client context
+      :returns: M2Crypto.SSL.Session or None
+  """
+  return gClientSessions.get(sessionKey)
+
+
+def setM2SSLSession(sessionKey, session):
+  """ Save (or forget, if session is None) the SSL session used with a server,
+      so that it can be resumed by the next connection
+
+      :param sessionKey: key identifying the server and the client context
+      :param session: M2Crypto.SSL.Session object
+  """
+  if session is None:
+    gClientSessions.delete(sessionKey)
+  else:
+    # Do not keep it longer than a server would
+    gClientSessions.add(sessionKey, DEFAULT_SESSION_TIMEOUT, session)
+
+
+def isM2SessionReused(conn):
+  """ Tells whether the handshake of an M2 SSL Connection resumed a previous session
+
+      :param conn: M2Crypto.SSL.Connection object
+      :returns: boolean, or None if it cannot be known
+  """
+  if not __sslSessionReused:
+    return None
+  try:
+    return bool(__sslSessionReused(int(conn.ssl)))
+  except Exception:  # pylint: disable=broad-except
+    return None
+
+
 def getM2PeerInfo(conn):
   """ Gets the details of the current peer as a standard dict. The peer
       details are obtained from the supplied M2 SSL Connection obj "conn".
@@ -0,0 +1,152 @@
+""" Test the resumption of the SSL sessions and the non blocking handshake
+    of the M2Crypto SSLTransport
+"""
+
+import os
+import socket
+import threading
+
+import pytest
+from pytest import fixture
+
+from DIRAC.Core.Security.test.x509TestUtilities import CERTDIR, HOSTCERT, getCertOption
+
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.Core.Utilities.CFG import CFG
+from DIRAC.Core.DISET.private.Transports import M2SSLTransport
+from DIRAC.Core.DISET.private.Transports.SSL import M2Utils
+from DIRAC.Core.DISET.private.ConnectionPoller import ConnectionPoller
+
+# pylint: disable=redefined-outer-name
+
+caLocation = os.path.join(CERTDIR, 'ca')
+hostCertLocation = os.path.join(CERTDIR, 'host/hostcert.pem')
+hostKeyLocation = os.path.join(CERTDIR, 'host/hostkey.pem')
+
+PORT_NUMBER = 50001
+
+
+@fixture
+def server():
+  """ Start an M2 server accepting connections until it is closed,
+      and returns the list of the accepted client transports
+  """
+  gConfigurationData.localCFG = CFG()
+  gConfigurationData.remoteCFG = CFG()
+  gConfigurationData.mergedCFG = CFG()
+  gConfigurationData.generateNewVersion()
+  gConfigurationData.setOptionInCFG('/DIRAC/Security/CALocation', caLocation)
+  gConfigurationData.setOptionInCFG('/DIRAC/Security/CertFile', hostCertLocation)
+  gConfigurationData.setOptionInCFG('/DIRAC/Security/KeyFile', hostKeyLocation)
+  M2Utils.gClientContexts.purgeAll()
+  M2Utils.gClientSessions.purgeAll()
+
+  serverTransport = M2SSLTransport.SSLTransport(("", PORT_NUMBER), bServerMode=True)
+  assert serverTransport.initAsServer()['OK']
+  accepted = []
+  stopEvent = threading.Event()
+
+  def serve():
+    while True:
+      try:
+        clientTransport = serverTransport.acceptConnection()['Value']
+      except Exception:  # pylint: disable=broad-except
+        if stopEvent.is_set():
+          return
+        continue
+      accepted.append(clientTransport)
+      clientTransport.receiveData(1024)
+      clientTransport.sendData("pong")
+      clientTransport.close()
+
+  serverThread = threading.Thread(target=serve)
+  serverThread.daemon = True
+  serverThread.start()
+
+  yield accepted
+
+  # Unblock the accept with a connection that is not even SSL
+  stopEvent.set()
+  socket.create_connection(("localhost", PORT_NUMBER)).close()
+  serverThread.join()
+  serverTransport.close()
+  gConfigurationData.localCFG = CFG()
+  gConfigurationData.remoteCFG = CFG()
+  gConfigurationData.mergedCFG = CFG()
+  gConfigurationData.generateNewVersion()
+
+
+def ping(**kwargs):
+  """ Connect to the server, exchange a message and disconnect
+
+      :returns: the client transport
+  """
+  clientTransport = M2SSLTransport.SSLTransport(("localhost", PORT_NUMBER), bServerMode=False,
+                                                clientMode=True, useCertificates=True, **kwargs)
+  assert clientTransport.initAsClient()['OK']
+  clientTransport.sendData("ping")
+  assert clientTransport.receiveData() == "pong"
+  clientTransport.close()
+  return clientTransport
+
+
+def test_sessionResumption(server):
+  """ The second connection to the same server resumes the session of the first one,
+      and the peer credentials are still known by the server
+  """
+  first = ping()
+  second = ping()
+
+  if first.getHandshakeStats()[1] is None:
+    pytest.skip("Session resumption cannot be detected with this OpenSSL library")
+  assert first.getHandshakeStats()[1] is False
+  assert second.getHandshakeStats()[1] is True
+  assert [trans.getHandshakeStats()[1] for trans in server] == [False, True]
+  for clientTransport in server:
+    assert clientTransport.getConnectingCredentials()['DN'] == getCertOption(HOSTCERT, 'subjectDN')
+
+
+def test_contextOptions(server):
+  """ Sessions are not shared between connections using different options """
+  ping()
+  other = ping(skipCACheck=True)
+  assert other.getHandshakeStats()[1] in (False, None)
+  assert len(M2Utils.gClientContexts.getKeys()) == 2
+
+
+def test_nonBlockingHandshake(server):
+  """ The handshake of a connection accepted with nonBlockingHandshake is done by the ConnectionPoller """
+  serverTransport = M2SSLTransport.SSLTransport(("", PORT_NUMBER + 1), bServerMode=True, nonBlockingHandshake=True)
+  assert serverTransport.initAsServer()['OK']
+  results = []
+  received = threading.Event()
+
+  def callback(result, clientTransport):
+    results.append((result, clientTransport))
+    received.set()
+
+  def client():
+    clientTransport = M2SSLTransport.SSLTransport(("localhost", PORT_NUMBER + 1), bServerMode=False,
+                                                  clientMode=True, useCertificates=True)
+    assert clientTransport.initAsClient()['OK']
+    clientTransport.sendData("ping")
+    received.wait(5)
+    clientTransport.close()
+
+  clientThread = threading.Thread(target=client)
+  clientThread.start()
+  try:
+    # The accept returns as soon as the TCP connection is established
+    clientTransport = serverTransport.acceptConnection()['Value']
+    assert clientTransport.getConnectingCredentials() == {}
+    ConnectionPoller("Test").watch(clientTransport, 5, callback, clientTransport)
+    assert received.wait(5)
+  finally:
+    clientThread.join()
+    serverTransport.close()
+
+  result, clientTransport = results[0]
+  assert result['OK'], result
+  assert clientTransport.getConnectingCredentials()['DN'] == getCertOption(HOSTCERT, 'subjectDN')
+  assert clientTransport.getHandshakeStats() is not None
+  assert clientTransport.receiveData() == "ping"
@@ -0,0 +1,76 @@
+""" Test the framing of the messages received by the transports, using PlainTransport on socket pairs """
+
+import socket
+import threading
+
+from pytest import fixture
+
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+
+# pylint: disable=redefined-outer-name
+
+
+@fixture
+def transports():
+  """ Returns a pair of connected transports """
+  sockets = socket.socketpair()
+  pair = []
+  for sock in sockets:
+    transport = PlainTransport(("", 0), keepAliveLapse=150)
+    transport.setClientSocket(sock)
+    pair.append(transport)
+  yield pair
+  for transport in pair:
+    transport.close()
+
+
+def sendInThread(transport, *messages):
+  """ Send messages from another thread, so that big messages do not block the socket pair """
+  thread = threading.Thread(target=lambda: [transport.sendData(message) for message in messages])
+  thread.start()
+  return thread
+
+
+def test_messages(transports):
+  """ Small and big messages sent back to back are received in order """
+  sender, receiver = transports
+  bigMessage = {'OK': True, 'Value': ['/lhcb/file%d' % i for i in range(200000)]}
+  thread = sendInThread(sender, "small", bigMessage, "last")
+  assert receiver.receiveData() == "small"
+  assert receiver.receiveData() == bigMessage
+  assert receiver.receiveData() == "last"
+  thread.join()
+  assert not receiver.byteStream
+
+
+def test_partialMessage(transports):
+  """ A message cut by the peer closing the connection is an error """
+  sender, receiver = transports
+  encoded = DEncode.encode("x" * 100000)
+  sender.oSocket.sendall("%s:%s" % (len(encoded), encoded[:50000]))
+  sender.close()
+  result = receiver.receiveData()
+  assert not result['OK']
+
+
+def test_maxBufferSize(transports):
+  """ Messages bigger than the allowed size are refused """
+  sender, receiver = transports
+  thread = sendInThread(sender, "x" * 100000)
+  result = receiver.receiveData(maxBufferSize=1024)
+  assert not result['OK']
+  assert 'Read limit exceeded' in result['Message']
+  receiver.close()
+  thread.join()
+
+
+def test_keepAlive(transports):
+  """ Keep alives are answered and skipped """
+  sender, receiver = transports
+  sender.sendKeepAlive(responseId=None, now=1e12)
+  sender.sendData("after keep alive")
+  assert receiver.receiveData() == "after keep alive"
+  # The pong has been sent back
+  result = sender.receiveData(blockAfterKeepAlive=False)
+  assert result['OK'] and result.get('keepAlive')
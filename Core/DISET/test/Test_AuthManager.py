@@ -318,6 +318,44 @@ class AuthManagerTest(unittest.TestCase):
     self.assertFalse(result)
 
 
+class CachedAuthManagerTest(AuthManagerTest):
+  """ The same tests, with the cache of the authorization decisions
+  """
+
+  def setUp(self):
+    super(CachedAuthManagerTest, self).setUp()
+    self.authMgr = AuthManager('/Systems/Service/Authorization', cacheSize=100)
+
+  def test_cachedDecisions(self):
+    uncachedAuthMgr = AuthManager('/Systems/Service/Authorization')
+    credDicts = [self.noAuthCredDict, self.userCredDict, self.suspendedOtherVOUserCredDict, self.badUserCredDict,
+                 self.suspendedUserCredDict, self.hostCredDict, self.badHostCredDict,
+                 {'DN': '/User/test/DN/CN=test.hostA.ch', 'group': 'hosts',
+                  'extraCredentials': ('/User/test/DN/CN=userA', 'group_test')}]
+    methods = ['Method', 'MethodAll', 'MethodAuth', 'MethodGroup', 'MethodVO', 'MethodHost', 'MethodTrustedHost']
+    for _ in range(2):
+      for method in methods:
+        for credDict in credDicts:
+          expectedCredDict = dict(credDict)
+          expected = uncachedAuthMgr.authQuery(method, expectedCredDict)
+          cachedCredDict = dict(credDict)
+          self.assertEqual(self.authMgr.authQuery(method, cachedCredDict), expected)
+          self.assertEqual(cachedCredDict, expectedCredDict)
+    cacheStats = self.authMgr.getCacheStats()
+    self.assertEqual(cacheStats['hits'], len(methods) * len(credDicts))
+    self.assertEqual(cacheStats['misses'], len(methods) * len(credDicts))
+
+  def test_configurationChange(self):
+    self.assertTrue(self.authMgr.authQuery('Method', dict(self.userCredDict)))
+    gConfig.setOptionValue('/Registry/Groups/group_test/Properties', 'NoProperties')
+    try:
+      self.assertFalse(self.authMgr.authQuery('Method', dict(self.userCredDict)))
+    finally:
+      gConfig.setOptionValue('/Registry/Groups/group_test/Properties', 'NormalUser')
+    self.assertTrue(self.authMgr.authQuery('Method', dict(self.userCredDict)))
+
+
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase(AuthManagerTest)
+  suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(CachedAuthManagerTest))
   testResult = unittest.TextTestRunner(verbosity=2).run(suite)
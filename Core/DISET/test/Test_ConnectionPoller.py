@@ -0,0 +1,111 @@
+""" Unit tests for the ConnectionPoller of the event driven services
+"""
+
+import time
+import socket
+import threading
+
+import pytest
+
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.DISET.private.ConnectionPoller import ConnectionPoller
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+
+__RCSID__ = "$Id$"
+
+# pylint: disable=redefined-outer-name
+
+
+class CallbackRecorder(object):
+  """ Records the calls of the poller callback """
+
+  def __init__(self):
+    self.calls = []
+    self.event = threading.Event()
+
+  def __call__(self, result, *args):
+    self.calls.append((result, args))
+    self.event.set()
+
+  def wait(self, timeout=5):
+    return self.event.wait(timeout)
+
+
+@pytest.fixture
+def connection():
+  """ Returns a server side transport and the client socket connected to it """
+  serverSocket, clientSocket = socket.socketpair()
+  transport = PlainTransport(("", 0))
+  transport.setClientSocket(serverSocket)
+  yield transport, clientSocket
+  clientSocket.close()
+  transport.close()
+
+
+def encodeMessage(data):
+  """ Frame a message as the transports do """
+  encoded = DEncode.encode(data)
+  return "%s:%s" % (len(encoded), encoded)
+
+
+def test_completeMessage(connection):
+  """ The callback is only called once the whole message has been received """
+  transport, clientSocket = connection
+  callback = CallbackRecorder()
+  poller = ConnectionPoller("Test")
+  message = encodeMessage({'OK': True, 'Value': 'x' * 100})
+
+  poller.watch(transport, 10, callback, 'arg')
+  clientSocket.send(message[:20])
+  assert not callback.wait(0.5)
+  assert poller.getNumWatched() == 1
+
+  clientSocket.send(message[20:])
+  assert callback.wait()
+  assert len(callback.calls) == 1
+  result, args = callback.calls[0]
+  assert result['OK']
+  assert args == ('arg',)
+  assert poller.getNumWatched() == 0
+  # The message can now be received without blocking
+  assert transport.receiveData() == {'OK': True, 'Value': 'x' * 100}
+
+
+def test_bufferedMessage(connection):
+  """ A message already buffered by the transport does not need to wait for the socket """
+  transport, clientSocket = connection
+  callback = CallbackRecorder()
+  poller = ConnectionPoller("Test")
+  clientSocket.send(encodeMessage('first') + encodeMessage('second'))
+  time.sleep(0.1)
+  assert transport.receiveData() == 'first'
+
+  poller.watch(transport, 10, callback)
+  assert callback.wait()
+  assert callback.calls[0][0]['OK']
+  assert transport.receiveData() == 'second'
+
+
+def test_closedConnection(connection):
+  """ The callback gets an error if the client goes away """
+  transport, clientSocket = connection
+  callback = CallbackRecorder()
+  poller = ConnectionPoller("Test")
+
+  poller.watch(transport, 10, callback)
+  clientSocket.send("10:")
+  clientSocket.close()
+  assert callback.wait()
+  assert not callback.calls[0][0]['OK']
+
+
+def test_timeout(connection):
+  """ The callback gets an error if the client is too slow """
+  transport, _clientSocket = connection
+  callback = CallbackRecorder()
+  poller = ConnectionPoller("Test")
+
+  poller.watch(transport, 0.5, callback)
+  assert callback.wait()
+  assert not callback.calls[0][0]['OK']
+  assert poller.getNumWatched() == 0
@@ -0,0 +1,134 @@
+""" Unit tests for the client ConnectionPool
+"""
+
+import socket
+
+import pytest
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.DISET.private import ConnectionPool as moduleTested
+
+__RCSID__ = "$Id$"
+
+# pylint: disable=redefined-outer-name,protected-access
+
+
+class FakeTransportPool(object):
+  """ Minimal replacement of the TransportPool, holding transports on socket pairs """
+
+  def __init__(self):
+    self.transports = {}
+    self.peers = {}
+    self.closed = []
+
+  def newTransport(self, trid):
+    localSocket, peerSocket = socket.socketpair()
+    transport = MagicMock()
+    transport.getSocket.return_value = localSocket
+    transport.getKeepAliveLapse.return_value = 150
+    transport.receiveData.return_value = S_ERROR("Connection closed by peer")
+    self.transports[trid] = transport
+    self.peers[trid] = peerSocket
+    return transport
+
+  def get(self, trid):
+    return self.transports.get(trid)
+
+  def close(self, trid):
+    self.closed.append(trid)
+    self.transports.pop(trid).getSocket().close()
+    self.peers.pop(trid).close()
+
+
+@pytest.fixture
+def pools(mocker):
+  """ Returns a ConnectionPool and the fake TransportPool behind it """
+  transportPool = FakeTransportPool()
+  mocker.patch.object(moduleTested, 'getGlobalTransportPool', return_value=transportPool)
+  mocker.patch.object(moduleTested.gThreadScheduler, 'addPeriodicTask', return_value=S_OK('taskId'))
+  yield moduleTested.ConnectionPool(), transportPool
+  for trid in list(transportPool.transports):
+    transportPool.close(trid)
+
+
+def test_reuse(pools):
+  """ A connection given back to the pool is reused for the same key only """
+  connPool, transportPool = pools
+  transport = transportPool.newTransport('trid1')
+
+  assert connPool.get('key') is None
+  connPool.put('key', 'trid1', serverIdleTimeout=30)
+  assert connPool.get('otherKey') is None
+  assert connPool.get('key') == ('trid1', transport)
+  # It is not in the pool any more while it is used
+  assert connPool.get('key') is None
+
+  stats = connPool.getStats()
+  assert stats['hits'] == 1
+  assert stats['misses'] == 3
+  assert stats['idle'] == 0
+  assert not transportPool.closed
+
+
+def test_expiredConnection(pools, mocker):
+  """ Connections are closed when they have been idle for too long """
+  connPool, transportPool = pools
+  transportPool.newTransport('trid1')
+  transportPool.newTransport('trid2')
+
+  # The server does not keep it long enough to be worth it
+  connPool.put('key', 'trid1', serverIdleTimeout=1)
+  assert transportPool.closed == ['trid1']
+
+  connPool.put('key', 'trid2', serverIdleTimeout=30)
+  now = moduleTested.time.time()
+  mocker.patch.object(moduleTested.time, 'time', return_value=now + 60)
+  assert connPool.get('key') is None
+  assert transportPool.closed == ['trid1', 'trid2']
+  assert connPool.getStats()['evictions'] == 2
+
+
+def test_brokenConnection(pools):
+  """ Connections closed by the server are detected and discarded """
+  connPool, transportPool = pools
+  transportPool.newTransport('trid1')
+  transport = transportPool.newTransport('trid2')
+
+  connPool.put('key', 'trid1', serverIdleTimeout=30)
+  connPool.put('key', 'trid2', serverIdleTimeout=30)
+  # The server closed the most recently used one
+  transportPool.peers['trid2'].close()
+
+  assert connPool.get('key') == ('trid1', transportPool.transports['trid1'])
+  assert transport.receiveData.called
+  assert transportPool.closed == ['trid2']
+  assert connPool.getStats()['discarded'] == 1
+
+
+def test_keepAliveAnswer(pools):
+  """ A pending keep alive answer does not make the connection unusable """
+  connPool, transportPool = pools
+  transport = transportPool.newTransport('trid1')
+  keepAliveResult = S_OK()
+  keepAliveResult['keepAlive'] = True
+  transport.receiveData.return_value = keepAliveResult
+
+  connPool.put('key', 'trid1', serverIdleTimeout=30)
+  transportPool.peers['trid1'].send(b"dka")
+  assert connPool.get('key') == ('trid1', transport)
+
+
+def test_limits(pools):
+  """ The number of idle connections per key is limited, and the pool can be flushed """
+  connPool, transportPool = pools
+  connPool._ConnectionPool__maxIdleConnections = 2
+  for trid in ('trid1', 'trid2', 'trid3'):
+    transportPool.newTransport(trid)
+    connPool.put('key', trid, serverIdleTimeout=30)
+  assert transportPool.closed == ['trid3']
+  assert connPool.getStats()['idle'] == 2
+
+  connPool.discard('key')
+  assert sorted(transportPool.closed) == ['trid1', 'trid2', 'trid3']
+  assert connPool.getStats()['idle'] == 0
@@ -0,0 +1,120 @@
+""" Unit tests for the RPC results streamed by the services to the clients accepting them
+"""
+
+import pytest
+from mock import MagicMock
+
+from DIRAC.Core.Utilities.ReturnValues import S_OK
+from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.DISET.private.InnerRPCClient import InnerRPCClient
+
+__RCSID__ = "$Id$"
+
+# pylint: disable=redefined-outer-name,protected-access
+
+
+class StreamingHandler(RequestHandler):
+  """ Handler with methods returning generators """
+
+  types_count = [int]
+
+  def export_count(self, number):
+    return S_OK(({'Index': i, 'Name': 'file%d' % i} for i in range(number)))
+
+  types_failing = []
+
+  def export_failing(self):
+    def generator():
+      yield 1
+      raise RuntimeError("Database gone")
+    return S_OK(generator())
+
+
+class FakeTransportPool(object):
+  """ Records the messages sent by the handler """
+
+  def __init__(self, args):
+    self.args = args
+    self.sent = []
+
+  def receive(self, _trid, *_args, **_kwargs):
+    return S_OK(self.args)
+
+  def send(self, _trid, msg):
+    self.sent.append(msg)
+    return S_OK()
+
+  def get(self, _trid):
+    return MagicMock()
+
+
+def callHandler(method, args, streamResponse):
+  """ Execute an RPC call with the handler
+
+      :returns: the result of the action and the list of the messages sent to the client
+  """
+  trPool = FakeTransportPool(args)
+  msgBroker = MagicMock()
+  msgBroker.getTransportPool.return_value = trPool
+  StreamingHandler._rh__initializeClass({'serviceName': 'Test/Streaming', 'csPaths': []},
+                                        MagicMock(), msgBroker, MagicMock())
+  handler = StreamingHandler({}, 'trid')
+  proposalTuple = [('Test/Streaming', 'Setup', 'VO'), ('RPC', method), '', 'v1']
+  if streamResponse:
+    proposalTuple.append({'streamResponse': True, 'keepConnection': True})
+  result = handler._rh_executeAction(proposalTuple)
+  return result, trPool.sent
+
+
+def readStream(messages, keepConnection=30):
+  """ Read the stream with the InnerRPCClient, as if the messages were received from the server
+
+      :returns: the iterator and the mock of the InnerRPCClient disconnection
+  """
+  client = InnerRPCClient.__new__(InnerRPCClient)
+  client._disconnect = MagicMock()
+  transport = MagicMock()
+  transport.receiveData.side_effect = messages
+  stream = client._InnerRPCClient__readStream(transport, 'trid', {'keepConnection': keepConnection})
+  next(stream)
+  return stream, client._disconnect
+
+
+def test_notStreamed():
+  """ Clients not accepting streamed results get the whole list """
+  result, sent = callHandler('count', [3], streamResponse=False)
+  assert result['OK'] and result['Value'][2]
+  assert sent == [S_OK([{'Index': i, 'Name': 'file%d' % i} for i in range(3)])]
+
+
+def test_streamed():
+  """ The items are received one by one and the connection can be kept """
+  result, sent = callHandler('count', [50000], streamResponse=True)
+  assert result['OK'] and result['Value'][2]
+  assert sent[0]['Stream']
+  # More than one chunk
+  assert len(sent) > 3
+  stream, disconnect = readStream(sent[1:])
+  for i, item in enumerate(stream):
+    assert item == {'Index': i, 'Name': 'file%d' % i}
+  assert i == 49999
+  disconnect.assert_called_once_with('trid', keepConnection=30)
+
+
+def test_streamError():
+  """ An error while generating the items interrupts the stream on the client side """
+  result, sent = callHandler('failing', [], streamResponse=True)
+  assert not result['Value'][2]
+  assert not sent[-1]['OK']
+  stream, disconnect = readStream(sent[1:])
+  with pytest.raises(RuntimeError):
+    list(stream)
+  disconnect.assert_called_once_with('trid', keepConnection=0)
+
+
+def test_streamNotIterated():
+  """ The connection is closed if the stream is dropped before the end """
+  _result, sent = callHandler('count', [10], streamResponse=True)
+  stream, disconnect = readStream(sent[1:])
+  del stream
+  disconnect.assert_called_once_with('trid', keepConnection=0)
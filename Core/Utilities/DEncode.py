@@ -20,6 +20,7 @@ import six
 import types
 import datetime
 import os
+import re
 
 import functools
 import inspect
@@ -479,28 +480,274 @@ g_dEncodeFunctions[types.DictType] = encodeDict
 g_dDecodeFunctions["d"] = decodeDict
 
 
+# Encoded datetime without time zone, as produced by encodeDateTime
+_dateTimeRE = re.compile(r"zati(\d+)ei(\d+)ei(\d+)ei(\d+)ei(\d+)ei(\d+)ei(\d+)ene")
+
+
+def _encodeObject(uObject, eList):
+  """ Single pass encoding of an object, appended to eList
+
+      The containers and the common types they contain are encoded inline, producing exactly
+      the same output as the functions of g_dEncodeFunctions, which encode the other types.
+  """
+  oType = type(uObject)
+  if oType is dict:
+    append = eList.append
+    extend = eList.extend
+    append("d")
+    for key in sorted(uObject):
+      if type(key) is str:
+        extend(("s", str(len(key)), ":", key))
+      else:
+        _encodeObject(key, eList)
+      value = uObject[key]
+      valueType = type(value)
+      if valueType is str:
+        extend(("s", str(len(value)), ":", value))
+      elif valueType is int:
+        extend(("i", str(value), "e"))
+      elif value is None:
+        append("n")
+      else:
+        _encodeObject(value, eList)
+    append("e")
+  elif oType is list or oType is tuple:
+    append = eList.append
+    extend = eList.extend
+    append("l" if oType is list else "t")
+    for value in uObject:
+      valueType = type(value)
+      if valueType is str:
+        extend(("s", str(len(value)), ":", value))
+      elif valueType is int:
+        extend(("i", str(value), "e"))
+      else:
+        _encodeObject(value, eList)
+    append("e")
+  elif oType is _dateTimeType and uObject.tzinfo is None:
+    eList.extend(("zati", str(uObject.year), "ei", str(uObject.month), "ei", str(uObject.day),
+                  "ei", str(uObject.hour), "ei", str(uObject.minute), "ei", str(uObject.second),
+                  "ei", str(uObject.microsecond), "ene"))
+  elif oType is str:
+    eList.extend(("s", str(len(uObject)), ":", uObject))
+  else:
+    g_dEncodeFunctions[oType](uObject, eList)
+
+
+def _decodeObject(data, i):
+  """ Single pass decoding of the object starting at position i
+
+      The containers and the common types they contain are decoded inline, the other
+      types by g_dDecodeFunctions.
+
+      :returns: tuple (decoded object, position after it)
+  """
+  typeId = data[i]
+  index = data.index
+  if typeId == "d":
+    oD = {}
+    i += 1
+    while data[i] != "e":
+      keyType = data[i]
+      if keyType == "s":
+        colon = index(":", i + 1)
+        i = colon + 1 + int(data[i + 1:colon])
+        key = data[colon + 1:i]
+      elif keyType == "i":
+        end = index("e", i + 1)
+        key = int(data[i + 1:end])
+        i = end + 1
+      else:
+        key, i = _decodeObject(data, i)
+      valueType = data[i]
+      if valueType == "s":
+        colon = index(":", i + 1)
+        i = colon + 1 + int(data[i + 1:colon])
+        oD[key] = data[colon + 1:i]
+      elif valueType == "i":
+        end = index("e", i + 1)
+        oD[key] = int(data[i + 1:end])
+        i = end + 1
+      elif valueType == "n":
+        oD[key] = None
+        i += 1
+      else:
+        oD[key], i = _decodeObject(data, i)
+    return (oD, i + 1)
+  if typeId == "l" or typeId == "t":
+    oL = []
+    append = oL.append
+    i += 1
+    while True:
+      valueType = data[i]
+      if valueType == "s":
+        colon = index(":", i + 1)
+        i = colon + 1 + int(data[i + 1:colon])
+        append(data[colon + 1:i])
+      elif valueType == "i":
+        end = index("e", i + 1)
+        append(int(data[i + 1:end]))
+        i = end + 1
+      elif valueType == "e":
+        break
+      else:
+        value, i = _decodeObject(data, i)
+        append(value)
+    return (oL if typeId == "l" else tuple(oL), i + 1)
+  if typeId == "s":
+    colon = index(":", i + 1)
+    end = colon + 1 + int(data[i + 1:colon])
+    return (data[colon + 1:end], end)
+  if typeId == "z":
+    match = _dateTimeRE.match(data, i)
+    if match:
+      return (datetime.datetime(*[int(value) for value in match.groups()]), match.end())
+  return g_dDecodeFunctions[typeId](data, i)
+
+
+def encodeStream(items, chunkSize=1048576, asDict=False):
+  """ Encode a list, or a dictionary, one item at a time
+
+      The concatenation of the yielded chunks is the encoding of the list of the items
+      (but the keys of a dictionary are not sorted), so it can be decoded by decode.
+
+      :param items: iterable of the items of the list, or of the (key, value) pairs of the dictionary
+      :param int chunkSize: minimum size of the chunks, except for the last one
+      :param bool asDict: if set, encode a dictionary
+      :returns: generator of strings
+  """
+  eList = ["d" if asDict else "l"]
+  # Encoded pieces, grouped to limit the number of strings kept
+  pieces = []
+  size = 0
+  for item in items:
+    if asDict:
+      _encodeObject(item[0], eList)
+      _encodeObject(item[1], eList)
+    else:
+      _encodeObject(item, eList)
+    if len(eList) >= 1024:
+      piece = "".join(eList)
+      eList = []
+      pieces.append(piece)
+      size += len(piece)
+      if size >= chunkSize:
+        yield "".join(pieces)
+        pieces = []
+        size = 0
+  pieces.extend(eList)
+  pieces.append("e")
+  yield "".join(pieces)
+
+
+class StreamDecoder(object):
+  """ Incremental decoder of a list or a dictionary, fed with chunks of its encoding
+      (typically produced by encodeStream), which returns the items as soon as they are complete.
+
+      Only the items of the top level list or dictionary are returned one by one:
+      an item is only returned once it has been fully received.
+  """
+
+  def __init__(self):
+    self.__buffer = ""
+    # "d", "l" or "t" once the type of the container is known
+    self.__containerType = None
+    self.__finished = False
+
+  def isFinished(self):
+    """ Whether the whole container has been decoded """
+    return self.__finished
+
+  def isDict(self):
+    """ Whether the container is a dictionary, in which case the items are (key, value) tuples """
+    return self.__containerType == "d"
+
+  def feed(self, data):
+    """ Add data to decode
+
+        :param str data: next chunk of the encoded container
+        :returns: list of the items completed by this chunk
+        :raises ValueError: if the data does not encode a list, tuple or dictionary,
+                            or if data is added after the end of the container
+    """
+    if self.__finished:
+      if data:
+        raise ValueError("Data received after the end of the encoded container")
+      return []
+    self.__buffer += data
+    if not self.__containerType:
+      if not self.__buffer:
+        return []
+      if self.__buffer[0] not in "dlt":
+        raise ValueError("Only lists, tuples and dictionaries can be decoded incrementally")
+      self.__containerType = self.__buffer[0]
+      self.__buffer = self.__buffer[1:]
+    data = self.__buffer
+    dataLen = len(data)
+    items = []
+    i = 0
+    while i < dataLen:
+      if data[i] == "e":
+        self.__finished = True
+        i += 1
+        break
+      try:
+        if data[i] == "s":
+          colon = data.index(":", i + 1)
+          end = colon + 1 + int(data[i + 1:colon])
+          item = data[colon + 1:end]
+        else:
+          item, end = _decodeObject(data, i)
+        if self.__containerType == "d":
+          value, end = _decodeObject(data, end)
+          item = (item, value)
+      except (IndexError, ValueError):
+        # Incomplete item
+        break
+      # The item is only complete for sure if it is followed by something,
+      # at least the end of the container: a string or a float may still be cut
+      if end >= dataLen:
+        break
+      items.append(item)
+      i = end
+    self.__buffer = data[i:]
+    if self.__finished and self.__buffer:
+      raise ValueError("Data received after the end of the encoded container")
+    return items
+
+
+def _encodeWithFunctions(uObject):
+  """ Encoding only going through g_dEncodeFunctions, as needed by DIRAC_DEBUG_DENCODE_CALLSTACK """
+  eList = []
+  g_dEncodeFunctions[type(uObject)](uObject, eList)
+  return "".join(eList)
+
+
+def _decodeWithFunctions(data):
+  """ Decoding only going through g_dDecodeFunctions, as needed by DIRAC_DEBUG_DENCODE_CALLSTACK """
+  if not data:
+    return data
+  return g_dDecodeFunctions[data[0]](data, 0)
+
+
 # Encode function
 def encode(uObject):
   """ Generic encoding function """
 
-  try:
-    eList = []
-    # print "ENCODE FUNCTION : %s" % g_dEncodeFunctions[ type( uObject ) ]
-    g_dEncodeFunctions[type(uObject)](uObject, eList)
-    return "".join(eList)
-  except Exception:
-    raise
+  if DIRAC_DEBUG_DENCODE_CALLSTACK:
+    return _encodeWithFunctions(uObject)
+  eList = []
+  _encodeObject(uObject, eList)
+  return "".join(eList)
 
 
 def decode(data):
   """ Generic decoding function """
+  if DIRAC_DEBUG_DENCODE_CALLSTACK:
+    return _decodeWithFunctions(data)
   if not data:
     return data
-  try:
-    # print "DECODE FUNCTION : %s" % g_dDecodeFunctions[ sStream [ iIndex ] ]
-    return g_dDecodeFunctions[data[0]](data, 0)
-  except Exception:
-    raise
+  return _decodeObject(data, 0)
 
 
 if __name__ == "__main__":
@@ -3,24 +3,45 @@
 """
 __RCSID__ = "$Id$"
 
+import heapq
 import datetime
+import itertools
 import threading
+from collections import OrderedDict
 # DIRAC
-from DIRAC.Core.Utilities.LockRing import LockRing
+from DIRAC.Core.Utilities.Time import monotonic
+
+
+class CacheStore(object):
+  """ Content of a DictCache:
+
+      * cache: dictionary cKey -> [expiration time, value], ordered from the least to the most recently
+        used key if the size of the DictCache is limited
+      * expirations: heap of (expiration time, sequence number, cKey). It may contain obsolete entries,
+        for keys which have been deleted or added again, which are skipped when found.
+  """
+
+  def __init__(self, maxSize=0):
+    """ c'tor
+
+        :param int maxSize: if set, the cache keeps track of the least recently used key
+    """
+    self.cache = OrderedDict() if maxSize else {}
+    self.expirations = []
 
 
 class ThreadLocalDict(threading.local):
-  """ This class is just useful to have a mutable object (in this case, a dict) as a thread local
+  """ This class is just useful to have a mutable object (in this case, a CacheStore) as a thread local
       Read the _threading_local docstring for more details.
 
       Its purpose is to have a different cache per thread
   """
 
-  def __init__(self):  # pylint: disable=super-init-not-called
+  def __init__(self, maxSize=0):  # pylint: disable=super-init-not-called
     """ c'tor """
     # Note: it is on purpose that the threading.local constructor is not called
-    # Dictionary, local to a thread, that will be used as such
-    self.cache = {}
+    # CacheStore, local to a thread, that will be used as such
+    self.store = CacheStore(maxSize)
 
 
 class MockLockRing(object):
@@ -40,59 +61,88 @@ class DictCache(object):
     The user can decide whether this cache should be shared among the threads or not, but it is always thread safe
     Note that when shared, the access to the cache is protected by a lock, but not necessarily the
     object you are retrieving from it.
+
+    The size of the cache can be limited, in which case the least recently used entries are evicted
+    when adding new ones. The expired entries are removed when accessed, or by purgeExpired,
+    which only looks at the expired entries.
   """
 
-  def __init__(self, deleteFunction=False, threadLocal=False):
+  def __init__(self, deleteFunction=False, threadLocal=False, maxSize=0):
     """
     Initialize the dict cache.
 
       :param deleteFunction: if not False, invoked when deleting a cached object
       :param threadLocal: if False, the cache will be shared among all the threads, otherwise,
                           each thread gets its own cache.
+      :param int maxSize: if set, maximum number of entries of the cache (of each thread, if threadLocal).
 
     """
 
     self.__threadLocal = threadLocal
+    self.__maxSize = maxSize
 
-    # Placeholder either for a LockRing if the cache is shared,
-    # or a mock class if not.
-    self.__lock = None
+    # A lock if the cache is shared, or a mock class if not. It is created here, as two
+    # threads creating it at the same time would each get their own lock
+    self.__lock = MockLockRing() if threadLocal else threading.RLock()
 
     # One of the following two objects is returned
-    # by the __cache property, depending on the threadLocal strategy
+    # by the __store property, depending on the threadLocal strategy
 
     # This is the Placeholder for a shared cache
-    self.__sharedCache = {}
-    # This is the Placeholder for a shared cache
-    self.__threadLocalCache = ThreadLocalDict()
+    self.__sharedStore = CacheStore(maxSize)
+    # This is the Placeholder for a thread local cache
+    self.__threadLocalStore = ThreadLocalDict(maxSize)
 
     # Function to clean the elements
     self.__deleteFunction = deleteFunction
 
+    # Sequence numbers of the expiration heap entries, so that the keys themselves are never compared
+    self.__sequence = itertools.count()
+    self.__stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
   @property
   def lock(self):
     """ Return the lock.
-        In practice, if the cache is shared among threads, it is a LockRing.
-        Otherwise, it is just a mock object.
+        In practice, if the cache is shared among threads, it is a recursive lock
+        belonging to this DictCache. Otherwise, it is just a mock object.
     """
-
-    if not self.__lock:
-      if not self.__threadLocal:
-        self.__lock = LockRing().getLock(self.__class__.__name__, recursive=True)
-      else:
-        self.__lock = MockLockRing()
-
     return self.__lock
 
   @property
-  def __cache(self):
-    """ Returns either a shared or a thread local cache.
-        In any case, the returned object is a dictionary
+  def __store(self):
+    """ Returns either a shared or a thread local CacheStore.
     """
     if self.__threadLocal:
-      return self.__threadLocalCache.cache
+      return self.__threadLocalStore.store
 
-    return self.__sharedCache
+    return self.__sharedStore
+
+  def __isValid(self, store, cKey, validSeconds):
+    """
+      Check if a key exists and is valid for the given number of seconds,
+      deleting it if it is not. Must be called with the lock acquired.
+
+      :returns: the [expiration time, value] list of the key, or None
+    """
+    entry = store.cache.get(cKey)
+    if entry is None:
+      return None
+    now = monotonic()
+    if entry[0] > now + validSeconds:
+      return entry
+    if entry[0] <= now:
+      self.__stats['expired'] += 1
+    self.__delete(store, cKey)
+    return None
+
+  def __delete(self, store, cKey):
+    """
+      Delete a key, which must exist, from the cache. Must be called with the lock acquired.
+      The entry of the expiration heap is left, and ignored when found.
+    """
+    entry = store.cache.pop(cKey)
+    if self.__deleteFunction:
+      self.__deleteFunction(entry[1])
 
   def exists(self, cKey, validSeconds=0):
     """
@@ -103,16 +153,7 @@ class DictCache(object):
     """
     self.lock.acquire()
     try:
-      # Is the key in the cache?
-      if cKey in self.__cache:
-        expTime = self.__cache[cKey]['expirationTime']
-        # If it's valid return True!
-        if expTime > datetime.datetime.now() + datetime.timedelta(seconds=validSeconds):
-          return True
-        else:
-          # Delete expired
-          self.delete(cKey)
-      return False
+      return self.__isValid(self.__store, cKey, validSeconds) is not None
     finally:
       self.lock.release()
 
@@ -124,11 +165,9 @@ class DictCache(object):
     """
     self.lock.acquire()
     try:
-      if cKey not in self.__cache:
-        return
-      if self.__deleteFunction:
-        self.__deleteFunction(self.__cache[cKey]['value'])
-      del self.__cache[cKey]
+      store = self.__store
+      if cKey in store.cache:
+        self.__delete(store, cKey)
     finally:
       self.lock.release()
 
@@ -144,9 +183,21 @@ class DictCache(object):
       return
     self.lock.acquire()
     try:
-      vD = {'expirationTime': datetime.datetime.now() + datetime.timedelta(seconds=validSeconds),
-            'value': value}
-      self.__cache[cKey] = vD
+      store = self.__store
+      expirationTime = monotonic() + validSeconds
+      # Remove the previous entry, so that the key becomes the most recently used one
+      store.cache.pop(cKey, None)
+      store.cache[cKey] = [expirationTime, value]
+      heapq.heappush(store.expirations, (expirationTime, next(self.__sequence), cKey))
+      if self.__maxSize and len(store.cache) > self.__maxSize:
+        self.__purgeExpired(store, expirationTime - validSeconds)
+        while len(store.cache) > self.__maxSize:
+          self.__stats['evictions'] += 1
+          self.__delete(store, next(iter(store.cache)))
+      # Get rid of the obsolete entries of the heap if there are too many of them
+      if len(store.expirations) > 2 * len(store.cache) + 100:
+        store.expirations = [(entry[0], next(self.__sequence), key) for key, entry in store.cache.iteritems()]
+        heapq.heapify(store.expirations)
     finally:
       self.lock.release()
 
@@ -159,16 +210,32 @@ class DictCache(object):
     """
     self.lock.acquire()
     try:
-      # Is the key in the cache?
-      if cKey in self.__cache:
-        expTime = self.__cache[cKey]['expirationTime']
-        # If it's valid return True!
-        if expTime > datetime.datetime.now() + datetime.timedelta(seconds=validSeconds):
-          return self.__cache[cKey]['value']
-        else:
-          # Delete expired
-          self.delete(cKey)
-      return None
+      store = self.__store
+      entry = self.__isValid(store, cKey, validSeconds)
+      if entry is None:
+        self.__stats['misses'] += 1
+        return None
+      self.__stats['hits'] += 1
+      if self.__maxSize:
+        # The key becomes the most recently used one
+        store.cache[cKey] = store.cache.pop(cKey)
+      return entry[1]
+    finally:
+      self.lock.release()
+
+  def getStats(self):
+    """
+    Get the statistics of the cache: number of hits and misses of get,
+    number of entries evicted to respect the maximum size, or removed because expired,
+    and current size (of the cache of the current thread if threadLocal)
+
+    :return: dictionary
+    """
+    self.lock.acquire()
+    try:
+      stats = dict(self.__stats)
+      stats['size'] = len(self.__store.cache)
+      return stats
     finally:
       self.lock.release()
 
@@ -179,11 +246,14 @@ class DictCache(object):
     self.lock.acquire()
     try:
       data = []
-      for cKey in self.__cache:
+      now = monotonic()
+      cache = self.__store.cache
+      for cKey in cache:
+        expirationTime, value = cache[cKey]
         data.append("%s:" % str(cKey))
-        data.append("\tExp: %s" % self.__cache[cKey]['expirationTime'])
-        if self.__cache[cKey]['value']:
-          data.append("\tVal: %s" % self.__cache[cKey]['value'])
+        data.append("\tExp: %s" % (datetime.datetime.now() + datetime.timedelta(seconds=expirationTime - now)))
+        if value:
+          data.append("\tVal: %s" % value)
       return "\n".join(data)
     finally:
       self.lock.release()
@@ -194,30 +264,33 @@ class DictCache(object):
     """
     self.lock.acquire()
     try:
-      keys = []
-      limitTime = datetime.datetime.now() + datetime.timedelta(seconds=validSeconds)
-      for cKey in self.__cache:
-        if self.__cache[cKey]['expirationTime'] > limitTime:
-          keys.append(cKey)
-      return keys
+      limitTime = monotonic() + validSeconds
+      cache = self.__store.cache
+      return [cKey for cKey in cache if cache[cKey][0] > limitTime]
     finally:
       self.lock.release()
 
+  def __purgeExpired(self, store, limitTime):
+    """
+    Purge the entries expiring before limitTime, using the expiration heap.
+    Must be called with the lock acquired.
+    """
+    expirations = store.expirations
+    while expirations and expirations[0][0] < limitTime:
+      expirationTime, _sequence, cKey = heapq.heappop(expirations)
+      entry = store.cache.get(cKey)
+      # Skip the obsolete entries of the heap
+      if entry is not None and entry[0] == expirationTime:
+        self.__stats['expired'] += 1
+        self.__delete(store, cKey)
+
   def purgeExpired(self, expiredInSeconds=0):
     """
     Purge all entries that are expired or will be expired in <expiredInSeconds>
     """
     self.lock.acquire()
     try:
-      keys = []
-      limitTime = datetime.datetime.now() + datetime.timedelta(seconds=expiredInSeconds)
-      for cKey in self.__cache:
-        if self.__cache[cKey]['expirationTime'] < limitTime:
-          keys.append(cKey)
-      for cKey in keys:
-        if self.__deleteFunction:
-          self.__deleteFunction(self.__cache[cKey]['value'])
-        del self.__cache[cKey]
+      self.__purgeExpired(self.__store, monotonic() + expiredInSeconds)
     finally:
       self.lock.release()
 
@@ -229,11 +302,10 @@ class DictCache(object):
     if useLock:
       self.lock.acquire()
     try:
-      keys = self.__cache.keys()
-      for cKey in keys:
-        if self.__deleteFunction:
-          self.__deleteFunction(self.__cache[cKey]['value'])
-        del self.__cache[cKey]
+      store = self.__store
+      for cKey in list(store.cache):
+        self.__delete(store, cKey)
+      store.expirations = []
     finally:
       if useLock:
         self.lock.release()
@@ -248,6 +320,6 @@ class DictCache(object):
     self.purgeAll(useLock=False)
     del self.__lock
     if self.__threadLocal:
-      del self.__threadLocalCache
+      del self.__threadLocalStore
     else:
-      del self.__sharedCache
+      del self.__sharedStore
@@ -135,6 +135,44 @@ def fromEpoch(epoch):
   return dt.fromtimestamp(epoch)
 
 
+def _getMonotonicClock():
+  """
+  Get a function returning a number of seconds that is not affected by the changes of the system clock,
+  to measure durations: time.monotonic with python 3, clock_gettime(CLOCK_MONOTONIC) on Linux with python 2,
+  and time.time as a last resort
+  """
+  if hasattr(nativetime, 'monotonic'):
+    return nativetime.monotonic
+  if not sys.platform.startswith('linux'):
+    return nativetime.time
+  import ctypes
+
+  class TimeSpec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+  clockMonotonic = 1
+  for libName in (None, 'librt.so.1'):
+    try:
+      clockGetTime = ctypes.CDLL(libName).clock_gettime
+    except (OSError, AttributeError):
+      continue
+    clockGetTime.argtypes = [ctypes.c_int, ctypes.POINTER(TimeSpec)]
+    if clockGetTime(clockMonotonic, TimeSpec()):
+      break
+
+    def monotonicClock():
+      """ Seconds of the monotonic clock """
+      timeSpec = TimeSpec()
+      clockGetTime(clockMonotonic, timeSpec)
+      return timeSpec.tv_sec + timeSpec.tv_nsec * 1e-9
+    return monotonicClock
+  return nativetime.time
+
+
+# Seconds elapsed since an arbitrary point, for measuring durations and timeouts
+monotonic = _getMonotonicClock()
+
+
 def to2K(dateTimeObject=None):
   """
   Get seconds, with microsecond precission, since 2K
@@ -0,0 +1,150 @@
+""" Unit tests for the DictCache
+"""
+
+import threading
+
+import pytest
+
+from DIRAC.Core.Utilities import DictCache as DictCacheModule
+from DIRAC.Core.Utilities.DictCache import DictCache
+
+__RCSID__ = "$Id$"
+
+# pylint: disable=redefined-outer-name
+
+
+class FakeClock(object):
+  """ Monotonic clock moved by hand """
+
+  def __init__(self):
+    self.now = 1000.
+
+  def __call__(self):
+    return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+  """ Replace the monotonic clock of the DictCache """
+  fakeClock = FakeClock()
+  monkeypatch.setattr(DictCacheModule, 'monotonic', fakeClock)
+  return fakeClock
+
+
+def test_expiration(clock):
+  """ Entries are only returned while they are valid for the requested time """
+  cache = DictCache()
+  cache.add('key', 10, 'value')
+  assert cache.exists('key')
+  assert cache.get('key', validSeconds=5) == 'value'
+  clock.now += 6
+  assert cache.getKeys() == ['key']
+  assert cache.getKeys(validSeconds=5) == []
+  # Not valid for 5 more seconds: removed
+  assert cache.get('key', validSeconds=5) is None
+  assert not cache.exists('key')
+  # Not added
+  cache.add('key', 0, 'value')
+  assert not cache.exists('key')
+
+
+def test_purgeExpired(clock):
+  """ Only the expired entries are purged, and the delete function is called on them """
+  deleted = []
+  cache = DictCache(deleteFunction=deleted.append)
+  for i in range(10):
+    cache.add(i, 10 + i, 'value%d' % i)
+  # Re-adding a key replaces its expiration time
+  cache.add(0, 100, 'new0')
+  clock.now += 15.5
+  cache.purgeExpired()
+  assert sorted(deleted) == ['value%d' % i for i in range(1, 6)]
+  assert sorted(cache.getKeys()) == [0, 6, 7, 8, 9]
+  cache.purgeExpired(expiredInSeconds=10)
+  assert sorted(cache.getKeys()) == [0]
+  assert cache.getStats()['expired'] == 9
+  cache.purgeAll()
+  assert cache.getKeys() == []
+  assert 'new0' in deleted
+
+
+def test_maxSize(clock):
+  """ The least recently used entries are evicted beyond the maximum size """
+  deleted = []
+  cache = DictCache(deleteFunction=deleted.append, maxSize=3)
+  for key in 'abc':
+    cache.add(key, 10, key.upper())
+  assert cache.get('a') == 'A'
+  cache.add('d', 10, 'D')
+  assert deleted == ['B']
+  assert sorted(cache.getKeys()) == ['a', 'c', 'd']
+
+  # Expired entries are dropped before evicting valid ones
+  cache.add('e', 1, 'E')
+  clock.now += 2
+  cache.add('f', 10, 'F')
+  assert deleted == ['B', 'C', 'E']
+  assert sorted(cache.getKeys()) == ['a', 'd', 'f']
+
+  stats = cache.getStats()
+  assert stats['evictions'] == 2
+  assert stats['expired'] == 1
+  assert stats['size'] == 3
+
+
+def test_heapCompaction(clock):
+  """ Adding the same keys again and again does not make the expiration heap grow forever """
+  cache = DictCache()
+  for i in range(10000):
+    cache.add(i % 10, 10, i)
+  assert len(cache._DictCache__store.expirations) < 1000  # pylint: disable=protected-access
+  clock.now += 20
+  cache.purgeExpired()
+  assert cache.getStats()['size'] == 0
+
+
+def test_stats(clock):
+  """ Hits and misses of get are counted """
+  cache = DictCache()
+  cache.add('key', 10, 'value')
+  cache.get('key')
+  cache.get('key')
+  cache.get('other')
+  stats = cache.getStats()
+  assert (stats['hits'], stats['misses'], stats['size']) == (2, 1, 1)
+
+
+def test_locks():
+  """ Each shared cache has its own lock, thread local caches do not need one """
+  first = DictCache()
+  second = DictCache()
+  assert first.lock is not second.lock
+  first.lock.acquire()
+  try:
+    # Does not wait for the lock of the first cache
+    thread = threading.Thread(target=second.add, args=('key', 10, 'value'))
+    thread.start()
+    thread.join(5)
+    assert second.exists('key')
+  finally:
+    first.lock.release()
+  # The lock is created with the cache, not by the first thread using it
+  assert DictCache()._DictCache__lock is not None  # pylint: disable=protected-access,no-member
+
+
+def test_threadLocal():
+  """ Each thread has its own thread local cache """
+  cache = DictCache(threadLocal=True, maxSize=2)
+  cache.add('key', 10, 'main')
+  seen = []
+
+  def otherThread():
+    seen.append(cache.get('key'))
+    cache.add('key', 10, 'other')
+    seen.append(cache.get('key'))
+
+  thread = threading.Thread(target=otherThread)
+  thread.start()
+  thread.join()
+  assert seen == [None, 'other']
+  assert cache.get('key') == 'main'
@@ -14,11 +14,12 @@ import sys
 
 
 from DIRAC.Core.Utilities.DEncode import encode as disetEncode, decode as disetDecode, g_dEncodeFunctions
+from DIRAC.Core.Utilities.DEncode import _encodeWithFunctions, _decodeWithFunctions, encodeStream, StreamDecoder
 from DIRAC.Core.Utilities.JEncode import encode as jsonEncode, decode as jsonDecode, JSerializable
 
 from hypothesis import given
 from hypothesis.strategies import builds, integers, lists, recursive, floats, text,\
-    booleans, none, dictionaries, tuples, datetimes
+    booleans, none, dictionaries, tuples, datetimes, dates, times, binary
 
 from pytest import mark, approx, raises
 parametrize = mark.parametrize
@@ -278,3 +279,63 @@ def test_nestedSerializable(data):
   subObj = Serializable(instAttr=data)
   objData = Serializable(instAttr=subObj)
   agnosticTestFunction(jsonTuple, objData)
+
+
+# All the types supported by DEncode, including the ones only encoded by g_dEncodeFunctions
+allDisetStrategies = recursive(
+    none() | booleans() | text() | binary().map(str) | integers() | floats(allow_nan=False) |
+    datetimes(timezones=none()) | dates() | times(timezones=none()),
+    lambda x: lists(x) | dictionaries(integers() | binary().map(str), x) | lists(x).map(tuple),
+    max_leaves=20)
+
+
+@given(data=allDisetStrategies)
+def test_singlePassCompatibility(data):
+  """ encode and decode produce exactly the same result as the functions of g_dEncodeFunctions
+      and g_dDecodeFunctions, used by DIRAC_DEBUG_DENCODE_CALLSTACK and by older clients
+  """
+  encodedData = disetEncode(data)
+  assert encodedData == _encodeWithFunctions(data)
+  assert disetDecode(encodedData) == _decodeWithFunctions(encodedData)
+
+
+@given(data=lists(allDisetStrategies, max_size=5), chunkSize=integers(min_value=1, max_value=100),
+       feedSize=integers(min_value=1, max_value=100))
+def test_stream(data, chunkSize, feedSize):
+  """ Lists encoded with encodeStream can be decoded by decode, or incrementally by StreamDecoder,
+      whatever the size of the chunks the decoder is fed with
+  """
+  encodedData = "".join(encodeStream(iter(data), chunkSize=chunkSize))
+  assert encodedData == disetEncode(data)
+
+  decoder = StreamDecoder()
+  decodedData = []
+  for i in range(0, len(encodedData), feedSize):
+    assert not decoder.isFinished()
+    decodedData.extend(decoder.feed(encodedData[i:i + feedSize]))
+  assert decoder.isFinished()
+  assert decodedData == disetDecode(encodedData)[0]
+
+
+def test_streamDict():
+  """ Dictionaries are decoded incrementally as (key, value) pairs """
+  data = dict(('/lhcb/file%d' % i, {'Size': i, 'SE': ['CERN', 'RAL']}) for i in range(1000))
+  encodedData = "".join(encodeStream(data.iteritems(), chunkSize=100, asDict=True))
+  assert disetDecode(encodedData)[0] == data
+
+  decoder = StreamDecoder()
+  items = decoder.feed(encodedData[:500])
+  assert decoder.isDict()
+  assert 0 < len(items) < 1000
+  items += decoder.feed(encodedData[500:])
+  assert dict(items) == data
+  assert decoder.isFinished()
+
+
+def test_streamInvalid():
+  """ Only containers can be decoded incrementally, and nothing can follow them """
+  with raises(ValueError):
+    StreamDecoder().feed(disetEncode("string"))
+  decoder = StreamDecoder()
+  with raises(ValueError):
+    decoder.feed(disetEncode([1]) + "i1e")
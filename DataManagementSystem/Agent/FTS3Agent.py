@@ -30,6 +30,7 @@ from DIRAC.AccountingSystem.Client.Types.DataOperation import DataOperation
 from DIRAC.Core.Base.AgentModule import AgentModule
 from DIRAC.Core.Utilities.DErrno import cmpError
 from DIRAC.Core.Utilities.DictCache import DictCache
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.Core.Utilities.Time import fromString
 from DIRAC.ConfigurationSystem.Client.Helpers.Resources import getFTS3ServerDict
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations as opHelper
@@ -37,7 +38,7 @@ from DIRAC.ConfigurationSystem.Client.Helpers.Registry import getDNForUsername
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.FrameworkSystem.Client.ProxyManagerClient import gProxyManager
 from DIRAC.DataManagementSystem.private import FTS3Utilities
-from DIRAC.DataManagementSystem.DB.FTS3DB import FTS3DB
+from DIRAC.DataManagementSystem.DB.FTS3DB import FTS3DB, LINK_STATS_HALF_LIFE
 from DIRAC.DataManagementSystem.Client.FTS3Job import FTS3Job
 from DIRAC.DataManagementSystem.Utilities.DMSHelpers import DMSHelpers
 from DIRAC.RequestManagementSystem.Client.ReqClient import ReqClient
@@ -73,8 +74,12 @@ class FTS3Agent(AgentModule):
       return res
 
     srvDict = res['Value']
-    serverPolicyType = opHelper().getValue('DataManagement/FTSPlacement/FTS3/ServerPolicy', 'Random')
-    self._serverPolicy = FTS3Utilities.FTS3ServerPolicy(srvDict, serverPolicy=serverPolicyType)
+    self.serverPolicyType = opHelper().getValue('DataManagement/FTSPlacement/FTS3/ServerPolicy', 'Random')
+    self._serverPolicy = FTS3Utilities.FTS3ServerPolicy(srvDict, serverPolicy=self.serverPolicyType)
+
+    # Random: any replica, Throughput: according to the performance of the links
+    self.sourcePolicyType = opHelper().getValue('DataManagement/FTSPlacement/FTS3/SourcePolicy', 'Random')
+    self._linkPerformance = None
 
     # List of third party protocols for transfers
     self.thirdPartyProtocols = DMSHelpers().getThirdPartyProtocols()
@@ -85,12 +90,16 @@ class FTS3Agent(AgentModule):
     self.operationBulkSize = self.am_getOption("OperationBulkSize", 20)
     # Number of Jobs we treat in one loop
     self.jobBulkSize = self.am_getOption("JobBulkSize", 20)
+    # Monitor the jobs of a server and user with one query, and update the DB with a few statements
+    self.bulkMonitoring = self.am_getOption("BulkMonitoring", False)
+    self.maxJobsPerMonitoringQuery = self.am_getOption("MaxJobsPerMonitoringQuery", 100)
     self.maxFilesPerJob = self.am_getOption("MaxFilesPerJob", 100)
     self.maxAttemptsPerFile = self.am_getOption("MaxAttemptsPerFile", 256)
     self.kickDelay = self.am_getOption("KickAssignedHours", 1)
     self.maxKick = self.am_getOption("KickLimitPerCycle", 100)
     self.deleteDelay = self.am_getOption("DeleteGraceDays", 180)
     self.maxDelete = self.am_getOption("DeleteLimitPerCycle", 100)
+    self.linkStatsHalfLife = self.am_getOption("LinkStatsHalfLifeHours", LINK_STATS_HALF_LIFE / 3600) * 3600
 
     return S_OK()
 
@@ -228,6 +237,7 @@ class FTS3Agent(AgentModule):
 
       if ftsJob.status in ftsJob.FINAL_STATES:
         self.__sendAccounting(ftsJob)
+        self.__updateLinkStats(ftsJob, log)
 
       return ftsJob, res
 
@@ -248,6 +258,96 @@ class FTS3Agent(AgentModule):
     else:
       log.debug("Successfully updated job status")
 
+  def _monitorJobsBulk(self, ftsJobs):
+    """
+        Same as _monitorJob for several jobs of the same server and user:
+        * query the FTS server for all the jobs at once
+        * update the FTSFiles and FTSJobs status of all the jobs together
+    """
+    # General try catch to avoid that the tread dies
+    try:
+      threadID = current_process().name
+      log = gLogger.getSubLogger("_monitorJobsBulk/%s" % ftsJobs[0].ftsServer, child=True)
+
+      res = self.getFTS3Context(
+          ftsJobs[0].username, ftsJobs[0].userGroup, ftsJobs[0].ftsServer, threadID=threadID)
+
+      if not res['OK']:
+        log.error("Error getting context", res)
+        return ftsJobs, res
+
+      context = res['Value']
+
+      res = FTS3Job.monitorJobs(ftsJobs, context)
+
+      if not res['OK']:
+        log.error("Error monitoring jobs", res)
+        return ftsJobs, res
+
+      jobResults = res['Value']
+
+      # { ftsGUID : { fileID : { Status, Error } } }
+      filesStatusPerJob = {}
+      upDict = {}
+      monitoredJobs = []
+      for ftsJob in ftsJobs:
+        res = jobResults.get(ftsJob.ftsGUID, S_ERROR("FTSGUID not set, FTS job not submitted?"))
+
+        if not res['OK']:
+          log.error("Error monitoring job", "%s: %s" % (ftsJob.jobID, res))
+
+          # If the job was not found on the server, update the DB
+          if cmpError(res, errno.ESRCH):
+            res = self.fts3db.cancelNonExistingJob(ftsJob.operationID, ftsJob.ftsGUID)
+            if not res['OK']:
+              log.error("Error canceling job", "%s: %s" % (ftsJob.jobID, res))
+          continue
+
+        filesStatusPerJob[ftsJob.ftsGUID] = res['Value']
+        upDict[ftsJob.jobID] = {
+            'status': ftsJob.status,
+            'error': ftsJob.error,
+            'completeness': ftsJob.completeness,
+        }
+        monitoredJobs.append(ftsJob)
+
+      if not monitoredJobs:
+        return ftsJobs, S_OK()
+
+      # Specify the jobs ftsGUID to make sure we do not overwrite
+      # status of files already taken by newer jobs
+      res = self.fts3db.updateFileStatusBulk(filesStatusPerJob)
+
+      if not res['OK']:
+        log.error("Error updating files fts status", res)
+        return ftsJobs, res
+
+      res = self.fts3db.updateJobStatusBulk(upDict)
+
+      for ftsJob in monitoredJobs:
+        if ftsJob.status in ftsJob.FINAL_STATES:
+          self.__sendAccounting(ftsJob)
+          self.__updateLinkStats(ftsJob, log)
+
+      return ftsJobs, res
+
+    except Exception as e:
+      return ftsJobs, S_ERROR(0, "Exception %s" % repr(e))
+
+  @staticmethod
+  def _monitorJobsBulkCallback(returnedValue):
+    """ Callback when jobs have been monitored together
+        :param returnedValue: value returned by the _monitorJobsBulk method
+                              (ftsJobs, standard dirac return struct)
+    """
+
+    ftsJobs, res = returnedValue
+    log = gLogger.getSubLogger("_monitorJobsBulkCallback/%s" % ftsJobs[0].ftsServer, child=True)
+    if not res['OK']:
+      log.error("Error updating jobs status", res)
+    else:
+      log.debug("Successfully updated jobs status", "%s jobs" % len(ftsJobs))
+
   def monitorJobsLoop(self):
     """
         * fetch the active FTSJobs from the DB
@@ -271,13 +371,30 @@ class FTS3Agent(AgentModule):
     # We store here the AsyncResult object on which we are going to wait
     applyAsyncResults = []
 
-    # Starting the monitoring threads
-    for ftsJob in activeJobs:
-      log.debug("Queuing executing of ftsJob %s" % ftsJob.jobID)
-      # queue the execution of self._monitorJob( ftsJob ) in the thread pool
-      # The returned value is passed to _monitorJobCallback
-      applyAsyncResults.append(self.jobsThreadPool.apply_async(
-          self._monitorJob, (ftsJob, ), callback=self._monitorJobCallback))
+    if self.bulkMonitoring:
+      # The jobs are monitored together when they are on the same server
+      # and can be seen with the same credentials
+      jobsPerContext = {}
+      for ftsJob in activeJobs:
+        jobsPerContext.setdefault((ftsJob.ftsServer, ftsJob.username, ftsJob.userGroup), []).append(ftsJob)
+
+      # Starting the monitoring threads
+      for contextJobs in jobsPerContext.itervalues():
+        for ftsJobs in breakListIntoChunks(contextJobs, self.maxJobsPerMonitoringQuery):
+          log.debug("Queuing executing of %s ftsJobs on %s" % (len(ftsJobs), ftsJobs[0].ftsServer))
+          # queue the execution of self._monitorJobsBulk( ftsJobs ) in the thread pool
+          # The returned value is passed to _monitorJobsBulkCallback
+          applyAsyncResults.append(self.jobsThreadPool.apply_async(
+              self._monitorJobsBulk, (ftsJobs, ), callback=self._monitorJobsBulkCallback))
+
+    else:
+      # Starting the monitoring threads
+      for ftsJob in activeJobs:
+        log.debug("Queuing executing of ftsJob %s" % ftsJob.jobID)
+        # queue the execution of self._monitorJob( ftsJob ) in the thread pool
+        # The returned value is passed to _monitorJobCallback
+        applyAsyncResults.append(self.jobsThreadPool.apply_async(
+            self._monitorJob, (ftsJob, ), callback=self._monitorJobCallback))
 
     log.debug("All execution queued")
 
@@ -362,7 +479,8 @@ class FTS3Agent(AgentModule):
 
         if continueOperationProcessing:
           res = operation.prepareNewJobs(
-              maxFilesPerJob=self.maxFilesPerJob, maxAttemptsPerFile=self.maxAttemptsPerFile)
+              maxFilesPerJob=self.maxFilesPerJob, maxAttemptsPerFile=self.maxAttemptsPerFile,
+              linkPerformance=self._linkPerformance)
 
           if not res['OK']:
             log.error("Cannot prepare new Jobs", "FTS3Operation %s : %s" %
@@ -440,6 +558,8 @@ class FTS3Agent(AgentModule):
 
     log.info("Treating %s incomplete operations" % len(incompleteOperations))
 
+    self.__loadPlacementInfo(log)
+
     applyAsyncResults = []
 
     for operation in incompleteOperations:
@@ -460,6 +580,52 @@ class FTS3Agent(AgentModule):
 
     return S_OK()
 
+  def __loadPlacementInfo(self, log):
+    """ Load from the DB the information needed by the source and server policies:
+        the performance of the links and the number of active jobs per server.
+        In case of error, the sources are chosen at random, and the previous loads are kept.
+    """
+
+    self._linkPerformance = None
+    if self.sourcePolicyType == 'Throughput':
+      res = self.fts3db.getLinkStats(halfLife=self.linkStatsHalfLife)
+      if not res['OK']:
+        log.error("Could not get the link statistics, choosing random sources", res)
+      else:
+        self._linkPerformance = FTS3Utilities.LinkPerformance(res['Value'])
+        log.debug("Statistics of %s links loaded" % len(res['Value']))
+    elif self.sourcePolicyType != 'Random':
+      log.error("Unknown source policy, choosing random sources", self.sourcePolicyType)
+
+    if self.serverPolicyType == 'Load':
+      res = self.fts3db.getActiveJobsPerServer()
+      if not res['OK']:
+        log.error("Could not get the number of active jobs per server", res)
+      else:
+        self._serverPolicy.setServerLoads(res['Value'])
+
+  def __updateLinkStats(self, ftsJob, log):
+    """ Add the results of a final transfer job to the performance of its link
+
+        :param ftsJob: the FTS3Job in a final state
+        :param log: logger to use
+    """
+
+    accountingDict = ftsJob.accountingDict
+    if ftsJob.type != 'Transfer' or not accountingDict:
+      return
+    if not accountingDict.get('Source') or not accountingDict.get('Destination'):
+      return
+
+    res = self.fts3db.updateLinkStats(accountingDict['Source'], accountingDict['Destination'],
+                                      accountingDict['TransferOK'],
+                                      accountingDict['TransferTotal'] - accountingDict['TransferOK'],
+                                      accountingDict['TransferSize'],
+                                      accountingDict['TransferTime'],
+                                      halfLife=self.linkStatsHalfLife)
+    if not res['OK']:
+      log.error("Could not update the link statistics", res)
+
   def kickOperations(self):
     """ kick stuck operations """
 
@@ -5,6 +5,7 @@ __RCSID__ = "$Id $"
 
 import datetime
 import errno
+import json
 
 # Requires at least version 3.3.3
 import fts3.rest.client.easy as fts3
@@ -24,6 +25,10 @@ from DIRAC.DataManagementSystem.Client.FTS3File import FTS3File
 # 3 days in seconds
 BRING_ONLINE_TIMEOUT = 259200
 
+# Attributes of the files needed when monitoring several jobs at once:
+# status, error and what is needed for the accounting
+BULK_MONITORING_FILE_FIELDS = ['file_state', 'file_metadata', 'reason', 'filesize', 'tx_duration']
+
 
 class FTS3Job(JSerializable):
   """ Abstract class to represent a job to be executed by FTS. It belongs
@@ -130,6 +135,72 @@ class FTS3Job(JSerializable):
     except FTS3ClientException as e:
       return S_ERROR("Error getting the job status %s" % e)
 
+    return self._processJobStatus(jobStatusDict)
+
+  @staticmethod
+  def monitorJobs(ftsJobs, context):
+    """ Queries the fts server to monitor several jobs at once, with a single request.
+        The internal state of each job is updated as with the monitor method.
+
+        The jobs must all be on the server of the context, and visible with its credentials.
+
+        :param ftsJobs: list of FTS3Job, with their ftsGUID set
+        :param context: fts3 context
+
+        :returns: S_ERROR if the server could not be queried,
+                  S_OK({ftsGUID: the return of the monitor method for the job}) otherwise
+    """
+
+    jobsByGUID = dict((ftsJob.ftsGUID, ftsJob) for ftsJob in ftsJobs if ftsJob.ftsGUID)
+    if not jobsByGUID:
+      return S_OK({})
+
+    try:
+      jobStatusList = json.loads(context.get("/jobs/%s?files=%s" % (','.join(jobsByGUID),
+                                                                    ','.join(BULK_MONITORING_FILE_FIELDS))))
+    # With a single job, the server answers that it is not found,
+    # otherwise the jobs not found are in the list with a 404 status
+    except NotFound:
+      if len(jobsByGUID) > 1:
+        return S_ERROR("Error getting the jobs status: not found")
+      jobStatusList = []
+    except FTS3ClientException as e:
+      return S_ERROR("Error getting the jobs status %s" % e)
+
+    # A single job is not returned in a list
+    if isinstance(jobStatusList, dict):
+      jobStatusList = [jobStatusList]
+
+    jobResults = {}
+    for jobStatusDict in jobStatusList:
+      ftsGUID = jobStatusDict.get('job_id')
+      ftsJob = jobsByGUID.get(ftsGUID)
+      if ftsJob is None:
+        continue
+      httpStatus = str(jobStatusDict.get('http_status', '200'))
+      if httpStatus.startswith('404'):
+        continue
+      if not httpStatus.startswith('200'):
+        jobResults[ftsGUID] = S_ERROR("Error getting the job status %s" % httpStatus)
+        continue
+      jobResults[ftsGUID] = ftsJob._processJobStatus(jobStatusDict)
+
+    # The jobs not returned by the server do not exist there
+    for ftsGUID, ftsJob in jobsByGUID.iteritems():
+      if ftsGUID not in jobResults:
+        ftsJob.status = 'Failed'
+        jobResults[ftsGUID] = S_ERROR(errno.ESRCH, "FTSGUID %s not found on %s" % (ftsGUID, ftsJob.ftsServer))
+
+    return S_OK(jobResults)
+
+  def _processJobStatus(self, jobStatusDict):
+    """ Update the internal state of the object with the status returned by the fts server
+
+        :param jobStatusDict: status of the job and of its files, as returned by the fts server
+
+        :returns: see the monitor method
+    """
+
     now = datetime.datetime.utcnow().replace(microsecond=0)
     self.lastMonitor = now
 
@@ -244,11 +244,12 @@ class FTS3Operation(JSerializable):
 
     return res
 
-  def prepareNewJobs(self, maxFilesPerJob=100, maxAttemptsPerFile=10):
+  def prepareNewJobs(self, maxFilesPerJob=100, maxAttemptsPerFile=10, linkPerformance=None):
     """ Prepare the new jobs that have to be submitted
 
         :param maxFilesPerJob: maximum number of files assigned to a job
         :param maxAttemptsPerFile: maximum number of retry after an fts failure
+        :param linkPerformance: LinkPerformance used to choose the sources, random choice if None
 
         :return: list of jobs
     """
@@ -370,7 +371,7 @@ class FTS3TransferOperation(FTS3Operation):
   """ Class to be used for a Replication operation
   """
 
-  def prepareNewJobs(self, maxFilesPerJob=100, maxAttemptsPerFile=10):
+  def prepareNewJobs(self, maxFilesPerJob=100, maxAttemptsPerFile=10, linkPerformance=None):
 
     log = self._log.getSubLogger("_prepareNewJobs", child=True)
 
@@ -401,7 +402,7 @@ class FTS3TransferOperation(FTS3Operation):
 
       sourceSEs = self.sourceSEs.split(',') if self.sourceSEs is not None else []
       # { sourceSE : [FTSFiles] }
-      res = FTS3Utilities.selectUniqueRandomSource(ftsFiles, allowedSources=sourceSEs)
+      res = FTS3Utilities.selectUniqueSource(ftsFiles, allowedSources=sourceSEs, linkPerformance=linkPerformance)
 
       if not res['OK']:
         return res
@@ -518,7 +519,7 @@ class FTS3StagingOperation(FTS3Operation):
   """ Class to be used for a Staging operation
   """
 
-  def prepareNewJobs(self, maxFilesPerJob=100, maxAttemptsPerFile=10):
+  def prepareNewJobs(self, maxFilesPerJob=100, maxAttemptsPerFile=10, linkPerformance=None):
 
     log = gLogger.getSubLogger("_prepareNewJobs", child=True)
 
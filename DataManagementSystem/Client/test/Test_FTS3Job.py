@@ -0,0 +1,99 @@
+""" Test the monitoring of the FTS3Jobs """
+
+__RCSID__ = "$Id$"
+
+import errno
+import json
+import unittest
+
+from mock import MagicMock
+
+from DIRAC.Core.Utilities.DErrno import cmpError
+from DIRAC.DataManagementSystem.Client.FTS3Job import FTS3Job
+
+
+def jobStatus(ftsGUID, jobState, fileStates):
+  """ Status of a job as returned by the fts server """
+  return {'job_id': ftsGUID,
+          'job_state': jobState,
+          'reason': '',
+          'job_metadata': {'sourceSE': 'Src', 'targetSE': 'Dst'},
+          'files': [{'file_state': fileState,
+                     'file_metadata': fileID,
+                     'reason': 'Failed' if fileState == 'FAILED' else '',
+                     'filesize': 10,
+                     'tx_duration': 2}
+                    for fileID, fileState in fileStates.iteritems()]}
+
+
+class TestFTS3JobMonitoring(unittest.TestCase):
+  """ Testing the monitoring of several jobs with one query """
+
+  def setUp(self):
+    self.jobs = []
+    for jobID in range(1, 4):
+      ftsJob = FTS3Job()
+      ftsJob.jobID = jobID
+      ftsJob.ftsGUID = 'guid%d' % jobID
+      ftsJob.ftsServer = 'https://fts3:8446'
+      ftsJob.type = 'Transfer'
+      self.jobs.append(ftsJob)
+    self.context = MagicMock()
+
+  def test_monitorJobs(self):
+    """ The status of all the jobs is obtained with one query """
+
+    self.context.get.return_value = json.dumps([jobStatus('guid1', 'FINISHED', {1: 'FINISHED', 2: 'FINISHED'}),
+                                                jobStatus('guid2', 'ACTIVE', {3: 'FINISHED', 4: 'ACTIVE'}),
+                                                {'job_id': 'guid3', 'http_status': '404 Not Found'}])
+
+    res = FTS3Job.monitorJobs(self.jobs, self.context)
+    self.assertTrue(res['OK'], res)
+    jobResults = res['Value']
+
+    self.context.get.assert_called_once()
+    self.assertTrue(self.context.get.call_args[0][0].startswith('/jobs/'))
+    self.assertEqual(set(self.context.get.call_args[0][0].split('?')[0][6:].split(',')),
+                     set(['guid1', 'guid2', 'guid3']))
+
+    self.assertTrue(jobResults['guid1']['OK'])
+    self.assertEqual(self.jobs[0].status, 'Finished')
+    self.assertEqual(self.jobs[0].completeness, 100)
+    self.assertEqual(jobResults['guid1']['Value'][1], {'status': 'Finished', 'error': '', 'ftsGUID': None})
+    self.assertEqual(self.jobs[0].accountingDict['TransferOK'], 2)
+    self.assertEqual(self.jobs[0].accountingDict['TransferTime'], 4)
+
+    self.assertTrue(jobResults['guid2']['OK'])
+    self.assertEqual(self.jobs[1].status, 'Active')
+    self.assertEqual(self.jobs[1].completeness, 50)
+    self.assertEqual(jobResults['guid2']['Value'][4], {'status': 'Active', 'error': ''})
+    self.assertTrue(self.jobs[1].accountingDict is None)
+
+    # The job not found on the server
+    self.assertTrue(cmpError(jobResults['guid3'], errno.ESRCH))
+    self.assertEqual(self.jobs[2].status, 'Failed')
+
+  def test_monitorSingleJob(self):
+    """ A single job is not returned in a list """
+
+    self.context.get.return_value = json.dumps(jobStatus('guid1', 'ACTIVE', {1: 'SUBMITTED'}))
+    res = FTS3Job.monitorJobs(self.jobs[:1], self.context)
+    self.assertTrue(res['OK'], res)
+    self.assertEqual(res['Value']['guid1']['Value'], {1: {'status': 'Submitted', 'error': ''}})
+
+  def test_monitorJobsInconsistent(self):
+    """ A job in a final state with a file which is not is an error for this job only """
+
+    self.context.get.return_value = json.dumps([jobStatus('guid1', 'FINISHED', {1: 'ACTIVE'}),
+                                                jobStatus('guid2', 'FAILED', {2: 'FAILED'}),
+                                                jobStatus('guid3', 'ACTIVE', {3: 'ACTIVE'})])
+    res = FTS3Job.monitorJobs(self.jobs, self.context)
+    self.assertTrue(res['OK'], res)
+    self.assertTrue(cmpError(res['Value']['guid1'], errno.EDEADLK))
+    self.assertTrue(res['Value']['guid2']['OK'])
+    self.assertTrue(res['Value']['guid3']['OK'])
+
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestFTS3JobMonitoring)
+  unittest.TextTestRunner(verbosity=2).run(suite)
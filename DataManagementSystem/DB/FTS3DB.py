@@ -11,7 +11,7 @@ import errno
 
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.sql.expression import and_
+from sqlalchemy.sql.expression import and_, case, tuple_
 from sqlalchemy.orm import relationship, sessionmaker, mapper
 from sqlalchemy.sql import update, delete
 from sqlalchemy import create_engine, Table, Column, MetaData, ForeignKey, \
@@ -23,6 +23,7 @@ from DIRAC.DataManagementSystem.Client.FTS3Operation import FTS3Operation, FTS3T
 from DIRAC.DataManagementSystem.Client.FTS3File import FTS3File
 from DIRAC.DataManagementSystem.Client.FTS3Job import FTS3Job
 from DIRAC.ConfigurationSystem.Client.Utilities import getDBParameters
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 
 __RCSID__ = "$Id$"
 
@@ -137,6 +138,23 @@ mapper(FTS3StagingOperation, fts3OperationTable,
        )
 
 
+# Performance of the transfers between two SEs, aggregated from the final FTS3Jobs.
+# The values are decayed with time, so that they reflect the recent state of the link
+fts3LinkStatsTable = Table('LinkStats', metadata,
+                           Column('sourceSE', String(255), primary_key=True),
+                           Column('targetSE', String(255), primary_key=True),
+                           Column('transferredFiles', Float, server_default='0'),
+                           Column('failedFiles', Float, server_default='0'),
+                           Column('transferredBytes', Float, server_default='0'),
+                           Column('transferTime', Float, server_default='0'),
+                           Column('lastUpdate', DateTime),
+                           mysql_engine='InnoDB',
+                           )
+
+# Time in seconds after which half of the weight of the past transfers of a link is lost
+LINK_STATS_HALF_LIFE = 6 * 3600
+
+
 ########################################################################
 class FTS3DB(object):
   """
@@ -444,6 +462,105 @@ class FTS3DB(object):
     finally:
       session.close()
 
+  def updateFileStatusBulk(self, fileStatusPerJob, chunkSize=1000):
+    """ Update the file ftsStatus and error of several jobs, like updateFileStatus does for one job.
+        The files getting the same values are updated together, in a single transaction.
+
+       :param fileStatusPerJob: { ftsGUID : { fileID : { status , error, ftsGUID } } }
+                                A file is only updated if its ftsGUID still matches the one of the job
+       :param chunkSize: maximum number of files updated by a statement
+
+    """
+
+    # Group the files by new values: { (status, error, ftsGUID) : [ (fileID, current ftsGUID) ] }
+    # error and ftsGUID are only updated if they are specified
+    notSpecified = object()
+    filesByValues = {}
+    for ftsGUID, fileStatusDict in fileStatusPerJob.iteritems():
+      for fileID, valueDict in fileStatusDict.iteritems():
+        # Replace empty strings with None
+        newError = (valueDict['error'] or None) if 'error' in valueDict else notSpecified
+        newFtsGUID = (valueDict['ftsGUID'] or None) if 'ftsGUID' in valueDict else notSpecified
+        filesByValues.setdefault((valueDict['status'], newError, newFtsGUID), []).append((fileID, ftsGUID))
+
+    session = self.dbSession()
+    try:
+
+      for (newStatus, newError, newFtsGUID), files in filesByValues.iteritems():
+        updateDict = {FTS3File.status: newStatus}
+        if newError is not notSpecified:
+          updateDict[FTS3File.error] = newError
+        if newFtsGUID is not notSpecified:
+          updateDict[FTS3File.ftsGUID] = newFtsGUID
+
+        for filesChunk in breakListIntoChunks(sorted(files), chunkSize):
+          session.execute(update(FTS3File)
+                          .where(and_(tuple_(FTS3File.fileID, FTS3File.ftsGUID).in_(filesChunk),
+                                      ~ FTS3File.status.in_(FTS3File.FINAL_STATES)
+                                      )
+                                 )
+                          .values(updateDict)
+                          )
+
+      session.commit()
+
+      return S_OK()
+
+    except SQLAlchemyError as e:
+      session.rollback()
+      self.log.exception("updateFileStatusBulk: unexpected exception", lException=e)
+      return S_ERROR("updateFileStatusBulk: unexpected exception %s" % e)
+    finally:
+      session.close()
+
+  def updateJobStatusBulk(self, jobStatusDict, chunkSize=1000):
+    """ Update the job Status, error and completeness of several monitored jobs,
+        with one statement per chunk of jobs.
+        The update is only done if the job is not in a final state
+        The lastMonitor time is set and the assignment flag is released
+
+       :param jobStatusDict: { jobID : { status , error, completeness } }
+       :param chunkSize: maximum number of jobs updated by a statement
+    """
+    session = self.dbSession()
+    try:
+
+      for jobIDs in breakListIntoChunks(sorted(jobStatusDict), chunkSize):
+
+        statusCases = dict((jobID, jobStatusDict[jobID]['status']) for jobID in jobIDs)
+        # Replace empty string with None
+        errorCases = dict((jobID, jobStatusDict[jobID]['error'] or None) for jobID in jobIDs
+                          if 'error' in jobStatusDict[jobID])
+        completenessCases = dict((jobID, jobStatusDict[jobID]['completeness']) for jobID in jobIDs
+                                 if 'completeness' in jobStatusDict[jobID])
+
+        updateDict = {FTS3Job.status: case(statusCases, value=FTS3Job.jobID),
+                      FTS3Job.lastMonitor: func.utc_timestamp(),
+                      FTS3Job.assignment: None}
+        if errorCases:
+          updateDict[FTS3Job.error] = case(errorCases, value=FTS3Job.jobID, else_=FTS3Job.error)
+        if completenessCases:
+          updateDict[FTS3Job.completeness] = case(completenessCases, value=FTS3Job.jobID,
+                                                  else_=FTS3Job.completeness)
+
+        session.execute(update(FTS3Job)
+                        .where(and_(FTS3Job.jobID.in_(jobIDs),
+                                    ~ FTS3Job.status.in_(FTS3Job.FINAL_STATES)
+                                    )
+                               )
+                        .values(updateDict)
+                        )
+      session.commit()
+
+      return S_OK()
+
+    except SQLAlchemyError as e:
+      session.rollback()
+      self.log.exception("updateJobStatusBulk: unexpected exception", lException=e)
+      return S_ERROR("updateJobStatusBulk: unexpected exception %s" % e)
+    finally:
+      session.close()
+
   def cancelNonExistingJob(self, operationID, ftsGUID):
     """
       Cancel an FTS3Job with the associated FTS3Files.
@@ -719,3 +836,109 @@ class FTS3DB(object):
       return S_ERROR("getOperationsFromRMSOpID: unexpected exception : %s" % e)
     finally:
       session.close()
+
+  def updateLinkStats(self, sourceSE, targetSE, transferredFiles, failedFiles, transferredBytes, transferTime,
+                      halfLife=LINK_STATS_HALF_LIFE):
+    """ Add the results of transfers to the performance of a link.
+        The values already stored are first decayed according to their age.
+
+    :param str sourceSE: source SE of the transfers
+    :param str targetSE: destination SE of the transfers
+    :param int transferredFiles: number of successful transfers
+    :param int failedFiles: number of failed transfers
+    :param int transferredBytes: size of the successful transfers
+    :param transferTime: sum of the durations of the successful transfers, in seconds
+    :param int halfLife: time in seconds after which half of the weight of the stored values is lost
+
+    :returns: S_OK/S_ERROR
+    """
+
+    decay = "POW(0.5, TIMESTAMPDIFF(SECOND, lastUpdate, UTC_TIMESTAMP()) / :halfLife)"
+    # The assignments are done in order: lastUpdate has to be the last one,
+    # so that the others are decayed with its previous value
+    query = text("INSERT INTO LinkStats (sourceSE, targetSE, transferredFiles, failedFiles, "
+                 "transferredBytes, transferTime, lastUpdate) "
+                 "VALUES (:sourceSE, :targetSE, :transferredFiles, :failedFiles, "
+                 ":transferredBytes, :transferTime, UTC_TIMESTAMP()) "
+                 "ON DUPLICATE KEY UPDATE "
+                 "transferredFiles = transferredFiles * %(decay)s + VALUES(transferredFiles), "
+                 "failedFiles = failedFiles * %(decay)s + VALUES(failedFiles), "
+                 "transferredBytes = transferredBytes * %(decay)s + VALUES(transferredBytes), "
+                 "transferTime = transferTime * %(decay)s + VALUES(transferTime), "
+                 "lastUpdate = UTC_TIMESTAMP()" % {'decay': decay})
+
+    session = self.dbSession()
+    try:
+      session.execute(query, {'sourceSE': sourceSE,
+                              'targetSE': targetSE,
+                              'transferredFiles': transferredFiles,
+                              'failedFiles': failedFiles,
+                              'transferredBytes': transferredBytes,
+                              'transferTime': transferTime,
+                              'halfLife': max(halfLife, 1)})
+      session.commit()
+      return S_OK()
+
+    except SQLAlchemyError as e:
+      session.rollback()
+      self.log.exception("updateLinkStats: unexpected exception", lException=e)
+      return S_ERROR("updateLinkStats: unexpected exception %s" % e)
+    finally:
+      session.close()
+
+  def getLinkStats(self, halfLife=LINK_STATS_HALF_LIFE):
+    """ Returns the performance of all the links, decayed to the current time
+
+    :param int halfLife: time in seconds after which half of the weight of the stored values is lost
+
+    :returns: S_OK({(sourceSE, targetSE): {'TransferredFiles', 'FailedFiles',
+                                           'TransferredBytes', 'TransferTime'}})
+    """
+
+    query = text("SELECT sourceSE, targetSE, transferredFiles * decay, failedFiles * decay, "
+                 "transferredBytes * decay, transferTime * decay FROM "
+                 "(SELECT *, POW(0.5, TIMESTAMPDIFF(SECOND, lastUpdate, UTC_TIMESTAMP()) / :halfLife) AS decay "
+                 "FROM LinkStats) AS DecayedLinkStats")
+
+    session = self.dbSession()
+    try:
+      rows = session.execute(query, {'halfLife': max(halfLife, 1)}).fetchall()
+      session.commit()
+
+      linkStats = {}
+      for sourceSE, targetSE, transferredFiles, failedFiles, transferredBytes, transferTime in rows:
+        linkStats[(sourceSE, targetSE)] = {'TransferredFiles': transferredFiles,
+                                           'FailedFiles': failedFiles,
+                                           'TransferredBytes': transferredBytes,
+                                           'TransferTime': transferTime}
+      return S_OK(linkStats)
+
+    except SQLAlchemyError as e:
+      session.rollback()
+      self.log.exception("getLinkStats: unexpected exception", lException=e)
+      return S_ERROR("getLinkStats: unexpected exception %s" % e)
+    finally:
+      session.close()
+
+  def getActiveJobsPerServer(self):
+    """ Returns the number of jobs which are not in a final state on each FTS server
+
+    :returns: S_OK({ftsServer: number of jobs})
+    """
+
+    session = self.dbSession()
+    try:
+      rows = session.query(FTS3Job.ftsServer, func.count(FTS3Job.jobID))\
+          .filter(~FTS3Job.status.in_(FTS3Job.FINAL_STATES))\
+          .group_by(FTS3Job.ftsServer)\
+          .all()
+      session.commit()
+
+      return S_OK(dict((ftsServer, count) for ftsServer, count in rows if ftsServer))
+
+    except SQLAlchemyError as e:
+      session.rollback()
+      self.log.exception("getActiveJobsPerServer: unexpected exception", lException=e)
+      return S_ERROR("getActiveJobsPerServer: unexpected exception %s" % e)
+    finally:
+      session.close()
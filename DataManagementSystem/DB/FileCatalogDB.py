@@ -2,11 +2,19 @@
 
 __RCSID__ = "$Id$"
 
+import time
+
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.Core.Base.DB import DB
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.Resources.Catalog.Utilities import checkArgumentFormat
 from DIRAC.Core.Utilities.ObjectLoader import ObjectLoader
 
+# Days the changes of the catalog are kept for the clients following them
+CHANGE_LOG_LIFETIME = 30
+# Seconds before a change is given to the clients, so that all the changes before it are committed
+CHANGE_LOG_DELAY = 10
+
 #############################################################################
 
 
@@ -33,6 +41,7 @@ class FileCatalogDB(DB):
     self.fmeta = None
     self.datasetManager = None
     self.objectLoader = None
+    self.__changeLogPurgeTime = 0
 
   def setConfig(self, databaseConfig):
 
@@ -428,6 +437,7 @@ class FileCatalogDB(DB):
       return res
     failed.update(res['Value']['Failed'])
     successful = res['Value']['Successful']
+    self.__logChanges(successful)
     return S_OK({'Successful': successful, 'Failed': failed})
 
   def setFileStatus(self, lfns, credDict):
@@ -507,6 +517,8 @@ class FileCatalogDB(DB):
       return res
     failed.update(res['Value']['Failed'])
     successful = res['Value']['Successful']
+    # The storage elements of the files can be used in the metadata queries
+    self.__logChanges(successful)
     return S_OK({'Successful': successful, 'Failed': failed})
 
   def removeReplica(self, lfns, credDict):
@@ -1053,12 +1065,16 @@ class FileCatalogDB(DB):
       return result
     if not result['Value']['Successful']:
       return S_ERROR('Failed to determine the path type')
-    if result['Value']['Successful'][path]:
+    isDirectory = result['Value']['Successful'][path]
+    if isDirectory:
       # This is a directory
-      return self.dmeta.setMetadata(path, metadataDict, credDict)
+      result = self.dmeta.setMetadata(path, metadataDict, credDict)
     else:
       # This is a file
-      return self.fmeta.setMetadata(path, metadataDict, credDict)
+      result = self.fmeta.setMetadata(path, metadataDict, credDict)
+    if result['OK']:
+      self.__logChanges([path], isDirectory=isDirectory)
+    return result
 
   def setMetadataBulk(self, pathMetadataDict, credDict):
     """  Add metadata for the given paths
@@ -1104,12 +1120,87 @@ class FileCatalogDB(DB):
       return result
     if not result['Value']['Successful']:
       return S_ERROR('Failed to determine the path type')
-    if result['Value']['Successful'][path]:
+    isDirectory = result['Value']['Successful'][path]
+    if isDirectory:
       # This is a directory
-      return self.dmeta.removeMetadata(path, metadata, credDict)
+      result = self.dmeta.removeMetadata(path, metadata, credDict)
     else:
       # This is a file
-      return self.fmeta.removeMetadata(path, metadata, credDict)
+      result = self.fmeta.removeMetadata(path, metadata, credDict)
+    if result['OK']:
+      self.__logChanges([path], isDirectory=isDirectory)
+    return result
+
+  #######################################################################
+  #
+  #  Catalog change log methods
+  #
+
+  def __logChanges(self, paths, isDirectory=False):
+    """ Record the files added, and the files or directories with their metadata changed,
+        for the clients following the changes of the catalog. A failure is only logged,
+        the clients doing then a complete query periodically.
+
+        :param paths: LFNs of the files or paths of the directories
+        :param bool isDirectory: whether the paths are directories
+    """
+    for pathChunk in breakListIntoChunks(list(paths), 1000):
+      result = self._escapeValues(pathChunk)
+      if not result['OK']:
+        gLogger.error("Failed to log the catalog changes", result['Message'])
+        return
+      values = ["(%s, %d, UTC_TIMESTAMP())" % (path, int(bool(isDirectory))) for path in result['Value']]
+      result = self._update("INSERT INTO FC_ChangeLog (Path, IsDirectory, ChangeDate) VALUES %s" % ", ".join(values))
+      if not result['OK']:
+        gLogger.error("Failed to log the catalog changes", result['Message'])
+        return
+
+  def getMetadataChanges(self, cursor, maxChanges, credDict):
+    """ Get the files added and the files or directories with their metadata changed since a cursor.
+        The changes of the last seconds are only given once all the changes before them are committed
+
+        :param cursor: cursor returned by the previous call, None to get the current cursor only
+        :param int maxChanges: maximum number of changes to return
+        :param dict credDict: credential
+
+        :return: S_OK( dict ) with the keys Cursor, the cursor to use for the next call,
+                 Files and Directories, the paths changed, and Complete, whether all the changes
+                 since the cursor are returned
+    """
+    if cursor is None:
+      self.__purgeChangeLog()
+      result = self._query("SELECT MAX(ChangeID) FROM FC_ChangeLog")
+      if not result['OK']:
+        return result
+      return S_OK({'Cursor': (result['Value'][0][0] if result['Value'] else None) or 0,
+                   'Files': [], 'Directories': [], 'Complete': True})
+
+    result = self._query("SELECT ChangeID, Path, IsDirectory FROM FC_ChangeLog WHERE ChangeID > %d "
+                         "AND ChangeDate < UTC_TIMESTAMP() - INTERVAL %d SECOND ORDER BY ChangeID LIMIT %d" %
+                         (int(cursor), CHANGE_LOG_DELAY, int(maxChanges)))
+    if not result['OK']:
+      return result
+    files = set()
+    directories = set()
+    for changeID, path, isDirectory in result['Value']:
+      cursor = changeID
+      if isDirectory:
+        directories.add(path)
+      else:
+        files.add(path)
+    return S_OK({'Cursor': cursor, 'Files': sorted(files), 'Directories': sorted(directories),
+                 'Complete': len(result['Value']) < maxChanges})
+
+  def __purgeChangeLog(self):
+    """ Delete the old changes, at most once per hour
+    """
+    if time.time() - self.__changeLogPurgeTime < 3600:
+      return
+    self.__changeLogPurgeTime = time.time()
+    result = self._update("DELETE FROM FC_ChangeLog WHERE ChangeDate < UTC_TIMESTAMP() - INTERVAL %d DAY" %
+                          CHANGE_LOG_LIFETIME)
+    if not result['OK']:
+      gLogger.error("Failed to delete the old catalog changes", result['Message'])
 
   #######################################################################
   #
@@ -272,3 +272,13 @@ CREATE TABLE FC_FileAncestors (
   UNIQUE INDEX (FileID,AncestorID)
 ) ENGINE = INNODB;
 
+-- ------------------------------------------------------------------------------
+
+CREATE TABLE FC_ChangeLog (
+  ChangeID BIGINT AUTO_INCREMENT PRIMARY KEY,
+  Path VARCHAR(1024) CHARACTER SET latin1 COLLATE latin1_bin NOT NULL,
+  IsDirectory TINYINT(1) NOT NULL DEFAULT 0,
+  ChangeDate DATETIME NOT NULL,
+  INDEX (ChangeDate)
+) ENGINE = INNODB;
+
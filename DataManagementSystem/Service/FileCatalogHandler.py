@@ -16,7 +16,7 @@ import six
 import cStringIO
 import csv
 import os
-from types import IntType, LongType, DictType, StringTypes, BooleanType, ListType
+from types import IntType, LongType, DictType, StringTypes, BooleanType, ListType, NoneType
 # from DIRAC
 from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 
@@ -403,6 +403,28 @@ class FileCatalogHandler(RequestHandler):
     gMonitor.addMark('ListDirectory', 1)
     return gFileCatalogDB.listDirectory(lfns, self.getRemoteCredentials(), verbose=verbose)
 
+  types_iterateDirectory = [list(StringTypes), BooleanType]
+
+  def export_iterateDirectory(self, lfn, verbose):
+    """ List the contents of a directory as a stream of (entry type, LFN, details) tuples,
+        for clients accepting streamed results
+    """
+    gMonitor.addMark('ListDirectory', 1)
+    result = gFileCatalogDB.listDirectory([lfn], self.getRemoteCredentials(), verbose=verbose)
+    if not result['OK']:
+      return result
+    if lfn in result['Value']['Failed']:
+      return S_ERROR(result['Value']['Failed'][lfn])
+    return S_OK(self.__iterateEntries(lfn, result['Value']['Successful'][lfn]))
+
+  @staticmethod
+  def __iterateEntries(path, listing):
+    """ Generate the entries of a directory listing, forgetting them as they are sent """
+    for entryType, entries in listing.items():
+      while entries:
+        name, details = entries.popitem()
+        yield (entryType, os.path.join(path, os.path.basename(name)), details)
+
   types_isDirectory = [[ListType, DictType] + list(StringTypes)]
 
   def export_isDirectory(self, lfns):
@@ -629,6 +651,13 @@ class FileCatalogHandler(RequestHandler):
     result = S_OK({"TotalRecords": totalRecords, "Records": resultDetails['Value']})
     return result
 
+  types_getMetadataChanges = [[IntType, LongType, NoneType], [IntType, LongType]]
+
+  def export_getMetadataChanges(self, cursor, maxChanges):
+    """ Get the files added, and the files or directories with their metadata changed since a cursor
+    """
+    return gFileCatalogDB.getMetadataChanges(cursor, maxChanges, self.getRemoteCredentials())
+
   types_getCompatibleMetadata = [DictType, StringTypes]
 
   def export_getCompatibleMetadata(self, metaDict, path='/'):
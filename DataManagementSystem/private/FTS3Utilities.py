@@ -27,20 +27,23 @@ def _checkSourceReplicas(ftsFiles):
   return res
 
 
-def selectUniqueRandomSource(ftsFiles, allowedSources=None):
+def selectUniqueSource(ftsFiles, allowedSources=None, linkPerformance=None):
   """
-      For a list of FTS3files object, select a random source, and group the files by source.
+      For a list of FTS3files object, select a source, and group the files by source.
+      The source is picked at random, or according to the performance of the links
+      if a LinkPerformance model is given.
 
       We also return the FTS3Files for which we had problems getting replicas
 
       :param allowedSources: list of allowed sources
       :param ftsFiles: list of FTS3File object
+      :param linkPerformance: LinkPerformance object, or None for a random choice
 
       :return:  S_OK(({ sourceSE: [ FTS3Files] }, {FTS3File: errors}))
 
   """
 
-  _log = gLogger.getSubLogger("selectUniqueRandomSource")
+  _log = gLogger.getSubLogger("selectUniqueSource")
 
   allowedSourcesSet = set(allowedSources) if allowedSources else set()
 
@@ -75,15 +78,124 @@ def selectUniqueRandomSource(ftsFiles, allowedSources=None):
     # If we have a restriction, apply it, otherwise take all the replicas
     allowedReplicaSource = (set(replicaDict) & allowedSourcesSet) if allowedSourcesSet else replicaDict
 
-    # pick a random source
-
-    randSource = random.choice(list(allowedReplicaSource))  # one has to convert to list
+    if linkPerformance:
+      source = linkPerformance.chooseSource(allowedReplicaSource, ftsFile.targetSE)
+    else:
+      source = random.choice(list(allowedReplicaSource))  # one has to convert to list
 
-    groupBySource.setdefault(randSource, []).append(ftsFile)
+    groupBySource.setdefault(source, []).append(ftsFile)
 
   return S_OK((groupBySource, failedFiles))
 
 
+def selectUniqueRandomSource(ftsFiles, allowedSources=None):
+  """
+      For a list of FTS3files object, select a random source, and group the files by source.
+
+      We also return the FTS3Files for which we had problems getting replicas
+
+      :param allowedSources: list of allowed sources
+      :param ftsFiles: list of FTS3File object
+
+      :return:  S_OK(({ sourceSE: [ FTS3Files] }, {FTS3File: errors}))
+
+  """
+  return selectUniqueSource(ftsFiles, allowedSources=allowedSources)
+
+
+class LinkPerformance(object):
+  """
+  Model of the performance of the links between SEs, built from the statistics
+  of the past transfers (see FTS3DB.getLinkStats), used to choose the sources.
+
+  The expected throughput of a link is its measured throughput multiplied by its success rate.
+  The measures of a link are mixed with the average of all the links, with a weight of
+  PRIOR_FILES files, so that the links with little history are still tried.
+  """
+
+  # Weight, in number of files, of the average of all the links in the estimation of a link
+  PRIOR_FILES = 5
+  # Values used when there is no history at all
+  DEFAULT_THROUGHPUT = 10. * 1024 * 1024  # bytes per second
+  DEFAULT_FILE_SIZE = 1024. * 1024 * 1024  # bytes
+  DEFAULT_SUCCESS_RATE = 0.9
+
+  def __init__(self, linkStats=None):
+    """
+        :param dict linkStats: { (sourceSE, targetSE): {'TransferredFiles', 'FailedFiles',
+                                                        'TransferredBytes', 'TransferTime'} }
+    """
+    self._linkStats = dict((link, dict(stats)) for link, stats in (linkStats or {}).iteritems())
+    self._computeAverages()
+
+  def _computeAverages(self):
+    """ Compute the average throughput, file size and success rate of all the links """
+    transferredFiles = float(sum(stats['TransferredFiles'] for stats in self._linkStats.itervalues()))
+    failedFiles = float(sum(stats['FailedFiles'] for stats in self._linkStats.itervalues()))
+    transferredBytes = float(sum(stats['TransferredBytes'] for stats in self._linkStats.itervalues()))
+    transferTime = float(sum(stats['TransferTime'] for stats in self._linkStats.itervalues()))
+
+    self._avgThroughput = transferredBytes / transferTime if transferTime > 0 else self.DEFAULT_THROUGHPUT
+    self._avgFileSize = transferredBytes / transferredFiles if transferredFiles > 0 else self.DEFAULT_FILE_SIZE
+    totalFiles = transferredFiles + failedFiles
+    self._avgSuccessRate = transferredFiles / totalFiles if totalFiles > 0 else self.DEFAULT_SUCCESS_RATE
+
+  def addTransfers(self, sourceSE, targetSE, transferredFiles, failedFiles, transferredBytes, transferTime):
+    """ Add the results of transfers to the statistics of a link
+
+        :param int transferredFiles: number of successful transfers
+        :param int failedFiles: number of failed transfers
+        :param int transferredBytes: size of the successful transfers
+        :param transferTime: sum of the durations of the successful transfers, in seconds
+    """
+    stats = self._linkStats.setdefault((sourceSE, targetSE), {'TransferredFiles': 0.,
+                                                              'FailedFiles': 0.,
+                                                              'TransferredBytes': 0.,
+                                                              'TransferTime': 0.})
+    stats['TransferredFiles'] += transferredFiles
+    stats['FailedFiles'] += failedFiles
+    stats['TransferredBytes'] += transferredBytes
+    stats['TransferTime'] += transferTime
+    self._computeAverages()
+
+  def getThroughput(self, sourceSE, targetSE):
+    """ Estimated throughput of the successful transfers of a link, in bytes per second """
+    stats = self._linkStats.get((sourceSE, targetSE), {})
+    priorBytes = self.PRIOR_FILES * self._avgFileSize
+    return (stats.get('TransferredBytes', 0.) + priorBytes) / \
+        (stats.get('TransferTime', 0.) + priorBytes / self._avgThroughput)
+
+  def getSuccessRate(self, sourceSE, targetSE):
+    """ Estimated fraction of the transfers of a link which succeed """
+    stats = self._linkStats.get((sourceSE, targetSE), {})
+    transferredFiles = stats.get('TransferredFiles', 0.)
+    totalFiles = transferredFiles + stats.get('FailedFiles', 0.)
+    return (transferredFiles + self.PRIOR_FILES * self._avgSuccessRate) / (totalFiles + self.PRIOR_FILES)
+
+  def getExpectedThroughput(self, sourceSE, targetSE):
+    """ Estimated throughput of a link, taking into account the failed transfers """
+    return self.getThroughput(sourceSE, targetSE) * self.getSuccessRate(sourceSE, targetSE)
+
+  def chooseSource(self, sourceSEs, targetSE):
+    """ Choose a source at random, with a probability proportional to the expected throughput
+        of its link to the target. The slow links thus keep a share of the transfers,
+        which both spreads the load and keeps their statistics up to date.
+
+        :param sourceSEs: possible sources
+        :param str targetSE: destination of the transfer
+
+        :return: the chosen source SE
+    """
+    sourceSEs = sorted(sourceSEs)
+    weights = [self.getExpectedThroughput(sourceSE, targetSE) for sourceSE in sourceSEs]
+    threshold = random.random() * sum(weights)
+    for sourceSE, weight in zip(sourceSEs, weights):
+      threshold -= weight
+      if threshold < 0:
+        return sourceSE
+    return sourceSEs[-1]
+
+
 def groupFilesByTarget(ftsFiles):
   """
         For a list of FTS3files object, group the Files by target
@@ -122,6 +234,8 @@ class FTS3ServerPolicy(object):
     self._maxAttempts = len(self._serverList)
     self._nextServerID = 0
     self._resourceStatus = ResourceStatus()
+    # { server URL : number of active jobs }, used by the Load policy
+    self._serverLoads = {}
 
     methName = "_%sServerPolicy" % serverPolicy.lower()
     if not hasattr(self, methName):
@@ -166,6 +280,24 @@ class FTS3ServerPolicy(object):
 
     return fts3Server
 
+  def _loadServerPolicy(self, _attempt):
+    """
+      Returns the server with the fewest active jobs, then the next ones
+      for the following attempts
+    """
+
+    rankedServerList = sorted(self._serverList,
+                              key=lambda server: self._serverLoads.get(self._serverDict[server], 0))
+    return rankedServerList[_attempt]
+
+  def setServerLoads(self, serverLoads):
+    """
+      Set the number of active jobs of the servers, used by the Load policy
+
+      :param dict serverLoads: { server URL : number of active jobs }
+    """
+    self._serverLoads = dict(serverLoads)
+
   def _getFTSServerStatus(self, ftsServer):
     """ Fetch the status of the FTS server from RSS """
 
@@ -209,6 +341,9 @@ class FTS3ServerPolicy(object):
         attempt += 1
 
     if fts3Server:
-      return S_OK(self._serverDict[fts3Server])
+      ftsServerURL = self._serverDict[fts3Server]
+      # Count the job to be submitted until the loads are refreshed
+      self._serverLoads[ftsServerURL] = self._serverLoads.get(ftsServerURL, 0) + 1
+      return S_OK(ftsServerURL)
 
     return S_ERROR("Could not find an FTS3 server (max attempt reached)")
@@ -2,6 +2,7 @@
 
 __RCSID__ = "$Id$"
 
+import random
 import unittest
 
 import mock
@@ -11,6 +12,8 @@ from DIRAC import S_OK, S_ERROR
 
 from DIRAC.DataManagementSystem.private.FTS3Utilities import groupFilesByTarget, \
     selectUniqueRandomSource, \
+    selectUniqueSource, \
+    LinkPerformance, \
     FTS3ServerPolicy
 
 
@@ -102,6 +105,84 @@ class TestFileGrouping(unittest.TestCase):
     self.assertTrue(self.f2 in filesInSrc2 + filesInSrc3)
     self.assertTrue(self.f3 in filesInSrc4)
 
+  @mock.patch(
+      'DIRAC.DataManagementSystem.private.FTS3Utilities._checkSourceReplicas',
+      side_effect=mock__checkSourceReplicas)
+  def test_05_selectUniqueSourceThroughput(self, _mk_checkSourceReplicas):
+    """ The sources are chosen according to the performance of the links """
+
+    # Src2 is much faster than Src1 towards target1, and Src3 always fails towards target2
+    linkPerformance = LinkPerformance({('Src1', 'target1'): {'TransferredFiles': 100, 'FailedFiles': 0,
+                                                             'TransferredBytes': 100 * 10**9,
+                                                             'TransferTime': 100 * 1000},
+                                       ('Src2', 'target1'): {'TransferredFiles': 100, 'FailedFiles': 0,
+                                                             'TransferredBytes': 100 * 10**9,
+                                                             'TransferTime': 100 * 10},
+                                       ('Src3', 'target2'): {'TransferredFiles': 0, 'FailedFiles': 100,
+                                                             'TransferredBytes': 0,
+                                                             'TransferTime': 0}})
+
+    random.seed(1234)
+    counts = {}
+    for _ in range(100):
+      res = selectUniqueSource(self.allFiles, linkPerformance=linkPerformance)
+      self.assertTrue(res['OK'])
+      uniqueSources, failedFiles = res['Value']
+      self.assertEqual(set(failedFiles), set([self.f4]))
+      for srcSE, ftsFiles in uniqueSources.iteritems():
+        for ftsFile in ftsFiles:
+          counts[(ftsFile.lfn, srcSE)] = counts.get((ftsFile.lfn, srcSE), 0) + 1
+
+    self.assertGreater(counts.get(('f1', 'Src2'), 0), 90)
+    self.assertGreater(counts.get(('f2', 'Src2'), 0), 90)
+    self.assertEqual(counts[('f3', 'Src4')], 100)
+
+    # The allowed sources are still enforced
+    res = selectUniqueSource([self.f1], allowedSources=['Src1'], linkPerformance=linkPerformance)
+    self.assertEqual(res['Value'][0]['Src1'], [self.f1])
+
+
+class TestLinkPerformance(unittest.TestCase):
+  """ Testing the model of the links performance """
+
+  def test_estimations(self):
+    """ Estimations with and without history """
+
+    # Without history, the default values are used
+    linkPerformance = LinkPerformance()
+    self.assertAlmostEqual(linkPerformance.getThroughput('Src', 'Dst'), LinkPerformance.DEFAULT_THROUGHPUT)
+    self.assertAlmostEqual(linkPerformance.getSuccessRate('Src', 'Dst'), LinkPerformance.DEFAULT_SUCCESS_RATE)
+
+    linkPerformance.addTransfers('Src', 'Dst', 1000, 0, 1000 * 10**6, 1000)
+    linkPerformance.addTransfers('Src', 'Bad', 0, 1000, 0, 0)
+
+    # Enough history: the measured values are used
+    self.assertAlmostEqual(linkPerformance.getThroughput('Src', 'Dst') / 10**6, 1., places=3)
+    self.assertLess(linkPerformance.getSuccessRate('Src', 'Bad'), 0.01)
+    self.assertLess(linkPerformance.getExpectedThroughput('Src', 'Bad'),
+                    linkPerformance.getExpectedThroughput('Src', 'Dst') / 100)
+
+    # Unknown links get the average of all the links
+    self.assertAlmostEqual(linkPerformance.getThroughput('Other', 'Dst') / 10**6, 1., places=3)
+    self.assertAlmostEqual(linkPerformance.getSuccessRate('Other', 'Dst'), 0.5)
+
+    # A single slow transfer lowers the estimation, but not down to its own throughput
+    linkPerformance.addTransfers('New', 'Dst', 1, 0, 10**6, 100)
+    self.assertLess(linkPerformance.getThroughput('New', 'Dst'), 10**5)
+    self.assertGreater(linkPerformance.getThroughput('New', 'Dst'), 5 * 10**4)
+
+  def test_chooseSource(self):
+    """ The sources are chosen proportionally to their expected throughput """
+
+    linkPerformance = LinkPerformance({('Fast', 'Dst'): {'TransferredFiles': 1000, 'FailedFiles': 0,
+                                                         'TransferredBytes': 3 * 10**9, 'TransferTime': 1000},
+                                       ('Slow', 'Dst'): {'TransferredFiles': 1000, 'FailedFiles': 0,
+                                                         'TransferredBytes': 10**9, 'TransferTime': 1000}})
+    random.seed(1234)
+    choices = [linkPerformance.chooseSource(['Slow', 'Fast'], 'Dst') for _ in range(4000)]
+    self.assertAlmostEqual(choices.count('Fast') / 4000., 0.75, delta=0.03)
+    self.assertEqual(linkPerformance.chooseSource(set(['Slow']), 'Dst'), 'Slow')
+
 
 def mock__failoverServerPolicy(_attempt):
   return "server_0"
@@ -205,8 +286,26 @@ class TestFTS3ServerPolicy (unittest.TestCase):
 
     self.assertEquals(len(serverSet), len(self.fakeServerDict))
 
+  @mock.patch(
+      'DIRAC.DataManagementSystem.private.FTS3Utilities.FTS3ServerPolicy._getFTSServerStatus',
+      side_effect=mock__OKFTSServerStatus)
+  def testLoadServerPolicy(self, mockFTSServerStatus):
+    """ Test if the load server policy selects the servers with the fewest active jobs """
+
+    obj = FTS3ServerPolicy(self.fakeServerDict, "Load")
+    obj.setServerLoads({"server0.cern.ch": 2, "server1.cern.ch": 0, "server2.cern.ch": 5})
+
+    self.assertEquals(['server_1', 'server_0', 'server_2'], [obj._loadServerPolicy(i) for i in range(3)])
+
+    # The chosen servers are counted until the loads are refreshed
+    chosen = [obj.chooseFTS3Server()['Value'] for _ in range(6)]
+    self.assertEquals(chosen.count("server1.cern.ch"), 4)
+    self.assertEquals(chosen.count("server0.cern.ch"), 2)
+    self.assertEquals(chosen.count("server2.cern.ch"), 0)
+
 
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestFileGrouping)
+  suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestLinkPerformance))
   suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestFTS3ServerPolicy))
   unittest.TextTestRunner(verbosity=2).run(suite)
@@ -30,7 +30,8 @@ class ComponentMonitoring(BaseType):
     self.monitoringFields = ['runningTime', 'memoryUsage', 'threads', 'cpuPercentage',
                              'Connections', 'PendingQueries', 'ActiveQueries',
                              'RunningThreads', 'MaxFD', 'ServiceResponseTime',
-                             'cycleDuration', 'cycles']
+                             'cycleDuration', 'cycles', 'HandshakeTime', 'ResumedHandshakes',
+                             'AuthCacheHits']
 
     self.doc_type = "ComponentMonitoring"
 
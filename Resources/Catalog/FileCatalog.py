@@ -16,7 +16,14 @@
     plug-ins are called (in case they implement the method) for the "write" methods.
 
     For the "read" methods plug-ins are called one by one, starting with the Master
-    plug-in if declared, until getting a successful result.
+    plug-in if declared, and the first successful result of each LFN is kept.
+
+    With the ParallelExecution option of the Services/Catalogs section of the Operations,
+    the plug-ins other than the Master are called at the same time, each in its own thread,
+    and their results are merged in the same order as when they are called one by one.
+    For the "write" methods, they are called once the Master succeeded. With the
+    ReturnOnMasterSuccess option, the "read" methods return the result of the Master
+    as soon as it succeeded for all the LFNs, without waiting for the other plug-ins.
 
     Most of the catalog plug-in methods are taking the first argument which represents
     the required LFNS. The LFNs argument can have one of the following forms:
@@ -46,16 +53,47 @@
 
 import six
 import re
+import functools
+import threading
 
 from DIRAC                                               import gLogger, gConfig, S_OK, S_ERROR
 from DIRAC.Core.Utilities                                import DErrno
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Security.ProxyInfo                       import getVOfromProxyGroup
+from DIRAC.Core.DISET.ThreadConfig                       import ThreadConfig
 from DIRAC.Resources.Catalog.Utilities                   import checkArgumentFormat
 from DIRAC.Resources.Catalog.FileCatalogFactory          import FileCatalogFactory
 from DIRAC.Resources.Catalog.FCConditionParser           import FCConditionParser
 
 
+class CatalogCall( threading.Thread ):
+  """ Call of a catalog plug-in method in its own thread, done on behalf of
+      the same user as in the calling thread
+  """
+
+  def __init__( self, method, *parms, **kws ):
+    super( CatalogCall, self ).__init__()
+    self.daemon = True
+    self.__method = method
+    self.__parms = parms
+    # The keyword arguments are shared by the calls to the different plug-ins
+    self.__kws = dict( kws )
+    self.__threadConfig = ThreadConfig().dump()
+    self.__result = None
+
+  def run( self ):
+    ThreadConfig().load( self.__threadConfig )
+    try:
+      self.__result = self.__method( *self.__parms, **self.__kws )
+    except Exception as e:  # pylint: disable=broad-except
+      self.__result = S_ERROR( DErrno.EFCERR, "Exception in the catalog call: %s" % repr( e ) )
+
+  def getResult( self ):
+    """ Wait for the end of the call and return its result """
+    self.join()
+    return self.__result
+
+
 class FileCatalog( object ):
 
 
@@ -77,6 +115,11 @@ class FileCatalog( object ):
 
     self.opHelper = Operations( vo = self.vo )
 
+    # Call the catalogs at the same time rather than one after the other
+    self.parallelExecution = self.opHelper.getValue( '/Services/Catalogs/ParallelExecution', False )
+    # Return the read result of the master without waiting for the other catalogs if it is complete
+    self.returnOnMasterSuccess = self.opHelper.getValue( '/Services/Catalogs/ReturnOnMasterSuccess', False )
+
     catalogList = []
     if isinstance(catalogs, six.string_types):
       catalogList = [catalogs]
@@ -180,8 +223,13 @@ class FileCatalog( object ):
         If the method is a write no_lfn method, then the return value are completely different.
         We only return the result of the master catalog
 
+      With the ParallelExecution option, the other catalogs are called at the same time once
+      the master catalog succeeded.
+
 
     """
+    # The name of the method is read at once, as it is changed by the next call
+    call = self.call
     successful = {}
     failed = {}
     failedCatalogs = {}
@@ -194,7 +242,7 @@ class FileCatalog( object ):
     lfnMapDict = {}
     masterResult = {}
     parms1 = []
-    if self.call not in self.no_lfn_methods:
+    if call not in self.no_lfn_methods:
       fileInfo = parms[0]
       result = checkArgumentFormat( fileInfo, generateMap = True )
       if not result['OK']:
@@ -205,26 +253,32 @@ class FileCatalog( object ):
       allLfns = fileInfo.keys()
       parms1 = parms[1:]
 
-    for catalogName, oCatalog, master in self.writeCatalogs:
+    # The master catalog is called first: if it fails, the other catalogs are not called,
+    # and they are only called for the LFNs for which it succeeded
+    writeCatalogs = sorted( self.writeCatalogs, key = lambda catalog: not catalog[2] )
+
+    # ( catalogName, master, function returning the result of the call )
+    catalogCalls = []
+    for catalogName, oCatalog, master in writeCatalogs:
 
       # Skip if the method is not implemented in this catalog
       # NOTE: it is impossible for the master since the write method list is populated
       # only from the master catalog, and if the method is not there, __getattr__
       # would raise an exception
-      if not oCatalog.hasCatalogMethod( self.call ):
+      if not oCatalog.hasCatalogMethod( call ):
         continue
 
-      method = getattr( oCatalog, self.call )
+      method = getattr( oCatalog, call )
 
-      if self.call in self.no_lfn_methods:
-        result = method( *parms, **kws )
+      if call in self.no_lfn_methods:
+        callParms = parms
       else:
         if isinstance( specialConditions, dict ):
           condition = specialConditions.get( catalogName )
         else:
           condition = specialConditions
         # Check whether this catalog should be used for this method
-        res = self.condParser( catalogName, self.call, fileInfo, condition = condition )
+        res = self.condParser( catalogName, call, fileInfo, condition = condition )
         # condParser never returns S_ERROR
         condEvals = res['Value']['Successful']
         # For a master catalog, ALL the lfns should be valid
@@ -244,25 +298,38 @@ class FileCatalog( object ):
         invalidLFNs = [lfn for lfn in condEvals if not condEvals[lfn]]
 
         if invalidLFNs:
-          gLogger.debug( "Some LFNs are not valid for operation '%s' on catalog '%s' : %s" % ( self.call, catalogName,
+          gLogger.debug( "Some LFNs are not valid for operation '%s' on catalog '%s' : %s" % ( call, catalogName,
                                                                                                invalidLFNs ) )
 
-
-        result = method( validLFNs, *parms1, **kws )
-
+        callParms = ( validLFNs, ) + tuple( parms1 )
 
       if master:
+        result = method( *callParms, **kws )
         masterResult = result
-
-      if not result['OK']:
-        if master:
+        if not result['OK']:
           # If this is the master catalog and it fails we don't want to continue with the other catalogs
           self.log.error( "Failed to execute call on master catalog",
-                          "%s on %s: %s" % ( self.call, catalogName, result['Message'] ) )
+                          "%s on %s: %s" % ( call, catalogName, result['Message'] ) )
           return result
-        else:
-          # Otherwise we keep the failed catalogs so we can update their state later
-          failedCatalogs[catalogName] = result['Message']
+        if allLfns:
+          # The operation is not attempted on other catalogs for the LFNs which failed in the master
+          for lfn in result['Value']['Failed']:
+            fileInfo.pop( lfn, None )
+        catalogCalls.append( ( catalogName, master, lambda result = result: result ) )
+      elif self.parallelExecution:
+        catalogCall = CatalogCall( method, *callParms, **kws )
+        catalogCall.start()
+        catalogCalls.append( ( catalogName, master, catalogCall.getResult ) )
+      else:
+        catalogCalls.append( ( catalogName, master, functools.partial( method, *callParms, **kws ) ) )
+
+    for catalogName, master, getResult in catalogCalls:
+
+      result = getResult()
+
+      if not result['OK']:
+        # We keep the failed catalogs so we can update their state later
+        failedCatalogs[catalogName] = result['Message']
       else:
         successfulCatalogs[catalogName] = result['Value']
 
@@ -271,9 +338,6 @@ class FileCatalog( object ):
           for lfn, message in result['Value']['Failed'].items():
             # Save the error message for the failed operations
             failed.setdefault( lfn, {} )[catalogName] = message
-            if master:
-              # If this is the master catalog then we should not attempt the operation on other catalogs
-              fileInfo.pop( lfn, None )
           for lfn, result in result['Value']['Successful'].items():
             # Save the result return for each file for the successful operations
             successful.setdefault( lfn, {} )[catalogName] = result
@@ -299,17 +363,43 @@ class FileCatalog( object ):
 
   def r_execute( self, *parms, **kws ):
     """ Read method executor.
+
+      The first successful result of each LFN is kept, in the order of the catalogs.
+      With the ParallelExecution option, all the catalogs are called at the same time.
+      With the ReturnOnMasterSuccess option, the result of the master catalog is returned
+      without waiting for the other catalogs if it succeeded for all the LFNs.
     """
-    successful = {}
-    failed = {}
-    for _catalogName, oCatalog, _master in self.readCatalogs:
+    # The name of the method is read at once, as it is changed by the next call
+    call = self.call
+
+    # Number of LFNs for which the master catalog should succeed to be returned at once
+    nbLFNs = None
+    if self.returnOnMasterSuccess and parms and call not in self.no_lfn_methods:
+      result = checkArgumentFormat( parms[0] )
+      if result['OK']:
+        nbLFNs = len( result['Value'] )
+
+    # ( master, function returning the result of the call )
+    catalogCalls = []
+    for _catalogName, oCatalog, master in self.readCatalogs:
 
       # Skip if the method is not implemented in this catalog
-      if not oCatalog.hasCatalogMethod( self.call ):
+      if not oCatalog.hasCatalogMethod( call ):
         continue
 
-      method = getattr( oCatalog, self.call )
-      res = method( *parms, **kws )
+      method = getattr( oCatalog, call )
+      # The master catalog is called in this thread
+      if self.parallelExecution and not master:
+        catalogCall = CatalogCall( method, *parms, **kws )
+        catalogCall.start()
+        catalogCalls.append( ( master, catalogCall.getResult ) )
+      else:
+        catalogCalls.append( ( master, functools.partial( method, *parms, **kws ) ) )
+
+    successful = {}
+    failed = {}
+    for master, getResult in catalogCalls:
+      res = getResult()
       if res['OK']:
         if 'Successful' in res['Value']:
           for key, item in res['Value']['Successful'].items():
@@ -318,10 +408,13 @@ class FileCatalog( object ):
           for key, item in res['Value']['Failed'].items():
             if key not in successful:
               failed[key] = item
+          if master and nbLFNs is not None and not res['Value']['Failed'] and \
+             len( res['Value']['Successful'] ) >= nbLFNs:
+            break
         else:
           return res
     if not successful and not failed:
-      return S_ERROR( DErrno.EFCERR, "Failed to perform %s from any catalog" % self.call )
+      return S_ERROR( DErrno.EFCERR, "Failed to perform %s from any catalog" % call )
     return S_OK( {'Failed':failed, 'Successful':successful} )
 
   ###########################################################################################
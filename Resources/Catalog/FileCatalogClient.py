@@ -27,7 +27,8 @@ class FileCatalogClient(FileCatalogClientBase):
        'findDirectoriesByMetadata', 'getReplicasByMetadata', 'findFilesByMetadataDetailed',
        'findFilesByMetadataWeb', 'getCompatibleMetadata', 'getMetadataSet', 'getDatasets',
        'getFileDescendents', 'getFileAncestors', 'getDirectoryUserMetadata', 'getFileUserMetadata',
-       'checkDataset', 'getDatasetParameters', 'getDatasetFiles', 'getDatasetAnnotation']
+       'checkDataset', 'getDatasetParameters', 'getDatasetFiles', 'getDatasetAnnotation',
+       'getMetadataChanges']
 
   WRITE_METHODS = [
       'createLink',
@@ -80,6 +81,7 @@ class FileCatalogClient(FileCatalogClientBase):
       'findFilesByMetadataDetailed',
       'findFilesByMetadataWeb',
       'getCompatibleMetadata',
+      'getMetadataChanges',
       'addMetadataSet',
       'getMetadataSet',
       'getFileUserMetadata',
@@ -211,6 +213,17 @@ class FileCatalogClient(FileCatalogClientBase):
           entryDict[lfn] = detailsDict
     return result
 
+  def iterateDirectory(self, lfn, verbose=False, timeout=120):
+    """ List the given directory's contents without holding the whole listing in memory
+
+        :param str lfn: directory to list
+        :param bool verbose: get the details of the entries, as with listDirectory
+        :return: S_OK(iterator) yielding (entry type, LFN, details) tuples,
+                 the entry type being 'Files', 'SubDirs', 'Links' or 'Datasets'
+    """
+    rpcClient = self._getRPC(timeout=timeout, streamResponses=True)
+    return rpcClient.iterateDirectory(lfn, verbose)
+
   @checkCatalogArguments
   def getDirectoryMetadata(self, lfns, timeout=120):
     ''' Get standard directory metadata
@@ -579,6 +592,12 @@ class FileCatalogClient(FileCatalogClientBase):
     """
     return self._getRPC(timeout=timeout).getCompatibleMetadata(metaDict, path)
 
+  def getMetadataChanges(self, cursor, maxChanges=10000, timeout=120):
+    """ Get the files added, and the files or directories with their metadata changed since a cursor.
+        A None cursor gives the current cursor
+    """
+    return self._getRPC(timeout=timeout).getMetadataChanges(cursor, maxChanges)
+
   def addMetadataSet(self, setName, setDict, timeout=120):
     """ Add a new metadata set
     """
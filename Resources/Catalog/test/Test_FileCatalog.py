@@ -3,6 +3,7 @@
 """
 
 import sys
+import time
 import unittest
 import mock
 
@@ -10,6 +11,7 @@ import DIRAC
 from DIRAC.Resources.Catalog.FileCatalog import FileCatalog
 
 from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
 
 __RCSID__ = "$Id $"
 
@@ -409,9 +411,129 @@ class TestRead( unittest.TestCase ):
     self.assertEqual( ['c1'], res['Value']['Successful'][lfn].keys() )
     self.assertEqual( ['c2'], res['Value']['Failed'][lfn].keys() )
 
+class SlowCatalog( object ):
+  """ Wraps a catalog, to make its calls take some time """
+
+  def __init__( self, catalog, delay ):
+    self.catalog = catalog
+    self.delay = delay
+    self.callIDs = []
+
+  def hasCatalogMethod( self, methName ):
+    return self.catalog.hasCatalogMethod( methName )
+
+  def __getattr__( self, meth ):
+    method = getattr( self.catalog, meth )
+
+    def slowMethod( *args, **kwargs ):
+      time.sleep( self.delay )
+      self.callIDs.append( ThreadConfig().getID() )
+      return method( *args, **kwargs )
+    return slowMethod
+
+
+class TestParallel( unittest.TestCase ):
+  """ Tests of the parallel execution of the catalog calls """
+
+  @staticmethod
+  def slowCatalogs( fc, delays ):
+    """ Make the calls of the catalogs take some time """
+    fc.readCatalogs = [( name, SlowCatalog( obj, delays[name] ), master ) for name, obj, master in fc.readCatalogs]
+    fc.writeCatalogs = [( name, SlowCatalog( obj, delays[name] ), master ) for name, obj, master in fc.writeCatalogs]
+
+  # autospec is for the binding of the method...
+  @mock.patch.object( DIRAC.Resources.Catalog.FileCatalog.FileCatalog, '_getSelectedCatalogs',
+                      side_effect = mock_fc_getSelectedCatalogs, autospec = True )
+  @mock.patch.object( DIRAC.Resources.Catalog.FileCatalog.FileCatalog, '_getEligibleCatalogs',
+                      side_effect = mock_fc_getEligibleCatalogs, autospec = True )
+  def test_01_sameResults( self, mk_getSelectedCatalogs, mk_getEligibleCatalogs ):
+    """ The parallel execution gives the same results as the sequential one """
+
+    catalogs = ['c1_True_True_True_2_0_2_1', 'c2_False_True_True_3_0_2_1', 'c3_False_True_True_2_0_1_0']
+    sequentialFc = FileCatalog( catalogs = catalogs )
+    parallelFc = FileCatalog( catalogs = catalogs )
+    parallelFc.parallelExecution = True
+
+    lfnLists = [['/lhcb/toto'], ['/lhcb/c1/Error'], ['/lhcb/c1/Failed', '/lhcb/toto'],
+                ['/lhcb/c2/Error', '/lhcb/c3/Failed'], ['/lhcb/c2/Failed', '/lhcb/c3/Error', '/lhcb/c1/Failed']]
+    for methodName in ['read1', 'read2', 'read3', 'write1', 'write2']:
+      for lfns in lfnLists:
+        sequentialRes = getattr( sequentialFc, methodName )( lfns )
+        parallelRes = getattr( parallelFc, methodName )( lfns )
+        self.assertEqual( sequentialRes['OK'], parallelRes['OK'] )
+        self.assertEqual( sequentialRes.get( 'Value' ), parallelRes.get( 'Value' ) )
+
+    # The other catalogs are not called for the LFNs which failed in the master
+    res = parallelFc.write1( ['/lhcb/c1/Failed', '/lhcb/toto'] )
+    self.assertEqual( res['Value']['Failed']['/lhcb/c1/Failed'].keys(), ['c1'] )
+    self.assertEqual( sorted( res['Value']['Successful']['/lhcb/toto'] ), ['c1', 'c2', 'c3'] )
+
+    # no_lfn method: the result of the master
+    self.assertEqual( parallelFc.write2( '/lhcb/c2' )['Value'], 'yeah' )
+    self.assertTrue( not parallelFc.write2( '/lhcb/c1' )['OK'] )
+
+  # autospec is for the binding of the method...
+  @mock.patch.object( DIRAC.Resources.Catalog.FileCatalog.FileCatalog, '_getSelectedCatalogs',
+                      side_effect = mock_fc_getSelectedCatalogs, autospec = True )
+  @mock.patch.object( DIRAC.Resources.Catalog.FileCatalog.FileCatalog, '_getEligibleCatalogs',
+                      side_effect = mock_fc_getEligibleCatalogs, autospec = True )
+  def test_02_latency( self, mk_getSelectedCatalogs, mk_getEligibleCatalogs ):
+    """ The calls take the time of the master plus the slowest of the others for the writes,
+        and of the slowest catalog for the reads
+    """
+
+    fc = FileCatalog( catalogs = ['c1_True_True_True_2_0_2_0', 'c2_False_True_True_2_0_2_0',
+                                  'c3_False_True_True_2_0_2_0'] )
+    fc.parallelExecution = True
+    self.slowCatalogs( fc, {'c1': 0.1, 'c2': 0.3, 'c3': 0.3} )
+
+    # The calls are done on behalf of the user of the calling thread
+    ThreadConfig().setID( '/some/DN', 'someGroup' )
+    try:
+      startTime = time.time()
+      res = fc.read1( ['/lhcb/toto', '/lhcb/c1/Failed'] )
+      self.assertLess( time.time() - startTime, 0.55 )
+      self.assertEqual( sorted( res['Value']['Successful'] ), ['/lhcb/c1/Failed', '/lhcb/toto'] )
+
+      startTime = time.time()
+      res = fc.write1( '/lhcb/toto' )
+      self.assertLess( time.time() - startTime, 0.65 )
+      self.assertEqual( sorted( res['Value']['Successful']['/lhcb/toto'] ), ['c1', 'c2', 'c3'] )
+    finally:
+      ThreadConfig().reset()
+
+    for _name, catalog, _master in fc.readCatalogs + fc.writeCatalogs:
+      self.assertEqual( catalog.callIDs, [( '/some/DN', 'someGroup' )] )
+
+  # autospec is for the binding of the method...
+  @mock.patch.object( DIRAC.Resources.Catalog.FileCatalog.FileCatalog, '_getSelectedCatalogs',
+                      side_effect = mock_fc_getSelectedCatalogs, autospec = True )
+  @mock.patch.object( DIRAC.Resources.Catalog.FileCatalog.FileCatalog, '_getEligibleCatalogs',
+                      side_effect = mock_fc_getEligibleCatalogs, autospec = True )
+  def test_03_returnOnMasterSuccess( self, mk_getSelectedCatalogs, mk_getEligibleCatalogs ):
+    """ The result of the master is returned at once if it succeeded for all the LFNs """
+
+    for parallel in ( True, False ):
+      fc = FileCatalog( catalogs = ['c1_True_True_True_2_0_2_0', 'c2_False_True_True_2_0_2_0'] )
+      fc.parallelExecution = parallel
+      fc.returnOnMasterSuccess = True
+      self.slowCatalogs( fc, {'c1': 0, 'c2': 0.5} )
+
+      startTime = time.time()
+      res = fc.read1( ['/lhcb/toto', '/lhcb/titi'] )
+      self.assertLess( time.time() - startTime, 0.25 )
+      self.assertEqual( sorted( res['Value']['Successful'] ), ['/lhcb/titi', '/lhcb/toto'] )
+
+      # The master failed for one LFN, which is found in the other catalog
+      res = fc.read1( ['/lhcb/toto', '/lhcb/c1/Failed'] )
+      self.assertEqual( sorted( res['Value']['Successful'] ), ['/lhcb/c1/Failed', '/lhcb/toto'] )
+      self.assertEqual( res['Value']['Failed'], {} )
+
+
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( TestInitialization )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TestWrite ) )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TestRead ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TestParallel ) )
 
   unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -6,6 +6,14 @@ Possibility to speedup the query time by only fetching files that were added sin
 Use the CS option RefreshOnly (False by default) and set the DateKey (empty by default) to the meta data
 key set in the DIRAC FileCatalog.
 
+By default (UseChangeLog option), the agent follows the change log of the DIRAC FileCatalog: the complete
+query is only done for the new transformations, when their query changes and every FullUpdatePeriod seconds.
+In between, the query is only done in the directories of the files added or with their metadata changed since
+the previous cycle. As the catalog only restricts the search to a directory for the queries on directory
+metadata, the complete query is still done for the queries without directory metadata, and when the changes
+are spread over more than MaxSearchPaths directories. The position in the change log is kept in the work
+directory of the agent.
+
 The following options can be set for the InputDataAgent.
 
 .. literalinclude:: ../ConfigTemplate.cfg
@@ -16,6 +24,8 @@ The following options can be set for the InputDataAgent.
 '''
 
 from past.builtins import long
+import os
+import pickle
 import time
 import datetime
 
@@ -49,6 +59,14 @@ class InputDataAgent(AgentModule):
     self.fullUpdatePeriod = self.am_getOption('FullUpdatePeriod', 86400)
     self.refreshonly = self.am_getOption('RefreshOnly', False)
     self.dateKey = self.am_getOption('DateKey', None)
+    self.useChangeLog = self.am_getOption('UseChangeLog', True)
+    self.maxChanges = self.am_getOption('MaxChanges', 10000)
+    self.maxSearchPaths = self.am_getOption('MaxSearchPaths', 100)
+
+    # Position in the change log of the catalog, and for each transformation the query and
+    # the time of the last complete query
+    self.changeLogState = {'Cursor': None, 'Transformations': {}}
+    self.stateFile = None
 
     self.transClient = TransformationClient()
     self.metadataClient = FileCatalogClient()
@@ -73,8 +91,117 @@ class InputDataAgent(AgentModule):
           self.transformationTypes.remove(extendable)
           # This is because the Extendables do not use this Agent (have no Input data query)
 
+    if self.useChangeLog:
+      self.stateFile = os.path.join(self.am_getWorkDirectory(), 'InputDataCursors.pkl')
+      self.__readChangeLogState()
+
     return S_OK()
 
+  def __readChangeLogState(self):
+    """ Read the position in the change log of the catalog, kept in the work directory
+    """
+    if not os.path.exists(self.stateFile):
+      return
+    try:
+      with open(self.stateFile, 'r') as stateFile:
+        self.changeLogState = pickle.load(stateFile)
+      self.log.info("Loaded the position in the catalog change log",
+                    "(%d transformations)" % len(self.changeLogState['Transformations']))
+    except Exception as x:  # pylint: disable=broad-except
+      self.log.exception("Failed to load the position in the catalog change log", self.stateFile, lException=x)
+      self.changeLogState = {'Cursor': None, 'Transformations': {}}
+
+  def __writeChangeLogState(self):
+    """ Write the position in the change log of the catalog
+    """
+    try:
+      # write to a temporary file in order to avoid corrupted files
+      tmpFile = self.stateFile + '.tmp'
+      with open(tmpFile, 'w') as stateFile:
+        pickle.dump(self.changeLogState, stateFile)
+      os.rename(tmpFile, self.stateFile)
+    except Exception as x:  # pylint: disable=broad-except
+      self.log.exception("Could not write the position in the catalog change log", self.stateFile, lException=x)
+
+  def __getMetadataChanges(self):
+    """ Get the changes of the catalog since the previous cycle
+
+        :return: dict with the keys Cursor, Files and Directories, or None if the complete
+                 queries have to be done
+    """
+    cursor = self.changeLogState['Cursor']
+    result = self.metadataClient.getMetadataChanges(cursor, self.maxChanges)
+    if not result['OK']:
+      self.log.warn("Failed to get the changes of the catalog, doing the complete queries", result['Message'])
+      return None
+    changes = result['Value']
+    if cursor is None:
+      # Only the current position is known, all the transformations are queried completely
+      self.changeLogState = {'Cursor': changes['Cursor'], 'Transformations': {}}
+      return None
+    self.log.info("Changes in the catalog since the previous cycle",
+                  "%d files, %d directories%s" % (len(changes['Files']), len(changes['Directories']),
+                                                  '' if changes['Complete'] else ' (more to follow)'))
+
+    # The subdirectories of a changed directory are searched with it
+    directories = []
+    for directory in sorted(changes['Directories']):
+      if not directories or not directory.startswith(directories[-1].rstrip('/') + '/'):
+        directories.append(directory)
+    changedFiles = set(lfn for lfn in changes['Files']
+                       if not any(lfn.startswith(directory.rstrip('/') + '/') for directory in directories))
+    changes['SearchDirectories'] = directories
+    changes['ChangedFiles'] = changedFiles
+    changes['SearchPaths'] = sorted(set(directories) | set(os.path.dirname(lfn) for lfn in changedFiles))
+
+    # Only the queries on directory metadata are restricted to the search paths by the catalog
+    result = self.metadataClient.getMetadataFields()
+    if not result['OK']:
+      self.log.warn("Failed to get the metadata fields, doing the complete queries", result['Message'])
+      return None
+    changes['DirectoryMetaFields'] = set(result['Value']['DirectoryMetaFields'])
+    return changes
+
+  def __canFindChangedFiles(self, inputDataQuery, changes):
+    """ Whether looking for the changed files is cheaper than the complete query
+
+        :param dict inputDataQuery: metadata query
+        :param dict changes: changes of the catalog, as returned by __getMetadataChanges
+
+        :return: bool
+    """
+    if not any(key in changes['DirectoryMetaFields'] for key in inputDataQuery):
+      # The catalog would search the whole name space for each path
+      self.log.verbose("No directory metadata in the query, doing the complete query", str(inputDataQuery))
+      return False
+    if len(changes['SearchPaths']) > self.maxSearchPaths:
+      self.log.verbose("Too many directories changed, doing the complete query",
+                       "%d > %d" % (len(changes['SearchPaths']), self.maxSearchPaths))
+      return False
+    return True
+
+  def __findChangedFiles(self, inputDataQuery, changes):
+    """ Find the files matching the query among the files and directories changed
+
+        :param dict inputDataQuery: metadata query
+        :param dict changes: changes of the catalog, as returned by __getMetadataChanges
+
+        :return: S_OK( list of LFNs ) / S_ERROR
+    """
+    directories = changes['SearchDirectories']
+    changedFiles = changes['ChangedFiles']
+
+    lfns = set()
+    for path in changes['SearchPaths']:
+      result = self.metadataClient.findFilesByMetadata(inputDataQuery, path=path)
+      if not result['OK']:
+        return result
+      # Only the changed files are kept from the directories of the changed files
+      lfns.update(lfn for lfn in result['Value']
+                  if lfn in changedFiles or any(lfn.startswith(directory.rstrip('/') + '/')
+                                                for directory in directories))
+    return S_OK(sorted(lfns))
+
   ##############################################################################
   def execute(self):
     ''' Main execution method
@@ -88,6 +215,11 @@ class InputDataAgent(AgentModule):
       self.log.error("InputDataAgent.execute: Failed to get transformations.", result['Message'])
       return S_OK()
 
+    changes = self.__getMetadataChanges() if self.useChangeLog else None
+    # The transformations not processed in this cycle are queried completely when they are back
+    previousStates = self.changeLogState['Transformations']
+    transStates = {}
+
     # Process each transformation
     for transDict in result['Value']:
       transID = long(transDict['TransformationID'])
@@ -102,6 +234,26 @@ class InputDataAgent(AgentModule):
         continue
       inputDataQuery = res['Value']
 
+      transState = previousStates.get(transID)
+      fullUpdateDue = not transState or \
+          (datetime.datetime.utcnow() - transState['FullUpdate']) >= datetime.timedelta(seconds=self.fullUpdatePeriod)
+      if changes is not None and not fullUpdateDue and transState['Query'] == inputDataQuery and \
+              self.__canFindChangedFiles(inputDataQuery, changes):
+        # Only the files changed since the previous cycle are looked for
+        start = time.time()
+        result = self.__findChangedFiles(inputDataQuery, changes)
+        self.log.verbose("Metadata catalog query time of the changed files", ": %.2f seconds." % (time.time() - start))
+        if not result['OK']:
+          self.log.error("InputDataAgent.execute: Failed to find the changed files in the metadata catalog",
+                         result['Message'])
+          continue
+        lfnList = result['Value']
+        self.log.info("Changed files matching the query of the transformation", "%d -> %d" % (transID, len(lfnList)))
+        if self.__addFilesToTransformation(transID, lfnList):
+          transStates[transID] = transState
+        continue
+      fullQuery = dict(inputDataQuery)
+
       if self.refreshonly:
         # Determine the correct time stamp to use for this transformation
         if transID in self.timeLog:
@@ -141,23 +293,37 @@ class InputDataAgent(AgentModule):
       self.fileLog[transID] = nlfns
 
       # Add any new files to the transformation
-      addedLfns = []
-      if lfnList:
-        self.log.verbose('Processing lfns for transformation:', "%d -> %d" % (transID, len(lfnList)))
-        # Add the files to the transformation
-        self.log.verbose('Adding lfns for transformation:', "%d -> %d" % (transID, len(lfnList)))
-        result = self.transClient.addFilesToTransformation(transID, sorted(lfnList))
-        if not result['OK']:
-          self.log.warn("InputDataAgent.execute: failed to add lfns to transformation", result['Message'])
-          self.fileLog[transID] = 0
-        else:
-          if result['Value']['Failed']:
-            for lfn, error in res['Value']['Failed'].items():
-              self.log.warn("InputDataAgent.execute: Failed to add to transformation:", "%s: %s" % (lfn, error))
-          if result['Value']['Successful']:
-            for lfn, status in result['Value']['Successful'].items():
-              if status == 'Added':
-                addedLfns.append(lfn)
-            self.log.info("InputDataAgent.execute: Added files to transformation", "(%d)" % len(addedLfns))
+      if self.__addFilesToTransformation(transID, lfnList):
+        transStates[transID] = {'Query': fullQuery, 'FullUpdate': datetime.datetime.utcnow()}
+      else:
+        self.fileLog[transID] = 0
+
+    self.changeLogState['Transformations'] = transStates
+    if changes is not None:
+      self.changeLogState['Cursor'] = changes['Cursor']
+    if self.useChangeLog:
+      self.__writeChangeLogState()
 
     return S_OK()
+
+  def __addFilesToTransformation(self, transID, lfnList):
+    """ Add files to a transformation
+
+        :return: True if all the files were added
+    """
+    if not lfnList:
+      return True
+    addedLfns = []
+    self.log.verbose('Adding lfns for transformation:', "%d -> %d" % (transID, len(lfnList)))
+    result = self.transClient.addFilesToTransformation(transID, sorted(lfnList))
+    if not result['OK']:
+      self.log.warn("InputDataAgent.execute: failed to add lfns to transformation", result['Message'])
+      return False
+    for lfn, error in result['Value']['Failed'].items():
+      self.log.warn("InputDataAgent.execute: Failed to add to transformation:", "%s: %s" % (lfn, error))
+    for lfn, status in result['Value']['Successful'].items():
+      if status == 'Added':
+        addedLfns.append(lfn)
+    if addedLfns:
+      self.log.info("InputDataAgent.execute: Added files to transformation", "(%d)" % len(addedLfns))
+    return not result['Value']['Failed']
@@ -14,7 +14,6 @@ import time
 import Queue
 import os
 import datetime
-import pickle
 
 from DIRAC import S_OK, S_ERROR
 from DIRAC.Core.Base.AgentModule import AgentModule
@@ -24,6 +23,7 @@ from DIRAC.Core.Utilities.List import breakListIntoChunks, randomize
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.TransformationSystem.Client.TransformationClient import TransformationClient
 from DIRAC.TransformationSystem.Agent.TransformationAgentsUtilities import TransformationAgentsUtilities
+from DIRAC.TransformationSystem.Utilities.ReplicaCacheFile import ReplicaCacheFile
 from DIRAC.DataManagementSystem.Client.DataManager import DataManager
 
 __RCSID__ = "$Id$"
@@ -63,6 +63,7 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
     self.lastFileOffset = {}
     # Validity of the cache
     self.replicaCache = None
+    self.replicaCacheFiles = {}
     self.replicaCacheValidity = None
     self.writingCache = False
     self.removedFromCache = 0
@@ -96,7 +97,7 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
     # clients
     self.transfClient = TransformationClient()
 
-    # for caching using a pickle file
+    # for caching using a snapshot and a journal per transformation
     self.workDirectory = self.am_getWorkDirectory()
     self.cacheFile = os.path.join(self.workDirectory, 'ReplicaCache.pkl')
     self.controlDirectory = self.am_getControlDirectory()
@@ -250,8 +251,7 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
     if not transFiles['Value']:
       return S_OK()
 
-    if transID not in self.replicaCache:
-      self.__readCache(transID)
+    self.__readCache(transID)
     transFiles = transFiles['Value']
     unusedLfns = [f['LFN'] for f in transFiles]
     unusedFiles = len(unusedLfns)
@@ -298,14 +298,12 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
     tasks = res['Value']
     self.pluginTimeout[transID] = res.get('Timeout', False)
     # Create the tasks
+    res = self.__addTasks(transID, tasks, clients)
     allCreated = True
     created = 0
     lfnsInTasks = []
-    for se, lfns in tasks:
-      res = clients['TransformationClient'].addTaskForTransformation(transID, lfns, se)
-      if not res['OK']:
-        self._logError("Failed to add task generated by plug-in:", res['Message'],
-                       method=method, transID=transID)
+    for (se, lfns), taskID in zip(tasks, res):
+      if not taskID:
         allCreated = False
       else:
         created += 1
@@ -339,6 +337,38 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
   # Internal methods used by the agent
   #
 
+  def __addTasks(self, transID, tasks, clients):
+    """ Create the tasks generated by the plugin, at once if the service allows it
+
+        :param list tasks: list of ( se, lfns )
+        :return: list of the task IDs, None for the tasks not created
+    """
+    method = '__addTasks'
+    if not tasks:
+      return []
+    res = clients['TransformationClient'].addTasksForTransformation(transID, [(lfns, se) for se, lfns in tasks])
+    if res['OK']:
+      taskIDs = res['Value']
+      if None in taskIDs:
+        self._logError("Failed to add %d tasks generated by plug-in" % taskIDs.count(None),
+                       method=method, transID=transID)
+      return taskIDs
+    if not res['Message'].startswith('Unknown method'):
+      self._logError("Failed to add tasks generated by plug-in:", res['Message'],
+                     method=method, transID=transID)
+      return [None] * len(tasks)
+    # The service does not create several tasks at once
+    taskIDs = []
+    for se, lfns in tasks:
+      res = clients['TransformationClient'].addTaskForTransformation(transID, lfns, se)
+      if not res['OK']:
+        self._logError("Failed to add task generated by plug-in:", res['Message'],
+                       method=method, transID=transID)
+        taskIDs.append(None)
+      else:
+        taskIDs.append(res['Value'])
+    return taskIDs
+
   def _getTransformationFiles(self, transDict, clients, statusList=None, replicateOrRemove=False):
     """ get the data replicas for a certain transID
     """
@@ -560,14 +590,15 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
   def __updateCache(self, transID, newReplicas):
     """ Add replicas to the cache
     """
-    self.replicaCache.setdefault(transID, {})[datetime.datetime.utcnow()] = newReplicas
-#    if len( newReplicas ) > 5000:
-#      self.__writeCache( transID )
+    updateTime = datetime.datetime.utcnow()
+    self.replicaCache.setdefault(transID, {})[updateTime] = newReplicas
+    self.__journalCache(transID, 'add', updateTime, newReplicas)
 
   def __clearCacheForTrans(self, transID):
     """ Remove all replicas for a transformation
     """
     self.replicaCache.pop(transID, None)
+    self.__journalCache(transID, 'clear')
 
   def __cleanReplicas(self, transID, lfns):
     """ Remove cached replicas that are not in a list
@@ -586,6 +617,7 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
     try:
       if transID in self.replicaCache:
         timeLimit = datetime.datetime.utcnow() - datetime.timedelta(days=self.replicaCacheValidity)
+        expired = []
         for updateTime in set(self.replicaCache[transID]):
           nCache = len(self.replicaCache[transID][updateTime])
           if updateTime < timeLimit or not nCache:
@@ -593,6 +625,8 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
                           ('%d cached' % nCache if nCache else 'empty cache', str(transID), str(updateTime)),
                           transID=transID, method='__cleanCache')
             del self.replicaCache[transID][updateTime]
+            expired.append(updateTime)
+        self.__journalCache(transID, 'expire', expired)
         # Remove empty transformations
         if not self.replicaCache[transID]:
           del self.replicaCache[transID]
@@ -608,36 +642,54 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
   def __removeFromCache(self, transID, lfns):
     if transID not in self.replicaCache:
       return
-    removed = 0
+    removed = set()
     if self.replicaCache[transID] and lfns:
       for lfn in lfns:
         for timeKey in self.replicaCache[transID]:
           if self.replicaCache[transID][timeKey].pop(lfn, None):
-            removed += 1
-    return removed
+            removed.add(lfn)
+    self.__journalCache(transID, 'remove', removed)
+    return len(removed)
 
   def __cacheFile(self, transID):
     return self.cacheFile.replace('.pkl', '_%s.pkl' % str(transID))
 
   @gSynchro
+  def __getReplicaCacheFile(self, transID):
+    """ Get the on disk cache of a transformation, the global lock being only held to create it
+    """
+    if transID not in self.replicaCacheFiles:
+      self.replicaCacheFiles[transID] = ReplicaCacheFile(self.__cacheFile(transID))
+    return self.replicaCacheFiles[transID]
+
+  def __journalCache(self, transID, action, *args):
+    """ Append a change of the cache of a transformation to its journal
+    """
+    cacheFile = self.__getReplicaCacheFile(transID)
+    try:
+      with cacheFile.lock:
+        getattr(cacheFile, action)(*args)
+    except Exception as x:
+      self._logException("Could not write replica cache journal %s" % cacheFile.journalFile, lException=x,
+                         method='__journalCache', transID=transID)
+
   def __readCache(self, transID):
-    """ Reads from the cache
+    """ Reads from the cache, only for the transformation to be processed
     """
     if transID in self.replicaCache:
       return
+    method = '__readCache'
+    cacheFile = self.__getReplicaCacheFile(transID)
     try:
-      method = '__readCache'
-      fileName = self.__cacheFile(transID)
-      if not os.path.exists(fileName):
-        self.replicaCache[transID] = {}
-      else:
-        with open(fileName, 'r') as cacheFile:
-          self.replicaCache[transID] = pickle.load(cacheFile)
-        self._logInfo("Successfully loaded replica cache from file %s (%d files)" %
-                      (fileName, self.__filesInCache(transID)),
+      with cacheFile.lock:
+        startTime = time.time()
+        self.replicaCache[transID] = cacheFile.load()
+      if self.replicaCache[transID]:
+        self._logInfo("Successfully loaded replica cache from file %s (%d files) in %.1f seconds" %
+                      (cacheFile.snapshotFile, self.__filesInCache(transID), time.time() - startTime),
                       method=method, transID=transID)
     except Exception as x:
-      self._logException("Failed to load replica cache from file %s" % fileName, lException=x,
+      self._logException("Failed to load replica cache from file %s" % cacheFile.snapshotFile, lException=x,
                          method=method, transID=transID)
       self.replicaCache[transID] = {}
 
@@ -645,33 +697,31 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
     cache = self.replicaCache.get(transID, {})
     return sum(len(lfns) for lfns in cache.itervalues())
 
-  @gSynchro
   def __writeCache(self, transID=None):
-    """ Writes the cache
+    """ Writes the snapshot of the cache of the transformations whose journal became too large,
+        the changes being already in the journal
     """
     method = '__writeCache'
-    try:
-      startTime = time.time()
-      transList = [transID] if transID else set(self.replicaCache)
-      filesInCache = 0
-      nCache = 0
-      for t_id in transList:
-        # Protect the copy of the cache
-        filesInCache += self.__filesInCache(t_id)
-        # write to a temporary file in order to avoid corrupted files
-        cacheFile = self.__cacheFile(t_id)
-        tmpFile = cacheFile + '.tmp'
-        with open(tmpFile, 'w') as fd:
-          pickle.dump(self.replicaCache.get(t_id, {}), fd)
-        # Now rename the file as it shold
-        os.rename(tmpFile, cacheFile)
-        nCache += 1
+    transList = [transID] if transID else list(self.replicaCacheFiles)
+    filesInCache = 0
+    nCache = 0
+    startTime = time.time()
+    for t_id in transList:
+      cacheFile = self.__getReplicaCacheFile(t_id)
+      try:
+        with cacheFile.lock:
+          if not cacheFile.needsCompaction():
+            continue
+          filesInCache += self.__filesInCache(t_id)
+          cacheFile.compact(self.replicaCache.get(t_id, {}))
+          nCache += 1
+      except Exception as x:
+        self._logException("Could not write replica cache file %s" % cacheFile.snapshotFile, lException=x,
+                           method=method, transID=t_id)
+    if nCache:
       self._logInfo("Successfully wrote %d replica cache file(s) (%d files) in %.1f seconds"
                     % (nCache, filesInCache, time.time() - startTime),
                     method=method, transID=transID if transID else None)
-    except Exception as x:
-      self._logException("Could not write replica cache file %s" % cacheFile, lException=x,
-                         method=method, transID=t_id)
 
   def __generatePluginObject(self, plugin, clients):
     """ This simply instantiates the TransformationPlugin class with the relevant plugin name
@@ -700,7 +750,7 @@ class TransformationAgent(AgentModule, TransformationAgentsUtilities):
       try:
         if transID in self.replicaCache:
           self._logInfo("Removed cached replicas for transformation", method='pluginCallBack', transID=transID)
-          self.replicaCache.pop(transID)
+          self.__clearCacheForTrans(transID)
           self.__writeCache(transID)
       except:
         pass
@@ -206,3 +206,107 @@ def test__getTransformationFiles(mocker, transDict, getTFiles, expected):
   tc_mock.getTransformationFiles.return_value = getTFiles
   res = TransformationAgent()._getTransformationFiles(transDict, {'TransformationClient': tc_mock})
   assert res['OK'] == expected
+
+
+def test_InputDataAgentChangeLog(mocker, tmpdir):
+  mocker.patch('DIRAC.TransformationSystem.Agent.InputDataAgent.AgentModule', side_effect=mockAM)
+  mocker.patch('DIRAC.TransformationSystem.Agent.InputDataAgent.TransformationClient')
+  mocker.patch('DIRAC.TransformationSystem.Agent.InputDataAgent.FileCatalogClient')
+  mocker.patch('DIRAC.TransformationSystem.Agent.InputDataAgent.Operations')
+  mocker.patch('DIRAC.TransformationSystem.Agent.InputDataAgent.gMonitor')
+  from DIRAC.TransformationSystem.Agent.InputDataAgent import InputDataAgent
+  mocker.patch.object(InputDataAgent, 'am_getOption', side_effect=lambda option, default=None: default, create=True)
+  agent = InputDataAgent()
+  agent.log = gLogger
+  agent.am_getWorkDirectory = MagicMock(return_value=str(tmpdir))
+  agent.initialize()
+  query = {'DataType': 'RAW'}
+  agent.transClient.getTransformations.return_value = {'OK': True, 'Value': [{'TransformationID': 1}]}
+  agent.transClient.getTransformationMetaQuery.return_value = {'OK': True, 'Value': dict(query)}
+  agent.transClient.addFilesToTransformation.return_value = {'OK': True, 'Value': {'Successful': {}, 'Failed': {}}}
+  catalog = agent.metadataClient
+
+  # First cycle: the position in the change log is taken before the complete query
+  catalog.getMetadataChanges.return_value = {'OK': True, 'Value': {'Cursor': 10, 'Files': [], 'Directories': [],
+                                                                   'Complete': True}}
+  catalog.findFilesByMetadata.return_value = {'OK': True, 'Value': ['/vo/raw/1/f1']}
+  agent.execute()
+  assert catalog.getMetadataChanges.call_args[0][0] is None
+  catalog.findFilesByMetadata.assert_called_once_with(query)
+  assert agent.transClient.addFilesToTransformation.call_args[0] == (1, ['/vo/raw/1/f1'])
+
+  # Next cycle: only the directories of the changes are queried, from the persisted position
+  agent = InputDataAgent()
+  agent.log = gLogger
+  agent.am_getWorkDirectory = MagicMock(return_value=str(tmpdir))
+  agent.initialize()
+  assert agent.changeLogState['Cursor'] == 10
+  agent.transClient = MagicMock()
+  agent.transClient.getTransformations.return_value = {'OK': True, 'Value': [{'TransformationID': 1}]}
+  agent.transClient.getTransformationMetaQuery.return_value = {'OK': True, 'Value': dict(query)}
+  agent.transClient.addFilesToTransformation.return_value = {'OK': True, 'Value': {'Successful': {}, 'Failed': {}}}
+  catalog = agent.metadataClient = MagicMock()
+  catalog.getMetadataFields.return_value = {'OK': True, 'Value': {'DirectoryMetaFields': {'DataType': 'VARCHAR(128)'},
+                                                                  'FileMetaFields': {'Quality': 'VARCHAR(128)'}}}
+  catalog.getMetadataChanges.return_value = {'OK': True, 'Value': {'Cursor': 12,
+                                                                   'Files': ['/vo/raw/2/f2', '/vo/raw/3/sub/f4'],
+                                                                   'Directories': ['/vo/raw/3', '/vo/raw/3/sub'],
+                                                                   'Complete': True}}
+  catalog.findFilesByMetadata.side_effect = lambda query, path: {'OK': True, 'Value': {
+      '/vo/raw/2': ['/vo/raw/2/f2', '/vo/raw/2/old'],
+      '/vo/raw/3': ['/vo/raw/3/f3', '/vo/raw/3/sub/f4']}[path]}
+  agent.execute()
+  assert catalog.getMetadataChanges.call_args[0][0] == 10
+  assert sorted(call[1]['path'] for call in catalog.findFilesByMetadata.call_args_list) == ['/vo/raw/2', '/vo/raw/3']
+  assert agent.transClient.addFilesToTransformation.call_args[0] == (1, ['/vo/raw/2/f2', '/vo/raw/3/f3',
+                                                                         '/vo/raw/3/sub/f4'])
+  assert agent.changeLogState['Cursor'] == 12
+
+  # A changed query is done completely
+  agent.transClient.getTransformationMetaQuery.return_value = {'OK': True, 'Value': {'DataType': 'DST'}}
+  catalog.findFilesByMetadata.side_effect = None
+  catalog.findFilesByMetadata.return_value = {'OK': True, 'Value': []}
+  agent.execute()
+  catalog.findFilesByMetadata.assert_called_with({'DataType': 'DST'})
+
+  # The next cycle only searches the changed directories
+  catalog.findFilesByMetadata.reset_mock()
+  agent.execute()
+  assert sorted(call[1]['path'] for call in catalog.findFilesByMetadata.call_args_list) == ['/vo/raw/2', '/vo/raw/3']
+
+  # Without directory metadata, the catalog would search everything for each path: the complete query is done
+  agent.transClient.getTransformationMetaQuery.return_value = {'OK': True, 'Value': {'Quality': 'Good'}}
+  agent.execute()
+  catalog.findFilesByMetadata.reset_mock()
+  agent.execute()
+  catalog.findFilesByMetadata.assert_called_once_with({'Quality': 'Good'})
+
+  # As well as when the changes are in too many directories
+  agent.transClient.getTransformationMetaQuery.return_value = {'OK': True, 'Value': {'DataType': 'DST'}}
+  agent.execute()
+  agent.maxSearchPaths = 1
+  catalog.findFilesByMetadata.reset_mock()
+  agent.execute()
+  catalog.findFilesByMetadata.assert_called_once_with({'DataType': 'DST'})
+
+
+def test__addTasks(mocker):
+  mocker.patch('DIRAC.TransformationSystem.Agent.TransformationAgent.AgentModule', side_effect=mockAM)
+  agent = TransformationAgent()
+  agent.log = gLogger
+  clients = {'TransformationClient': MagicMock()}
+  tasks = [('SE1', ['/lfn/1', '/lfn/2']), ('SE2', ['/lfn/3'])]
+
+  # All the tasks are created at once
+  clients['TransformationClient'].addTasksForTransformation.return_value = {'OK': True, 'Value': [4, None]}
+  assert agent._TransformationAgent__addTasks(123, tasks, clients) == [4, None]
+  clients['TransformationClient'].addTasksForTransformation.assert_called_once_with(
+      123, [(['/lfn/1', '/lfn/2'], 'SE1'), (['/lfn/3'], 'SE2')])
+  clients['TransformationClient'].addTaskForTransformation.assert_not_called()
+
+  # One by one with a service not knowing the bulk method
+  clients['TransformationClient'].addTasksForTransformation.return_value = {
+      'OK': False, 'Message': 'Unknown method addTasksForTransformation'}
+  clients['TransformationClient'].addTaskForTransformation.side_effect = [{'OK': True, 'Value': 4},
+                                                                         {'OK': True, 'Value': 5}]
+  assert agent._TransformationAgent__addTasks(123, tasks, clients) == [4, 5]
@@ -1299,7 +1299,8 @@ class TransformationDB(DB):
       return res
 
     # With InnoDB, TaskID is computed by a trigger, which sets the local variable @last (per connection)
-    # @last is the last insert TaskID. With multi-row inserts, will be the first new TaskID inserted.
+    # @last is the TaskID of the row just inserted. It is only relied upon for single-row inserts:
+    # the TaskIDs of multi-row inserts are read back from the table (see __insertTasks).
     # The trigger TaskID_Generator must be present with the InnoDB schema (defined in TransformationDB.sql)
     if self.isTransformationTasksInnoDB:
       res = self._query("SELECT @last;", connection)
@@ -1323,6 +1324,137 @@ class TransformationDB(DB):
         return res
     return S_OK(taskID)
 
+  def addTasksForTransformation(self, transID, tasks, connection=False):
+    """ Create tasks with the supplied files for a transformation, in one transaction.
+        The tasks with files not available for the transformation are not created.
+
+        :param transID: transformation ID or name
+        :param list tasks: list of ( lfns, se ) tuples
+        :return: S_OK( list of the task IDs, None for the tasks not created ) / S_ERROR
+    """
+    res = self._getConnectionTransID(connection, transID)
+    if not res['OK']:
+      return res
+    connection = res['Value']['Connection']
+    transID = res['Value']['TransformationID']
+    if not self.isTransformationTasksInnoDB:
+      # No transaction without InnoDB, create the tasks one by one
+      taskIDs = []
+      for lfns, se in tasks:
+        res = self.addTaskForTransformation(transID, lfns=lfns, se=se, connection=connection)
+        taskIDs.append(res['Value'] if res['OK'] else None)
+      return S_OK(taskIDs)
+
+    # Be sure the all the supplied LFNs are known to the database for the supplied transformation
+    allLfns = set(lfn for lfns, _se in tasks for lfn in lfns)
+    fileIDs = {}
+    if allLfns:
+      res = self.getTransformationFiles(condDict={'TransformationID': transID, 'LFN': list(allLfns)},
+                                        connection=connection)
+      if not res['OK']:
+        return res
+      for fileDict in res['Value']:
+        if fileDict['Status'] in self.allowedStatusForTasks:
+          fileIDs[fileDict['LFN']] = fileDict['FileID']
+        else:
+          gLogger.error("Supplied file not in %s status but %s" % (self.allowedStatusForTasks, fileDict['Status']),
+                        fileDict['LFN'])
+    validTasks = []
+    usedLfns = set()
+    for index, (lfns, se) in enumerate(tasks):
+      unavailableLfns = set(lfn for lfn in lfns if lfn not in fileIDs or lfn in usedLfns)
+      if unavailableLfns:
+        gLogger.error("Supplied files not available for a task of transformation %d" % transID,
+                      sorted(unavailableLfns))
+        continue
+      usedLfns.update(lfns)
+      validTasks.append((index, lfns, se))
+    taskIDs = [None] * len(tasks)
+    if not validTasks:
+      return S_OK(taskIDs)
+
+    self.lock.acquire()
+    try:
+      res = self.transactionStart()
+      if not res['OK']:
+        return res
+      res = self.__insertTasks(transID, validTasks, fileIDs, taskIDs, connection)
+      if not res['OK']:
+        self.transactionRollback()
+        gLogger.error("Failed to publish tasks for transformation", res['Message'])
+        return res
+      res = self.transactionCommit()
+      if not res['OK']:
+        return res
+    finally:
+      self.lock.release()
+    gLogger.verbose("Published %d tasks for transformation %d." % (len(validTasks), transID))
+    return S_OK(taskIDs)
+
+  def __insertTasks(self, transID, validTasks, fileIDs, taskIDs, connection):
+    """ Insert the tasks, their inputs and assign their files, to be called in a transaction
+
+        :param list validTasks: list of ( index, lfns, se ), the files being available
+        :param dict fileIDs: LFN -> FileID
+        :param list taskIDs: filled with the new task IDs, at the index of the tasks
+    """
+    for taskChunk in breakListIntoChunks(validTasks, 1000):
+      res = self._escapeValues([se for _index, _lfns, se in taskChunk] +
+                               [';'.join(lfns) for _index, lfns, _se in taskChunk])
+      if not res['OK']:
+        return res
+      ses = res['Value'][:len(taskChunk)]
+      vectors = res['Value'][len(taskChunk):]
+      # The new tasks are the ones after the last task, which is locked until the end of the transaction
+      res = self._query("SELECT IFNULL(MAX(TaskID), 0) FROM TransformationTasks WHERE TransformationID = %d "
+                        "FOR UPDATE" % transID, connection)
+      if not res['OK']:
+        return res
+      previousTaskID = int(res['Value'][0][0])
+      req = "INSERT INTO TransformationTasks(TransformationID, ExternalStatus, ExternalID, TargetSE,"
+      req += " CreationTime, LastUpdateTime) VALUES %s" % ','.join("(%d, 'Created', '0', %s, UTC_TIMESTAMP(), "
+                                                                   "UTC_TIMESTAMP())" % (transID, se) for se in ses)
+      res = self._update(req, connection)
+      if not res['OK']:
+        return res
+      # The trigger TaskID_Generator gives increasing TaskIDs to the rows, in the order of the insertion
+      res = self._query("SELECT TaskID FROM TransformationTasks WHERE TransformationID = %d AND TaskID > %d "
+                        "ORDER BY TaskID" % (transID, previousTaskID), connection)
+      if not res['OK']:
+        return res
+      chunkTaskIDs = [int(row[0]) for row in res['Value']]
+      if len(chunkTaskIDs) != len(taskChunk):
+        return S_ERROR("Inserted %d tasks but found %d new tasks" % (len(taskChunk), len(chunkTaskIDs)))
+      for (index, _lfns, _se), taskID in zip(taskChunk, chunkTaskIDs):
+        taskIDs[index] = taskID
+
+      req = "INSERT INTO TaskInputs (TransformationID, TaskID, InputVector) VALUES %s"
+      res = self._update(req % ','.join("(%d, %d, %s)" % (transID, taskID, vector)
+                                        for taskID, vector in zip(chunkTaskIDs, vectors)), connection)
+      if not res['OK']:
+        return res
+      fileTuples = ["(%d, %d, %d)" % (transID, fileIDs[lfn], taskID)
+                    for (_index, lfns, _se), taskID in zip(taskChunk, chunkTaskIDs) for lfn in lfns]
+      if not fileTuples:
+        continue
+      for fileTupleChunk in breakListIntoChunks(fileTuples, 10000):
+        req = "INSERT INTO TransformationFileTasks (TransformationID, FileID, TaskID) VALUES %s"
+        res = self._update(req % ','.join(fileTupleChunk), connection)
+        if not res['OK']:
+          return res
+      # The files take the task and the SE of their task
+      req = "UPDATE TransformationFiles tf JOIN TransformationFileTasks tft"
+      req += " ON (tft.TransformationID = tf.TransformationID AND tft.FileID = tf.FileID)"
+      req += " JOIN TransformationTasks tt ON (tt.TransformationID = tft.TransformationID AND tt.TaskID = tft.TaskID)"
+      req += " SET tf.TaskID = tft.TaskID, tf.UsedSE = tt.TargetSE, tf.Status = 'Assigned',"
+      req += " tf.LastUpdate = UTC_TIMESTAMP()"
+      req += " WHERE tft.TransformationID = %d AND tft.TaskID BETWEEN %d AND %d" % (transID, chunkTaskIDs[0],
+                                                                                   chunkTaskIDs[-1])
+      res = self._update(req, connection)
+      if not res['OK']:
+        return res
+    return S_OK()
+
   def extendTransformation(self, transName, nTasks, author='', connection=False):
     """ Extend SIMULATION type transformation by nTasks number of tasks
     """
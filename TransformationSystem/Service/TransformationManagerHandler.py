@@ -176,6 +176,14 @@ class TransformationManagerHandler(RequestHandler):
     res = database.addTaskForTransformation(transName, lfns=lfns, se=se)
     return self._parseRes(res)
 
+  types_addTasksForTransformation = [transTypes, [list, tuple]]
+
+  def export_addTasksForTransformation(self, transName, tasks):
+    """ Create tasks for a transformation, tasks being a list of ( lfns, se )
+    """
+    res = database.addTasksForTransformation(transName, tasks)
+    return self._parseRes(res)
+
   def _wasFileInError(self, newStatus, currentStatus):
     """ Tells whether the file was Assigned and failed, i.e. was not Processed """
     return currentStatus.lower() == 'assigned' and newStatus.lower() != 'processed'
@@ -0,0 +1,134 @@
+""" On disk replica cache of a transformation, used by the TransformationAgent.
+
+    The cache is kept in two files:
+
+    * a snapshot, the pickled dictionary { update time : { LFN : [ SE ] } } as written by the
+      previous versions of the TransformationAgent, which are thus read without migration
+    * a journal, where the changes done since the snapshot are appended as pickled records
+
+    Only the changes are written while the agent runs, and the snapshot is rewritten when the
+    journal becomes larger than it. As the records only set or delete entries, replaying the journal
+    on a snapshot already containing its changes gives the same cache, so the two files never need
+    to be written at once.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import pickle
+import threading
+
+from DIRAC import gLogger
+
+# Minimal size of the journal before the snapshot is rewritten
+MIN_JOURNAL_SIZE = 1024 * 1024
+
+
+class ReplicaCacheFile(object):
+  """ Snapshot and journal of the replica cache of one transformation. The methods
+      writing to the files must be called with the lock acquired.
+  """
+
+  def __init__(self, snapshotFile):
+    """ c'tor
+
+        :param str snapshotFile: path of the snapshot, the journal being next to it
+    """
+    self.snapshotFile = snapshotFile
+    self.journalFile = os.path.splitext(snapshotFile)[0] + '.journal'
+    self.lock = threading.Lock()
+    self.log = gLogger.getSubLogger('ReplicaCacheFile')
+
+  def load(self):
+    """ Read the snapshot and replay the journal
+
+        :return: dict { update time : { LFN : [ SE ] } }
+    """
+    cache = {}
+    if os.path.exists(self.snapshotFile):
+      with open(self.snapshotFile, 'rb') as fd:
+        cache = pickle.load(fd)
+    if not os.path.exists(self.journalFile):
+      return cache
+    records = 0
+    journalSize = os.path.getsize(self.journalFile)
+    with open(self.journalFile, 'rb') as fd:
+      while fd.tell() < journalSize:
+        try:
+          record = pickle.load(fd)
+        except Exception as x:  # pylint: disable=broad-except
+          # The agent stopped while writing the last record: keep what was written before
+          self.log.warn("Truncated replica cache journal", "%s after %d records: %s" % (self.journalFile, records, x))
+          self.compact(cache)
+          break
+        self.__apply(cache, record)
+        records += 1
+    return cache
+
+  @staticmethod
+  def __apply(cache, record):
+    """ Apply a record of the journal to the cache """
+    action = record[0]
+    if action == 'add':
+      cache[record[1]] = record[2]
+    elif action == 'remove':
+      for replicas in cache.itervalues():
+        for lfn in record[1]:
+          replicas.pop(lfn, None)
+    elif action == 'expire':
+      for updateTime in record[1]:
+        cache.pop(updateTime, None)
+    elif action == 'clear':
+      cache.clear()
+
+  def __append(self, record):
+    """ Append a record to the journal """
+    with open(self.journalFile, 'ab') as fd:
+      pickle.dump(record, fd, pickle.HIGHEST_PROTOCOL)
+
+  def add(self, updateTime, replicas):
+    """ Record the replicas obtained at a given time
+
+        :param datetime updateTime: time of the update
+        :param dict replicas: { LFN : [ SE ] }
+    """
+    self.__append(('add', updateTime, replicas))
+
+  def remove(self, lfns):
+    """ Record the removal of LFNs from the cache """
+    if lfns:
+      self.__append(('remove', list(lfns)))
+
+  def expire(self, updateTimes):
+    """ Record the removal of the replicas obtained at given times """
+    if updateTimes:
+      self.__append(('expire', list(updateTimes)))
+
+  def clear(self):
+    """ Record the removal of all the replicas """
+    self.__append(('clear', ))
+
+  def needsCompaction(self):
+    """ Whether the journal is larger than the snapshot """
+    try:
+      journalSize = os.path.getsize(self.journalFile)
+    except OSError:
+      return False
+    try:
+      snapshotSize = os.path.getsize(self.snapshotFile)
+    except OSError:
+      snapshotSize = 0
+    return journalSize > max(snapshotSize, MIN_JOURNAL_SIZE)
+
+  def compact(self, cache):
+    """ Rewrite the snapshot with the content of the cache, and empty the journal
+
+        :param dict cache: { update time : { LFN : [ SE ] } }
+    """
+    # write to a temporary file in order to avoid corrupted files
+    tmpFile = self.snapshotFile + '.tmp'
+    with open(tmpFile, 'wb') as fd:
+      pickle.dump(cache, fd, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpFile, self.snapshotFile)
+    if os.path.exists(self.journalFile):
+      os.remove(self.journalFile)
@@ -0,0 +1,60 @@
+"""Test the on disk replica cache of the TransformationAgent"""
+
+import datetime
+import os
+import pickle
+
+from DIRAC.TransformationSystem.Utilities.ReplicaCacheFile import ReplicaCacheFile
+
+__RCSID__ = "$Id$"
+
+# pylint: disable=missing-docstring
+
+T1 = datetime.datetime(2020, 1, 1)
+T2 = datetime.datetime(2020, 1, 2)
+
+
+def test_journal(tmpdir):
+  """ The changes are appended to the journal and replayed on the snapshot """
+  snapshot = str(tmpdir.join('ReplicaCache_1.pkl'))
+  cacheFile = ReplicaCacheFile(snapshot)
+  assert cacheFile.load() == {}
+  cacheFile.add(T1, {'/lfn/1': ['SE1'], '/lfn/2': ['SE2']})
+  cacheFile.add(T2, {'/lfn/3': ['SE1']})
+  cacheFile.remove(['/lfn/2'])
+  assert not os.path.exists(snapshot)
+  assert ReplicaCacheFile(snapshot).load() == {T1: {'/lfn/1': ['SE1']}, T2: {'/lfn/3': ['SE1']}}
+
+  cacheFile.expire([T1])
+  cache = ReplicaCacheFile(snapshot).load()
+  assert cache == {T2: {'/lfn/3': ['SE1']}}
+
+  # Replaying the journal on the new snapshot gives the same cache
+  with open(cacheFile.journalFile, 'rb') as fd:
+    journal = fd.read()
+  cacheFile.compact(cache)
+  assert not os.path.exists(cacheFile.journalFile)
+  with open(cacheFile.journalFile, 'wb') as fd:
+    fd.write(journal)
+  assert ReplicaCacheFile(snapshot).load() == cache
+
+  cacheFile.clear()
+  assert ReplicaCacheFile(snapshot).load() == {}
+
+
+def test_formerPickleAndTruncatedJournal(tmpdir):
+  """ The pickle files of the previous versions are read as snapshots, and a truncated record is ignored """
+  snapshot = str(tmpdir.join('ReplicaCache_2.pkl'))
+  with open(snapshot, 'w') as fd:
+    pickle.dump({T1: {'/lfn/1': ['SE1']}}, fd)
+  cacheFile = ReplicaCacheFile(snapshot)
+  cacheFile.add(T2, {'/lfn/2': ['SE2']})
+  with open(cacheFile.journalFile, 'ab') as fd:
+    fd.write(pickle.dumps(('add', T2, {'/lfn/3': ['SE3']}), pickle.HIGHEST_PROTOCOL)[:-5])
+  expected = {T1: {'/lfn/1': ['SE1']}, T2: {'/lfn/2': ['SE2']}}
+  assert cacheFile.load() == expected
+  # The snapshot was rewritten, so that the journal can be appended again
+  assert not os.path.exists(cacheFile.journalFile)
+  cacheFile.remove(['/lfn/1'])
+  assert cacheFile.load() == {T1: {}, T2: {'/lfn/2': ['SE2']}}
+  assert not cacheFile.needsCompaction()
@@ -65,6 +65,9 @@ class JobAgent(AgentModule):
     self.jobCount = 0
     self.matchFailedCount = 0
     self.extraOptions = ''
+    # Maximum number of jobs matched at once for the free slots, and the ones matched but not submitted yet
+    self.jobsPerRequest = 1
+    self.matchedJobs = []
     # Timeleft
     self.timeLeftUtil = None
     self.timeLeftError = ''
@@ -117,6 +120,7 @@ class JobAgent(AgentModule):
     self.minimumTimeLeft = self.am_getOption('MinimumTimeLeft', self.minimumTimeLeft)
     self.stopOnApplicationFailure = self.am_getOption('StopOnApplicationFailure', self.stopOnApplicationFailure)
     self.stopAfterFailedMatches = self.am_getOption('StopAfterFailedMatches', self.stopAfterFailedMatches)
+    self.jobsPerRequest = self.am_getOption('JobsPerRequest', self.jobsPerRequest)
     self.extraOptions = gConfig.getValue('/AgentJobRequirements/ExtraOptions', self.extraOptions)
     # Timeleft
     self.timeLeftUtil = TimeLeft()
@@ -210,7 +214,15 @@ class JobAgent(AgentModule):
 
       # here finally calling the matcher
       start = time.time()
-      jobRequest = MatcherClient().requestJob(ceDict)
+      numJobs = min(availableSlots, self.jobsPerRequest)
+      if numJobs > 1 and len(ceDictList) == 1:
+        jobRequest = MatcherClient().requestJobs(ceDict, numJobs)
+        if jobRequest['OK']:
+          # The other jobs are submitted in the same cycle, in the other free slots
+          self.matchedJobs = jobRequest['Value'][1:]
+          jobRequest = S_OK(jobRequest['Value'][0])
+      else:
+        jobRequest = MatcherClient().requestJob(ceDict)
       matchTime = time.time() - start
       self.log.info('MatcherTime', '= %.2f (s)' % (matchTime))
       if jobRequest['OK']:
@@ -245,7 +257,16 @@ class JobAgent(AgentModule):
     # Reset the Counter
     self.matchFailedCount = 0
 
-    matcherInfo = jobRequest['Value']
+    result = self.__submitMatchedJob(jobRequest['Value'], ceDict, matchTime)
+    while result['OK'] and self.matchedJobs:
+      self.log.info('Submitting a job matched by the same request', '(%d left)' % (len(self.matchedJobs) - 1))
+      result = self.__submitMatchedJob(self.matchedJobs.pop(0), ceDict, matchTime)
+    return result
+
+  #############################################################################
+  def __submitMatchedJob(self, matcherInfo, ceDict, matchTime):
+    """Submit a job returned by the Matcher to the CE.
+    """
     if not self.pilotInfoReportedFlag:
       # Check the flag after the first access to the Matcher
       self.pilotInfoReportedFlag = matcherInfo.get('PilotInfoReportedFlag', False)
@@ -307,7 +328,7 @@ class JobAgent(AgentModule):
       params['Arguments'] += ' ' + self.extraOptions
       params['ExtraOptions'] = self.extraOptions
 
-    self.log.verbose('Job request successful: \n', jobRequest['Value'])
+    self.log.verbose('Job request successful: \n', matcherInfo)
     self.log.info('Received',
                   'JobID=%s, JobType=%s, OwnerDN=%s, JobGroup=%s' % (jobID, jobType, ownerDN, jobGroup))
     self.jobCount += 1
@@ -634,6 +655,11 @@ class JobAgent(AgentModule):
     """ Job Agent finalization method
     """
 
+    # The jobs matched for slots which were not used go back to the task queues
+    for matcherInfo in self.matchedJobs:
+      self._rescheduleFailedJob(matcherInfo['JobID'], 'Job not submitted by the JobAgent', stop=False)
+    self.matchedJobs = []
+
     gridCE = gConfig.getValue('/LocalSite/GridCE', '')
     queue = gConfig.getValue('/LocalSite/CEQueue', '')
     result = PilotManagerClient().setPilotStatus(str(self.pilotReference), 'Done', gridCE,
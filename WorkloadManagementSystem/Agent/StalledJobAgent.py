@@ -108,6 +108,12 @@ for the agent restart
     if not result['OK']:
       self.log.error('Failed to kick stuck jobs', result['Message'])
 
+    # The job counters used for the job limits are corrected, in case of missed changes
+    if self.am_getOption('ReconcileJobCounters', True):
+      result = self.jobDB.reconcileJobCounters()
+      if not result['OK']:
+        self.log.error('Failed to reconcile the job counters', result['Message'])
+
     return S_OK('Stalled Job Agent cycle complete')
 
   #############################################################################
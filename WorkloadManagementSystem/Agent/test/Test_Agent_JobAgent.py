@@ -240,3 +240,32 @@ def test_submitJob(mocker, mockJWInput, expected):
 
   if not result['OK']:
     assert result['Message'] == expected['Message']
+
+
+def test_executeJobsPerRequest(mocker):
+  """ Testing JobAgent().execute() submits all the jobs matched for the free slots in the same cycle
+  """
+
+  mocker.patch("DIRAC.WorkloadManagementSystem.Agent.JobAgent.AgentModule.__init__")
+  mocker.patch("DIRAC.WorkloadManagementSystem.Agent.JobAgent.AgentModule.am_getOption",
+               side_effect=lambda option, default: default)
+  matchedJobs = [{'JobID': jobID} for jobID in (101, 102, 103)]
+  mockMatcher = mocker.patch("DIRAC.WorkloadManagementSystem.Agent.JobAgent.MatcherClient")
+  mockMatcher.return_value.requestJobs.return_value = {'OK': True, 'Value': matchedJobs}
+
+  jobAgent = JobAgent('Test', 'Test1')
+  jobAgent.log = gLogger
+  jobAgent.jobsPerRequest = 5
+  jobAgent.computingElement = MagicMock()
+  jobAgent.computingElement.available.return_value = {'OK': True, 'Value': 3, 'CEInfoDict': {}}
+  jobAgent.computingElement.getDescription.return_value = {'OK': True, 'Value': {}}
+  submitMatchedJob = mocker.patch.object(jobAgent, '_JobAgent__submitMatchedJob',
+                                         return_value={'OK': True, 'Value': 'Job Agent cycle complete'})
+
+  result = jobAgent.execute()
+
+  assert result['OK']
+  mockMatcher.return_value.requestJobs.assert_called_once_with({'PilotReference': 'Unknown', 'PilotBenchmark': 0.0,
+                                                                'PilotInfoReportedFlag': False}, 3)
+  assert [call[0][0] for call in submitMatchedJob.call_args_list] == matchedJobs
+  assert jobAgent.matchedJobs == []
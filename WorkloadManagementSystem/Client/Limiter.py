@@ -10,7 +10,7 @@ from DIRAC import gLogger
 
 from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
-from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
+from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB, LIMITED_JOB_STATES
 
 
 class Limiter(object):
@@ -165,18 +165,10 @@ class Limiter(object):
         self.log.error("Attribute does not exist",
                        "(%s). Check the job limits" % attName)
         continue
-      cK = "Running:%s:%s" % (siteName, attName)
-      data = self.condCache.get(cK)
-      if not data:
-        result = self.jobDB.getCounters(
-            'Jobs', [attName], {
-                'Site': siteName, 'Status': [
-                    'Running', 'Matched', 'Stalled']})
-        if not result['OK']:
-          return result
-        data = result['Value']
-        data = dict([(k[0][attName], k[1]) for k in data])
-        self.condCache.add(cK, 10, data)
+      result = self.__getRunningCounters(siteName, attName)
+      if not result['OK']:
+        return result
+      data = result['Value']
       for attValue in limitsDict[attName]:
         limit = limitsDict[attName][attValue]
         running = data.get(attValue, 0)
@@ -190,6 +182,34 @@ class Limiter(object):
     # negCond is something like : {'JobType': ['Merge']}
     return S_OK(negCond)
 
+  def __getRunningCounters(self, siteName, attName):
+    """ Get the number of jobs counted by the limits at a site, per value of the attribute:
+        from the counters maintained by the JobDB for all the sites if it counts the attribute,
+        otherwise by counting the jobs of the site
+    """
+    if attName in self.jobDB.jobCounterAttributes:
+      counters = self.condCache.get("JobCounters")
+      if counters is None:
+        result = self.jobDB.getJobCounters()
+        if result['OK']:
+          counters = result['Value']
+          self.condCache.add("JobCounters", 10, counters)
+        else:
+          self.log.warn("Can not get the job counters, counting the jobs", result['Message'])
+      if counters is not None:
+        return S_OK(counters.get(siteName, {}).get(attName, {}))
+
+    cK = "Running:%s:%s" % (siteName, attName)
+    data = self.condCache.get(cK)
+    if not data:
+      result = self.jobDB.getCounters('Jobs', [attName], {'Site': siteName, 'Status': LIMITED_JOB_STATES})
+      if not result['OK']:
+        return result
+      data = result['Value']
+      data = dict([(k[0][attName], k[1]) for k in data])
+      self.condCache.add(cK, 10, data)
+    return S_OK(data)
+
   def updateDelayCounters(self, siteName, jid):
     # Get the info from the CS
     siteSection = "%s/%s" % (self.__matchingDelaySection, siteName)
@@ -61,6 +61,16 @@ class Matcher(object):
   def selectJob(self, resourceDescription, credDict):
     """ Main job selection function to find the highest priority job matching the resource capacity
     """
+    jobs = self.selectJobs(resourceDescription, credDict, 1)
+    return jobs[0] if jobs else {}
+
+  def selectJobs(self, resourceDescription, credDict, numJobs):
+    """ Find up to numJobs of the highest priority jobs matching the resource capacity,
+        e.g. for the free slots of a multi-slot pilot. The jobs are taken out of the task queues
+        together, and their status is updated in bulk
+
+        :returns: list of job dictionaries, as the one returned by selectJob
+    """
 
     startTime = time.time()
 
@@ -82,66 +92,74 @@ class Matcher(object):
     self.log.info('Resource description for matching', printDict(toPrintDict))
 
     negativeCond = self.limiter.getNegativeCondForSite(resourceDict['Site'])
-    result = self.tqDB.matchAndGetJob(resourceDict, negativeCond=negativeCond)
+    result = self.tqDB.matchAndGetJobs(resourceDict, numJobs, negativeCond=negativeCond)
 
     if not result['OK']:
       raise RuntimeError(result['Message'])
     result = result['Value']
     if not result['matchFound']:
       self.log.info("No match found")
-      return {}
+      return []
 
-    jobID = result['jobId']
-    resAtt = self.jobDB.getJobAttributes(jobID, ['OwnerDN', 'OwnerGroup', 'Status'])
+    matchedJobIDs = [jobID for jobID, _tqId in result['jobs']]
+    resAtt = self.jobDB.getAttributesForJobList(matchedJobIDs, ['OwnerDN', 'OwnerGroup', 'Status'])
     if not resAtt['OK']:
       raise RuntimeError('Could not retrieve job attributes')
-    if not resAtt['Value']:
-      raise RuntimeError("No attributes returned for job")
-    if not resAtt['Value']['Status'] == 'Waiting':
-      self.log.error('Job matched by the TQ is not in Waiting state', str(jobID))
-      result = self.tqDB.deleteJob(jobID)
-      if not result['OK']:
-        raise RuntimeError(result['Message'])
-      raise RuntimeError("Job %s is not in Waiting state" % str(jobID))
+    jobAttributes = resAtt['Value']
+    jobIDs = []
+    errors = []
+    for jobID in matchedJobIDs:
+      if int(jobID) not in jobAttributes:
+        self.log.error('No attributes returned for job matched by the TQ', str(jobID))
+        errors.append("No attributes returned for job")
+      elif not jobAttributes[int(jobID)]['Status'] == 'Waiting':
+        self.log.error('Job matched by the TQ is not in Waiting state', str(jobID))
+        result = self.tqDB.deleteJob(jobID)
+        if not result['OK']:
+          raise RuntimeError(result['Message'])
+        errors.append("Job %s is not in Waiting state" % str(jobID))
+      else:
+        jobIDs.append(jobID)
+    if not jobIDs:
+      raise RuntimeError(errors[0])
 
-    self._reportStatus(resourceDict, jobID)
+    self._reportStatus(resourceDict, jobIDs)
 
-    result = self.jobDB.getJobJDL(jobID)
+    result = self.jobDB.getJobsJDL(jobIDs)
     if not result['OK']:
       raise RuntimeError("Failed to get the job JDL")
-
-    resultDict = {}
-    resultDict['JDL'] = result['Value']
-    resultDict['JobID'] = jobID
+    jobJDLs = result['Value']
 
     matchTime = time.time() - startTime
     self.log.info("Match time", "[%s]" % str(matchTime))
     gMonitor.addMark("matchTime", matchTime)
 
     # Get some extra stuff into the response returned
-    resOpt = self.jobDB.getJobOptParameters(jobID)
-    if resOpt['OK']:
-      for key, value in resOpt['Value'].items():
-        resultDict[key] = value
-    resAtt = self.jobDB.getJobAttributes(jobID, ['OwnerDN', 'OwnerGroup'])
-    if not resAtt['OK']:
-      raise RuntimeError('Could not retrieve job attributes')
-    if not resAtt['Value']:
-      raise RuntimeError('No attributes returned for job')
+    resOpt = self.jobDB.getJobsOptParameters(jobIDs)
+    optParameters = resOpt['Value'] if resOpt['OK'] else {}
 
     if self.opsHelper.getValue("JobScheduling/CheckMatchingDelay", True):
-      self.limiter.updateDelayCounters(resourceDict['Site'], jobID)
+      for jobID in jobIDs:
+        self.limiter.updateDelayCounters(resourceDict['Site'], jobID)
 
     pilotInfoReportedFlag = resourceDict.get('PilotInfoReportedFlag', False)
     if not pilotInfoReportedFlag:
       self._updatePilotInfo(resourceDict)
-    self._updatePilotJobMapping(resourceDict, jobID)
 
-    resultDict['DN'] = resAtt['Value']['OwnerDN']
-    resultDict['Group'] = resAtt['Value']['OwnerGroup']
-    resultDict['PilotInfoReportedFlag'] = True
+    resultList = []
+    for jobID in jobIDs:
+      self._updatePilotJobMapping(resourceDict, jobID)
+
+      resultDict = {}
+      resultDict['JDL'] = jobJDLs.get(int(jobID), '')
+      resultDict['JobID'] = jobID
+      resultDict.update(optParameters.get(int(jobID), {}))
+      resultDict['DN'] = jobAttributes[int(jobID)]['OwnerDN']
+      resultDict['Group'] = jobAttributes[int(jobID)]['OwnerGroup']
+      resultDict['PilotInfoReportedFlag'] = True
+      resultList.append(resultDict)
 
-    return resultDict
+    return resultList
 
   def _getResourceDict(self, resourceDescription, credDict):
     """ from resourceDescription to resourceDict (just various mods)
@@ -223,7 +241,7 @@ class Matcher(object):
     return resourceDict
 
   def _reportStatus(self, resourceDict, jobID):
-    """ Reports the status of the matched job in jobDB and jobLoggingDB
+    """ Reports the status of the matched job(s) in jobDB and jobLoggingDB
 
         Do not fail if errors happen here
     """
@@ -14,6 +14,7 @@ from DIRAC.DataManagementSystem.Client.test.mock_DM import dm_mock
 from DIRAC import S_OK
 from DIRAC.WorkloadManagementSystem.Client.DownloadInputData import DownloadInputData
 from DIRAC.WorkloadManagementSystem.Client.Matcher import Matcher
+from DIRAC.WorkloadManagementSystem.Client.Limiter import Limiter
 from DIRAC.WorkloadManagementSystem.Client.SandboxStoreClient import SandboxStoreClient
 
 
@@ -148,6 +149,60 @@ class MatcherTestCase(ClientsTestCase):
 
     self.assertEqual(res, resExpected)
 
+  def test_selectJobs(self):
+
+    self.matcher._getResourceDict = MagicMock(return_value={'Site': 'DIRAC.Jenkins.ch', 'Setup': 'LHCb-Certification'})
+    self.matcher.limiter = MagicMock()
+    self.tqDBMock.matchAndGetJobs.return_value = S_OK({'matchFound': True, 'jobs': [(1, 10), (2, 10), (3, 11)]})
+    self.jobDBMock.getAttributesForJobList.return_value = S_OK({
+        1: {'JobID': 1, 'OwnerDN': '/my/DN', 'OwnerGroup': 'myGroup', 'Status': 'Waiting'},
+        2: {'JobID': 2, 'OwnerDN': '/my/DN', 'OwnerGroup': 'myGroup', 'Status': 'Killed'},
+        3: {'JobID': 3, 'OwnerDN': '/other/DN', 'OwnerGroup': 'otherGroup', 'Status': 'Waiting'}})
+    self.jobDBMock.getJobsJDL.return_value = S_OK({1: '[jdl1]', 3: '[jdl3]'})
+    self.jobDBMock.getJobsOptParameters.return_value = S_OK({1: {'SomeParameter': 'aValue'}, 3: {}})
+
+    res = self.matcher.selectJobs({}, {}, 3)
+    self.assertEqual([jobDict['JobID'] for jobDict in res], [1, 3])
+    self.assertEqual(res[0]['JDL'], '[jdl1]')
+    self.assertEqual(res[0]['SomeParameter'], 'aValue')
+    self.assertEqual((res[1]['DN'], res[1]['Group']), ('/other/DN', 'otherGroup'))
+    # The job which is not waiting any more is removed, the status of the others is set at once
+    self.tqDBMock.deleteJob.assert_called_once_with(2)
+    self.assertEqual(self.jobDBMock.setJobAttributes.call_args[0][0], [1, 3])
+    self.assertEqual(self.jlDBMock.addLoggingRecord.call_args[0][0], [1, 3])
+
+    # A single job which is not waiting is an error
+    self.tqDBMock.matchAndGetJobs.return_value = S_OK({'matchFound': True, 'jobs': [(2, 10)]})
+    self.assertRaises(RuntimeError, self.matcher.selectJob, {}, {})
+
+    self.tqDBMock.matchAndGetJobs.return_value = S_OK({'matchFound': False, 'jobs': []})
+    self.assertEqual(self.matcher.selectJob({}, {}), {})
+
+#############################################################################
+
+
+class LimiterTestCase(ClientsTestCase):
+
+  def test_getNegativeCondForSite(self):
+
+    self.opsHelperMock.getValue.side_effect = lambda option, default: option == "JobScheduling/CheckJobLimits"
+    self.opsHelperMock.getSections.return_value = S_OK(['JobType', 'OwnerGroup'])
+    self.opsHelperMock.getOptionsDict.side_effect = lambda section: S_OK({'MCSimulation': '5', 'User': '10'}
+                                                                         if section.endswith('JobType')
+                                                                         else {'lhcb_user': '3'})
+    self.jobDBMock.jobAttributeNames = ['JobID', 'Status', 'Site', 'JobType', 'OwnerGroup']
+    self.jobDBMock.jobCounterAttributes = ['JobType']
+    self.jobDBMock.getJobCounters.return_value = S_OK({'LCG.Limited.ch': {'JobType': {'MCSimulation': 5,
+                                                                                      'User': 9}}})
+    self.jobDBMock.getCounters.return_value = S_OK([({'OwnerGroup': 'lhcb_user'}, 3)])
+    limiter = Limiter(jobDB=self.jobDBMock, opsHelper=self.opsHelperMock)
+
+    self.assertEqual(limiter.getNegativeCondForSite('LCG.Limited.ch'),
+                     {'JobType': ['MCSimulation'], 'OwnerGroup': ['lhcb_user']})
+    # The jobs are only counted in the DB for the attributes which are not in the counters
+    self.jobDBMock.getCounters.assert_called_once()
+    self.assertEqual(self.jobDBMock.getCounters.call_args[0][1], ['OwnerGroup'])
+
 #############################################################################
 
 
@@ -170,6 +225,7 @@ class SandboxStoreTestCaseSuccess(ClientsTestCase):
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase(ClientsTestCase)
   suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(MatcherTestCase))
+  suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(LimiterTestCase))
   suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(DownloadInputDataSuccess))
   suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(SandboxStoreTestCaseSuccess))
   testResult = unittest.TextTestRunner(verbosity=2).run(suite)
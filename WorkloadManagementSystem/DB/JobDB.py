@@ -9,6 +9,9 @@ The following options can be set in ``Systems/WorkloadManagement/<Setup>/Databas
 
 * *MaxRescheduling*:     Set the maximum number of times a job can be rescheduled, default *3*.
 * *CompressJDLs*:        Enable compression of JDLs when they are stored in the database, default *False*.
+* *JobCounterAttributes*: Job attributes for which the jobs in the Matched, Running and Stalled states are
+                        counted per site in the JobCounters table, as used by the job limits of the Matcher,
+                        default *JobType*. An empty list disables the counters.
 
 """
 
@@ -17,6 +20,7 @@ from past.builtins import long
 
 import six
 import zlib
+from collections import defaultdict
 
 from six.moves import range
 import operator
@@ -28,6 +32,7 @@ from DIRAC.Core.Utilities.ClassAd.ClassAdLight import ClassAd
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 from DIRAC.Core.Utilities import Time
 from DIRAC.Core.Utilities.DErrno import EWMSSUBM
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.Core.Utilities.Decorators import deprecated
 from DIRAC.Core.Utilities.ObjectLoader import ObjectLoader
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
@@ -38,6 +43,9 @@ from DIRAC.WorkloadManagementSystem.Client.JobState.JobManifest import JobManife
 from DIRAC.ResourceStatusSystem.Client.SiteStatus import SiteStatus
 from DIRAC.WorkloadManagementSystem.Client import JobStatus
 
+# Jobs in these states are counted by the job limits
+LIMITED_JOB_STATES = [JobStatus.RUNNING, JobStatus.MATCHED, JobStatus.STALLED]
+
 #############################################################################
 
 
@@ -63,6 +71,7 @@ class JobDB(DB):
     self.getDIRACPlatform = res['Value']
 
     self.jobAttributeNames = []
+    self.jobCounterAttributes = []
 
     self.siteClient = SiteStatus()
 
@@ -74,6 +83,14 @@ class JobDB(DB):
 
     self.jdl2DBParameters = ['JobName', 'JobType', 'JobGroup']
 
+    self.jobCounterAttributes = [attrName for attrName in self.getCSOption('JobCounterAttributes', ['JobType'])
+                                 if attrName in self.jobAttributeNames]
+    if self.jobCounterAttributes:
+      result = self.__initializeJobCounters()
+      if not result['OK']:
+        self.log.error('JobDB: Can not create the JobCounters table, the jobs are not counted', result['Message'])
+        self.jobCounterAttributes = []
+
     self.log.info("MaxReschedule", self.maxRescheduling)
     self.log.info("CompressJDLs", self.compressJDLs)
     self.log.info("==================================================")
@@ -97,6 +114,23 @@ class JobDB(DB):
 
     return S_OK()
 
+  def __initializeJobCounters(self):
+    """ Create the JobCounters table, if it does not exist yet
+    """
+    result = self._query("SHOW TABLES LIKE 'JobCounters'")
+    if not result['OK']:
+      return result
+    if result['Value']:
+      return S_OK()
+    result = self._createTables({'JobCounters': {'Fields': {'Site': 'VARCHAR(100) NOT NULL',
+                                                            'Attribute': 'VARCHAR(32) NOT NULL',
+                                                            'Value': 'VARCHAR(128) NOT NULL',
+                                                            'Jobs': 'INT(11) NOT NULL DEFAULT 0'},
+                                                 'PrimaryKey': ['Site', 'Attribute', 'Value']}})
+    if not result['OK']:
+      return result
+    return self.reconcileJobCounters()
+
 #############################################################################
   def getAttributesForJobList(self, jobIDList, attrList=None):
     """ Get attributes for the jobs in the the jobIDList.
@@ -467,6 +501,30 @@ class JobDB(DB):
     else:
       return S_ERROR('JobDB.getJobOptParameters: failed to retrieve parameters')
 
+#############################################################################
+  def getJobsOptParameters(self, jobIDList):
+    """ Get all the optimizer parameters of several jobs
+
+        :param list jobIDList: job IDs
+        :return: S_OK( { jobID : { name : value } } ) / S_ERROR
+    """
+    resultDict = dict((int(jobID), {}) for jobID in jobIDList)
+    if not resultDict:
+      return S_OK(resultDict)
+
+    cmd = "SELECT JobID, Name, Value from OptimizerParameters WHERE JobID in (%s)" % \
+        ','.join(str(jobID) for jobID in resultDict)
+    result = self._query(cmd)
+    if not result['OK']:
+      return S_ERROR('JobDB.getJobsOptParameters: failed to retrieve parameters')
+    for jobID, name, value in result['Value']:
+      try:
+        value = value.tostring()
+      except BaseException:
+        pass
+      resultDict[int(jobID)][name] = value
+    return S_OK(resultDict)
+
 #############################################################################
 
   def getInputData(self, jobID):
@@ -597,6 +655,10 @@ class JobDB(DB):
     if attrName not in self.jobAttributeNames:
       return S_ERROR(EWMSSUBM, 'Request to set non-existing job attribute')
 
+    if attrName == 'Status' and self.jobCounterAttributes:
+      # The job counters are updated with the status
+      return self.setJobAttributes(jobID, [attrName], [attrValue], update=update, myDate=myDate)
+
     ret = self._escapeString(jobID)
     if not ret['OK']:
       return ret
@@ -664,13 +726,127 @@ class JobDB(DB):
     if not attr:
       return S_ERROR('JobDB.setAttributes: Nothing to do')
 
-    cmd = 'UPDATE Jobs SET %s WHERE JobID in ( %s )' % (', '.join(attr), ', '.join(jIDList))
-
+    condition = 'JobID in ( %s )' % ', '.join(jIDList)
     if myDate:
-      cmd += ' AND LastUpdateTime < %s' % myDate
+      condition += ' AND LastUpdateTime < %s' % myDate
+    cmd = 'UPDATE Jobs SET %s WHERE %s' % (', '.join(attr), condition)
 
+    if self.jobCounterAttributes and ('Status' in attrNames or 'Site' in attrNames):
+      return self.__updateJobsAndCounters(cmd, condition, dict(zip(attrNames, attrValues)))
     return self._transaction([cmd])
 
+  def __updateJobsAndCounters(self, cmd, condition, attrDict):
+    """ Update the attributes of jobs, and the counters of the jobs which enter or leave
+        the LIMITED_JOB_STATES in the same transaction
+
+        :param str cmd: UPDATE command of the Jobs table
+        :param str condition: condition of the UPDATE command
+        :param dict attrDict: new values of the attributes
+        :return: S_OK( [ ( cmd, number of jobs updated ) ] ) / S_ERROR, as _transaction
+    """
+    counterAttributes = ['Site', 'Status'] + self.jobCounterAttributes
+    result = self.transactionStart()
+    if not result['OK']:
+      return result
+    # Lock the jobs, so that their state is known until the end of the transaction
+    result = self._query('SELECT %s FROM Jobs WHERE %s FOR UPDATE' % (', '.join(counterAttributes), condition))
+    if result['OK']:
+      deltas = defaultdict(int)
+      for row in result['Value']:
+        oldValues = dict(zip(counterAttributes, (str(value) for value in row)))
+        newValues = dict(oldValues)
+        newValues.update((name, str(attrDict[name])) for name in counterAttributes if name in attrDict)
+        for values, delta in ((oldValues, -1), (newValues, 1)):
+          if values['Status'] in LIMITED_JOB_STATES:
+            for attrName in self.jobCounterAttributes:
+              deltas[(values['Site'], attrName, values[attrName])] += delta
+      result = self._update(cmd)
+      if result['OK']:
+        updateResult = S_OK([(cmd, result['Value'])])
+        result = self.__addToJobCounters(deltas)
+    if not result['OK']:
+      self.transactionRollback()
+      return result
+    result = self.transactionCommit()
+    if not result['OK']:
+      return result
+    return updateResult
+
+  def __addToJobCounters(self, deltas):
+    """ Add to the counters of jobs
+
+        :param dict deltas: ( site, attribute, value ) -> number of jobs to add
+    """
+    values = []
+    # The rows are always locked in the same order, to avoid deadlocks between concurrent updates
+    for (site, attrName, attrValue), delta in sorted(deltas.items()):
+      if not delta:
+        continue
+      result = self._escapeValues([site, attrName, attrValue])
+      if not result['OK']:
+        return result
+      values.append("(%s, %d)" % (', '.join(result['Value']), delta))
+    if not values:
+      return S_OK(0)
+    return self._update("INSERT INTO JobCounters (Site, Attribute, Value, Jobs) VALUES %s "
+                        "ON DUPLICATE KEY UPDATE Jobs = Jobs + VALUES(Jobs)" % ', '.join(values))
+
+  def getJobCounters(self):
+    """ Get the numbers of jobs in the LIMITED_JOB_STATES, per site and value of the JobCounterAttributes
+
+        :return: S_OK( { site : { attribute : { value : number of jobs } } } ) / S_ERROR
+    """
+    if not self.jobCounterAttributes:
+      return S_ERROR('JobDB: the jobs are not counted')
+    result = self._query("SELECT Site, Attribute, Value, Jobs FROM JobCounters")
+    if not result['OK']:
+      return result
+    counters = {}
+    for site, attrName, attrValue, jobs in result['Value']:
+      counters.setdefault(site, {}).setdefault(attrName, {})[attrValue] = max(int(jobs), 0)
+    return S_OK(counters)
+
+  def reconcileJobCounters(self):
+    """ Recompute the job counters from the Jobs table, to correct the changes of status
+        that were not counted, e.g. done with direct SQL updates
+
+        The jobs and the counters are read without locking them, in the same snapshot, and
+        the differences are added to the counters: the changes done in the meantime, which
+        are added to the counters as well, are thus kept.
+    """
+    if not self.jobCounterAttributes:
+      return S_OK()
+    result = self.transactionStart()
+    if not result['OK']:
+      return result
+    deltas = defaultdict(int)
+    for attrName in self.jobCounterAttributes:
+      result = self.getCounters('Jobs', ['Site', attrName], {'Status': LIMITED_JOB_STATES})
+      if not result['OK']:
+        break
+      # The values as in __updateJobsAndCounters
+      for attrDict, jobs in result['Value']:
+        deltas[(str(attrDict['Site']), attrName, str(attrDict[attrName]))] += int(jobs)
+    else:
+      result = self._query("SELECT Site, Attribute, Value, Jobs FROM JobCounters")
+      if result['OK']:
+        for site, attrName, attrValue, jobs in result['Value']:
+          if attrName in self.jobCounterAttributes:
+            deltas[(site, attrName, attrValue)] -= int(jobs)
+    if not result['OK']:
+      self.transactionRollback()
+      return result
+    # Only reading: the end of the snapshot
+    result = self.transactionCommit()
+    if not result['OK']:
+      return result
+    result = self.__addToJobCounters(deltas)
+    if not result['OK']:
+      return result
+    if result['Value']:
+      self.log.info('Job counters corrected', '%s' % dict((key, delta) for key, delta in deltas.items() if delta))
+    return S_OK()
+
 #############################################################################
   def setJobStatus(self, jobID, status='', minor='', application=''):
     """ Set status of the job specified by its jobID
@@ -961,6 +1137,24 @@ class JobDB(DB):
       return S_OK(self.__extractJDL(jdl[0][0]))
     return result
 
+#############################################################################
+  def getJobsJDL(self, jobIDList, original=False):
+    """ Get the JDLs of several jobs in one query. By default the current job JDLs
+        are returned. If 'original' argument is True, original JDLs are returned
+
+        :param list jobIDList: job IDs
+        :return: S_OK( { jobID : JDL } ), without the jobs having no JDL / S_ERROR
+    """
+    if not jobIDList:
+      return S_OK({})
+
+    cmd = "SELECT JobID, %s FROM JobJDLs WHERE JobID in (%s)" % ('OriginalJDL' if original else 'JDL',
+                                                                 ','.join(str(int(jobID)) for jobID in jobIDList))
+    result = self._query(cmd)
+    if not result['OK']:
+      return result
+    return S_OK(dict((int(jobID), self.__extractJDL(jdl)) for jobID, jdl in result['Value']))
+
 #############################################################################
   def insertNewJobIntoDB(self, jdl, owner, ownerDN, ownerGroup, diracSetup,
                          initialStatus=JobStatus.RECEIVED,
@@ -1915,7 +2109,10 @@ class JobDB(DB):
       return ret
     e_jobID = ret['Value']
 
-    req = "UPDATE Jobs SET HeartBeatTime=UTC_TIMESTAMP(), Status='Running' WHERE JobID=%s" % e_jobID
+    # A late heart beat does not bring back to Running a job in a final state, as this is not counted
+    # in the JobCounters: only the jobs in the LIMITED_JOB_STATES go to Running
+    req = "UPDATE Jobs SET HeartBeatTime=UTC_TIMESTAMP(), Status=IF(Status IN (%s),'Running',Status) \
+WHERE JobID=%s" % (self.__limitedStatesSQL(), e_jobID)
     result = self._update(req)
     if not result['OK']:
       return S_ERROR('Failed to set the heart beat time: ' + result['Message'])
@@ -1958,6 +2155,91 @@ class JobDB(DB):
       return S_OK()
     return S_ERROR('Failed to store some or all the parameters')
 
+#####################################################################################
+  def setHeartBeatDataBulk(self, heartBeats, chunkSize=1000):
+    """ Add the heart beat data of several jobs to the database, with one statement per table
+        for each chunk of jobs
+
+        :param dict heartBeats: { jobID : ( last heart beat time, staticDataDict,
+                                            [ ( heart beat time, dynamicDataDict ) ] ) }
+                                with the times as UTC datetimes
+        :param int chunkSize: number of jobs per statement
+        :return: S_OK() / S_ERROR() with the failed job IDs in the 'Failed' key
+    """
+    failed = []
+    for jobIDs in breakListIntoChunks(sorted(heartBeats), chunkSize):
+      result = self.__setHeartBeatDataChunk(dict((jobID, heartBeats[jobID]) for jobID in jobIDs))
+      if not result['OK']:
+        self.log.warn('Failed to set the heart beat data', '%d jobs: %s' % (len(jobIDs), result['Message']))
+        failed.extend(jobIDs)
+    if failed:
+      result = S_ERROR('Failed to store the heart beat data of %d jobs' % len(failed))
+      result['Failed'] = failed
+      return result
+    return S_OK()
+
+  def __setHeartBeatDataChunk(self, heartBeats):
+    """ Write the heart beat data of a chunk of jobs, see setHeartBeatDataBulk
+    """
+    jobIDs = [str(int(jobID)) for jobID in heartBeats]
+    timeCases = ' '.join("WHEN %s THEN '%s'" % (int(jobID), heartBeatTime.strftime('%Y-%m-%d %H:%M:%S'))
+                         for jobID, (heartBeatTime, _staticData, _dynamicData) in heartBeats.items())
+    # The heart beats are written after a delay, during which the job may have reached a final state:
+    # only the jobs still in the LIMITED_JOB_STATES go to Running, which keeps the JobCounters right
+    req = "UPDATE Jobs SET HeartBeatTime=CASE JobID %s END, Status=IF(Status IN (%s),'Running',Status) \
+WHERE JobID IN (%s)" % (timeCases, self.__limitedStatesSQL(), ','.join(jobIDs))
+    result = self._update(req)
+    if not result['OK']:
+      return S_ERROR('Failed to set the heart beat time: ' + result['Message'])
+
+    parameterList = []
+    loggingInfo = {}
+    for jobID, (_heartBeatTime, staticData, dynamicData) in heartBeats.items():
+      for name, value in staticData.items():
+        result = self.__escapePair(name, value)
+        if not result['OK']:
+          return result
+        parameterList.append('(%s,%s,%s)' % ((int(jobID), ) + result['Value']))
+      # The heart beats received in the same second are one entry of the log
+      for heartBeatTime, dynamicDataDict in dynamicData:
+        for name, value in dynamicDataDict.items():
+          loggingInfo[(int(jobID), name, heartBeatTime.strftime('%Y-%m-%d %H:%M:%S'))] = value
+
+    # FIXME: It is rather not optimal to use parameters to store the heartbeat info, must find a proper solution
+    if parameterList:
+      result = self._update('REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ','.join(parameterList))
+      if not result['OK']:
+        return result
+
+    valueList = []
+    for (jobID, name, heartBeatTime), value in loggingInfo.items():
+      result = self.__escapePair(name, value)
+      if not result['OK']:
+        return result
+      valueList.append("(%s,%s,%s,'%s')" % ((jobID, ) + result['Value'] + (heartBeatTime, )))
+    if valueList:
+      req = "INSERT INTO HeartBeatLoggingInfo (JobID,Name,Value,HeartBeatTime) VALUES %s" % ','.join(valueList)
+      req += " ON DUPLICATE KEY UPDATE Value=VALUES(Value)"
+      result = self._update(req)
+      if not result['OK']:
+        return result
+    return S_OK()
+
+  @staticmethod
+  def __limitedStatesSQL():
+    """ The LIMITED_JOB_STATES as an SQL list """
+    return ','.join("'%s'" % status for status in LIMITED_JOB_STATES)
+
+  def __escapePair(self, name, value):
+    """ Escape the name and the value of a parameter """
+    escaped = []
+    for item in (name, value):
+      result = self._escapeString(item)
+      if not result['OK']:
+        return result
+      escaped.append(result['Value'])
+    return S_OK(tuple(escaped))
+
 #####################################################################################
   def getHeartBeatData(self, jobID):
     """ Retrieve the job's heart beat data
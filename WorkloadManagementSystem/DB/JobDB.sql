@@ -167,3 +167,13 @@ CREATE TABLE `JobCommands` (
   PRIMARY KEY (`JobID`,`Arguments`,`ReceptionTime`),
   FOREIGN KEY (`JobID`) REFERENCES `Jobs`(`JobID`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- ------------------------------------------------------------------------------
+DROP TABLE IF EXISTS `JobCounters`;
+CREATE TABLE `JobCounters` (
+  `Site` VARCHAR(100) NOT NULL,
+  `Attribute` VARCHAR(32) NOT NULL,
+  `Value` VARCHAR(128) NOT NULL,
+  `Jobs` INT(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`Site`,`Attribute`,`Value`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
@@ -44,7 +44,8 @@ class JobLoggingDB(DB):
         Optionally the time stamp of the status can
         be provided in a form of a string in a format '%Y-%m-%d %H:%M:%S' or
         as datetime.datetime object. If the time stamp is not provided the current
-        UTC time is used.
+        UTC time is used. jobID can also be a list of job IDs, to add the same
+        record for all of them in one statement.
     """
 
     event = 'status/minor/app=%s/%s/%s' % (status, minor, application)
@@ -78,10 +79,14 @@ class JobLoggingDB(DB):
         epoc = time.mktime(_date.timetuple()) - MAGIC_EPOC_NUMBER
         time_order = round(epoc, 3)
 
+    jobIDList = jobID if isinstance(jobID, (list, tuple)) else [jobID]
+    if not jobIDList:
+      return S_OK(0)
+    values = ["(%d,'%s','%s','%s','%s',%f,'%s')" % (int(jID), status, minor, application[:255],
+                                                     str(_date), time_order, source)
+              for jID in jobIDList]
     cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-        (int(jobID), status, minor, application[:255],
-         str(_date), time_order, source)
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES " + ",".join(values)
 
     return self._update(cmd)
 
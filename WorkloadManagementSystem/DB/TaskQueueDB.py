@@ -7,29 +7,24 @@ from past.builtins import long
 import six
 import random
 import string
+import threading
 
 from DIRAC import gConfig, S_OK, S_ERROR
 from DIRAC.Core.Base.DB import DB
 from DIRAC.Core.Utilities import List
 from DIRAC.Core.Utilities.PrettyPrint import printDict
 from DIRAC.Core.Utilities.DictCache import DictCache
+from DIRAC.Core.Utilities.Time import monotonic
 from DIRAC.Core.Security import Properties
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.ConfigurationSystem.Client.Helpers import Registry
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex, \
+    singleValueDefFields, multiValueDefFields, multiValueMatchFields, bannedJobMatchFields
 
 DEFAULT_GROUP_SHARE = 1000
 TQ_MIN_SHARE = 0.001
 
-# For checks at insertion time, and not only
-singleValueDefFields = ('OwnerDN', 'OwnerGroup', 'Setup', 'CPUTime')
-multiValueDefFields = ('Sites', 'GridCEs', 'GridMiddlewares', 'BannedSites',
-                       'Platforms', 'PilotTypes', 'SubmitPools', 'JobTypes', 'Tags')
-
-# Used for matching
-multiValueMatchFields = ('GridCE', 'Site', 'GridMiddleware', 'Platform',
-                         'PilotType', 'SubmitPool', 'JobType', 'Tag')
-bannedJobMatchFields = ('Site', )
 mandatoryMatchFields = ('Setup', 'CPUTime')
 priorityIgnoredFields = ('Sites', 'BannedSites')
 
@@ -62,6 +57,10 @@ class TaskQueueDB(DB):
     self.__opsHelper = Operations()
     self.__ensureInsertionIsSingle = False
     self.__sharesCorrector = SharesCorrector(self.__opsHelper)
+    # In memory index of the task queues used for the matching, and time of its last synchronization
+    self.__tqIndex = TaskQueueIndex()
+    self.__tqIndexLock = threading.Lock()
+    self.__tqIndexSyncTime = None
     result = self.__initializeDB()
     if not result['OK']:
       raise Exception("Can't create tables: %s" % result['Message'])
@@ -88,6 +87,9 @@ class TaskQueueDB(DB):
   def getValidPilotTypes(self):
     return self.__getCSOption("AllPilotTypes", ['private'])
 
+  def __useTaskQueueIndex(self):
+    return self.__getCSOption("UseTaskQueueIndex", True)
+
   def __initializeDB(self):
     """
     Create the tables
@@ -317,6 +319,7 @@ class TaskQueueDB(DB):
         "DELETE FROM `tq_TaskQueues` WHERE TQId in ( %s )" % ','.join(orphanedTQs), conn=connObj)
     if not result['OK']:
       return result
+    self.__tqIndex.remove(orphanedTQs)
     return S_OK()
 
   def __setTaskQueueEnabled(self, tqId, enabled=True, connObj=False):
@@ -395,6 +398,9 @@ class TaskQueueDB(DB):
         self.recalculateTQSharesForEntity(tqDefDict['OwnerDN'], tqDefDict['OwnerGroup'], connObj=connObj)
     finally:
       self.__setTaskQueueEnabled(tqId, True)
+      if newTQ:
+        # The new task queue is added to the index by the next synchronization
+        self.__tqIndexSyncTime = None
     return S_OK()
 
   def __insertJobInTaskQueue(self, jobId, tqId, jobPriority, checkTQExists=True, connObj=False):
@@ -513,11 +519,28 @@ ORDER BY COUNT( `tq_Jobs`.JobID ) ASC" % (sqlCmd, result['Value'])
         :param dict tqDefDict: dict for TQ definition
         :returns: S_OK() / S_ERROR
     """
+    retVal = self.matchAndGetJobs(tqMatchDict, 1, numJobsPerTry=numJobsPerTry, numQueuesPerTry=numQueuesPerTry,
+                                  negativeCond=negativeCond)
+    if not retVal['OK']:
+      return retVal
+    matchDict = retVal['Value']
+    jobs = matchDict.pop('jobs')
+    if jobs:
+      matchDict['jobId'], matchDict['taskQueueId'] = jobs[0]
+    return S_OK(matchDict)
+
+  def matchAndGetJobs(self, tqMatchDict, numJobs, numJobsPerTry=50, numQueuesPerTry=10, negativeCond=None):
+    """ Match up to numJobs jobs based on requirements, and take them out of their task queues
+
+        :param dict tqMatchDict: resource description
+        :param int numJobs: maximum number of jobs to get
+        :returns: S_OK( { 'matchFound' : bool, 'jobs' : [ ( jobId, tqId ) ], 'tqMatch' : dict } ) / S_ERROR
+    """
     if negativeCond is None:
       negativeCond = {}
     # Make a copy to avoid modification of original if escaping needs to be done
-    tqMatchDict = dict(tqMatchDict)
-    retVal = self._checkMatchDefinition(tqMatchDict)
+    escapedMatchDict = dict(tqMatchDict)
+    retVal = self._checkMatchDefinition(escapedMatchDict)
     if not retVal['OK']:
       self.log.error("TQ match request check failed", retVal['Message'])
       return retVal
@@ -525,32 +548,29 @@ ORDER BY COUNT( `tq_Jobs`.JobID ) ASC" % (sqlCmd, result['Value'])
     if not retVal['OK']:
       return S_ERROR("Can't connect to DB: %s" % retVal['Message'])
     connObj = retVal['Value']
-    preJobSQL = "SELECT `tq_Jobs`.JobId, `tq_Jobs`.TQId \
-FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s"
+    # The priority is chosen randomly amongst the jobs of the TQ, and then the jobs amongst the ones
+    # with the lowest ID having this priority. The priority is chosen by its own query, as RAND()
+    # in a subquery would be evaluated again for each job
     prioSQL = "SELECT `tq_Jobs`.Priority FROM `tq_Jobs` \
 WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
-    postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % numJobsPerTry
+    jobSQL = "SELECT `tq_Jobs`.JobId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %(tqId)s AND `tq_Jobs`.Priority = %(prio)s"
+    if 'JobID' in tqMatchDict:
+      # A certain JobID is required by the resource, so all TQ are to be considered
+      jobSQL += " AND `tq_Jobs`.JobId = %s" % escapedMatchDict['JobID']
+      numQueuesPerTry = 0
+      negativeCond = {}
+    jobSQL += " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % max(numJobsPerTry, numJobs)
+    jobs = []
     for _ in xrange(self.__maxMatchRetry):
       noJobsFound = False
-      if 'JobID' in tqMatchDict:
-        # A certain JobID is required by the resource, so all TQ are to be considered
-        retVal = self.matchAndGetTaskQueue(tqMatchDict,
-                                           numQueuesToGet=0,
-                                           skipMatchDictDef=True,
-                                           connObj=connObj)
-        preJobSQL = "%s AND `tq_Jobs`.JobId = %s " % (preJobSQL, tqMatchDict['JobID'])
-      else:
-        retVal = self.matchAndGetTaskQueue(tqMatchDict,
-                                           numQueuesToGet=numQueuesPerTry,
-                                           skipMatchDictDef=True,
-                                           negativeCond=negativeCond,
-                                           connObj=connObj)
+      retVal = self.__matchTaskQueues(tqMatchDict, escapedMatchDict, numQueuesToGet=numQueuesPerTry,
+                                      negativeCond=negativeCond, connObj=connObj)
       if not retVal['OK']:
         return retVal
       tqList = retVal['Value']
       if not tqList:
         self.log.info("No TQ matches requirements")
-        return S_OK({'matchFound': False, 'tqMatch': tqMatchDict})
+        return S_OK({'matchFound': bool(jobs), 'jobs': jobs, 'tqMatch': escapedMatchDict})
       for tqId, tqOwnerDN, tqOwnerGroup in tqList:
         self.log.info("Trying to extract jobs from TQ", tqId)
         retVal = self._query(prioSQL % tqId, conn=connObj)
@@ -560,34 +580,75 @@ WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
           noJobsFound = True
           continue
         prio = retVal['Value'][0][0]
-        retVal = self._query("%s %s" % (preJobSQL % (tqId, prio), postJobSQL), conn=connObj)
+        retVal = self._query(jobSQL % {'tqId': tqId, 'prio': prio}, conn=connObj)
         if not retVal['OK']:
-          return S_ERROR("Can't begin transaction for matching job: %s" % retVal['Message'])
-        jobTQList = [(row[0], row[1]) for row in retVal['Value']]
-        if not jobTQList:
+          return S_ERROR("Can't retrieve jobs for matching: %s" % retVal['Message'])
+        jobList = [row[0] for row in retVal['Value']]
+        if not jobList:
+          noJobsFound = True
           self.log.info("Task queue seems to be empty, triggering a cleaning of", tqId)
           self.__deleteTQWithDelay.add(tqId, 300, (tqId, tqOwnerDN, tqOwnerGroup))
-        while jobTQList:
-          jobId, tqId = jobTQList.pop(random.randint(0, len(jobTQList) - 1))
-          self.log.info("Trying to extract job from TQ",
-                        "%s : %s" % (jobId, tqId))
-          retVal = self.deleteJob(jobId, connObj=connObj)
+          continue
+        while jobList and len(jobs) < numJobs:
+          jobIds = [jobList.pop(random.randint(0, len(jobList) - 1))
+                    for _ in xrange(min(numJobs - len(jobs), len(jobList)))]
+          self.log.info("Trying to extract jobs from TQ",
+                        "%s : %s" % (",".join(str(jobId) for jobId in jobIds), tqId))
+          retVal = self.__takeJobsOutOfTQ(jobIds, tqId, connObj=connObj)
           if not retVal['OK']:
-            msgFix = "Could not take job"
-            msgVar = " %s out from the TQ %s: %s" % (jobId, tqId, retVal['Message'])
+            msgFix = "Could not take jobs"
+            msgVar = " %s out from the TQ %s: %s" % (jobIds, tqId, retVal['Message'])
             self.log.error(msgFix, msgVar)
             return S_ERROR(msgFix + msgVar)
           if retVal['Value']:
-            self.log.info("Extracted job with prio from TQ",
-                          "(%s : %s : %s)" % (jobId, prio, tqId))
-            return S_OK({'matchFound': True, 'jobId': jobId, 'taskQueueId': tqId, 'tqMatch': tqMatchDict})
-        self.log.info("No jobs could be extracted from TQ", tqId)
+            self.log.info("Extracted jobs from TQ", "(%s : %s)" % (retVal['Value'], tqId))
+            self.__deleteTQWithDelay.add(tqId, 300, (tqId, tqOwnerDN, tqOwnerGroup))
+            jobs.extend((jobId, tqId) for jobId in retVal['Value'])
+        if len(jobs) >= numJobs:
+          break
+        self.log.info("No more jobs could be extracted from TQ", tqId)
+      if jobs:
+        return S_OK({'matchFound': True, 'jobs': jobs, 'tqMatch': escapedMatchDict})
     if noJobsFound:
-      return S_OK({'matchFound': False, 'tqMatch': tqMatchDict})
+      return S_OK({'matchFound': False, 'jobs': jobs, 'tqMatch': escapedMatchDict})
 
     self.log.info("Could not find a match after %s match retries" % self.__maxMatchRetry)
     return S_ERROR("Could not find a match after %s match retries" % self.__maxMatchRetry)
 
+  def __takeJobsOutOfTQ(self, jobIds, tqId, connObj=False):
+    """ Delete jobs from a task queue. Only one matcher can take a job out of the TQ:
+        the jobs deleted by another one in the meantime are not returned
+
+        :param list jobIds: IDs of the jobs to take
+        :param int tqId: task queue ID
+        :returns: S_OK( list of the IDs of the jobs taken ) / S_ERROR
+    """
+    if len(jobIds) == 1:
+      retVal = self._update("DELETE FROM `tq_Jobs` WHERE JobId = %s AND TQId = %s" % (jobIds[0], tqId),
+                            conn=connObj)
+      if not retVal['OK']:
+        return retVal
+      return S_OK(jobIds if retVal['Value'] else [])
+
+    # The jobs still in the TQ are locked, and deleted in the same transaction
+    retVal = self.transactionStart()
+    if not retVal['OK']:
+      return retVal
+    retVal = self._query("SELECT JobId FROM `tq_Jobs` WHERE TQId = %s AND JobId IN ( %s ) FOR UPDATE" %
+                         (tqId, ", ".join(str(jobId) for jobId in jobIds)), conn=connObj)
+    if retVal['OK']:
+      takenIds = [row[0] for row in retVal['Value']]
+      if takenIds:
+        retVal = self._update("DELETE FROM `tq_Jobs` WHERE TQId = %s AND JobId IN ( %s )" %
+                              (tqId, ", ".join(str(jobId) for jobId in takenIds)), conn=connObj)
+    if not retVal['OK']:
+      self.transactionRollback()
+      return retVal
+    retVal = self.transactionCommit()
+    if not retVal['OK']:
+      return retVal
+    return S_OK(takenIds)
+
   def matchAndGetTaskQueue(self, tqMatchDict, numQueuesToGet=1, skipMatchDictDef=False,
                            negativeCond=None, connObj=False):
     """ Get a queue that matches the requirements
@@ -595,12 +656,30 @@ WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
     if negativeCond is None:
       negativeCond = {}
     # Make a copy to avoid modification of original if escaping needs to be done
-    tqMatchDict = dict(tqMatchDict)
+    escapedMatchDict = dict(tqMatchDict)
     if not skipMatchDictDef:
-      retVal = self._checkMatchDefinition(tqMatchDict)
+      retVal = self._checkMatchDefinition(escapedMatchDict)
       if not retVal['OK']:
         return retVal
-    retVal = self.__generateTQMatchSQL(tqMatchDict, numQueuesToGet=numQueuesToGet, negativeCond=negativeCond)
+    else:
+      # The values have already been escaped, they can only be used in SQL
+      tqMatchDict = None
+    return self.__matchTaskQueues(tqMatchDict, escapedMatchDict, numQueuesToGet=numQueuesToGet,
+                                  negativeCond=negativeCond, connObj=connObj)
+
+  def __matchTaskQueues(self, tqMatchDict, escapedMatchDict, numQueuesToGet=1, negativeCond=None, connObj=False):
+    """ Get the task queues matching the requirements, using the task queue index if possible
+
+        :param dict tqMatchDict: match requirements, None if only the escaped ones are known
+        :param dict escapedMatchDict: match requirements, checked and escaped for SQL
+        :returns: S_OK( [ ( tqId, OwnerDN, OwnerGroup ) ] ) / S_ERROR
+    """
+    if tqMatchDict is not None and self.__useTaskQueueIndex():
+      retVal = self.__syncTaskQueueIndex(connObj=connObj)
+      if retVal['OK']:
+        return self.__tqIndex.match(tqMatchDict, numQueuesToGet=numQueuesToGet, negativeCond=negativeCond)
+      self.log.warn("Could not synchronize the task queue index, matching in the DB", retVal['Message'])
+    retVal = self.__generateTQMatchSQL(escapedMatchDict, numQueuesToGet=numQueuesToGet, negativeCond=negativeCond)
     if not retVal['OK']:
       return retVal
     matchSQL = retVal['Value']
@@ -609,6 +688,60 @@ WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
       return retVal
     return S_OK([(row[0], row[1], row[2]) for row in retVal['Value']])
 
+  def __syncTaskQueueIndex(self, connObj=False):
+    """ Add to the task queue index the new enabled task queues, remove the deleted ones
+        and update the priorities, at most every TaskQueueIndexSyncPeriod seconds
+    """
+    with self.__tqIndexLock:
+      syncTime = self.__tqIndexSyncTime
+      if syncTime is not None and monotonic() - syncTime < self.__getCSOption("TaskQueueIndexSyncPeriod", 2):
+        return S_OK()
+      syncTime = monotonic()
+      retVal = self._query("SELECT TQId, Enabled, Priority FROM `tq_TaskQueues`", conn=connObj)
+      if not retVal['OK']:
+        return retVal
+      indexedTQs = self.__tqIndex.getTQIds()
+      priorities = {}
+      newTQs = []
+      for tqId, enabled, priority in retVal['Value']:
+        priorities[tqId] = priority
+        # Disabled task queues may still be in creation
+        if tqId not in indexedTQs and enabled >= 1:
+          newTQs.append(tqId)
+      self.__tqIndex.remove(indexedTQs.difference(priorities))
+      if newTQs:
+        retVal = self.__getTaskQueueDefinitions(newTQs, connObj=connObj)
+        if not retVal['OK']:
+          return retVal
+        self.__tqIndex.update(retVal['Value'])
+      self.__tqIndex.setPriorities(priorities)
+      self.__tqIndexSyncTime = syncTime
+    return S_OK()
+
+  def __getTaskQueueDefinitions(self, tqIdList, connObj=False):
+    """ Get the definition of task queues, without the number of jobs
+
+        :param list tqIdList: task queue IDs
+        :returns: S_OK( { tqId: definition dict } ) / S_ERROR
+    """
+    sqlFields = ('TQId', 'Priority') + singleValueDefFields
+    sqlTQCond = "TQId in ( %s )" % ", ".join([str(tqId) for tqId in tqIdList])
+    retVal = self._query("SELECT %s FROM `tq_TaskQueues` WHERE %s" % (", ".join(sqlFields), sqlTQCond),
+                         conn=connObj)
+    if not retVal['OK']:
+      return retVal
+    tqData = {}
+    for record in retVal['Value']:
+      tqData[record[0]] = dict(zip(sqlFields[1:], record[1:]))
+    for field in multiValueDefFields:
+      retVal = self._query("SELECT TQId, Value FROM `tq_TQTo%s` WHERE %s" % (field, sqlTQCond), conn=connObj)
+      if not retVal['OK']:
+        return retVal
+      for tqId, value in retVal['Value']:
+        if tqId in tqData:
+          tqData[tqId].setdefault(field, []).append(value)
+    return S_OK(tqData)
+
   @staticmethod
   def __generateSQLSubCond(sqlString, value, boolOp='OR'):
     if not isinstance(value, (list, tuple)):
@@ -1005,6 +1138,7 @@ WHERE j.JobId = %s AND t.TQId = j.TQId" %
       retVal = self._update("DELETE FROM `tq_TaskQueues` WHERE TQId = %s" % tqId, conn=connObj)
       if not retVal['OK']:
         return retVal
+      self.__tqIndex.remove([tqId])
       self.recalculateTQSharesForEntity(tqOwnerDN, tqOwnerGroup, connObj=connObj)
       self.log.info("Deleted empty and enabled TQ", tqId)
       return S_OK()
@@ -1042,6 +1176,7 @@ WHERE j.JobId = %s AND t.TQId = j.TQId" %
       if not retVal['OK']:
         return retVal
     if delTQ > 0:
+      self.__tqIndex.remove([tqId])
       self.recalculateTQSharesForEntity(tqOwnerDN, tqOwnerGroup, connObj=connObj)
       return S_OK(True)
     return S_OK(False)
@@ -1289,7 +1424,9 @@ FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE "
     for prio in prioDict:
       tqList = ", ".join([str(tqId) for tqId in prioDict[prio]])
       updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % (prio, tqList)
-      self._update(updateSQL, conn=connObj)
+      result = self._update(updateSQL, conn=connObj)
+      if result['OK']:
+        self.__tqIndex.setPriorities(dict((tqId, round(prio, 4)) for tqId in prioDict[prio]))
     return S_OK()
 
   @staticmethod
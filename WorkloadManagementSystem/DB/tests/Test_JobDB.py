@@ -3,10 +3,11 @@
 # pylint: disable=protected-access, missing-docstring
 
 from __future__ import print_function
+import datetime
 import unittest
 from mock import MagicMock, patch
 
-from DIRAC import S_OK
+from DIRAC import S_OK, S_ERROR
 
 MODULE_NAME = "DIRAC.WorkloadManagementSystem.DB.JobDB"
 
@@ -35,3 +36,94 @@ class JobDBTest(unittest.TestCase):
     print(result)
     self.assertTrue(result['OK'])
     self.assertEqual(result['Value'], ['/vo/user/lfn1', '/vo/user/lfn2'])
+
+  def test_setJobAttributesUpdatesCounters(self):
+    self.jobDB.jobAttributeNames = ['JobID', 'Status', 'MinorStatus', 'Site', 'JobType']
+    self.jobDB.jobCounterAttributes = ['JobType']
+    self.jobDB._escapeString = MagicMock(side_effect=lambda value: S_OK("'%s'" % value))
+    self.jobDB._escapeValues = MagicMock(side_effect=lambda values: S_OK(["'%s'" % value for value in values]))
+    self.jobDB._update = MagicMock(return_value=S_OK(2))
+    self.jobDB._transaction = MagicMock(return_value=S_OK([]))
+    for transactionMethod in ('transactionStart', 'transactionCommit', 'transactionRollback'):
+      setattr(self.jobDB, transactionMethod, MagicMock(return_value=S_OK()))
+    self.jobDB._query.return_value = S_OK((('LCG.CERN.ch', 'Running', 'MCSimulation'),
+                                          ('ANY', 'Waiting', 'User')))
+
+    result = self.jobDB.setJobAttributes([1, 2], ['Status', 'Site'], ['Matched', 'LCG.CERN.ch'])
+    self.assertTrue(result['OK'])
+    self.assertTrue(self.jobDB._query.call_args[0][0].endswith("FOR UPDATE"))
+    updateCmd, counterCmd = [callArgs[0][0] for callArgs in self.jobDB._update.call_args_list]
+    self.assertTrue(updateCmd.startswith("UPDATE Jobs SET Status='Matched', Site='LCG.CERN.ch'"))
+    # Only the job which was not running yet is counted
+    self.assertIn("VALUES ('LCG.CERN.ch', 'JobType', 'User', 1) ON DUPLICATE KEY", counterCmd)
+    self.assertNotIn("MCSimulation", counterCmd)
+    self.jobDB.transactionCommit.assert_called_once_with()
+
+    # Other attributes are set without counting the jobs
+    self.jobDB._update.reset_mock()
+    result = self.jobDB.setJobAttributes([1, 2], ['MinorStatus'], ['Some minor status'])
+    self.assertTrue(result['OK'])
+    self.jobDB._transaction.assert_called_once_with(["UPDATE Jobs SET MinorStatus='Some minor status' "
+                                                     "WHERE JobID in ( '1', '2' )"])
+    self.jobDB._update.assert_not_called()
+
+  def test_reconcileJobCounters(self):
+    self.jobDB.jobCounterAttributes = ['JobType']
+    self.jobDB._escapeValues = MagicMock(side_effect=lambda values: S_OK(["'%s'" % value for value in values]))
+    self.jobDB._update = MagicMock(return_value=S_OK(2))
+    for transactionMethod in ('transactionStart', 'transactionCommit', 'transactionRollback'):
+      setattr(self.jobDB, transactionMethod, MagicMock(return_value=S_OK()))
+    self.jobDB.getCounters = MagicMock(return_value=S_OK([({'Site': 'LCG.CERN.ch', 'JobType': 'User'}, 3),
+                                                          ({'Site': 'LCG.PIC.es', 'JobType': 'User'}, 1)]))
+    self.jobDB._query.return_value = S_OK((('LCG.CERN.ch', 'JobType', 'User', 3),
+                                          ('LCG.PIC.es', 'JobType', 'User', 2),
+                                          ('LCG.PIC.es', 'JobType', 'MCSimulation', 1)))
+
+    result = self.jobDB.reconcileJobCounters()
+    self.assertTrue(result['OK'])
+    # The jobs and the counters are read in the same snapshot, and only the differences are added
+    self.jobDB.transactionStart.assert_called_once_with()
+    self.jobDB.transactionCommit.assert_called_once_with()
+    self.assertFalse(self.jobDB._query.call_args[0][0].endswith("FOR UPDATE"))
+    self.jobDB._update.assert_called_once_with("INSERT INTO JobCounters (Site, Attribute, Value, Jobs) VALUES "
+                                               "('LCG.PIC.es', 'JobType', 'MCSimulation', -1), "
+                                               "('LCG.PIC.es', 'JobType', 'User', -1) "
+                                               "ON DUPLICATE KEY UPDATE Jobs = Jobs + VALUES(Jobs)")
+
+  def test_setHeartBeatData(self):
+    self.jobDB._escapeString = MagicMock(side_effect=lambda value: S_OK("'%s'" % value))
+    self.jobDB._update = MagicMock(return_value=S_OK(1))
+    self.jobDB.setJobParameters = MagicMock(return_value=S_OK())
+    result = self.jobDB.setHeartBeatData(1, {}, {})
+    self.assertTrue(result['OK'])
+    # A job in a final state is not brought back to Running
+    self.assertEqual(self.jobDB._update.call_args_list[0][0][0],
+                     "UPDATE Jobs SET HeartBeatTime=UTC_TIMESTAMP(), "
+                     "Status=IF(Status IN ('Running','Matched','Stalled'),'Running',Status) WHERE JobID='1'")
+
+  def test_setHeartBeatDataBulk(self):
+    self.jobDB._escapeString = MagicMock(side_effect=lambda value: S_OK("'%s'" % value))
+    self.jobDB._update = MagicMock(return_value=S_OK(1))
+    firstTime = datetime.datetime(2020, 1, 1, 12, 0, 0)
+    lastTime = datetime.datetime(2020, 1, 1, 12, 0, 10)
+    result = self.jobDB.setHeartBeatDataBulk({1: (lastTime, {'CPU': 'x86'},
+                                                  [(firstTime, {'LoadAverage': 1.5}), (lastTime, {'LoadAverage': 2})]),
+                                              2: (firstTime, {}, [(firstTime, {'Memory': 10})])})
+    self.assertTrue(result['OK'])
+    # One statement per table for all the jobs
+    self.assertEqual(self.jobDB._update.call_count, 3)
+    updateJobs, replaceParameters, insertLogging = [args[0][0] for args in self.jobDB._update.call_args_list]
+    self.assertEqual(updateJobs, "UPDATE Jobs SET HeartBeatTime=CASE JobID WHEN 1 THEN '2020-01-01 12:00:10' "
+                                 "WHEN 2 THEN '2020-01-01 12:00:00' END, "
+                                 "Status=IF(Status IN ('Running','Matched','Stalled'),'Running',Status) "
+                                 "WHERE JobID IN (1,2)")
+    self.assertEqual(replaceParameters, "REPLACE JobParameters (JobID,Name,Value) VALUES (1,'CPU','x86')")
+    for row in ("(1,'LoadAverage','1.5','2020-01-01 12:00:00')", "(1,'LoadAverage','2','2020-01-01 12:00:10')",
+                "(2,'Memory','10','2020-01-01 12:00:00')"):
+      self.assertIn(row, insertLogging)
+
+    # The jobs of the failed chunks are returned
+    self.jobDB._update = MagicMock(side_effect=[S_ERROR('Lost connection'), S_OK(1), S_OK(1)])
+    result = self.jobDB.setHeartBeatDataBulk({1: (firstTime, {}, []), 2: (firstTime, {}, [])}, chunkSize=1)
+    self.assertFalse(result['OK'])
+    self.assertEqual(result['Failed'], [1])
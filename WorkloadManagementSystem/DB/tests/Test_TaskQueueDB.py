@@ -0,0 +1,191 @@
+""" tests for the matching of the TaskQueueDB module, with the task queue index """
+
+# pylint: disable=protected-access, missing-docstring, redefined-outer-name
+
+import re
+import threading
+
+import pytest
+from mock import MagicMock, patch
+
+from DIRAC import S_OK
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+MODULE_NAME = "DIRAC.WorkloadManagementSystem.DB.TaskQueueDB"
+
+
+class FakeTaskQueueTables(object):
+  """ Answers the queries of the TaskQueueDB, and records them """
+
+  def __init__(self):
+    self.taskQueues = {1: ('/my/DN', 'myGroup', 'aSetup', 86400, 1.),
+                       2: ('/my/DN', 'myGroup', 'aSetup', 86400, 1.)}
+    self.sites = {1: ['LCG.CERN.ch'], 2: ['DIRAC.Test.org']}
+    self.jobs = {1: [10, 11], 2: [20]}
+    self.queries = []
+    self.deleted = []
+
+  def query(self, sqlCmd, conn=None):
+    self.queries.append(sqlCmd)
+    if sqlCmd.startswith("SELECT TQId, Enabled, Priority"):
+      return S_OK(tuple((tqId, 1, tq[4]) for tqId, tq in self.taskQueues.items()))
+    if sqlCmd.startswith("SELECT TQId, Priority, OwnerDN"):
+      return S_OK(tuple((tqId, tq[4]) + tq[:4] for tqId, tq in self.taskQueues.items()))
+    if sqlCmd.startswith("SELECT TQId, Value FROM `tq_TQToSites`"):
+      return S_OK(tuple((tqId, site) for tqId in self.sites for site in self.sites[tqId]))
+    if sqlCmd.startswith("SELECT TQId, Value"):
+      return S_OK(())
+    if sqlCmd.startswith("SELECT `tq_Jobs`.Priority"):
+      # All the jobs have the same priority
+      for tqId in self.jobs:
+        if "`tq_Jobs`.TQId = %s " % tqId in sqlCmd and self.jobs[tqId]:
+          return S_OK(((1, ), ))
+    if sqlCmd.startswith("SELECT `tq_Jobs`.JobId"):
+      # The random choice of the priority is not done again for each job
+      assert "RAND()" not in sqlCmd
+      for tqId in self.jobs:
+        if "`tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = 1 " % tqId in sqlCmd:
+          return S_OK(tuple((jobId, ) for jobId in self.jobs[tqId]))
+    if sqlCmd.startswith("SELECT JobId FROM `tq_Jobs`"):
+      tqId, jobIds = self.__parseJobsCondition(sqlCmd)
+      return S_OK(tuple((jobId, ) for jobId in self.jobs.get(tqId, []) if jobId in jobIds))
+    return S_OK(())
+
+  @staticmethod
+  def __parseJobsCondition(sqlCmd):
+    match = re.search(r"TQId = (\d+) AND JobId IN \( ([\d, ]+) \)", sqlCmd)
+    return int(match.group(1)), [int(jobId) for jobId in match.group(2).split(",")]
+
+  def update(self, sqlCmd, conn=None):
+    self.queries.append(sqlCmd)
+    if " IN ( " in sqlCmd:
+      tqId, jobIds = self.__parseJobsCondition(sqlCmd)
+      deleted = [jobId for jobId in self.jobs.get(tqId, []) if jobId in jobIds]
+      self.jobs[tqId] = [jobId for jobId in self.jobs[tqId] if jobId not in deleted]
+      self.deleted.extend(deleted)
+      return S_OK(len(deleted))
+    for tqId in self.jobs:
+      for jobId in self.jobs[tqId]:
+        if sqlCmd == "DELETE FROM `tq_Jobs` WHERE JobId = %s AND TQId = %s" % (jobId, tqId):
+          self.jobs[tqId].remove(jobId)
+          self.deleted.append(jobId)
+          return S_OK(1)
+    return S_OK(0)
+
+
+@pytest.fixture
+def tqDB():
+  csOptions = {}
+
+  def mockInit(self):
+    self.log = MagicMock()
+    self._TaskQueueDB__maxMatchRetry = 3
+    self._TaskQueueDB__deleteTQWithDelay = MagicMock()
+    self._TaskQueueDB__opsHelper = MagicMock()
+    self._TaskQueueDB__opsHelper.getValue.side_effect = lambda path, default: csOptions.get(path, default)
+    self._TaskQueueDB__tqIndex = TaskQueueIndex()
+    self._TaskQueueDB__tqIndexLock = threading.Lock()
+    self._TaskQueueDB__tqIndexSyncTime = None
+
+  from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB import TaskQueueDB
+  with patch(MODULE_NAME + ".TaskQueueDB.__init__", new=mockInit):
+    db = TaskQueueDB()
+  db.tables = FakeTaskQueueTables()
+  db.csOptions = csOptions
+  db._query = MagicMock(side_effect=db.tables.query)
+  db._update = MagicMock(side_effect=db.tables.update)
+  db._getConnection = MagicMock(return_value=S_OK(MagicMock()))
+  db._escapeString = MagicMock(side_effect=lambda value: S_OK('"%s"' % value))
+  db._escapeValues = MagicMock(side_effect=lambda values: S_OK(['"%s"' % value for value in values]))
+  for transactionMethod in ('transactionStart', 'transactionCommit', 'transactionRollback'):
+    setattr(db, transactionMethod, MagicMock(return_value=S_OK()))
+  return db
+
+
+def test_matchWithIndex(tqDB):
+  """ The task queue is selected in the index, and the DB is only used to claim a job """
+  resource = {'Setup': 'aSetup', 'CPUTime': 100000, 'Site': 'LCG.CERN.ch'}
+  result = tqDB.matchAndGetJob(resource)
+  assert result['OK']
+  assert result['Value']['matchFound']
+  assert result['Value']['taskQueueId'] == 1
+  assert result['Value']['jobId'] in (10, 11)
+  assert tqDB.tables.deleted == [result['Value']['jobId']]
+
+  # The index is not synchronized again for the next match
+  del tqDB.tables.queries[:]
+  result = tqDB.matchAndGetJob(resource)
+  assert result['Value']['taskQueueId'] == 1
+  # Choice of the priority, selection of the jobs having it and deletion of the job
+  assert len(tqDB.tables.queries) == 3
+  assert not any("tq_TaskQueues" in sqlCmd for sqlCmd in tqDB.tables.queries)
+
+  # The task queue is now empty
+  result = tqDB.matchAndGetJob(resource)
+  assert result['OK']
+  assert not result['Value']['matchFound']
+
+
+def test_claimedByAnotherMatcher(tqDB):
+  """ A job which is already gone is skipped """
+  tqDB.tables.update = MagicMock(side_effect=[S_OK(0), S_OK(1)])
+  tqDB._update.side_effect = tqDB.tables.update
+  result = tqDB.matchAndGetJob({'Setup': 'aSetup', 'CPUTime': 100000, 'Site': 'LCG.CERN.ch'})
+  assert result['Value']['matchFound']
+  assert tqDB.tables.update.call_count == 2
+
+
+def test_synchronization(tqDB):
+  """ Task queues created or deleted by other processes are seen once the index is synchronized """
+  tqDB.csOptions['JobScheduling/TaskQueueIndexSyncPeriod'] = 0
+  resource = {'Setup': 'aSetup', 'CPUTime': 100000, 'Site': 'Other.Site.org'}
+  assert not tqDB.matchAndGetJob(resource)['Value']['matchFound']
+  tqDB.tables.taskQueues[3] = ('/my/DN', 'myGroup', 'aSetup', 86400, 1.)
+  tqDB.tables.jobs[3] = [30]
+  assert tqDB.matchAndGetJob(resource)['Value']['jobId'] == 30
+  tqDB.tables.taskQueues.pop(3)
+  assert tqDB.matchAndGetTaskQueue(resource, numQueuesToGet=0)['Value'] == []
+
+
+def test_matchWithSQL(tqDB):
+  """ The SQL matching is still used if the index is disabled """
+  tqDB.csOptions['JobScheduling/UseTaskQueueIndex'] = False
+  tqDB.matchAndGetTaskQueue({'Setup': 'aSetup', 'CPUTime': 100000})
+  assert tqDB.tables.queries[-1].startswith("SELECT tq.TQId, tq.OwnerDN, tq.OwnerGroup FROM `tq_TaskQueues` tq")
+
+
+def test_matchSeveralJobs(tqDB):
+  """ Several jobs are taken out of the task queue in one transaction """
+  tqDB.tables.jobs[1] = [10, 11, 12]
+  resource = {'Setup': 'aSetup', 'CPUTime': 100000, 'Site': 'LCG.CERN.ch'}
+  result = tqDB.matchAndGetJobs(resource, 2)
+  assert result['OK']
+  assert result['Value']['matchFound']
+  jobs = result['Value']['jobs']
+  assert len(jobs) == 2
+  assert sorted(tqDB.tables.deleted) == sorted(jobId for jobId, _tqId in jobs)
+  assert tqDB.transactionStart.call_count == tqDB.transactionCommit.call_count == 1
+  assert any(sqlCmd.endswith("FOR UPDATE") for sqlCmd in tqDB.tables.queries)
+
+  # Only the jobs left in the task queue are returned
+  result = tqDB.matchAndGetJobs(resource, 5)
+  assert result['OK']
+  assert result['Value']['jobs'] == [(tqDB.tables.deleted[-1], 1)]
+  assert sorted(tqDB.tables.deleted) == [10, 11, 12]
+
+
+def test_matchSeveralJobsClaimedByAnotherMatcher(tqDB):
+  """ The jobs taken by another matcher in the meantime are not returned """
+  tqDB.tables.jobs[1] = [10, 11]
+  originalQuery = tqDB.tables.query
+
+  def query(sqlCmd, conn=None):
+    if sqlCmd.endswith("FOR UPDATE"):
+      # Job 10 is taken between the selection of the jobs and their lock
+      tqDB.tables.jobs[1] = [jobId for jobId in tqDB.tables.jobs[1] if jobId != 10]
+    return originalQuery(sqlCmd, conn=conn)
+
+  tqDB._query.side_effect = query
+  result = tqDB.matchAndGetJobs({'Setup': 'aSetup', 'CPUTime': 100000, 'Site': 'LCG.CERN.ch'}, 2)
+  assert result['OK']
+  assert result['Value']['jobs'] == [(11, 1)]
@@ -16,29 +16,66 @@ __RCSID__ = "$Id$"
 import time
 
 from DIRAC import S_OK, S_ERROR
-from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 from DIRAC.Core.Utilities import Time
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.ElasticJobDB import ElasticJobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
 from DIRAC.WorkloadManagementSystem.Client import JobStatus
+from DIRAC.WorkloadManagementSystem.private.HeartBeatBuffer import HeartBeatBuffer
 
 # This is a global instance of the JobDB class
 jobDB = False
 logDB = False
 elasticJobDB = False
+heartBeatBuffer = None
+# Counters of the heart beat buffer at the previous flush
+heartBeatMetrics = {}
 
 
 def initializeJobStateUpdateHandler(serviceInfo):
 
   global jobDB
   global logDB
+  global heartBeatBuffer
   jobDB = JobDB()
   logDB = JobLoggingDB()
+  # The heart beats can be written to the JobDB in bulk every few seconds
+  if getServiceOption(serviceInfo, 'BufferHeartBeats', False):
+    heartBeatBuffer = HeartBeatBuffer(jobDB, maxJobs=getServiceOption(serviceInfo, 'HeartBeatBufferSize', 10000))
+    gMonitor.registerActivity('heartBeatsReceived', "Heart beats received",
+                              'HeartBeats', "heart beats", gMonitor.OP_SUM, 300)
+    gMonitor.registerActivity('heartBeatsFlushed', "Jobs with heart beats written",
+                              'HeartBeats', "jobs", gMonitor.OP_SUM, 300)
+    gMonitor.registerActivity('heartBeatsFailed', "Jobs with heart beats not written",
+                              'HeartBeats', "jobs", gMonitor.OP_SUM, 300)
+    gMonitor.registerActivity('heartBeatsBuffered', "Jobs with heart beats in the buffer",
+                              'HeartBeats', "jobs", gMonitor.OP_MEAN, 300)
+    gMonitor.registerActivity('heartBeatFlushTime', "Heart beat flush time",
+                              'HeartBeats', "secs", gMonitor.OP_MEAN, 300)
+    gThreadScheduler.addPeriodicTask(getServiceOption(serviceInfo, 'HeartBeatFlushPeriod', 5), flushHeartBeats)
+    heartBeatBuffer.flushAtExit()
   return S_OK()
 
 
+def flushHeartBeats():
+  """ Write the buffered heart beats to the JobDB, and report the activity of the buffer to the monitoring
+  """
+  heartBeatBuffer.flush()
+  metrics = heartBeatBuffer.getMetrics()
+  for activity, counter in (('heartBeatsReceived', 'Received'),
+                            ('heartBeatsFlushed', 'FlushedJobs'),
+                            ('heartBeatsFailed', 'FailedJobs')):
+    gMonitor.addMark(activity, metrics[counter] - heartBeatMetrics.get(counter, 0))
+  gMonitor.addMark('heartBeatsBuffered', metrics['Buffered'])
+  if metrics['Flushes'] != heartBeatMetrics.get('Flushes'):
+    gMonitor.addMark('heartBeatFlushTime', metrics['LastFlushDuration'])
+  heartBeatMetrics.update(metrics)
+
+
 class JobStateUpdateHandler(RequestHandler):
 
   def initialize(self):
@@ -360,7 +397,10 @@ class JobStateUpdateHandler(RequestHandler):
     """ Send a heart beat sign of life for a job jobID
     """
 
-    result = jobDB.setHeartBeatData(int(jobID), staticData, dynamicData)
+    if heartBeatBuffer:
+      result = heartBeatBuffer.add(int(jobID), staticData, dynamicData)
+    else:
+      result = jobDB.setHeartBeatData(int(jobID), staticData, dynamicData)
     if not result['OK']:
       self.log.warn('Failed to set the heart beat data', 'for job %d ' % int(jobID))
 
@@ -104,6 +104,42 @@ class MatcherHandler(RequestHandler):
     # FIXME: This is correctly interpreted by the JobAgent, but DErrno should be used instead
     return S_ERROR("No match found")
 
+##############################################################################
+  types_requestJobs = [[basestring, dict], six.integer_types]
+
+  def export_requestJobs(self, resourceDescription, numJobs):
+    """ Serve up to numJobs jobs, e.g. for the free slots of a multi-slot pilot, which are
+        the highest priority ones matching the agent's site capacity.
+        The number of jobs is limited by the MaxJobsPerRequest option of the service
+
+        :returns: S_OK( list of job dictionaries, as the one returned by requestJob ) / S_ERROR
+    """
+    numJobs = min(numJobs, self.srv_getCSOption("MaxJobsPerRequest", 20))
+    if numJobs < 1:
+      return S_ERROR("The number of jobs requested must be positive")
+
+    resourceDescription['Setup'] = self.serviceInfoDict['clientSetup']
+    credDict = self.getRemoteCredentials()
+
+    try:
+      opsHelper = Operations(group=credDict['group'])
+      matcher = Matcher(pilotAgentsDB=pilotAgentsDB,
+                        jobDB=gJobDB,
+                        tqDB=gTaskQueueDB,
+                        jlDB=jlDB,
+                        opsHelper=opsHelper)
+      result = matcher.selectJobs(resourceDescription, credDict, numJobs)
+    except RuntimeError as rte:
+      self.log.error("Error requesting jobs: ", rte)
+      return S_ERROR("Error requesting jobs")
+
+    # result can be empty, meaning that no job matched
+    if result:
+      gMonitor.addMark("matchesDone")
+      gMonitor.addMark("matchesOK", len(result))
+      return S_OK(result)
+    return S_ERROR("No match found")
+
 ##############################################################################
   types_getActiveTaskQueues = []
 
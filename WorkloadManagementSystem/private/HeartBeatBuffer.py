@@ -0,0 +1,178 @@
+""" Buffer of the job heart beats received by the JobStateUpdate service, written to the JobDB
+    in bulk by a periodic flush instead of one heart beat at a time.
+
+    The heart beats of a job received between two flushes are coalesced: the heart beat time and the
+    static data are the last ones received, while the dynamic data of each heart beat is kept for the
+    HeartBeatLoggingInfo table. When the buffer holds its maximum number of jobs, the heart beats of
+    the other jobs are written directly, as without buffer. The heart beats of the jobs which could not
+    be written are put back in the buffer, to be written by the next flushes.
+"""
+
+__RCSID__ = "$Id$"
+
+import atexit
+import datetime
+import signal
+import threading
+import time
+
+from DIRAC import S_OK, gLogger
+
+
+class HeartBeatBuffer(object):
+  """ Heart beats waiting to be written to the JobDB
+  """
+
+  def __init__(self, jobDB, maxJobs=10000, maxRetries=3):
+    """ c'tor
+
+        :param jobDB: JobDB instance
+        :param int maxJobs: maximum number of jobs with heart beats in the buffer
+        :param int maxRetries: number of flushes after the first one trying to write the heart beats of a job
+    """
+    self.__jobDB = jobDB
+    self.__maxJobs = maxJobs
+    self.__maxRetries = maxRetries
+    # { jobID : number of failed flushes }
+    self.__retries = {}
+    # { jobID : ( last heart beat time, staticDataDict, [ ( heart beat time, dynamicDataDict ) ] ) }
+    self.__heartBeats = {}
+    self.__lock = threading.Lock()
+    self.__flushLock = threading.Lock()
+    self.__metrics = {'Received': 0,
+                      'Coalesced': 0,
+                      'WrittenDirectly': 0,
+                      'Flushes': 0,
+                      'FlushedJobs': 0,
+                      'FailedJobs': 0,
+                      'RequeuedJobs': 0,
+                      'DroppedJobs': 0,
+                      'LastFlushJobs': 0,
+                      'LastFlushDuration': 0.}
+    self.log = gLogger.getSubLogger('HeartBeatBuffer')
+
+  def __len__(self):
+    return len(self.__heartBeats)
+
+  def add(self, jobID, staticData, dynamicData):
+    """ Add the heart beat of a job
+
+        :param int jobID: job ID
+        :param dict staticData: static data, stored as job parameters
+        :param dict dynamicData: dynamic data, stored in the heart beat log
+        :return: S_OK() / S_ERROR(), the result of the direct write if the buffer is full
+    """
+    heartBeatTime = datetime.datetime.utcnow()
+    with self.__lock:
+      self.__metrics['Received'] += 1
+      heartBeat = self.__heartBeats.get(jobID)
+      if heartBeat is None and len(self.__heartBeats) >= self.__maxJobs:
+        self.__metrics['WrittenDirectly'] += 1
+        full = True
+      else:
+        full = False
+        if heartBeat is None:
+          heartBeat = self.__heartBeats[jobID] = (heartBeatTime, {}, [])
+        else:
+          self.__metrics['Coalesced'] += 1
+          self.__heartBeats[jobID] = (heartBeatTime, heartBeat[1], heartBeat[2])
+        heartBeat[1].update(staticData)
+        if dynamicData:
+          heartBeat[2].append((heartBeatTime, dict(dynamicData)))
+    if full:
+      return self.__jobDB.setHeartBeatData(jobID, staticData, dynamicData)
+    return S_OK()
+
+  def flush(self):
+    """ Write the heart beats of the buffer to the JobDB
+
+        :return: S_OK(number of jobs written) / S_ERROR()
+    """
+    with self.__flushLock:
+      with self.__lock:
+        heartBeats = self.__heartBeats
+        self.__heartBeats = {}
+      if not heartBeats:
+        return S_OK(0)
+      startTime = time.time()
+      result = self.__jobDB.setHeartBeatDataBulk(heartBeats)
+      duration = time.time() - startTime
+      failed = set(result.get('Failed', heartBeats)) if not result['OK'] else set()
+      with self.__lock:
+        requeued = self.__requeue(heartBeats, failed)
+        self.__metrics['Flushes'] += 1
+        self.__metrics['FlushedJobs'] += len(heartBeats) - len(failed)
+        self.__metrics['FailedJobs'] += len(failed)
+        self.__metrics['RequeuedJobs'] += requeued
+        self.__metrics['DroppedJobs'] += len(failed) - requeued
+        self.__metrics['LastFlushJobs'] = len(heartBeats)
+        self.__metrics['LastFlushDuration'] = duration
+        metrics = dict(self.__metrics)
+      if not result['OK']:
+        self.log.error("Failed to flush the heart beats",
+                       "%s (%d jobs put back in the buffer)" % (result['Message'], requeued))
+        return result
+      self.log.verbose("Heart beats flushed", "%d jobs in %.3f s, metrics %s" % (len(heartBeats), duration, metrics))
+      return S_OK(len(heartBeats))
+
+  def __requeue(self, heartBeats, failed):
+    """ Put back in the buffer the heart beats of the jobs which could not be written, before the ones
+        received during the flush. Must be called with the lock acquired.
+
+        :param dict heartBeats: heart beats of the flush
+        :param set failed: IDs of the jobs which could not be written
+        :return: number of jobs put back in the buffer
+    """
+    for jobID in set(self.__retries) - failed:
+      if jobID in heartBeats:
+        del self.__retries[jobID]
+    requeued = 0
+    for jobID in failed:
+      retries = self.__retries.get(jobID, 0) + 1
+      if retries > self.__maxRetries:
+        self.__retries.pop(jobID, None)
+        self.log.warn("Heart beats dropped after failed flushes", "job %s" % jobID)
+        continue
+      self.__retries[jobID] = retries
+      requeued += 1
+      heartBeatTime, staticData, dynamicData = heartBeats[jobID]
+      newer = self.__heartBeats.get(jobID)
+      if newer is not None:
+        staticData.update(newer[1])
+        heartBeatTime = newer[0]
+        dynamicData.extend(newer[2])
+      self.__heartBeats[jobID] = (heartBeatTime, staticData, dynamicData)
+    return requeued
+
+  def getMetrics(self):
+    """ Counters of the heart beats received and written since the buffer was created
+
+        :return: dict
+    """
+    with self.__lock:
+      metrics = dict(self.__metrics)
+    metrics['Buffered'] = len(self.__heartBeats)
+    return metrics
+
+  def flushAtExit(self):
+    """ Flush the buffer when the process exits or is stopped by SIGTERM or SIGINT,
+        before the exit actions already set
+    """
+    atexit.register(self.flush)
+    for sigNum in (signal.SIGTERM, signal.SIGINT):
+      try:
+        previousHandler = signal.getsignal(sigNum)
+        signal.signal(sigNum, self.__getSignalHandler(previousHandler))
+      except ValueError:
+        # Signal handlers can only be set in the main thread
+        self.log.warn("Cannot flush the heart beats when the service is stopped", "signal %d" % sigNum)
+
+  def __getSignalHandler(self, previousHandler):
+    """ Signal handler flushing the buffer before calling the previous handler """
+    def handler(sigNum, frame):
+      self.flush()
+      if callable(previousHandler):
+        previousHandler(sigNum, frame)
+      elif previousHandler != signal.SIG_IGN:
+        raise SystemExit(sigNum)
+    return handler
@@ -0,0 +1,311 @@
+""" In memory index of the task queues, used by the TaskQueueDB to select the task queues
+    matching a resource without querying the database.
+
+    The matching reproduces the conditions of the SQL generated by TaskQueueDB.__generateTQMatchSQL,
+    including the case insensitive comparison of the values done by MySQL. The task queues are
+    ordered as by ORDER BY RAND() / Priority ASC, where the NULL obtained for a priority of 0 comes
+    first: the task queues of priority 0 are thus returned before the others.
+"""
+
+__RCSID__ = "$Id$"
+
+import bisect
+import heapq
+import random
+import string
+import threading
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Security import Properties
+from DIRAC.ConfigurationSystem.Client.Helpers import Registry
+
+# For checks at insertion time, and not only
+singleValueDefFields = ('OwnerDN', 'OwnerGroup', 'Setup', 'CPUTime')
+multiValueDefFields = ('Sites', 'GridCEs', 'GridMiddlewares', 'BannedSites',
+                       'Platforms', 'PilotTypes', 'SubmitPools', 'JobTypes', 'Tags')
+# Used for matching
+multiValueMatchFields = ('GridCE', 'Site', 'GridMiddleware', 'Platform',
+                         'PilotType', 'SubmitPool', 'JobType', 'Tag')
+bannedJobMatchFields = ('Site', )
+
+
+def _normalize(value):
+  """ Value as compared by MySQL """
+  return str(value).strip().lower()
+
+
+def _getValues(value):
+  """ List of the normalized values of a single or multi value match field """
+  if isinstance(value, (list, tuple)):
+    return [_normalize(subValue) for subValue in value]
+  return [_normalize(value)]
+
+
+def _isAny(values):
+  """ Whether the normalized values contain the 'any' wildcard """
+  return any(value.translate(None, string.punctuation) == 'any' for value in values)
+
+
+class IndexedTaskQueue(object):
+  """ Definition of a task queue, with the values normalized for the matching
+  """
+
+  __slots__ = ('tqId', 'ownerDN', 'ownerGroup', 'cpuTime', 'priority', 'fields')
+
+  def __init__(self, tqId, tqDef):
+    """ c'tor
+
+        :param int tqId: task queue ID
+        :param dict tqDef: task queue definition, as returned by TaskQueueDB.retrieveTaskQueues
+    """
+    self.tqId = tqId
+    self.ownerDN = tqDef['OwnerDN']
+    self.ownerGroup = tqDef['OwnerGroup']
+    self.cpuTime = int(tqDef['CPUTime'])
+    self.priority = float(tqDef['Priority'])
+    # Single value fields -> normalized value, multi value fields -> frozenset of normalized values
+    self.fields = dict((field, _normalize(tqDef[field])) for field in singleValueDefFields)
+    for field in multiValueDefFields:
+      self.fields[field] = frozenset(_normalize(value) for value in tqDef.get(field, []))
+
+
+class TaskQueueIndex(object):
+  """ Task queues indexed by setup and CPU time.
+
+      The index is filled from the database by the TaskQueueDB, which keeps it in sync
+      with the task queues it creates, deletes or changes the priority of, and periodically
+      with the changes done by other processes. It is thread safe.
+  """
+
+  def __init__(self):
+    self.__lock = threading.Lock()
+    # tqId -> IndexedTaskQueue
+    self.__taskQueues = {}
+    # normalized setup -> sorted list of ( CPU time, tqId )
+    self.__bySetup = {}
+
+  def __len__(self):
+    return len(self.__taskQueues)
+
+  def getTQIds(self):
+    """ Get the IDs of the task queues in the index
+
+        :returns: set
+    """
+    with self.__lock:
+      return set(self.__taskQueues)
+
+  def update(self, taskQueues):
+    """ Add or replace task queues. As the definition of a task queue never changes,
+        only the new task queues need to be added.
+
+        :param dict taskQueues: tqId -> task queue definition
+    """
+    newTaskQueues = dict((tqId, IndexedTaskQueue(tqId, taskQueues[tqId])) for tqId in taskQueues)
+    with self.__lock:
+      self.__taskQueues.update(newTaskQueues)
+      self.__rebuild()
+
+  def remove(self, tqIds):
+    """ Remove task queues from the index
+
+        :param list tqIds: task queue IDs
+    """
+    with self.__lock:
+      for tqId in tqIds:
+        self.__taskQueues.pop(int(tqId), None)
+      self.__rebuild()
+
+  def setPriorities(self, priorities):
+    """ Update the priorities of task queues
+
+        :param dict priorities: tqId -> priority
+    """
+    with self.__lock:
+      for tqId, priority in priorities.iteritems():
+        if tqId in self.__taskQueues:
+          self.__taskQueues[tqId].priority = float(priority)
+
+  def __rebuild(self):
+    """ Rebuild the setup and CPU time index. Must be called with the lock acquired """
+    bySetup = {}
+    for tq in self.__taskQueues.itervalues():
+      bySetup.setdefault(tq.fields['Setup'], []).append((tq.cpuTime, tq.tqId))
+    for entries in bySetup.itervalues():
+      entries.sort()
+    self.__bySetup = bySetup
+
+  def __getCandidates(self, tqMatchDict):
+    """ Task queues with the right setup and CPU time. Must be called with the lock acquired """
+    if 'Setup' in tqMatchDict:
+      setups = _getValues(tqMatchDict['Setup'])
+    else:
+      setups = self.__bySetup.keys()
+    maxCPUTime = None
+    if 'CPUTime' in tqMatchDict:
+      cpuTimes = tqMatchDict['CPUTime']
+      if not isinstance(cpuTimes, (list, tuple)):
+        cpuTimes = [cpuTimes]
+      maxCPUTime = max(int(cpuTime) for cpuTime in cpuTimes)
+    candidates = []
+    for setup in set(setups):
+      entries = self.__bySetup.get(setup, [])
+      if maxCPUTime is not None:
+        # tuples are compared element wise, and all the tqIds are lower than the infinity
+        entries = entries[:bisect.bisect_right(entries, (maxCPUTime, float('inf')))]
+      candidates.extend(self.__taskQueues[tqId] for _cpuTime, tqId in entries)
+    return candidates
+
+  @staticmethod
+  def __getOwnerCondition(tqMatchDict):
+    """ Function checking the owner of a task queue, or None if there is no condition on it """
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      groups = tqMatchDict['OwnerGroup']
+      if not isinstance(groups, (list, tuple)):
+        groups = [groups]
+      dns = _getValues(tqMatchDict['OwnerDN'])
+      sharingGroups = set()
+      owners = set()
+      for group in groups:
+        if Properties.JOB_SHARING in Registry.getPropertiesForGroup(group):
+          sharingGroups.add(_normalize(group))
+        else:
+          owners.update((dn, _normalize(group)) for dn in dns)
+      return lambda fields: (fields['OwnerGroup'] in sharingGroups or
+                             (fields['OwnerDN'], fields['OwnerGroup']) in owners)
+    conditions = []
+    for field in ('OwnerGroup', 'OwnerDN'):
+      if field in tqMatchDict:
+        conditions.append((field, frozenset(_getValues(tqMatchDict[field]))))
+    if not conditions:
+      return None
+    return lambda fields: all(fields[field] in values for field, values in conditions)
+
+  @staticmethod
+  def __getNegativeCondition(negativeCond):
+    """ Function checking the negative conditions, or None if there are none """
+    if not negativeCond:
+      return None
+    if isinstance(negativeCond, dict):
+      negativeCond = [negativeCond]
+    elif not isinstance(negativeCond, (list, tuple)):
+      raise RuntimeError("negativeCond has to be either a list or a dict or a tuple, and it's %s" %
+                         type(negativeCond))
+    # OR of the conditions of each dict, each one being an OR of the conditions of its fields
+    orConditions = []
+    for condDict in negativeCond:
+      notInMulti = []
+      notEqualSingle = []
+      for field in condDict:
+        if field in multiValueMatchFields:
+          notInMulti.append(("%ss" % field, _getValues(condDict[field])))
+        elif field in singleValueDefFields:
+          notEqualSingle.extend((field, value) for value in _getValues(condDict[field]))
+      if notInMulti or notEqualSingle:
+        orConditions.append((notInMulti, notEqualSingle))
+
+    def checkNegativeCondition(fields):
+      for notInMulti, notEqualSingle in orConditions:
+        if any(all(value not in fields[field] for value in values) for field, values in notInMulti):
+          return True
+        if any(fields[field] != value for field, value in notEqualSingle):
+          return True
+      return not orConditions
+
+    return checkNegativeCondition
+
+  def __getConditions(self, tqMatchDict):
+    """ Get the list of functions checking the multi value fields of a task queue
+
+        :returns: S_OK( list ) / S_ERROR
+    """
+    conditions = []
+    tagValues = []
+    # Resources without tags only match task queues without tags
+    if 'Tag' not in tqMatchDict and 'RequiredTag' not in tqMatchDict:
+      tqMatchDict = dict(tqMatchDict)
+      tqMatchDict['Tag'] = []
+
+    for field in multiValueMatchFields:
+      if field not in tqMatchDict:
+        continue
+      tqField = "%ss" % field
+      if field == 'Tag':
+        tagValues = [] if not tqMatchDict['Tag'] else _getValues(tqMatchDict['Tag'])
+        if _isAny(tagValues):
+          continue
+        # All the tags of the task queue must be provided by the resource
+        tags = frozenset(tagValues)
+        conditions.append(lambda fields, tags=tags: fields['Tags'] <= tags)
+        continue
+
+      if not tqMatchDict[field]:
+        continue
+      values = _getValues(tqMatchDict[field])
+      if _isAny(values):
+        continue
+      # Task queues without values for the field match all the resources
+      conditions.append(lambda fields, tqField=tqField, values=frozenset(values):
+                        not fields[tqField] or not fields[tqField].isdisjoint(values))
+      # In case of Site, check it's not in job banned sites
+      if field in bannedJobMatchFields:
+        conditions.append(lambda fields, tqField="Banned%ss" % field, values=values:
+                          any(value not in fields[tqField] for value in values))
+
+    # Tags that the task queues must require
+    requiredTags = _getValues(tqMatchDict['RequiredTag']) if tqMatchDict.get('RequiredTag') else []
+    if requiredTags and not _isAny(requiredTags):
+      if not set(requiredTags).issubset(set(tagValues)):
+        return S_ERROR('Wrong conditions')
+      requiredTags = frozenset(requiredTags)
+      conditions.append(lambda fields: requiredTags <= fields['Tags'])
+
+    # Resource banning conditions
+    for field in multiValueMatchFields:
+      bannedValue = tqMatchDict.get("Banned%s" % field)
+      if not bannedValue:
+        continue
+      values = _getValues(bannedValue)
+      if _isAny(values):
+        continue
+      conditions.append(lambda fields, tqField="%ss" % field, values=values:
+                        any(value not in fields[tqField] for value in values))
+
+    return S_OK(conditions)
+
+  def match(self, tqMatchDict, numQueuesToGet=1, negativeCond=None):
+    """ Get the task queues matching the requirements of a resource, randomly ordered
+        according to their priorities
+
+        :param dict tqMatchDict: resource description, not escaped
+        :param int numQueuesToGet: maximum number of task queues to return, 0 for all of them
+        :param negativeCond: dict or list of dicts of conditions that the task queues must not meet
+
+        :returns: S_OK( [ ( tqId, OwnerDN, OwnerGroup ) ] ) / S_ERROR
+    """
+    result = self.__getConditions(tqMatchDict)
+    if not result['OK']:
+      return result
+    conditions = result['Value']
+    for condition in (self.__getOwnerCondition(tqMatchDict), self.__getNegativeCondition(negativeCond)):
+      if condition:
+        conditions.append(condition)
+
+    with self.__lock:
+      candidates = self.__getCandidates(tqMatchDict)
+    matching = []
+    for tq in candidates:
+      fields = tq.fields
+      for condition in conditions:
+        if not condition(fields):
+          break
+      else:
+        # Same as ORDER BY RAND() / Priority ASC: in SQL, RAND() / 0 is NULL,
+        # which comes before any number, so the task queues of priority 0 come first
+        key = random.random() / tq.priority if tq.priority > 0 else -1.
+        matching.append((key, tq.tqId, tq))
+    if numQueuesToGet:
+      matching = heapq.nsmallest(numQueuesToGet, matching)
+    else:
+      matching.sort()
+    return S_OK([(tq.tqId, tq.ownerDN, tq.ownerGroup) for _key, _tqId, tq in matching])
@@ -0,0 +1,86 @@
+""" tests for the buffer of the job heart beats """
+
+# pylint: disable=protected-access, missing-docstring
+
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.private.HeartBeatBuffer import HeartBeatBuffer
+
+
+def test_coalescing():
+  jobDB = MagicMock()
+  jobDB.setHeartBeatDataBulk.return_value = S_OK()
+  heartBeatBuffer = HeartBeatBuffer(jobDB)
+  assert heartBeatBuffer.add(1, {'CPU': 'x86', 'Memory': '2GB'}, {'LoadAverage': 1})['OK']
+  assert heartBeatBuffer.add(2, {}, {})['OK']
+  assert heartBeatBuffer.add(1, {'Memory': '4GB'}, {'LoadAverage': 2})['OK']
+  assert len(heartBeatBuffer) == 2
+  jobDB.setHeartBeatData.assert_not_called()
+
+  assert heartBeatBuffer.flush()['Value'] == 2
+  heartBeats = jobDB.setHeartBeatDataBulk.call_args[0][0]
+  lastTime, staticData, dynamicData = heartBeats[1]
+  assert staticData == {'CPU': 'x86', 'Memory': '4GB'}
+  assert [data for _time, data in dynamicData] == [{'LoadAverage': 1}, {'LoadAverage': 2}]
+  assert lastTime == dynamicData[-1][0]
+  assert heartBeats[2][1:] == ({}, [])
+
+  # Nothing left to write
+  assert heartBeatBuffer.flush()['Value'] == 0
+  assert jobDB.setHeartBeatDataBulk.call_count == 1
+  metrics = heartBeatBuffer.getMetrics()
+  assert (metrics['Received'], metrics['Coalesced'], metrics['FlushedJobs'], metrics['Buffered']) == (3, 1, 2, 0)
+
+
+def test_fullBuffer():
+  jobDB = MagicMock()
+  jobDB.setHeartBeatData.return_value = S_ERROR('Failed to set the heart beat time')
+  heartBeatBuffer = HeartBeatBuffer(jobDB, maxJobs=1)
+  assert heartBeatBuffer.add(1, {}, {'LoadAverage': 1})['OK']
+  assert heartBeatBuffer.add(1, {}, {'LoadAverage': 2})['OK']
+  # The heart beats of other jobs are written directly
+  assert not heartBeatBuffer.add(2, {'CPU': 'x86'}, {})['OK']
+  jobDB.setHeartBeatData.assert_called_once_with(2, {'CPU': 'x86'}, {})
+  assert len(heartBeatBuffer) == 1
+  assert heartBeatBuffer.getMetrics()['WrittenDirectly'] == 1
+
+
+def test_failedFlush():
+  jobDB = MagicMock()
+  failure = S_ERROR('Failed to store the heart beat data of 1 jobs')
+  failure['Failed'] = [1]
+  jobDB.setHeartBeatDataBulk.return_value = failure
+  heartBeatBuffer = HeartBeatBuffer(jobDB)
+  heartBeatBuffer.add(1, {}, {})
+  heartBeatBuffer.add(2, {}, {})
+  assert not heartBeatBuffer.flush()['OK']
+  metrics = heartBeatBuffer.getMetrics()
+  assert (metrics['FlushedJobs'], metrics['FailedJobs'], metrics['LastFlushJobs']) == (1, 1, 2)
+
+  # The failed job is written by the next flush, with the heart beats received in between
+  jobDB.setHeartBeatDataBulk.return_value = S_OK()
+  heartBeatBuffer.add(1, {'CPU': 'x86'}, {'LoadAverage': 1})
+  assert heartBeatBuffer.flush()['Value'] == 1
+  heartBeats = jobDB.setHeartBeatDataBulk.call_args[0][0]
+  assert heartBeats.keys() == [1]
+  lastTime, staticData, dynamicData = heartBeats[1]
+  assert staticData == {'CPU': 'x86'}
+  assert dynamicData == [(lastTime, {'LoadAverage': 1})]
+  metrics = heartBeatBuffer.getMetrics()
+  assert (metrics['FlushedJobs'], metrics['RequeuedJobs'], metrics['Buffered']) == (2, 1, 0)
+
+
+def test_droppedAfterRetries():
+  jobDB = MagicMock()
+  failure = S_ERROR('Failed to store the heart beat data of 1 jobs')
+  failure['Failed'] = [1]
+  jobDB.setHeartBeatDataBulk.return_value = failure
+  heartBeatBuffer = HeartBeatBuffer(jobDB, maxRetries=2)
+  heartBeatBuffer.add(1, {}, {})
+  for _ in range(3):
+    assert len(heartBeatBuffer) == 1
+    assert not heartBeatBuffer.flush()['OK']
+  assert len(heartBeatBuffer) == 0
+  metrics = heartBeatBuffer.getMetrics()
+  assert (metrics['FailedJobs'], metrics['RequeuedJobs'], metrics['DroppedJobs']) == (3, 2, 1)
@@ -0,0 +1,140 @@
+""" Test the matching of the task queues by the TaskQueueIndex
+    (the same cases are tested against the SQL matching in
+    tests/Integration/WorkloadManagementSystem/Test_TaskQueueDB.py)
+"""
+
+# pylint: disable=redefined-outer-name
+
+import pytest
+
+from DIRAC.Core.Security import Properties
+from DIRAC.WorkloadManagementSystem.private import TaskQueueIndex as TaskQueueIndexModule
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+__RCSID__ = "$Id$"
+
+
+def tqDef(**kwargs):
+  """ Task queue definition """
+  definition = {'OwnerDN': '/my/DN', 'OwnerGroup': 'myGroup', 'Setup': 'aSetup', 'CPUTime': 86400,
+                'Priority': 1.}
+  definition.update(kwargs)
+  return definition
+
+
+def match(index, numQueuesToGet=0, negativeCond=None, **kwargs):
+  """ IDs of the task queues matching the resource """
+  tqMatchDict = {'Setup': 'aSetup', 'CPUTime': 100000}
+  tqMatchDict.update(kwargs)
+  result = index.match(tqMatchDict, numQueuesToGet=numQueuesToGet, negativeCond=negativeCond)
+  assert result['OK'], result
+  return set(tqId for tqId, _ownerDN, _ownerGroup in result['Value'])
+
+
+@pytest.fixture
+def index(mocker):
+  """ Empty index, with a group having the JobSharing property """
+  mocker.patch.object(TaskQueueIndexModule.Registry, 'getPropertiesForGroup',
+                      side_effect=lambda group: [Properties.JOB_SHARING] if group == 'sharingGroup' else [])
+  return TaskQueueIndex()
+
+
+def test_setupAndCPUTime(index):
+  """ The setup must be the same, and the CPU time of the task queue not longer than the resource one """
+  index.update({1: tqDef(CPUTime=3600), 2: tqDef(CPUTime=86400), 3: tqDef(Setup='otherSetup')})
+  assert match(index, CPUTime=3600) == {1}
+  assert match(index) == {1, 2}
+  assert match(index, Setup=['aSetup', 'otherSetup']) == {1, 2, 3}
+  assert match(index, Setup='ASETUP ') == {1, 2}
+
+
+def test_sites(index):
+  """ Sites and banned sites of the jobs """
+  index.update({1: tqDef(BannedSites=['LCG.CERN.ch', 'CLOUD.IN2P3.fr']),
+                2: tqDef(BannedSites=['CLOUD.IN2P3.fr', 'DIRAC.Test.org']),
+                3: tqDef(Sites=['DIRAC.Test.org'])})
+  assert match(index) == {1, 2, 3}
+  assert match(index, Platform='centos7') == {1, 2, 3}
+  assert match(index, Site='DIRAC.Test.org') == {1, 3}
+  assert match(index, Site='LCG.CERN.ch') == {2}
+  assert match(index, Site='CLOUD.IN2P3.fr') == set()
+  assert match(index, Site='Any') == {1, 2, 3}
+
+
+def test_platforms(index):
+  """ Task queues without platform match all the resources """
+  index.update({1: tqDef(Platforms=['centos7']), 2: tqDef(Platforms=['ubuntu', 'centos7']), 3: tqDef()})
+  assert match(index, Platform='centos7') == {1, 2, 3}
+  assert match(index, Platform=['slc6', 'ubuntu']) == {2, 3}
+  assert match(index, Platform='slc6') == {3}
+  assert match(index, Platform=['slc6', 'ANY']) == {1, 2, 3}
+  assert match(index, BannedPlatform='centos7') == {3}
+
+
+def test_tags(index):
+  """ Task queues only match resources providing all their tags """
+  index.update({1: tqDef(Tags=['MultiProcessor']),
+                2: tqDef(Tags=['SingleProcessor']),
+                3: tqDef(Tags=['SingleProcessor', 'MultiProcessor']),
+                4: tqDef(Tags=['MultiProcessor', 'GPU']),
+                5: tqDef()})
+  assert match(index, Tag='aNy') == {1, 2, 3, 4, 5}
+  assert match(index, Tag=['MultiProcessor', 'aNy']) == {1, 2, 3, 4, 5}
+  assert match(index) == {5}
+  assert match(index, Tag='') == {5}
+  assert match(index, Tag=[]) == {5}
+  assert match(index, Tag='MultiProcessor') == {1, 5}
+  assert match(index, Tag=['MultiProcessor', 'SingleProcessor']) == {1, 2, 3, 5}
+  assert match(index, Tag=['MultiProcessor', 'GPU'], RequiredTag='GPU') == {4}
+  assert match(index, Tag=['MultiProcessor', 'SingleProcessor'], RequiredTag='MultiProcessor') == {1, 3}
+  # The required tags must be provided
+  result = index.match({'Setup': 'aSetup', 'CPUTime': 100000, 'Tag': 'GPU', 'RequiredTag': 'MultiProcessor'})
+  assert not result['OK']
+
+
+def test_owners(index):
+  """ Matching of the owners, with the groups sharing their jobs """
+  index.update({1: tqDef(OwnerGroup='sharingGroup'),
+                2: tqDef(OwnerDN='/other/DN', OwnerGroup='sharingGroup'),
+                3: tqDef(),
+                4: tqDef(OwnerDN='/other/DN')})
+  assert match(index, OwnerGroup='myGroup') == {3, 4}
+  assert match(index, OwnerDN='/other/DN') == {2, 4}
+  assert match(index, OwnerDN='/my/DN', OwnerGroup=['sharingGroup', 'myGroup']) == {1, 2, 3}
+
+
+def test_negativeConditions(index):
+  """ Task queues meeting all the conditions of a negative condition dict are excluded """
+  index.update({1: tqDef(JobTypes=['MonteCarlo'], Sites=['LCG.CERN.ch']),
+                2: tqDef(JobTypes=['User'], Sites=['LCG.CERN.ch']),
+                3: tqDef(JobTypes=['MonteCarlo'])})
+  assert match(index, negativeCond={'JobType': 'MonteCarlo'}) == {2}
+  assert match(index, negativeCond={'JobType': ['MonteCarlo', 'User']}) == set()
+  # Task queues are excluded if they meet all the conditions of the dict, or of all the dicts of a list
+  assert match(index, negativeCond={'JobType': 'MonteCarlo', 'Site': 'LCG.CERN.ch'}) == {2, 3}
+  assert match(index, negativeCond=[{'JobType': 'MonteCarlo'}, {'Site': 'LCG.CERN.ch'}]) == {2, 3}
+  assert match(index, negativeCond=[{'JobType': 'MonteCarlo'}, {'JobType': 'User'}]) == {1, 2, 3}
+  assert match(index, negativeCond={'OwnerDN': ['/my/DN']}) == set()
+
+
+def test_priorities(index):
+  """ Task queues are ordered randomly according to their priority, and can be removed """
+  index.update({1: tqDef(Priority=1000.), 2: tqDef(Priority=0.001)})
+  firsts = [index.match({'Setup': 'aSetup', 'CPUTime': 100000})['Value'][0][0] for _ in range(100)]
+  assert firsts.count(1) > 90
+  index.setPriorities({1: 0.001, 2: 1000.})
+  result = index.match({'Setup': 'aSetup', 'CPUTime': 100000}, numQueuesToGet=2)
+  assert [tq[0] for tq in result['Value']] in ([2, 1], [1, 2])
+  assert len(result['Value']) == 2
+  assert match(index, numQueuesToGet=1) in ({1}, {2})
+
+  index.remove([2])
+  assert index.getTQIds() == {1}
+  assert match(index) == {1}
+
+
+def test_zeroPriority(index):
+  """ As with ORDER BY RAND() / Priority ASC in MySQL, the task queues of priority 0 come first """
+  index.update({1: tqDef(Priority=1000.), 2: tqDef(Priority=0.)})
+  for _ in range(10):
+    assert index.match({'Setup': 'aSetup', 'CPUTime': 100000})['Value'][0][0] == 2
@@ -444,6 +444,93 @@ class TestClientFTS3(unittest.TestCase):
     self.assertTrue(op.ftsFiles[2].status == 'New')
     self.assertTrue(op.ftsFiles[3].status == 'New')
 
+  def test_06_bulkMonitoring(self):
+    """ The bulk updates of the monitoring only touch the files still assigned to the
+        monitored jobs, and release the jobs like the single updates.
+
+        Same scenario as test_04, with the two jobs updated together.
+    """
+    op = self.generateOperation('Transfer', 2, ['Target1'])
+
+    job1 = FTS3Job()
+    job1GUID = '06-bulk-job1'
+    job1.ftsGUID = job1GUID
+    job1.ftsServer = 'fts3'
+    job1.username = op.username
+    job1.userGroup = op.userGroup
+    op.ftsJobs.append(job1)
+
+    for ftsFile in op.ftsFiles:
+      ftsFile.ftsGUID = job1GUID
+
+    res = self.client.persistOperation(op)
+    opID = res['Value']
+
+    res = self.client.getOperation(opID)
+    op = res['Value']
+
+    fileIds = sorted(ftsFile.fileID for ftsFile in op.ftsFiles)
+    file1ID = fileIds[0]
+    file2ID = fileIds[-1]
+
+    # File1 failed in Job1, and is resubmitted in Job2
+    res = self.db.updateFileStatusBulk({job1GUID: {file1ID: {'status': 'Failed', 'error': 'Someone made a boo-boo',
+                                                             'ftsGUID': None},
+                                                   file2ID: {'status': 'Staging'}}})
+    self.assertTrue(res['OK'], res)
+
+    job2 = FTS3Job()
+    job2GUID = '06-bulk-job2'
+    job2.ftsGUID = job2GUID
+    job2.ftsServer = 'fts3'
+    job2.username = op.username
+    job2.userGroup = op.userGroup
+    op.ftsJobs.append(job2)
+
+    for ftsFile in op.ftsFiles:
+      if ftsFile.fileID == file1ID:
+        ftsFile.ftsGUID = job2GUID
+
+    res = self.client.persistOperation(op)
+    self.assertTrue(res['OK'], res)
+
+    # Both jobs are monitored together: Job1 still says that File1 failed
+    res = self.db.updateFileStatusBulk({job1GUID: {file1ID: {'status': 'Failed', 'error': 'Someone made a boo-boo'},
+                                                   file2ID: {'status': 'Finished', 'error': '', 'ftsGUID': None}},
+                                        job2GUID: {file1ID: {'status': 'Staging'}}})
+    self.assertTrue(res['OK'], res)
+
+    res = self.client.getOperation(opID)
+    op = res['Value']
+    filesByID = dict((ftsFile.fileID, ftsFile) for ftsFile in op.ftsFiles)
+    self.assertEqual(filesByID[file1ID].status, 'Staging')
+    self.assertEqual(filesByID[file1ID].ftsGUID, job2GUID)
+    self.assertEqual(filesByID[file2ID].status, 'Finished')
+    self.assertTrue(filesByID[file2ID].ftsGUID is None)
+    self.assertEquals(op._getFilesToSubmit(), [])
+
+    jobIDs = dict((ftsJob.ftsGUID, ftsJob.jobID) for ftsJob in op.ftsJobs)
+    res = self.db.updateJobStatusBulk({jobIDs[job1GUID]: {'status': 'Finisheddirty', 'error': 'Some failed',
+                                                          'completeness': 100},
+                                       jobIDs[job2GUID]: {'status': 'Staging', 'completeness': 0}})
+    self.assertTrue(res['OK'], res)
+
+    res = self.client.getOperation(opID)
+    op = res['Value']
+    jobsByGUID = dict((ftsJob.ftsGUID, ftsJob) for ftsJob in op.ftsJobs)
+    self.assertEqual(jobsByGUID[job1GUID].status, 'Finisheddirty')
+    self.assertEqual(jobsByGUID[job1GUID].error, 'Some failed')
+    self.assertEqual(jobsByGUID[job1GUID].completeness, 100)
+    self.assertEqual(jobsByGUID[job2GUID].status, 'Staging')
+    self.assertTrue(jobsByGUID[job2GUID].lastMonitor is not None)
+
+    # A job in a final state is not updated anymore
+    res = self.db.updateJobStatusBulk({jobIDs[job1GUID]: {'status': 'Active'}})
+    self.assertTrue(res['OK'], res)
+    res = self.client.getOperation(opID)
+    self.assertEqual(dict((ftsJob.ftsGUID, ftsJob.status) for ftsJob in res['Value'].ftsJobs)[job1GUID],
+                     'Finisheddirty')
+
   def _perf(self):
 
     listOfIds = []
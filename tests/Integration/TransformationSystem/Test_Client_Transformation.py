@@ -167,6 +167,39 @@ class TransformationClientChain(TestClientTransformationTestCase):
     self.transClient.deleteTransformation(transID)
     self.transClient.deleteTransformation(transIDNew)
 
+  def test_addSeveralTasks(self):
+    res = self.transClient.addTransformation('transName', 'description', 'longDescription', 'MCSimulation', 'Standard',
+                                             'Manual', '')
+    transID = res['Value']
+    res = self.transClient.addTaskForTransformation(transID)
+    self.assertTrue(res['OK'])
+    res = self.transClient.addFilesToTransformation(transID, ['/aa/lfn.1.txt', '/aa/lfn.2.txt', '/aa/lfn.3.txt'])
+    self.assertTrue(res['OK'])
+
+    # The task with a file not in the transformation is not created
+    res = self.transClient.addTasksForTransformation(transID, [(['/aa/lfn.1.txt', '/aa/lfn.2.txt'], 'SE1'),
+                                                               (['/aa/lfn.5.txt'], 'SE2'),
+                                                               (['/aa/lfn.3.txt'], 'SE3')])
+    self.assertTrue(res['OK'])
+    self.assertEqual(res['Value'], [2, None, 3])
+    res = self.transClient.getTransformationTasks({'TransformationID': transID})
+    self.assertTrue(res['OK'])
+    self.assertEqual([(task['TaskID'], task['TargetSE']) for task in res['Value']],
+                     [(1, 'Unknown'), (2, 'SE1'), (3, 'SE3')])
+    res = self.transClient.getTransformationFiles({'TransformationID': transID})
+    self.assertTrue(res['OK'])
+    self.assertEqual(sorted((f['LFN'], f['Status'], f['TaskID'], f['UsedSE']) for f in res['Value']),
+                     [('/aa/lfn.1.txt', 'Assigned', 2, 'SE1'),
+                      ('/aa/lfn.2.txt', 'Assigned', 2, 'SE1'),
+                      ('/aa/lfn.3.txt', 'Assigned', 3, 'SE3')])
+
+    # The files are not available any more
+    res = self.transClient.addTasksForTransformation(transID, [(['/aa/lfn.1.txt'], 'SE1')])
+    self.assertTrue(res['OK'])
+    self.assertEqual(res['Value'], [None])
+
+    self.transClient.deleteTransformation(transID)
+
   def test_mix(self):
     res = self.transClient.addTransformation('transName', 'description', 'longDescription', 'MCSimulation', 'Standard',
                                              'Manual', '')
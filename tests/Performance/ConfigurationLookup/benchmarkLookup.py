@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark of the lookup of the options of the configuration.
+
+A configuration with a Registry of users and groups, sites and Operations sections is generated, and
+the typical lookups of the Registry and Operations helpers are replayed with the index of the options
+of the merged configuration, and by walking the sections of the merged configuration. The time to
+build the index after a change of the configuration is also given.
+
+Usage::
+
+  python benchmarkLookup.py [--users 5000] [--groups 200] [--sites 500] [--lookups 100000]
+"""
+from __future__ import print_function
+
+import sys
+import time
+import random
+import argparse
+
+__RCSID__ = "$Id$"
+
+
+def generateCFG(users, groups, sites):
+  """ Configuration with the sizes of a large installation """
+  from DIRAC.Core.Utilities.CFG import CFG
+  userDict = dict(('user%d' % user, {'DN': '/DC=org/DC=example/CN=user%d' % user,
+                                     'Email': 'user%d@example.org' % user})
+                  for user in range(users))
+  groupDict = dict(('group%d' % group, {'Users': ', '.join(random.sample(sorted(userDict), min(users, 50))),
+                                        'Properties': 'NormalUser',
+                                        'VO': 'vo'})
+                   for group in range(groups))
+  siteDict = dict(('LCG.Site%d.org' % site, {'CE': 'ce%d.example.org' % site, 'SE': 'SE%d-DISK' % site})
+                  for site in range(sites))
+  operationsDict = dict(('Section%d' % section, dict(('Option%d' % option, str(option))
+                                                      for option in range(section, 200, 20)))
+                        for section in range(20))
+  return CFG().loadFromDict({'DIRAC': {'Setup': 'Production',
+                                       'Configuration': {'Version': '2020-01-01 00:00:00'}},
+                             'Registry': {'Users': userDict, 'Groups': groupDict},
+                             'Resources': {'Sites': {'LCG': siteDict}},
+                             'Operations': {'Defaults': operationsDict}})
+
+
+def generateLookups(count, users, groups, sites):
+  """ Paths looked up by the helpers, a part of them not existing """
+  lookups = []
+  for _ in range(count):
+    lookups.append(random.choice(['/Registry/Users/user%d/DN' % random.randint(0, users - 1),
+                                  '/Registry/Users/user%d/Email' % random.randint(0, users - 1),
+                                  '/Registry/Groups/group%d/Properties' % random.randint(0, groups - 1),
+                                  '/Registry/Groups/group%d/VOMSRole' % random.randint(0, groups - 1),
+                                  '/Resources/Sites/LCG/LCG.Site%d.org/SE' % random.randint(0, sites - 1),
+                                  '/Operations/Defaults/Section%d/Option%d' % (random.randint(0, 19),
+                                                                               random.randint(0, 199)),
+                                  '/DIRAC/Setup']))
+  return lookups
+
+
+def timeLookups(lookupFunction, lookups):
+  """ Look up all the paths, and return the time per lookup and the values """
+  startTime = time.time()
+  values = [lookupFunction(path) for path in lookups]
+  return (time.time() - startTime) / len(lookups), values
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+  parser.add_argument('--users', type=int, default=5000, help="number of users (default %(default)s)")
+  parser.add_argument('--groups', type=int, default=200, help="number of groups (default %(default)s)")
+  parser.add_argument('--sites', type=int, default=500, help="number of sites (default %(default)s)")
+  parser.add_argument('--lookups', type=int, default=100000, help="number of lookups (default %(default)s)")
+  args = parser.parse_args()
+
+  from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData
+  data = ConfigurationData(False)
+  data.setRemoteCFG(generateCFG(args.users, args.groups, args.sites))
+  lookups = generateLookups(args.lookups, args.users, args.groups, args.sites)
+
+  startTime = time.time()
+  data.extractOptionFromCFG('/DIRAC/Setup')
+  print("Index built in %.3f s" % (time.time() - startTime))
+
+  indexTime, indexValues = timeLookups(data.extractOptionFromCFG, lookups)
+  walkTime, walkValues = timeLookups(lambda path: data.extractOptionFromCFG(path, data.mergedCFG), lookups)
+  print("%d lookups" % len(lookups))
+  print("Index: %8.3f us per lookup" % (indexTime * 1e6))
+  print(" Walk: %8.3f us per lookup" % (walkTime * 1e6))
+  differences = sum(1 for indexValue, walkValue in zip(indexValues, walkValues) if indexValue != walkValue)
+  print("%d lookups gave different values" % differences)
+  return 1 if differences else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Benchmark of DEncode on payloads typical of the DIRAC services.
+
+Each payload is encoded and decoded with encode/decode, and with the functions of
+g_dEncodeFunctions/g_dDecodeFunctions, which is what DEncode used to do (and still does
+when DIRAC_DEBUG_DENCODE_CALLSTACK is set). The outputs are checked to be identical.
+
+Usage::
+
+  python benchmarkDEncode.py [--repeat 5] [--scale 1]
+"""
+from __future__ import print_function
+
+import sys
+import time
+import random
+import argparse
+import datetime
+
+from DIRAC.Core.Utilities import DEncode
+
+__RCSID__ = "$Id$"
+
+
+def deepDict(depth, width):
+  """ Nested dictionaries, like a configuration or a directory tree """
+  if not depth:
+    return {'Size': random.randint(0, 10 ** 9), 'Checksum': '%08x' % random.getrandbits(32), 'Status': 'AprioriGood'}
+  return dict(('key%d' % i, deepDict(depth - 1, width)) for i in range(width))
+
+
+def lfnList(count):
+  """ An S_OK with a long list of LFNs, like a FileCatalog listing """
+  return {'OK': True,
+          'Value': ['/lhcb/MC/2018/ALLSTREAMS.DST/00084556/0000/00084556_%08d_7.AllStreams.dst' % i
+                    for i in range(count)]}
+
+
+def replicaDict(count):
+  """ An S_OK with Successful/Failed dictionaries, like getReplicas """
+  successful = {}
+  for i in range(count):
+    successful['/lhcb/data/2018/RAW/FULL/LHCb/COLLISION18/%08d.raw' % i] = {
+        'CERN-RAW': 'root://eoslhcb.cern.ch//eos/lhcb/grid/prod/lhcb/data/2018/RAW/%08d.raw' % i,
+        'CNAF-RAW': 'srm://storm-fe-lhcb.cr.cnaf.infn.it/t1d0/lhcb/data/2018/RAW/%08d.raw' % i}
+  return {'OK': True, 'Value': {'Successful': successful, 'Failed': {}}}
+
+
+def jobRecords(count):
+  """ Job attributes with many datetimes, like getJobsAttributes """
+  now = datetime.datetime.utcnow()
+  records = {}
+  for jobID in range(count):
+    records[jobID] = {'JobID': jobID,
+                      'Status': 'Running',
+                      'MinorStatus': 'Application',
+                      'Site': 'LCG.CERN.cern',
+                      'Owner': 'someuser',
+                      'CPUTime': 12345.6,
+                      'RescheduleCounter': 0,
+                      'SubmissionTime': now - datetime.timedelta(minutes=jobID),
+                      'StartExecTime': now - datetime.timedelta(seconds=jobID),
+                      'LastUpdateTime': now,
+                      'HeartBeatTime': now,
+                      'EndExecTime': None}
+  return {'OK': True, 'Value': records}
+
+
+def timeIt(func, arg, repeat):
+  """ Best time of repeat calls to func(arg) """
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    func(arg)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+  parser.add_argument('--repeat', type=int, default=5,
+                      help="number of runs, the best one is kept (default %(default)s)")
+  parser.add_argument('--scale', type=float, default=1,
+                      help="multiply the size of the payloads (default %(default)s)")
+  args = parser.parse_args()
+
+  def scaled(count):
+    return max(1, int(count * args.scale))
+
+  random.seed(1)
+  payloads = [("Deep dicts", deepDict(6, 6)),
+              ("LFN list", lfnList(scaled(200000))),
+              ("Replicas", replicaDict(scaled(50000))),
+              ("Job records", jobRecords(scaled(20000)))]
+
+  print("%-12s %9s   %-19s %-19s %-19s %-19s" % ("Payload", "Size", "encode (functions)", "encode",
+                                                  "decode (functions)", "decode"))
+  for name, payload in payloads:
+    encoded = DEncode.encode(payload)
+    if encoded != DEncode._encodeWithFunctions(payload):  # pylint: disable=protected-access
+      print("%-12s encoded data differ!" % name)
+      return 1
+    results = [timeIt(DEncode._encodeWithFunctions, payload, args.repeat),  # pylint: disable=protected-access
+               timeIt(DEncode.encode, payload, args.repeat),
+               timeIt(DEncode._decodeWithFunctions, encoded, args.repeat),  # pylint: disable=protected-access
+               timeIt(DEncode.decode, encoded, args.repeat)]
+    mbytes = len(encoded) / 1024. ** 2
+    print("%-12s %6.1f MB   %s" % (name, mbytes, " ".join("%6.3f s %6.1f MB/s" % (result, mbytes / result)
+                                                           for result in results)))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Benchmark of the DISET transport receive path.
+
+For each payload size, a sender process sends the same message several times to a receiver
+process over a local TCP connection, using the DISET transports. The receiver reports the
+throughput and how much its peak RSS grew while receiving (i.e. the memory needed on top of
+the decoded message).
+
+Usage::
+
+  python benchmarkReceive.py [--sizes 1K,10K,100K,1M,10M,100M] [--ssl]
+
+--ssl uses the SSL transport, which needs the host certificate of the installation.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import resource
+import argparse
+import multiprocessing
+
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+
+__RCSID__ = "$Id$"
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# Total volume transferred for each payload size, so that small payloads are sent many times
+VOLUME = 200 * 1024 ** 2
+
+
+def parseSize(sizeStr):
+  """ Convert '10K' or '1M' to a number of bytes """
+  sizeStr = sizeStr.strip().upper()
+  if sizeStr[-1] in UNITS:
+    return int(float(sizeStr[:-1]) * UNITS[sizeStr[-1]])
+  return int(sizeStr)
+
+
+def getTransportClass(useSSL):
+  """ Get the transport class to benchmark """
+  if useSSL:
+    from DIRAC.Core.DISET.private.Transports.SSLTransport import SSLTransport
+    return SSLTransport
+  return PlainTransport
+
+
+def maxRSS():
+  """ Peak RSS of the current process, in MB """
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def sender(port, payloadSize, repetitions, useSSL):
+  """ Connect to the receiver and send it the payload """
+  transport = getTransportClass(useSSL)(("localhost", port), bServerMode=False, useCertificates=True)
+  result = transport.initAsClient()
+  if not result['OK']:
+    print("Cannot connect:", result['Message'])
+    return
+  payload = "x" * payloadSize
+  for _ in range(repetitions):
+    transport.sendData(payload)
+  transport.receiveData()
+  transport.close()
+
+
+def receiver(payloadSize, repetitions, useSSL, resultQueue):
+  """ Receive the payloads and report the throughput and the peak RSS growth """
+  server = getTransportClass(useSSL)(("", 0), bServerMode=True)
+  server.initAsServer()
+  port = server.getSocket().getsockname()[1]
+  senderProcess = multiprocessing.Process(target=sender, args=(port, payloadSize, repetitions, useSSL))
+  senderProcess.start()
+  transport = server.acceptConnection()['Value']
+  transport.handshake()
+  # The sender only starts sending once the handshake is done
+  startRSS = maxRSS()
+  startTime = time.time()
+  for _ in range(repetitions):
+    data = transport.receiveData()
+    if not isinstance(data, str) or len(data) != payloadSize:
+      resultQueue.put(None)
+      return
+    del data
+  elapsed = time.time() - startTime
+  transport.sendData("done")
+  senderProcess.join()
+  transport.close()
+  server.close()
+  resultQueue.put((elapsed, maxRSS() - startRSS))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+  parser.add_argument('--sizes', default="1K,10K,100K,1M,10M,100M",
+                      help="comma separated list of payload sizes (default %(default)s)")
+  parser.add_argument('--ssl', action='store_true', help="use the SSL transport instead of the plain one")
+  args = parser.parse_args()
+
+  print("%10s %8s %12s %10s %14s" % ("Payload", "Msgs", "Throughput", "Msgs/s", "Peak RSS +"))
+  for sizeStr in args.sizes.split(','):
+    payloadSize = parseSize(sizeStr)
+    repetitions = max(1, min(10000, VOLUME // payloadSize))
+    resultQueue = multiprocessing.Queue()
+    # A new process for each size, so that the peak RSS is not polluted by the previous runs
+    process = multiprocessing.Process(target=receiver, args=(payloadSize, repetitions, args.ssl, resultQueue))
+    process.start()
+    result = resultQueue.get()
+    process.join()
+    if not result:
+      print("%10s transfer failed" % sizeStr)
+      continue
+    elapsed, rssGrowth = result
+    print("%10s %8d %9.1f MB/s %10.1f %11.1f MB" % (sizeStr, repetitions,
+                                                   payloadSize * repetitions / elapsed / 1024 ** 2,
+                                                   repetitions / elapsed, rssGrowth))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Simulation of the choice of the sources of the FTS3 transfers, replaying a history of transfer jobs.
+
+The history is read from a file with one JSON record per final FTS3 job, with the keys of the accounting
+record of the job (Source, Destination, TransferOK, TransferTotal, TransferSize, TransferTime), or generated
+for links of random performance. The real performance of each link is taken from the history. The jobs are
+then replayed in order: the sources of their files are chosen among the sources known for their destination,
+with each source policy, and the transfers succeed and last according to the performance of the chosen link.
+With the Throughput policy, the results of each job are added to the link model before the next job, as done
+by the FTS3Agent through the FTS3DB.
+
+Usage::
+
+  python simulatePlacement.py [--history jobs.json] [--links 20] [--jobs 2000] [--seed 1]
+"""
+from __future__ import print_function
+
+import sys
+import json
+import random
+import argparse
+
+__RCSID__ = "$Id$"
+
+
+def generateHistory(links, jobs, rng):
+  """ History of transfer jobs on links with random throughputs and failure rates """
+  destinations = ['DST%d' % dst for dst in range(max(1, links // 4))]
+  sources = ['SRC%d' % src for src in range(4)]
+  linkPerformance = {}
+  for source in sources:
+    for destination in destinations:
+      # Throughputs between 1 and 100 MB/s, a few links failing often
+      linkPerformance[(source, destination)] = (10 ** rng.uniform(6, 8),
+                                                rng.choice([0.01, 0.02, 0.05, 0.05, 0.3]))
+  history = []
+  for _ in range(jobs):
+    source, destination = rng.choice(sorted(linkPerformance))
+    throughput, failureRate = linkPerformance[(source, destination)]
+    files = rng.randint(1, 100)
+    transferOK = sum(rng.random() >= failureRate for _ in range(files))
+    fileSize = rng.randint(100, 4000) * 1024 * 1024
+    history.append({'Source': source, 'Destination': destination, 'TransferTotal': files,
+                    'TransferOK': transferOK, 'TransferSize': transferOK * fileSize,
+                    'TransferTime': int(transferOK * fileSize / throughput)})
+  return history
+
+
+def readHistory(fileName):
+  """ History of transfer jobs, one JSON record per line """
+  history = []
+  with open(fileName) as fd:
+    for line in fd:
+      if line.strip():
+        record = json.loads(line)
+        if record.get('Source') and record.get('Destination') and record.get('TransferTotal'):
+          history.append(record)
+  return history
+
+
+def getLinkTruth(history):
+  """ Real performance of the links: throughput, success rate and mean file size """
+  totals = {}
+  for record in history:
+    link = totals.setdefault((record['Source'], record['Destination']), [0., 0., 0., 0.])
+    link[0] += record['TransferOK']
+    link[1] += record['TransferTotal']
+    link[2] += record['TransferSize']
+    link[3] += record['TransferTime']
+  truth = {}
+  for link, (transferOK, transferTotal, transferSize, transferTime) in totals.iteritems():
+    fileSize = transferSize / transferOK if transferOK else 1024. * 1024 * 1024
+    throughput = transferSize / transferTime if transferTime else 10. * 1024 * 1024
+    truth[link] = (throughput, transferOK / transferTotal, fileSize)
+  return truth
+
+
+def replay(history, truth, policy, seed):
+  """ Replay the jobs of the history, choosing the sources with a policy """
+  from DIRAC.DataManagementSystem.private.FTS3Utilities import LinkPerformance
+
+  # The random choices of the policies and the outcomes of the transfers use different generators
+  random.seed(seed)
+  rng = random.Random(seed)
+  sourcesPerDestination = {}
+  for source, destination in truth:
+    sourcesPerDestination.setdefault(destination, []).append(source)
+
+  linkPerformance = LinkPerformance() if policy == 'Throughput' else None
+  result = {'Files': 0, 'TransferOK': 0, 'TransferSize': 0., 'TransferTime': 0.}
+  for record in history:
+    destination = record['Destination']
+    sources = sourcesPerDestination[destination]
+    jobs = {}
+    for _ in range(record['TransferTotal']):
+      if linkPerformance:
+        source = linkPerformance.chooseSource(sources, destination)
+      else:
+        source = random.choice(sources)
+      throughput, successRate, fileSize = truth[(source, destination)]
+      job = jobs.setdefault(source, [0, 0, 0., 0.])
+      if rng.random() < successRate:
+        job[0] += 1
+        job[2] += fileSize
+        job[3] += fileSize / (throughput * rng.uniform(0.5, 1.5))
+      else:
+        job[1] += 1
+    for source, (transferOK, failed, transferSize, transferTime) in jobs.iteritems():
+      result['Files'] += transferOK + failed
+      result['TransferOK'] += transferOK
+      result['TransferSize'] += transferSize
+      result['TransferTime'] += transferTime
+      if linkPerformance:
+        linkPerformance.addTransfers(source, destination, transferOK, failed, transferSize, transferTime)
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+  parser.add_argument('--history', help="file of the transfer jobs, one JSON record per line")
+  parser.add_argument('--links', type=int, default=20, help="number of generated links (default %(default)s)")
+  parser.add_argument('--jobs', type=int, default=2000, help="number of generated jobs (default %(default)s)")
+  parser.add_argument('--seed', type=int, default=1, help="seed of the random choices (default %(default)s)")
+  args = parser.parse_args()
+
+  if args.history:
+    history = readHistory(args.history)
+  else:
+    history = generateHistory(args.links, args.jobs, random.Random(args.seed))
+  if not history:
+    print("No transfer job in the history")
+    return 1
+  truth = getLinkTruth(history)
+  print("%d jobs, %d links" % (len(history), len(truth)))
+
+  for policy in ('Random', 'Throughput'):
+    result = replay(history, truth, policy, args.seed)
+    print("%10s: %d/%d files transferred (%.1f%%), %.1f TB in %.1f days of transfer time, %.1f MB/s per file"
+          % (policy, result['TransferOK'], result['Files'], 100. * result['TransferOK'] / result['Files'],
+             result['TransferSize'] / 1e12, result['TransferTime'] / 86400,
+             result['TransferSize'] / result['TransferTime'] / 1e6 if result['TransferTime'] else 0.))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
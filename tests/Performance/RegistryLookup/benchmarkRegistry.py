@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Benchmark of the Registry lookups done by the AuthManager for each request of a service.
+
+A Registry with users, hosts and groups is generated, and the user DNs, host DNs and VOs are looked up
+with the reverse indexes of the Registry helper, and by going through the sections of the Registry as
+done without the indexes. The time of AuthManager.getUsername for the users and of the first lookup
+after a change of the configuration, which builds the indexes, are also given.
+
+Usage::
+
+  python benchmarkRegistry.py [--users 10000] [--hosts 500] [--groups 200] [--lookups 2000]
+"""
+from __future__ import print_function
+
+import sys
+import time
+import random
+import argparse
+
+__RCSID__ = "$Id$"
+
+
+def generateRegistry(users, hosts, groups):
+  """ Registry of a large installation """
+  from DIRAC.Core.Utilities.CFG import CFG
+  userDict = dict(('user%d' % user, {'DN': '/DC=org/DC=example/CN=user%d' % user})
+                  for user in range(users))
+  hostDict = dict(('host%d.example.org' % host, {'DN': '/DC=org/DC=example/CN=host%d.example.org' % host,
+                                                 'Properties': 'TrustedHost'})
+                  for host in range(hosts))
+  groupDict = dict(('group%d' % group, {'Users': ', '.join(random.sample(sorted(userDict), min(users, 200))),
+                                        'VO': 'vo%d' % (group % 10),
+                                        'Properties': 'NormalUser'})
+                   for group in range(groups))
+  return CFG().loadFromDict({'Registry': {'Users': userDict, 'Hosts': hostDict, 'Groups': groupDict}})
+
+
+def linearLookup(section, option, value, firstOnly):
+  """ Sections having the value in their option, going through the sections """
+  from DIRAC import gConfig
+  sections = []
+  for name in gConfig.getSections('/Registry/%s' % section)['Value']:
+    if value in gConfig.getValue('/Registry/%s/%s/%s' % (section, name, option), []):
+      sections.append(name)
+      if firstOnly:
+        break
+  return sections
+
+
+def timeLookups(lookupFunction, values):
+  """ Look up all the values, and return the time per lookup and the results """
+  startTime = time.time()
+  results = [lookupFunction(value) for value in values]
+  return (time.time() - startTime) / len(values), results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+  parser.add_argument('--users', type=int, default=10000, help="number of users (default %(default)s)")
+  parser.add_argument('--hosts', type=int, default=500, help="number of hosts (default %(default)s)")
+  parser.add_argument('--groups', type=int, default=200, help="number of groups (default %(default)s)")
+  parser.add_argument('--lookups', type=int, default=2000, help="number of lookups (default %(default)s)")
+  args = parser.parse_args()
+
+  from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+  from DIRAC.ConfigurationSystem.Client.Helpers import Registry
+  from DIRAC.Core.DISET.AuthManager import AuthManager
+  gConfigurationData.setRemoteCFG(generateRegistry(args.users, args.hosts, args.groups))
+
+  userDNs = ['/DC=org/DC=example/CN=user%d' % random.randint(0, args.users - 1) for _ in range(args.lookups)]
+  hostDNs = ['/DC=org/DC=example/CN=host%d.example.org' % random.randint(0, args.hosts - 1)
+             for _ in range(args.lookups)]
+  vos = ['vo%d' % random.randint(0, 9) for _ in range(args.lookups)]
+
+  startTime = time.time()
+  Registry.getUsernameForDN(userDNs[0])
+  Registry.getHostnameForDN(hostDNs[0])
+  Registry.getGroupsForVO(vos[0])
+  print("Indexes built in %.3f s" % (time.time() - startTime))
+  print("%d users, %d hosts, %d groups, %d lookups" % (args.users, args.hosts, args.groups, args.lookups))
+
+  differences = 0
+  for name, indexFunction, section, option, values, firstOnly in (
+      ('User DN', Registry.getUsernameForDN, 'Users', 'DN', userDNs, True),
+      ('Host DN', Registry.getHostnameForDN, 'Hosts', 'DN', hostDNs, True),
+      ('VO', Registry.getGroupsForVO, 'Groups', 'VO', vos, False)):
+    indexTime, indexResults = timeLookups(indexFunction, values)
+    linearTime, linearResults = timeLookups(lambda value, section=section, option=option, firstOnly=firstOnly:
+                                            linearLookup(section, option, value, firstOnly), values)
+    print("%7s: index %8.3f ms, linear %8.3f ms per lookup" % (name, indexTime * 1000, linearTime * 1000))
+    for indexResult, linearResult in zip(indexResults, linearResults):
+      if isinstance(indexResult['Value'], list):
+        differences += indexResult['Value'] != sorted(linearResult)
+      else:
+        differences += indexResult['Value'] != linearResult[0]
+
+  authManager = AuthManager('/Systems/Service/Authorization')
+  userGroups = dict((user, Registry.getGroupsForUser(user)) for user in set(Registry.getUsernameForDN(dn)['Value']
+                                                                            for dn in userDNs))
+  credDicts = []
+  for dn in userDNs:
+    groups = userGroups[Registry.getUsernameForDN(dn)['Value']]
+    if groups['OK']:
+      credDicts.append({'DN': dn, 'group': groups['Value'][0]})
+  if credDicts:
+    authTime, found = timeLookups(authManager.getUsername, credDicts)
+    print("AuthManager.getUsername: %8.3f ms per request, %d users found" % (authTime * 1000, sum(found)))
+
+  print("%d lookups gave different results" % differences)
+  return 1 if differences else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Benchmark of the selection of the task queues matching the pilots.
+
+The pilot resource descriptions are replayed against the task queues, selecting them with the
+TaskQueueIndex, and, with --db, also with the SQL query of the TaskQueueDB. In this case, the
+task queues of the TaskQueueDB are used, and the task queues selected by both methods are compared.
+
+The resource descriptions are read from a file with one JSON dictionary per line
+(e.g. the resource dictionaries logged by the Matcher). Without file, a population of task queues
+and pilots is generated.
+
+Usage::
+
+  python benchmarkMatching.py [--pilots descriptions.json] [--taskQueues 500] [--db]
+
+--db needs the configuration of the TaskQueueDB of an installation.
+"""
+from __future__ import print_function
+
+import sys
+import json
+import time
+import random
+import argparse
+
+__RCSID__ = "$Id$"
+
+SITES = ['LCG.Site%d.org' % i for i in range(100)]
+PLATFORMS = ['x86_64-slc6', 'x86_64-centos7', 'x86_64-centos8']
+JOB_TYPES = ['MCSimulation', 'User', 'DataReconstruction', 'DataStripping', 'Merge']
+TAGS = ['MultiProcessor', 'GPU', '8Processors', '16GB']
+SETUP = 'Production'
+
+
+def generateTaskQueues(count):
+  """ Task queue definitions, as stored in the TaskQueueDB """
+  taskQueues = {}
+  for tqId in range(1, count + 1):
+    tqDef = {'OwnerDN': '/DC=org/CN=user%d' % random.randint(0, 50),
+             'OwnerGroup': random.choice(['prod', 'user', 'user']),
+             'Setup': SETUP,
+             'CPUTime': random.choice([360, 1800, 3600, 21600, 86400, 172800]),
+             'Priority': random.uniform(0.001, 1000),
+             'JobTypes': [random.choice(JOB_TYPES)],
+             'Platforms': random.sample(PLATFORMS, random.randint(1, 2))}
+    if random.random() < 0.3:
+      tqDef['Sites'] = random.sample(SITES, random.randint(1, 10))
+    if random.random() < 0.2:
+      tqDef['BannedSites'] = random.sample(SITES, random.randint(1, 5))
+    if random.random() < 0.1:
+      tqDef['Tags'] = random.sample(TAGS, 1)
+    taskQueues[tqId] = tqDef
+  return taskQueues
+
+
+def generatePilots(count):
+  """ Resource descriptions, as given by the Matcher to the TaskQueueDB """
+  pilots = []
+  for _ in range(count):
+    pilots.append({'Setup': SETUP,
+                   'CPUTime': random.choice([3600, 86400, 172800, 400000]),
+                   'Site': random.choice(SITES),
+                   'GridCE': 'ce%d.example.org' % random.randint(0, 300),
+                   'Platform': random.sample(PLATFORMS, random.randint(1, 3)),
+                   'Tag': random.sample(TAGS, random.randint(0, 2))})
+  return pilots
+
+
+def readPilots(fileName):
+  """ Resource descriptions from a file with one JSON dictionary per line """
+  pilots = []
+  with open(fileName) as descriptions:
+    for line in descriptions:
+      if line.strip():
+        pilots.append(dict((str(key), value) for key, value in json.loads(line).iteritems()))
+  return pilots
+
+
+def timeMatching(matchFunction, pilots):
+  """ Match all the pilots, and return the time per pilot and the matched task queue IDs """
+  matches = []
+  startTime = time.time()
+  for pilot in pilots:
+    result = matchFunction(pilot)
+    matches.append(set(tq[0] for tq in result['Value']) if result['OK'] else None)
+  return (time.time() - startTime) / len(pilots), matches
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+  parser.add_argument('--pilots', help="file with one JSON resource description per line")
+  parser.add_argument('--numPilots', type=int, default=2000, help="number of generated pilots (default %(default)s)")
+  parser.add_argument('--taskQueues', type=int, default=500,
+                      help="number of generated task queues (default %(default)s)")
+  parser.add_argument('--db', action='store_true', help="use the task queues of the TaskQueueDB, and compare with SQL")
+  args = parser.parse_args()
+
+  pilots = readPilots(args.pilots) if args.pilots else generatePilots(args.numPilots)
+
+  if not args.db:
+    from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+    index = TaskQueueIndex()
+    index.update(generateTaskQueues(args.taskQueues))
+    perPilot, matches = timeMatching(lambda pilot: index.match(pilot, numQueuesToGet=0), pilots)
+    print("%d task queues, %d pilots" % (len(index), len(pilots)))
+    print("Index: %8.3f ms per pilot, %.1f matching task queues on average" %
+          (perPilot * 1000, sum(len(match) for match in matches) / float(len(matches))))
+    return 0
+
+  from DIRAC.Core.Base.Script import parseCommandLine
+  parseCommandLine()
+  from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB import TaskQueueDB
+  tqDB = TaskQueueDB()
+  print("%s task queues, %d pilots" % (tqDB.getNumTaskQueues().get('Value'), len(pilots)))
+  results = {}
+  for name, useIndex in (('SQL', False), ('Index', True)):
+    tqDB._TaskQueueDB__useTaskQueueIndex = lambda useIndex=useIndex: useIndex  # pylint: disable=protected-access
+    results[name] = timeMatching(lambda pilot: tqDB.matchAndGetTaskQueue(pilot, numQueuesToGet=0), pilots)
+    print("%5s: %8.3f ms per pilot" % (name, results[name][0] * 1000))
+  differences = sum(1 for sqlMatch, indexMatch in zip(results['SQL'][1], results['Index'][1])
+                    if sqlMatch != indexMatch)
+  print("%d pilots matched different task queues" % differences)
+  return 1 if differences else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())